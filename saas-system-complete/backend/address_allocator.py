@@ -0,0 +1,190 @@
+"""
+حجز عناوين IP والمنافذ وأسماء السيرفرات الجديدة
+
+كل حجز صف في cluster_leases بمفتاح أساسي (kind, value)، فالإدراج نفسه هو الحجز الذري:
+عمليتان تحاولان نفس العنوان - واحدة تنجح والأخرى تحصل على IntegrityError وتجرب العنوان التالي
+بعد انتظار عشوائي قصير (وإلا تختار العمليات الخاسرة نفس القيمة التالية معاً وتتعارض في كل محاولة).
+العناوين المستخدمة = الحجوزات + السيرفرات النشطة في cluster_servers (السيرفرات الأقدم من الجدول).
+الحجوزات تُحرر عند remove_server أو عند فشل إنشاء السيرفر.
+"""
+
+import ipaddress
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from circuit_breaker import connect_mysql
+
+logger = logging.getLogger(__name__)
+
+KIND_NAME = 'name'
+KIND_IP = 'ip'
+KIND_PORT = 'port'
+
+
+class AllocationError(Exception):
+    """لا توجد عناوين أو منافذ متاحة"""
+
+
+@dataclass
+class Lease:
+    """حجز سيرفر جديد"""
+    server_id: str
+    ip: str
+    port: int
+
+
+class AddressAllocator:
+    """حجز ذري للاسم وعنوان IP والمنفذ في قاعدة البيانات"""
+
+    def __init__(self, db_config: Dict, ip_range_start: str, ip_range_end: str,
+                 port_range_start: int, port_range_end: int, name_prefix: str = 'app-server-',
+                 max_attempts: int = 10, retry_jitter: float = 0.05):
+        self.db_config = db_config
+        start, end = ipaddress.ip_address(ip_range_start), ipaddress.ip_address(ip_range_end)
+        if end < start:
+            raise ValueError(f"نطاق IP غير صالح: {ip_range_start} - {ip_range_end}")
+        self.ip_range = (int(start), int(end))
+        self.port_range = (port_range_start, port_range_end)
+        self.name_prefix = name_prefix
+        self.max_attempts = max_attempts
+        self.retry_jitter = retry_jitter
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_leases (
+                kind VARCHAR(10) NOT NULL,
+                value VARCHAR(64) NOT NULL,
+                server_id VARCHAR(50) NOT NULL,
+                leased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, value),
+                INDEX idx_server_id (server_id)
+            )
+        """)
+        self._schema_ready = True
+
+    def _used(self, cursor) -> Dict[str, Set[str]]:
+        """القيم المحجوزة أو المستخدمة من السيرفرات النشطة"""
+        used = {KIND_NAME: set(), KIND_IP: set(), KIND_PORT: set()}
+        cursor.execute("SELECT kind, value FROM cluster_leases")
+        for kind, value in cursor.fetchall():
+            used.setdefault(kind, set()).add(value)
+        cursor.execute("SELECT server_id, ip_address, port FROM cluster_servers WHERE active = TRUE")
+        for server_id, ip, port in cursor.fetchall():
+            used[KIND_NAME].add(server_id)
+            used[KIND_IP].add(ip)
+            used[KIND_PORT].add(str(port))
+        return used
+
+    def _first_free(self, kind: str, used: Set[str]) -> str:
+        if kind == KIND_IP:
+            for value in range(self.ip_range[0], self.ip_range[1] + 1):
+                candidate = str(ipaddress.ip_address(value))
+                if candidate not in used:
+                    return candidate
+        elif kind == KIND_PORT:
+            for value in range(self.port_range[0], self.port_range[1] + 1):
+                if str(value) not in used:
+                    return str(value)
+        else:
+            number = 1
+            while f"{self.name_prefix}{number}" in used:
+                number += 1
+            return f"{self.name_prefix}{number}"
+        raise AllocationError(f"لا توجد قيم متاحة من نوع {kind}")
+
+    def lease(self) -> Lease:
+        """حجز اسم و IP ومنفذ لسيرفر جديد في معاملة واحدة"""
+        # الخيوط في نفس العملية تتسلسل هنا؛ التعارض بين العمليات يحله المفتاح الأساسي
+        with self._lock:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                conn.commit()
+                for attempt in range(self.max_attempts):
+                    used = self._used(cursor)
+                    server_id = self._first_free(KIND_NAME, used[KIND_NAME])
+                    ip = self._first_free(KIND_IP, used[KIND_IP])
+                    port = self._first_free(KIND_PORT, used[KIND_PORT])
+                    try:
+                        cursor.executemany(
+                            "INSERT INTO cluster_leases (kind, value, server_id) VALUES (%s, %s, %s)",
+                            [(KIND_NAME, server_id, server_id), (KIND_IP, ip, server_id), (KIND_PORT, port, server_id)]
+                        )
+                        conn.commit()
+                        logger.info(f"📌 تم حجز {server_id} على {ip}:{port}")
+                        return Lease(server_id=server_id, ip=ip, port=int(port))
+                    except mysql.connector.IntegrityError as e:
+                        if e.errno != errorcode.ER_DUP_ENTRY:
+                            raise
+                        # عملية أخرى حجزت نفس القيمة - إعادة المحاولة بالقيم المحدثة
+                        conn.rollback()
+                        logger.info(f"🔁 تعارض حجز (محاولة {attempt + 1}) - إعادة المحاولة")
+                        time.sleep(random.uniform(0, self.retry_jitter))
+                raise AllocationError(f"فشل الحجز بعد {self.max_attempts} محاولات")
+            finally:
+                conn.close()
+
+    def lease_many(self, count: int) -> List[Lease]:
+        """حجز عدة سيرفرات (يتوقف عند نفاد العناوين)"""
+        leases = []
+        for _ in range(count):
+            try:
+                leases.append(self.lease())
+            except AllocationError as e:
+                logger.warning(f"⚠️ {e}")
+                break
+        return leases
+
+    def adopt(self, server_id: str, ip: str, port: int):
+        """تسجيل حجز لسيرفر بعنوان محدد (إضافة يدوية) - يفشل إذا كان محجوزاً لسيرفر آخر"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            for kind, value in ((KIND_NAME, server_id), (KIND_IP, ip), (KIND_PORT, str(port))):
+                cursor.execute("""
+                    INSERT INTO cluster_leases (kind, value, server_id) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE server_id = server_id
+                """, (kind, value, server_id))
+                cursor.execute("SELECT server_id FROM cluster_leases WHERE kind = %s AND value = %s FOR UPDATE",
+                               (kind, value))
+                owner = cursor.fetchone()[0]
+                if owner != server_id:
+                    conn.rollback()
+                    raise AllocationError(f"{kind} {value} محجوز للسيرفر {owner}")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def release(self, server_id: str) -> int:
+        """تحرير كل حجوزات السيرفر"""
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                cursor.execute("DELETE FROM cluster_leases WHERE server_id = %s", (server_id,))
+                released = cursor.rowcount
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info(f"🔓 تم تحرير {released} حجز للسيرفر {server_id}")
+            return released
+        except Exception as e:
+            logger.error(f"❌ فشل تحرير حجوزات {server_id}: {e}")
+            return 0
@@ -1,40 +1,78 @@
-from flask import Flask, request, jsonify
+from startup import PROCESS_START, profiler, LazyResource, register_warmup, start_warmups_in_background, warmup_status
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import mysql.connector
 import json
 import random
 import string
+import re
 import logging
 import time
+import os
 from datetime import datetime, timedelta
-from nginx_manager import nginx_manager
+from dataclasses import asdict
+from nginx_manager import nginx_manager, DEFAULT_SERVER_ID
+from site_checker import site_checker
+from response_cache import response_cache, CACHE_TTLS
+from site_status import site_status_checker
+from background import register_background_task, start_background_tasks, background_status
+from cluster_manager import ClusterManager
+from assignment_store import SiteAssignmentStore
+from bulk_trials import BulkTrialImporter, BulkTrialStore
+from tracing import tracer, traced, install_log_trace_ids
+from circuit_breaker import breakers, connect_mysql
+from db_config import DB_CONFIG
 
 from frappe_direct_manager import get_frappe_direct_manager
 import requests
 
-# إعداد التسجيل
+# إعداد التسجيل (كل سجل يحمل trace_id للطلب الحالي)
+install_log_trace_ids()
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
-# إعدادات قاعدة البيانات
-DB_CONFIG = {
-    'host': '172.20.0.102',
-    'user': 'root',
-    'password': '123456',
-    'database': 'saas_trialsv1',
-    'connect_timeout': 30,
-}
+TRACE_ID_CHARS = set('0123456789abcdef-')
+SITE_NAME_PATTERN = re.compile(r'^[A-Za-z0-9.-]+(:[0-9]+)?$')
 
+
+@app.before_request
+def start_request_trace():
+    """بدء span للطلب - يُستخدم X-Trace-Id الوارد إن وُجد"""
+    incoming = (request.headers.get('X-Trace-Id') or '').lower()
+    trace_id = incoming if 0 < len(incoming) <= 64 and set(incoming) <= TRACE_ID_CHARS else None
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.trace = tracer.begin_span(f"{request.method} {route}", trace_id=trace_id, path=request.path)
+
+
+@app.after_request
+def tag_request_trace(response):
+    """إعادة trace id للعميل"""
+    trace = g.get('trace')
+    if trace:
+        trace[0].set_attribute('status_code', response.status_code)
+        response.headers['X-Trace-Id'] = trace[0].trace_id
+    return response
+
+
+@app.teardown_request
+def end_request_trace(error=None):
+    """إنهاء span الطلب"""
+    trace = g.pop('trace', None)
+    if trace:
+        tracer.end_span(trace[0], trace[1], error)
+
+
+@traced('db.connect')
 def get_db_connection():
     """الحصول على اتصال بقاعدة البيانات"""
     try:
-        return mysql.connector.connect(**DB_CONFIG)
+        return connect_mysql(DB_CONFIG)
     except mysql.connector.Error as e:
         logger.error(f"❌ فشل الاتصال بقاعدة البيانات: {str(e)}")
         raise e
@@ -43,8 +81,16 @@ class DatabaseManager:
     """مدير قاعدة البيانات"""
     
     def __init__(self):
-        self.init_database()
+        # تهيئة الجداول مؤجلة حتى التسخين أو أول كتابة
+        self._schema_ready = False
+    
+    def ensure_schema(self):
+        """تهيئة الجداول مرة واحدة لكل عملية"""
+        if not self._schema_ready:
+            self.init_database()
+        return self._schema_ready
     
+    @traced('db.init_database')
     def init_database(self):
         """تهيئة قاعدة البيانات"""
         try:
@@ -77,42 +123,49 @@ class DatabaseManager:
             conn.commit()
             cursor.close()
             conn.close()
+            self._schema_ready = True
             logger.info("✅ تم تهيئة قاعدة البيانات بنجاح")
             return True
         except Exception as e:
             logger.error(f"❌ فشل تهيئة قاعدة البيانات: {str(e)}")
             return False
     
-    def create_customer(self, customer_data):
-        """إنشاء عميل جديد"""
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            trial_days = int(customer_data.get('trial_days', 14))
-            expires_at = datetime.now() + timedelta(days=trial_days)
-            
-            query = """
+    CUSTOMER_INSERT_QUERY = """
             INSERT INTO trial_customers 
             (company_name, contact_name, email, phone, subdomain, site_url, site_name, 
              admin_password, selected_apps, trial_days, expires_at, frappe_site_created)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
+    
+    def _customer_row(self, customer_data):
+        """قيم صف العميل بترتيب CUSTOMER_INSERT_QUERY"""
+        trial_days = int(customer_data.get('trial_days', 14))
+        expires_at = datetime.now() + timedelta(days=trial_days)
+        
+        return (
+            customer_data['company_name'],
+            customer_data['full_name'],
+            customer_data['email'],
+            customer_data.get('phone', ''),
+            customer_data['subdomain'],
+            customer_data['site_url'],
+            customer_data['site_name'],
+            customer_data.get('admin_password', 'admin123'),
+            json.dumps(customer_data.get('selected_apps', [])),
+            trial_days,
+            expires_at,
+            customer_data.get('frappe_site_created', False)
+        )
+    
+    @traced('db.create_customer')
+    def create_customer(self, customer_data):
+        """إنشاء عميل جديد"""
+        try:
+            self.ensure_schema()
+            conn = get_db_connection()
+            cursor = conn.cursor()
             
-            cursor.execute(query, (
-                customer_data['company_name'],
-                customer_data['full_name'],
-                customer_data['email'],
-                customer_data.get('phone', ''),
-                customer_data['subdomain'],
-                customer_data['site_url'],
-                customer_data['site_name'],
-                customer_data.get('admin_password', 'admin123'),
-                json.dumps(customer_data.get('selected_apps', [])),
-                trial_days,
-                expires_at,
-                customer_data.get('frappe_site_created', False)
-            ))
+            cursor.execute(self.CUSTOMER_INSERT_QUERY, self._customer_row(customer_data))
             
             customer_id = cursor.lastrowid
             conn.commit()
@@ -125,7 +178,109 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"❌ فشل حفظ العميل: {str(e)}")
             raise e
+    
+    @traced('db.create_customers_bulk')
+    def create_customers_bulk(self, customers, batch_size=200):
+        """
+        إدراج عدة عملاء على دفعات (إدراج متعدد الصفوف لكل دفعة)
+        
+        عند تعارض مفتاح فريد داخل دفعة يُعاد إدراج صفوفها واحداً واحداً
+        لتحديد الصفوف المتعارضة فقط.
+        يعيد (subdomains المدرجة، {subdomain: سبب الفشل}).
+        """
+        self.ensure_schema()
+        inserted, failed = [], {}
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            for i in range(0, len(customers), batch_size):
+                batch = customers[i:i + batch_size]
+                try:
+                    cursor.executemany(self.CUSTOMER_INSERT_QUERY, [self._customer_row(c) for c in batch])
+                    conn.commit()
+                    inserted.extend(c['subdomain'] for c in batch)
+                    continue
+                except mysql.connector.IntegrityError:
+                    conn.rollback()
+                
+                for customer in batch:
+                    try:
+                        cursor.execute(self.CUSTOMER_INSERT_QUERY, self._customer_row(customer))
+                        conn.commit()
+                        inserted.append(customer['subdomain'])
+                    except mysql.connector.IntegrityError as e:
+                        conn.rollback()
+                        failed[customer['subdomain']] = 'البريد الإلكتروني مسجل مسبقاً' if "Duplicate entry" in str(e) else str(e)
+            cursor.close()
+        finally:
+            conn.close()
+        
+        logger.info(f"✅ تم حفظ {len(inserted)} عميل على دفعات ({len(failed)} متعارض)")
+        return inserted, failed
+    
+    @traced('db.find_existing_customers')
+    def find_existing_customers(self, emails, subdomains):
+        """البريد و subdomain الموجودة مسبقاً - استعلام واحد"""
+        if not emails and not subdomains:
+            return set(), set()
+        
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            emails = list(emails) or ['']
+            subdomains = list(subdomains) or ['']
+            cursor.execute(f"""
+                SELECT email, subdomain FROM trial_customers
+                WHERE email IN ({', '.join(['%s'] * len(emails))})
+                   OR subdomain IN ({', '.join(['%s'] * len(subdomains))})
+            """, tuple(emails) + tuple(subdomains))
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        
+        return {row[0].lower() for row in rows}, {row[1] for row in rows}
+    
+    @traced('db.mark_sites_created')
+    def mark_sites_created(self, subdomains):
+        """تعليم عدة مواقع كمُنشأة - تحديث واحد"""
+        if not subdomains:
+            return 0
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                UPDATE trial_customers SET frappe_site_created = TRUE
+                WHERE subdomain IN ({', '.join(['%s'] * len(subdomains))})
+            """, tuple(subdomains))
+            updated = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return updated
+    
+    @traced('db.delete_customers_by_subdomain')
+    def delete_customers_by_subdomain(self, subdomains):
+        """حذف حجوزات لم يكتمل إنشاء مواقعها"""
+        if not subdomains:
+            return 0
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                DELETE FROM trial_customers
+                WHERE subdomain IN ({', '.join(['%s'] * len(subdomains))})
+                  AND frappe_site_created = FALSE
+            """, tuple(subdomains))
+            deleted = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return deleted
 
+    @traced('db.get_recent_customers')
     def get_recent_customers(self, limit=10):
         """الحصول على أحدث العملاء"""
         try:
@@ -153,10 +308,8 @@ class TrialManager:
     def __init__(self):
         self.db = DatabaseManager()
         self.frappe_manager = get_frappe_direct_manager()
+        self.assignments = SiteAssignmentStore(DB_CONFIG)
         logger.info(f"✅ تم تهيئة مدير Frappe المباشر: {type(self.frappe_manager).__name__}")
-        
-        # اختبار الاتصال بـ Frappe Bench
-        self.test_frappe_connection()
     
     def test_frappe_connection(self):
         """اختبار اتصال Frappe Bench"""
@@ -182,6 +335,7 @@ class TrialManager:
         
         return subdomain
     
+    @traced('trial.create_account')
     def create_trial_account(self, data):
         """إنشاء حساب تجريبي"""
         try:
@@ -202,13 +356,14 @@ class TrialManager:
             
             # إنشاء الموقع باستخدام Frappe Manager الفعلي
             start_time = time.time()
-            success, site_url = self.frappe_manager.create_trial_site(
-                subdomain=subdomain,
-                company_name=data['company_name'],
-                apps=data.get('selected_apps', ['erpnext']),
-                admin_email=data['email'],
-                admin_password=data.get('password', 'admin123')
-            )
+            with tracer.start_span('trial.create_site', site=site_name):
+                success, site_url = self.frappe_manager.create_trial_site(
+                    subdomain=subdomain,
+                    company_name=data['company_name'],
+                    apps=data.get('selected_apps', ['erpnext']),
+                    admin_email=data['email'],
+                    admin_password=data.get('password', 'admin123')
+                )
             creation_time = time.time() - start_time
             
             if not success:
@@ -233,20 +388,26 @@ class TrialManager:
             }
             
             # حفظ في قاعدة البيانات
-            customer_id = self.db.create_customer(customer_data)
+            with tracer.start_span('trial.save_customer', site=site_name):
+                customer_id = self.db.create_customer(customer_data)
             
             # إضافة تكوين Nginx للموقع الجديد
             nginx_start_time = time.time()
-            nginx_success, nginx_msg = nginx_manager.create_site_config(site_name)
+            with tracer.start_span('trial.nginx_config', site=site_name):
+                nginx_success, nginx_msg = nginx_manager.create_site_config(site_name)
             nginx_time = time.time() - nginx_start_time
             
             if nginx_success:
                 logger.info(f"✅ تم إضافة تكوين Nginx: {nginx_msg} (وقت: {nginx_time:.2f} ثانية)")
             else:
                 logger.warning(f"⚠️ فشل إضافة تكوين Nginx: {nginx_msg}")
+
+            # الموقع يُنشأ على bench السيرفر الافتراضي - تسجيله في جدول التوزيع
+            self.assignments.assign(site_name, DEFAULT_SERVER_ID)
             
             # التحقق من أن الموقع تم إنشاؤه فعلياً
-            site_verified = self.verify_site_creation(site_name)
+            with tracer.start_span('trial.verify', site=site_name):
+                site_verified = self.verify_site_creation(site_name)
             
             logger.info(f"🎉 تم إنشاء حساب تجريبي بنجاح: {site_url}")
             logger.info(f"📊 إحصائيات الإنشاء:")
@@ -281,41 +442,132 @@ class TrialManager:
             logger.warning(f"⚠️ فشل التحقق من الموقع: {str(e)}")
             return False
 
-# إنشاء المانجر
-trial_manager = TrialManager()
+# إنشاء المانجر عند أول استخدام فقط (لا اتصالات ولا أوامر عند الاستيراد)
+trial_manager_resource = LazyResource('trial_manager', TrialManager)
 
-# نقاط النهاية
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """التحقق من صحة النظام"""
+def get_trial_manager() -> TrialManager:
+    """مدير التجارب لهذه العملية"""
+    return trial_manager_resource.get()
+
+# الاستيراد الجماعي للحسابات التجريبية
+# الدفعات محفوظة في قاعدة البيانات وتُنفذ في مالك المهام الخلفية (تُستأنف بعد إعادة تدوير العامل)
+bulk_importer_resource = LazyResource('bulk_trial_importer', lambda: BulkTrialImporter(
+    get_trial_manager(),
+    BulkTrialStore(DB_CONFIG),
+    max_workers=int(os.environ.get('BULK_PROVISION_CONCURRENCY', 4))
+))
+
+register_background_task('bulk_trials', lambda: bulk_importer_resource.get().start())
+
+# مدير الكلاستر - المراقبة لا تبدأ تلقائياً؛ عملية واحدة لكل مضيف تشارك في انتخاب قائد المراقبة
+# والبقية (وباقي المضيفات) تقرأ الحالة التي ينشرها القائد
+cluster_manager_resource = LazyResource('cluster_manager', lambda: ClusterManager(auto_start_monitoring=False))
+
+def get_cluster_manager() -> ClusterManager:
+    """مدير الكلاستر لهذه العملية"""
+    return cluster_manager_resource.get()
+
+register_background_task('cluster_monitor', lambda: get_cluster_manager().start_election())
+
+
+def get_cached_sites():
+    """قائمة مواقع bench من الذاكرة المؤقتة (أمر bench واحد لكل الطلبات المتزامنة)"""
+    ttl, stale_ttl = CACHE_TTLS['bench_sites']
+    return response_cache.get('bench_sites', lambda: get_trial_manager().frappe_manager.get_all_sites(), ttl, stale_ttl)
+
+def get_cached_nginx_configs():
+    """ملفات تكوين Nginx من الذاكرة المؤقتة (أمر docker exec واحد لكل الطلبات المتزامنة)"""
+    ttl, stale_ttl = CACHE_TTLS['nginx_configs']
+    return response_cache.get('nginx_configs', nginx_manager.list_site_configs, ttl, stale_ttl)
+
+def _build_fleet_status_payload():
+    """فحص كل مواقع bench (يعمل في الخلفية عند انتهاء الصلاحية)"""
+    return site_status_checker.check_fleet(get_cached_sites(), get_cached_nginx_configs())
+
+def _build_health_payload():
+    """تنفيذ فحص الصحة الفعلي (يعمل في الخلفية فقط)"""
     try:
         # اختبار اتصال قاعدة البيانات
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
-        
-        # اختبار اتصال Frappe Bench
-        sites = trial_manager.frappe_manager.get_all_sites()
-        
+        cursor.fetchall()
         cursor.close()
         conn.close()
         
-        return jsonify({
+        # اختبار اتصال Frappe Bench
+        sites = get_cached_sites()
+        
+        return {
             'success': True,
             'message': '✅ النظام يعمل بشكل صحيح',
             'database': '✅ متصل',
             'frappe_bench': f'✅ متصل ({len(sites)} مواقع)',
-            'frappe_manager': type(trial_manager.frappe_manager).__name__,
+            'frappe_manager': type(get_trial_manager().frappe_manager).__name__,
             'sites_list': sites,
             'timestamp': datetime.now().isoformat()
-        })
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             'success': False,
             'message': '❌ نظام قاعدة البيانات غير متصل',
             'error': str(e),
             'timestamp': datetime.now().isoformat()
-        }), 500
+        }, 500
+
+def _build_frappe_status_payload():
+    """تنفيذ أوامر bench التشخيصية"""
+    # اختبار أوامر bench الأساسية
+    bench_commands = [
+        ["version"],
+        ["site", "list"],
+        ["--version"]
+    ]
+    
+    results = {}
+    for cmd in bench_commands:
+        try:
+            success, output = get_trial_manager().frappe_manager.execute_bench_command(cmd)
+            results[' '.join(cmd)] = {
+                'success': success,
+                'output': output[:500] if output else 'No output'
+            }
+        except Exception as e:
+            results[' '.join(cmd)] = {
+                'success': False,
+                'error': str(e)
+            }
+    
+    # الحصول على قائمة المواقع
+    sites = get_cached_sites()
+    
+    return {
+        'success': True,
+        'bench_commands': results,
+        'sites_count': len(sites),
+        'sites_list': sites,
+        'manager_type': type(get_trial_manager().frappe_manager).__name__,
+        'bench_path': getattr(get_trial_manager().frappe_manager, 'bench_path', 'Unknown'),
+        'timestamp': datetime.now().isoformat()
+    }
+
+# نقاط النهاية
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """التحقق من صحة النظام - يعيد آخر نتيجة محفوظة ولا ينفذ أي أمر داخل الطلب"""
+    ttl, stale_ttl = CACHE_TTLS['health']
+    cached = response_cache.get('health', _build_health_payload, ttl, stale_ttl, wait=False)
+    
+    if cached is None:
+        return jsonify({
+            'success': False,
+            'message': '⏳ جاري تنفيذ أول فحص للنظام',
+            'status': 'warming_up',
+            'timestamp': datetime.now().isoformat()
+        }), 503
+    
+    payload, status_code = cached
+    return jsonify(payload), status_code
 
 @app.route('/api/create-trial', methods=['POST'])
 def create_trial():
@@ -325,19 +577,22 @@ def create_trial():
         data = request.json
         logger.info(f"📥 استلام طلب إنشاء حساب لـ: {data.get('company_name')}")
         
-        success, result = trial_manager.create_trial_account(data)
+        success, result = get_trial_manager().create_trial_account(data)
         
         execution_time = time.time() - start_time
         logger.info(f"⏱️ وقت تنفيذ الطلب: {execution_time:.2f} ثانية")
         
         if success:
+            # قائمة المواقع وتكوينات Nginx تغيرت
+            response_cache.invalidate('bench_sites')
+            response_cache.invalidate('nginx_configs')
             return jsonify({
                 'success': True,
                 'site_url': result,
                 'message': '🎉 تم إنشاء موقعك التجريبي بنجاح!',
                 'type': 'frappe_bench_site',
                 'execution_time': f"{execution_time:.2f} ثانية",
-                'manager_type': type(trial_manager.frappe_manager).__name__
+                'manager_type': type(get_trial_manager().frappe_manager).__name__
             })
         else:
             return jsonify({
@@ -345,7 +600,7 @@ def create_trial():
                 'message': result,
                 'type': 'error',
                 'execution_time': f"{execution_time:.2f} ثانية",
-                'manager_type': type(trial_manager.frappe_manager).__name__
+                'manager_type': type(get_trial_manager().frappe_manager).__name__
             }), 400
             
     except Exception as e:
@@ -355,111 +610,149 @@ def create_trial():
             'success': False,
             'message': f'حدث خطأ في الخادم: {str(e)}',
             'execution_time': f"{execution_time:.2f} ثانية",
-            'manager_type': type(trial_manager.frappe_manager).__name__
+            'manager_type': type(get_trial_manager().frappe_manager).__name__
+        }), 500
+
+@app.route('/api/bulk-trials', methods=['POST'])
+def create_bulk_trials():
+    """إنشاء جماعي لحسابات تجريبية من CSV أو JSON"""
+    try:
+        importer = bulk_importer_resource.get()
+        
+        upload = request.files.get('file')
+        if upload:
+            body = upload.read()
+            content_type = 'text/csv' if upload.filename.lower().endswith('.csv') else upload.mimetype
+        else:
+            body = request.get_data()
+            content_type = request.content_type
+        
+        records = importer.parse_rows(body, content_type)
+        if not records:
+            return jsonify({
+                'success': False,
+                'message': 'الدفعة فارغة'
+            }), 400
+        
+        job = importer.submit(records)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'دفعة غير صالحة: {str(e)}'
+        }), 400
+    except Exception as e:
+        logger.error(f"❌ خطأ في الإنشاء الجماعي: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'حدث خطأ في الخادم: {str(e)}'
         }), 500
+    
+    if request.args.get('stream'):
+        return Response(stream_with_context(importer.stream(job)), mimetype='application/x-ndjson')
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'report': job.report(include_rows=False),
+        'status_url': f'/api/bulk-trials/{job.job_id}'
+    }), 202
+
+@app.route('/api/bulk-trials/<job_id>', methods=['GET'])
+def bulk_trials_status(job_id):
+    """تقرير دفعة الإنشاء الجماعي (stream=1 للبث حتى الانتهاء)"""
+    importer = bulk_importer_resource.get()
+    try:
+        job = importer.get_job(job_id)
+    except Exception as e:
+        logger.error(f"❌ خطأ في قراءة الدفعة {job_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'حدث خطأ في الخادم: {str(e)}'
+        }), 500
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'الدفعة غير موجودة'
+        }), 404
+    
+    if request.args.get('stream'):
+        return Response(stream_with_context(importer.stream(job)), mimetype='application/x-ndjson')
+    
+    return jsonify({
+        'success': True,
+        **job.report()
+    })
 
 @app.route('/api/frappe-sites', methods=['GET'])
 def get_frappe_sites():
     """الحصول على قائمة المواقع من Frappe Bench"""
     try:
-        sites = trial_manager.frappe_manager.get_all_sites()
+        if request.args.get('refresh'):
+            response_cache.invalidate('bench_sites')
+        sites = get_cached_sites()
         return jsonify({
             'success': True,
             'sites': sites,
             'count': len(sites),
-            'manager_type': type(trial_manager.frappe_manager).__name__
+            'manager_type': type(get_trial_manager().frappe_manager).__name__
         })
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'خطأ في جلب المواقع: {str(e)}',
-            'manager_type': type(trial_manager.frappe_manager).__name__
+            'manager_type': type(get_trial_manager().frappe_manager).__name__
         }), 500
 
 @app.route('/api/debug/frappe-status', methods=['GET'])
 def debug_frappe_status():
     """تصحيح حالة Frappe Bench"""
     try:
-        # اختبار أوامر bench الأساسية
-        bench_commands = [
-            ["version"],
-            ["site", "list"],
-            ["--version"]
-        ]
-        
-        results = {}
-        for cmd in bench_commands:
-            try:
-                success, output = trial_manager.frappe_manager.execute_bench_command(cmd)
-                results[' '.join(cmd)] = {
-                    'success': success,
-                    'output': output[:500] if output else 'No output'
-                }
-            except Exception as e:
-                results[' '.join(cmd)] = {
-                    'success': False,
-                    'error': str(e)
-                }
-        
-        # الحصول على قائمة المواقع
-        sites = trial_manager.frappe_manager.get_all_sites()
-        
-        return jsonify({
-            'success': True,
-            'bench_commands': results,
-            'sites_count': len(sites),
-            'sites_list': sites,
-            'manager_type': type(trial_manager.frappe_manager).__name__,
-            'bench_path': getattr(trial_manager.frappe_manager, 'bench_path', 'Unknown')
-        })
+        ttl, stale_ttl = CACHE_TTLS['frappe_status']
+        return jsonify(response_cache.get('frappe_status', _build_frappe_status_payload, ttl, stale_ttl))
         
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e),
-            'manager_type': type(trial_manager.frappe_manager).__name__
+            'manager_type': type(get_trial_manager().frappe_manager).__name__
         }), 500
 
+@app.route('/api/debug/cache', methods=['GET'])
+def debug_cache():
+    """إحصائيات الذاكرة المؤقتة للاستجابات"""
+    return jsonify({
+        'success': True,
+        'cache': response_cache.stats(),
+        'ttls': CACHE_TTLS
+    })
+
+@app.route('/api/debug/breakers', methods=['GET'])
+def debug_breakers():
+    """قواطع الدوائر في هذه العملية (الحالة ونسبة الفشل والنداءات المرفوضة)"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        **breakers.status()
+    })
+
 # نقاط نهاية جديدة للتحقق من حالة المواقع وإصلاحها
 @app.route('/api/site-status/<path:site_name>', methods=['GET'])
 def check_site_status(site_name):
-    """التحقق من حالة موقع معين"""
+    """التحقق من حالة موقع معين - الجرد من الذاكرة المؤقتة والفحص الحي بالتوازي"""
     try:
         # تنظيف اسم الموقع
         clean_site_name = site_name.replace('http://', '').replace('https://', '')
         
-        # التحقق من وجود تكوين Nginx
-        nginx_configs = nginx_manager.list_site_configs()
-        has_nginx_config = any(clean_site_name in config for config in nginx_configs)
+        status = site_status_checker.check_site(clean_site_name, get_cached_nginx_configs, get_cached_sites)
+        sites = status.pop('sites')
         
-        # التحقق من وجود الموقع في Frappe Bench
-        sites = trial_manager.frappe_manager.get_all_sites()
-        site_exists = clean_site_name in sites
-        
-        # التحقق من اتصال الموقع
-        frappe_status = "unknown"
-        frappe_response = ""
-        
-        try:
-            test_url = f"http://{clean_site_name}/api/method/version"
-            response = requests.get(test_url, timeout=10)
-            frappe_status = "connected" if response.status_code == 200 else "failed"
-            frappe_response = response.text[:200] if response.text else "empty"
-        except requests.exceptions.ConnectionError:
-            frappe_status = "unreachable"
-        except requests.exceptions.Timeout:
-            frappe_status = "timeout"
-        except Exception as e:
-            frappe_status = f"error: {str(e)}"
+        # قائمة كل المواقع اختيارية (كانت تُعاد دائماً)
+        if request.args.get('include_sites') and sites is not None:
+            status['all_sites'] = sites
         
         return jsonify({
             'success': True,
-            'site_name': clean_site_name,
-            'nginx_config': has_nginx_config,
-            'frappe_site_exists': site_exists,
-            'frappe_status': frappe_status,
-            'frappe_response': frappe_response,
-            'all_sites': sites
+            **status
         })
     except Exception as e:
         return jsonify({
@@ -467,6 +760,48 @@ def check_site_status(site_name):
             'error': str(e)
         }), 500
 
+@app.route('/api/sites/status', methods=['GET', 'POST'])
+def fleet_site_status():
+    """
+    حالة كل المواقع للوحة المراقبة
+    
+    GET: كل مواقع bench (النتيجة مخزنة مؤقتاً، ?refresh=1 لإعادة الفحص)
+    POST {"sites": [...], "concurrency": 32}: فحص قائمة محددة
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            sites = data.get('sites')
+            if not isinstance(sites, list) or not sites:
+                return jsonify({
+                    'success': False,
+                    'message': 'يجب إرسال قائمة sites'
+                }), 400
+            sites = [str(site).replace('http://', '').replace('https://', '') for site in sites]
+            invalid = [site for site in sites if not SITE_NAME_PATTERN.match(site)]
+            if invalid:
+                return jsonify({
+                    'success': False,
+                    'message': f'أسماء مواقع غير صالحة: {invalid[:10]}'
+                }), 400
+            concurrency = min(int(data.get('concurrency', site_status_checker.max_workers)), site_status_checker.max_workers)
+            report = site_status_checker.check_fleet(sites, get_cached_nginx_configs(), max_workers=concurrency)
+        else:
+            if request.args.get('refresh'):
+                response_cache.invalidate('fleet_status')
+            ttl, stale_ttl = CACHE_TTLS['fleet_status']
+            report = response_cache.get('fleet_status', _build_fleet_status_payload, ttl, stale_ttl)
+        
+        return jsonify({
+            'success': True,
+            **report
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ في فحص المواقع: {str(e)}'
+        }), 500
+
 @app.route('/api/fix-site/<path:site_name>', methods=['POST'])
 def fix_site_config(site_name):
     """إصلاح تكوين موقع معين"""
@@ -478,6 +813,7 @@ def fix_site_config(site_name):
         success, message = nginx_manager.create_site_config(clean_site_name)
         
         if success:
+            response_cache.invalidate('nginx_configs')
             # اختبار الموقع بعد الإصلاح
             time.sleep(2)
             frappe_status = "unknown"
@@ -510,7 +846,7 @@ def fix_site_config(site_name):
 def get_recent_customers():
     """الحصول على أحدث العملاء"""
     try:
-        customers = trial_manager.db.get_recent_customers(10)
+        customers = get_trial_manager().db.get_recent_customers(10)
         return jsonify({
             'success': True,
             'customers': customers,
@@ -522,6 +858,48 @@ def get_recent_customers():
             'message': f'خطأ في جلب العملاء: {str(e)}'
         }), 500
 
+@app.route('/api/recent-sites', methods=['GET'])
+def get_recent_sites():
+    """أحدث المواقع مع نتيجة التحقق من إنشائها"""
+    try:
+        limit = min(int(request.args.get('limit', 10)), 1000)
+        sites = site_checker.get_recent_sites(limit)
+        return jsonify({
+            'success': True,
+            'sites': sites,
+            'count': len(sites)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ في جلب المواقع: {str(e)}'
+        }), 500
+
+@app.route('/api/sites/verify', methods=['POST'])
+def verify_sites():
+    """التحقق الجماعي من إنشاء عدة مواقع"""
+    try:
+        data = request.json or {}
+        subdomains = data.get('subdomains', [])
+        if not isinstance(subdomains, list) or not subdomains:
+            return jsonify({
+                'success': False,
+                'message': 'حقل subdomains مطلوب كقائمة'
+            }), 400
+
+        results = site_checker.verify_sites_bulk(subdomains, use_cache=not data.get('refresh', False))
+        return jsonify({
+            'success': True,
+            'results': results,
+            'verified': sum(1 for r in results.values() if r['overall_success']),
+            'count': len(results)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ في التحقق من المواقع: {str(e)}'
+        }), 500
+
 # نقاط نهاية إدارة Nginx
 @app.route('/api/nginx/status', methods=['GET'])
 def nginx_status():
@@ -604,6 +982,147 @@ def test_nginx_config():
             'message': f'خطأ في اختبار التكوين: {str(e)}'
         }), 500
 
+# دوال التسخين - تعمل بعد بدء الخادم وليس عند الاستيراد
+def _warmup_database():
+    get_trial_manager().db.ensure_schema()
+
+def _warmup_frappe_environment():
+    get_trial_manager().frappe_manager._debug_environment()
+
+def _warmup_health():
+    ttl, stale_ttl = CACHE_TTLS['health']
+    response_cache.get('health', _build_health_payload, ttl, stale_ttl)
+
+register_warmup('database_schema', _warmup_database)
+register_warmup('frappe_environment', _warmup_frappe_environment)
+register_warmup('health_cache', _warmup_health)
+
+@app.route('/api/debug/startup', methods=['GET'])
+def debug_startup():
+    """تفصيل زمن بدء التشغيل والتسخين"""
+    return jsonify({
+        'success': True,
+        'startup': profiler.summary(),
+        'warmup': warmup_status(),
+        'trial_manager_initialized': trial_manager_resource.initialized
+    })
+
+@app.route('/api/cluster/stats', methods=['GET'])
+def cluster_stats():
+    """إحصائيات الكلاستر"""
+    stats = get_cluster_manager().get_cluster_stats()
+    return jsonify(stats), (200 if stats.get('success') else 500)
+
+@app.route('/api/cluster/migrations', methods=['GET'])
+def cluster_migrations():
+    """الترحيلات الجارية وآخر النتائج"""
+    try:
+        return jsonify({
+            'success': True,
+            'migrations': get_cluster_manager().migration_engine.status()
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب حالة الترحيلات: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/migrate', methods=['POST'])
+def cluster_migrate():
+    """ترحيل موقع بين سيرفرين: {site, source, target}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        site, source, target = data.get('site'), data.get('source'), data.get('target')
+        if not site or not SITE_NAME_PATTERN.match(site):
+            return jsonify({'success': False, 'message': 'اسم موقع غير صالح'}), 400
+
+        manager = get_cluster_manager()
+        source = source or manager.assignments.server_of(site) or DEFAULT_SERVER_ID
+        if source not in manager.servers or target not in manager.servers or source == target:
+            return jsonify({'success': False, 'message': 'سيرفر المصدر أو الهدف غير صالح'}), 400
+
+        migration = manager.migration_engine.migrate(site, source, target)
+        return jsonify({
+            'success': migration.status == 'completed',
+            'migration': asdict(migration)
+        }), (200 if migration.status == 'completed' else 500)
+    except Exception as e:
+        logger.error(f"❌ خطأ في ترحيل الموقع: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/autoscaler', methods=['GET'])
+def cluster_autoscaler():
+    """حالة التوسع التلقائي وآخر القرارات"""
+    try:
+        return jsonify({
+            'success': True,
+            'autoscaler': get_cluster_manager().autoscaler_status()
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب حالة التوسع التلقائي: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/leader', methods=['GET'])
+def cluster_leader():
+    """قائد مراقبة الكلاستر وعمر آخر حالة منشورة"""
+    try:
+        return jsonify({
+            'success': True,
+            'leader': get_cluster_manager().leadership_status()
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب قائد المراقبة: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/standby', methods=['GET'])
+def cluster_standby():
+    """السيرفرات الاحتياطية وزمن الترقيات وكلفة الانتظار"""
+    try:
+        return jsonify({
+            'success': True,
+            'standby_pool': get_cluster_manager().standby_status()
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب السيرفرات الاحتياطية: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/failover', methods=['GET'])
+def cluster_failover():
+    """السيرفرات المتوقفة والمواقع المحوّلة وزمن التحويل من الكشف"""
+    try:
+        return jsonify({
+            'success': True,
+            'failover': get_cluster_manager().failover_status()
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب حالة التحويل: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/cluster/containers', methods=['GET'])
+def cluster_containers():
+    """آخر إطلاقات حاويات السيرفرات وأزمنة الجاهزية"""
+    try:
+        launcher = get_cluster_manager().container_launcher
+        return jsonify({
+            'success': True,
+            'containers': launcher.status() if launcher else None
+        })
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب حالة الحاويات: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/debug/background', methods=['GET'])
+def debug_background():
+    """المهام الخلفية في هذه العملية"""
+    return jsonify({
+        'success': True,
+        'background': background_status()
+    })
+
+profiler.record('import:app', time.perf_counter() - PROCESS_START)
+
 if __name__ == '__main__':
     logger.info("🚀 بدء تشغيل خادم SaaS Trial مع Frappe Bench...")
+    if os.environ.get('WARMUP_ON_START', '1') != '0':
+        start_warmups_in_background()
+    start_background_tasks()
+    # خادم التطوير - للإنتاج: gunicorn -c gunicorn.conf.py app:app
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
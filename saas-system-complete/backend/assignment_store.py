@@ -0,0 +1,298 @@
+"""
+جدول توزيع المواقع على السيرفرات (site_assignments)
+
+- الجدول مصدر الحقيقة: صف لكل موقع مع server_id وعداد version يزيد مع كل تغيير
+- فهرس في الذاكرة بالاتجاهين: موقع -> سيرفر و سيرفر -> مواقع (O(1))
+- الإبطال بين العمليات: كل كتابة تزيد generation في cluster_state_versions داخل نفس المعاملة،
+  وكل عملية تقارن الـ generation (استعلام مفتاح أساسي) كل refresh_interval ثانية وتعيد التحميل عند تغيره
+- compare-and-set بالـ version حتى لا يكتب ترحيلان متزامنان فوق بعضهما
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from circuit_breaker import connect_mysql
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'site_assignments'
+
+
+class SiteAssignmentStore:
+    """توزيع المواقع مع فهرس في الذاكرة"""
+
+    def __init__(self, db_config: Dict, refresh_interval: float = 2.0, failure_backoff: float = 30.0):
+        self.db_config = db_config
+        self.refresh_interval = refresh_interval
+        # عند تعذر الاتصال لا تُعاد المحاولة مع كل قراءة (مهلة الاتصال تبطئ الطلبات)
+        self.failure_backoff = failure_backoff
+
+        self._site_to_server: Dict[str, str] = {}
+        self._server_to_sites: Dict[str, Set[str]] = {}
+        self._versions: Dict[str, int] = {}
+        self._generation: Optional[int] = None
+        self._checked_at = 0.0
+        self._schema_ready = False
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+
+    # --- قاعدة البيانات ---
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS site_assignments (
+                site_name VARCHAR(255) PRIMARY KEY,
+                server_id VARCHAR(50) NOT NULL,
+                version INT NOT NULL DEFAULT 1,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_server_id (server_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_state_versions (
+                name VARCHAR(50) PRIMARY KEY,
+                generation BIGINT NOT NULL DEFAULT 0
+            )
+        """)
+        self._schema_ready = True
+
+    def _bump_generation(self, cursor) -> int:
+        """زيادة generation (داخل معاملة الكتابة) وإرجاع القيمة الجديدة"""
+        cursor.execute("""
+            INSERT INTO cluster_state_versions (name, generation) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE generation = LAST_INSERT_ID(generation + 1)
+        """, (GENERATION_KEY,))
+        return cursor.lastrowid if cursor.rowcount == 2 else 1
+
+    # --- الفهرس في الذاكرة ---
+
+    def _index(self, site: str, server_id: str, version: int):
+        previous = self._site_to_server.get(site)
+        if previous is not None and previous != server_id:
+            sites = self._server_to_sites.get(previous)
+            if sites is not None:
+                sites.discard(site)
+                if not sites:
+                    del self._server_to_sites[previous]
+        self._site_to_server[site] = server_id
+        self._server_to_sites.setdefault(server_id, set()).add(site)
+        self._versions[site] = version
+
+    def _unindex(self, site: str):
+        server_id = self._site_to_server.pop(site, None)
+        self._versions.pop(site, None)
+        if server_id is not None:
+            sites = self._server_to_sites.get(server_id)
+            if sites is not None:
+                sites.discard(site)
+                if not sites:
+                    del self._server_to_sites[server_id]
+
+    def _apply_local_write(self, generation: int):
+        """كتابة هذه العملية: الفهرس محدث، والـ generation يتقدم فقط إذا لم تكتب عملية أخرى بينهما"""
+        if self._generation is not None and generation == self._generation + 1:
+            self._generation = generation
+        else:
+            # كتابة من عملية أخرى لم تُحمّل بعد - إعادة تحميل عند الفحص التالي
+            self._checked_at = 0.0
+
+    def reload(self) -> bool:
+        """تحميل الجدول كاملاً وإعادة بناء الفهرس"""
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                cursor.execute("SELECT generation FROM cluster_state_versions WHERE name = %s", (GENERATION_KEY,))
+                row = cursor.fetchone()
+                cursor.execute("SELECT site_name, server_id, version FROM site_assignments")
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل تحميل توزيع المواقع: {e}")
+            self._checked_at = time.monotonic() + self.failure_backoff
+            return False
+
+        with self._lock:
+            self._site_to_server = {}
+            self._server_to_sites = {}
+            self._versions = {}
+            for site, server_id, version in rows:
+                self._index(site, server_id, version)
+            self._generation = row[0] if row else 0
+            self._checked_at = time.monotonic()
+        logger.info(f"📋 تم تحميل توزيع {len(rows)} موقع (generation {self._generation})")
+        return True
+
+    def _refresh_if_stale(self):
+        """مقارنة generation مع قاعدة البيانات كل refresh_interval ثانية"""
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        # فحص واحد في كل مرة - بقية الخيوط تقرأ الفهرس الحالي
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._check_generation()
+        finally:
+            self._refresh_lock.release()
+
+    def _check_generation(self):
+        if self._generation is None:
+            self.reload()
+            return
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT generation FROM cluster_state_versions WHERE name = %s", (GENERATION_KEY,))
+                row = cursor.fetchone()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر فحص إصدار توزيع المواقع: {e}")
+            self._checked_at = time.monotonic() + self.failure_backoff
+            return
+
+        if (row[0] if row else 0) != self._generation:
+            self.reload()
+        else:
+            self._checked_at = time.monotonic()
+
+    # --- القراءة ---
+
+    def server_of(self, site: str) -> Optional[str]:
+        """السيرفر الحالي للموقع"""
+        self._refresh_if_stale()
+        return self._site_to_server.get(site)
+
+    def sites_of(self, server_id: str) -> List[str]:
+        """مواقع السيرفر"""
+        self._refresh_if_stale()
+        with self._lock:
+            return sorted(self._server_to_sites.get(server_id, ()))
+
+    def version_of(self, site: str) -> Optional[int]:
+        self._refresh_if_stale()
+        return self._versions.get(site)
+
+    def snapshot(self) -> Dict[str, str]:
+        """نسخة {site: server_id}"""
+        self._refresh_if_stale()
+        with self._lock:
+            return dict(self._site_to_server)
+
+    def counts(self) -> Dict[str, int]:
+        """عدد المواقع لكل سيرفر"""
+        self._refresh_if_stale()
+        with self._lock:
+            return {server_id: len(sites) for server_id, sites in self._server_to_sites.items()}
+
+    # --- الكتابة ---
+
+    def assign(self, site: str, server_id: str, expected_version: Optional[int] = None) -> bool:
+        """
+        تعيين سيرفر الموقع
+
+        مع expected_version يُنفذ فقط إذا لم يتغير الصف منذ قراءته (False عند التعارض).
+        """
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                if expected_version is None:
+                    cursor.execute("""
+                        INSERT INTO site_assignments (site_name, server_id) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE
+                            version = IF(server_id = VALUES(server_id), version, version + 1),
+                            server_id = VALUES(server_id)
+                    """, (site, server_id))
+                else:
+                    cursor.execute("""
+                        UPDATE site_assignments SET server_id = %s, version = version + 1
+                        WHERE site_name = %s AND version = %s
+                    """, (server_id, site, expected_version))
+                    if cursor.rowcount == 0:
+                        conn.rollback()
+                        logger.warning(f"⚠️ تعارض في تعيين {site}: الإصدار تغير عن {expected_version}")
+                        self._checked_at = 0.0
+                        return False
+                cursor.execute("SELECT version FROM site_assignments WHERE site_name = %s", (site,))
+                version = cursor.fetchone()[0]
+                generation = self._bump_generation(cursor)
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل حفظ تعيين {site} -> {server_id}: {e}")
+            return False
+
+        with self._lock:
+            self._index(site, server_id, version)
+            self._apply_local_write(generation)
+        return True
+
+    def assign_many(self, assignments: Dict[str, str], removed: Iterable[str] = ()) -> bool:
+        """تعيين عدة مواقع وحذف أخرى في معاملة واحدة (إعادة التوزيع)"""
+        removed = list(removed)
+        changed = {site: server_id for site, server_id in assignments.items()
+                   if self._site_to_server.get(site) != server_id}
+        if not changed and not removed:
+            return True
+
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                if changed:
+                    cursor.executemany("""
+                        INSERT INTO site_assignments (site_name, server_id) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE
+                            version = IF(server_id = VALUES(server_id), version, version + 1),
+                            server_id = VALUES(server_id)
+                    """, list(changed.items()))
+                if removed:
+                    cursor.executemany("DELETE FROM site_assignments WHERE site_name = %s",
+                                       [(site,) for site in removed])
+                generation = self._bump_generation(cursor)
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل حفظ توزيع {len(changed)} موقع: {e}")
+            return False
+
+        with self._lock:
+            for site, server_id in changed.items():
+                self._index(site, server_id, self._versions.get(site, 0) + 1)
+            for site in removed:
+                self._unindex(site)
+            self._apply_local_write(generation)
+        return True
+
+    def remove(self, site: str) -> bool:
+        """حذف تعيين موقع محذوف"""
+        return self.assign_many({}, removed=[site])
+
+    def status(self) -> Dict:
+        """ملخص للوحة المراقبة"""
+        counts = self.counts()
+        return {
+            'sites': sum(counts.values()),
+            'servers': counts,
+            'generation': self._generation,
+            'refresh_interval': self.refresh_interval
+        }
@@ -0,0 +1,452 @@
+"""
+خادم API غير متزامن (asyncio) لنظام SaaS Trial - لنقاط النهاية التي تنتظر I/O فقط
+
+يقدم نقاط الاستعلام والمتابعة من app.py فوق حلقة asyncio واحدة، فتنتظر آلاف الفحوصات ومتابعات
+الدفعات المتزامنة دون thread لكل طلب:
+- aiomysql مع مجمع اتصالات بدلاً من اتصال جديد لكل طلب
+- asyncio subprocess لأوامر bench و docker
+- aiohttp ClientSession مع اتصالات keep-alive مشتركة
+
+نفس طبقات app.py: DB_CONFIG من db_config.py، الذاكرة المؤقتة (response_cache و CACHE_TTLS)، التتبع
+(X-Trace-Id و span لكل طلب وأمر)، وقواطع الدوائر (mysql:<host>، bench:local، docker:proxy-server).
+
+إنشاء التجارب (/api/create-trial، /api/bulk-trials POST) وإدارة الكلاستر تبقى في app.py (gunicorn):
+تمر عبر TrialManager ومنفذ الدفعات ومدير الكلاستر المتزامنة. متابعة الدفعات (/api/bulk-trials/<job_id>)
+هنا تقرأ نفس الجداول عبر BulkTrialStore.
+
+التشغيل:
+    python async_app.py
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import aiomysql
+from aiohttp import web
+
+from bulk_trials import BulkTrialStore
+from circuit_breaker import CircuitOpenError, breakers, docker_failure
+from db_config import DB_CONFIG
+from response_cache import CACHE_TTLS, response_cache
+from site_status import configured_sites
+from tracing import install_log_trace_ids, tracer
+
+# إعداد التسجيل (كل سجل يحمل trace_id للطلب الحالي)
+install_log_trace_ids()
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+TRACE_ID_CHARS = set('0123456789abcdef-')
+_MISSING = object()
+
+json_dumps = functools.partial(json.dumps, default=str, ensure_ascii=False)
+
+
+class AsyncCommandRunner:
+    """تنفيذ أوامر bench و docker عبر asyncio subprocess"""
+
+    def __init__(self, max_concurrent: int = 16):
+        self.bench_path = "/home/frappe/production"
+        self.nginx_conf_dir = "/etc/nginx/conf.d/dynamic"
+        self.proxy_server = "proxy-server"
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _exec(self, command: List[str], cwd: Optional[str], timeout: float,
+                    env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        """تشغيل الأمر وانتظاره (OSError أو TimeoutError فشل في التبعية نفسها)"""
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=cwd,
+            env=env,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        return subprocess.CompletedProcess(command, process.returncode,
+                                           stdout.decode(errors='replace'), stderr.decode(errors='replace'))
+
+    async def run(self, command: List[str], breaker: str, cwd: Optional[str] = None, timeout: float = 300,
+                  env: Optional[Dict[str, str]] = None,
+                  is_failure: Optional[Callable[[Any], Any]] = None) -> Tuple[bool, str]:
+        """تنفيذ أمر عبر قاطعه دون حجز thread أثناء الانتظار"""
+        async with self._semaphore:
+            start_time = time.time()
+            with tracer.start_span(' '.join(command[:2]), command=' '.join(command[:4])) as span:
+                try:
+                    result = await breakers.get(breaker).call_async(self._exec, command, cwd, timeout, env,
+                                                                    is_failure=is_failure)
+                except CircuitOpenError as e:
+                    logger.warning(f"🔌 [ASYNC] لم يُنفذ {command[0]}: {e}")
+                    return False, str(e)
+                except asyncio.TimeoutError:
+                    logger.error(f"⏰ [ASYNC] انتهت مهلة الأمر ({timeout} ثانية): {' '.join(command)}")
+                    return False, "انتهت مهلة تنفيذ الأمر"
+                except OSError as e:
+                    logger.error(f"💥 [ASYNC] تعذر تشغيل الأمر {command[0]}: {e}")
+                    return False, f"خطأ في التنفيذ: {str(e)}"
+                span.set_attribute('returncode', result.returncode)
+
+            execution_time = time.time() - start_time
+            logger.info(f"⏱️ [ASYNC] {' '.join(command[:4])} - {execution_time:.2f} ثانية - كود {result.returncode}")
+
+            if result.returncode == 0:
+                return True, result.stdout
+            return False, result.stderr if result.stderr else result.stdout
+
+    async def bench(self, command: List[str], site: Optional[str] = None, timeout: float = 300) -> Tuple[bool, str]:
+        """تنفيذ أمر bench"""
+        full_command = ["bench", "--site", site] + command if site else ["bench"] + command
+        return await self.run(full_command, "bench:local", cwd=self.bench_path, timeout=timeout,
+                              env=tracer.subprocess_env(os.environ.copy()))
+
+    async def nginx(self, command: str, timeout: float = 30) -> Tuple[bool, str]:
+        """تنفيذ أمر داخل حاوية proxy-server"""
+        success, output = await self.run(
+            ["docker", "exec", *tracer.docker_env_args(), self.proxy_server, "bash", "-c", command],
+            f"docker:{self.proxy_server}",
+            timeout=timeout,
+            is_failure=docker_failure
+        )
+        return success, output.strip()
+
+    async def get_all_sites(self) -> List[str]:
+        """قائمة مواقع bench"""
+        success, output = await self.bench(["site", "list"])
+        if not success:
+            logger.error(f"❌ [ASYNC] فشل جلب المواقع: {output}")
+            return []
+        return [line.strip() for line in output.split('\n') if line.strip() and not line.strip().startswith('#')]
+
+    async def list_site_configs(self) -> List[str]:
+        """قائمة تكوينات Nginx"""
+        success, output = await self.nginx(f"ls -1 {self.nginx_conf_dir}/*.conf 2>/dev/null || true")
+        if success and output:
+            return [line.strip() for line in output.splitlines() if line.strip()]
+        return []
+
+
+class AsyncBackend:
+    """الموارد المشتركة للخادم غير المتزامن"""
+
+    def __init__(self):
+        self.db_pool: Optional[aiomysql.Pool] = None
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.runner: Optional[AsyncCommandRunner] = None
+        self.bulk_store = BulkTrialStore(DB_CONFIG)
+
+        self.db_pool_size = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+        self.http_pool_size = int(os.environ.get('ASYNC_HTTP_POOL_SIZE', 200))
+        self.max_subprocesses = int(os.environ.get('ASYNC_MAX_SUBPROCESSES', 16))
+        self.db_breaker = breakers.get(f"mysql:{DB_CONFIG['host']}")
+
+    async def start(self, app: web.Application):
+        """إنشاء مجمعات الاتصال عند بدء الخادم"""
+        self.runner = AsyncCommandRunner(self.max_subprocesses)
+        # نفس DB_CONFIG المشترك - aiomysql يسمي قاعدة البيانات db
+        pool_config = dict(DB_CONFIG)
+        pool_config['db'] = pool_config.pop('database')
+        self.db_pool = await aiomysql.create_pool(
+            minsize=1,
+            maxsize=self.db_pool_size,
+            autocommit=True,
+            **pool_config
+        )
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.http_pool_size, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=10, connect=3)
+        )
+        logger.info(f"✅ [ASYNC] مجمع قاعدة البيانات: {self.db_pool_size} - مجمع HTTP: {self.http_pool_size}")
+
+    async def stop(self, app: web.Application):
+        """إغلاق مجمعات الاتصال"""
+        if self.http:
+            await self.http.close()
+        if self.db_pool:
+            self.db_pool.close()
+            await self.db_pool.wait_closed()
+        logger.info("🛑 [ASYNC] تم إغلاق الموارد")
+
+    async def _query(self, query: str, args: tuple) -> List[dict]:
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, args)
+                return list(await cursor.fetchall())
+
+    async def fetch_all(self, query: str, args: tuple = ()) -> List[dict]:
+        """تنفيذ استعلام قراءة من المجمع عبر قاطع MySQL"""
+        with tracer.start_span('db.query'):
+            return await self.db_breaker.call_async(self._query, query, args)
+
+    async def _ping(self):
+        async with self.db_pool.acquire() as conn:
+            await conn.ping(reconnect=True)
+
+    async def ping_db(self):
+        """اختبار اتصال قاعدة البيانات"""
+        with tracer.start_span('db.ping'):
+            await self.db_breaker.call_async(self._ping)
+
+    async def cached(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        قراءة من response_cache المشترك مع app.py (نفس المفاتيح و CACHE_TTLS)
+
+        القيمة الحاضرة تُعاد دون مغادرة الحلقة؛ عند الغياب ينتظر الطلب التحميل الوحيد الجاري
+        في thread، والتحميل نفسه يعمل على الحلقة (loader كوروتين).
+        """
+        ttl, stale_ttl = CACHE_TTLS[key]
+        loop = asyncio.get_running_loop()
+
+        def load():
+            return asyncio.run_coroutine_threadsafe(loader(), loop).result()
+
+        value = response_cache.get(key, load, ttl, stale_ttl, wait=False, default=_MISSING)
+        if value is _MISSING:
+            value = await asyncio.to_thread(response_cache.get, key, load, ttl, stale_ttl)
+        return value
+
+    async def sites(self) -> List[str]:
+        """مواقع bench من الذاكرة المؤقتة"""
+        return await self.cached('bench_sites', self.runner.get_all_sites)
+
+    async def nginx_configs(self) -> List[str]:
+        """تكوينات Nginx من الذاكرة المؤقتة"""
+        return await self.cached('nginx_configs', self.runner.list_site_configs)
+
+    async def probe_site(self, site_name: str) -> Tuple[str, str, Optional[int]]:
+        """فحص استجابة الموقع عبر HTTP"""
+        with tracer.start_span('site.probe', site=site_name) as span:
+            try:
+                async with self.http.get(f"http://{site_name}/api/method/version") as response:
+                    text = await response.text()
+                    span.set_attribute('status_code', response.status)
+                    status = "connected" if response.status == 200 else "failed"
+                    return status, text[:200] if text else "empty", response.status
+            except aiohttp.ClientConnectionError:
+                return "unreachable", "", None
+            except asyncio.TimeoutError:
+                return "timeout", "", None
+            except Exception as e:
+                return f"error: {str(e)}", "", None
+
+
+backend = AsyncBackend()
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """التحقق من صحة النظام"""
+    try:
+        await backend.ping_db()
+        sites = await backend.sites()
+        return web.json_response({
+            'success': True,
+            'message': '✅ النظام يعمل بشكل صحيح',
+            'database': '✅ متصل',
+            'frappe_bench': f'✅ متصل ({len(sites)} مواقع)',
+            'frappe_manager': 'AsyncCommandRunner',
+            'sites_list': sites,
+            'timestamp': datetime.now().isoformat()
+        }, dumps=json_dumps)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'message': '❌ نظام قاعدة البيانات غير متصل',
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }, status=500, dumps=json_dumps)
+
+
+async def get_frappe_sites(request: web.Request) -> web.Response:
+    """الحصول على قائمة المواقع من Frappe Bench"""
+    try:
+        if request.query.get('refresh'):
+            response_cache.invalidate('bench_sites')
+        sites = await backend.sites()
+        return web.json_response({
+            'success': True,
+            'sites': sites,
+            'count': len(sites),
+            'manager_type': 'AsyncCommandRunner'
+        }, dumps=json_dumps)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'message': f'خطأ في جلب المواقع: {str(e)}'
+        }, status=500, dumps=json_dumps)
+
+
+async def check_site_status(request: web.Request) -> web.Response:
+    """التحقق من حالة موقع معين - الجرد من الذاكرة المؤقتة والفحص الحي بالتوازي"""
+    try:
+        clean_site_name = request.match_info['site_name'].replace('http://', '').replace('https://', '')
+
+        nginx_configs, sites, (frappe_status, frappe_response, http_status) = await asyncio.gather(
+            backend.nginx_configs(),
+            backend.sites(),
+            backend.probe_site(clean_site_name)
+        )
+
+        status = {
+            'site_name': clean_site_name,
+            'nginx_config': bool(configured_sites([clean_site_name], nginx_configs)),
+            'frappe_site_exists': clean_site_name in sites,
+            'frappe_status': frappe_status,
+            'frappe_response': frappe_response,
+            'http_status': http_status
+        }
+        # قائمة كل المواقع اختيارية كما في app.py
+        if request.query.get('include_sites'):
+            status['all_sites'] = sites
+
+        return web.json_response({
+            'success': True,
+            **status
+        }, dumps=json_dumps)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500, dumps=json_dumps)
+
+
+async def bulk_trials_status(request: web.Request) -> web.StreamResponse:
+    """تقرير دفعة الإنشاء الجماعي (stream=1 للبث حتى الانتهاء) - الانتظار بين القراءات على الحلقة"""
+    job_id = request.match_info['job_id']
+    try:
+        job = await asyncio.to_thread(backend.bulk_store.load, job_id)
+    except Exception as e:
+        logger.error(f"❌ [ASYNC] خطأ في قراءة الدفعة {job_id}: {str(e)}")
+        return web.json_response({
+            'success': False,
+            'message': f'حدث خطأ في الخادم: {str(e)}'
+        }, status=500, dumps=json_dumps)
+    if job is None:
+        return web.json_response({
+            'success': False,
+            'message': 'الدفعة غير موجودة'
+        }, status=404, dumps=json_dumps)
+
+    if not request.query.get('stream'):
+        return web.json_response({
+            'success': True,
+            **job.report()
+        }, dumps=json_dumps)
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    steps = backend.bulk_store.stream_steps(job)
+    while True:
+        # كل خطوة تقرأ قاعدة البيانات مرة واحدة على الأكثر - في thread، والانتظار بين القراءات هنا
+        step = await asyncio.to_thread(next, steps, None)
+        if step is None:
+            break
+        if isinstance(step, float):
+            await asyncio.sleep(step)
+        else:
+            await response.write(step.encode())
+    await response.write_eof()
+    return response
+
+
+async def get_recent_customers(request: web.Request) -> web.Response:
+    """الحصول على أحدث العملاء"""
+    try:
+        customers = await backend.fetch_all("""
+            SELECT * FROM trial_customers
+            ORDER BY created_at DESC
+            LIMIT %s
+        """, (10,))
+        return web.json_response({
+            'success': True,
+            'customers': customers,
+            'count': len(customers)
+        }, dumps=json_dumps)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'message': f'خطأ في جلب العملاء: {str(e)}'
+        }, status=500, dumps=json_dumps)
+
+
+async def nginx_sites(request: web.Request) -> web.Response:
+    """قائمة تكوينات المواقع في Nginx"""
+    try:
+        if request.query.get('refresh'):
+            response_cache.invalidate('nginx_configs')
+        configs = await backend.nginx_configs()
+        return web.json_response({
+            'success': True,
+            'sites_count': len(configs),
+            'configs': configs
+        }, dumps=json_dumps)
+    except Exception as e:
+        return web.json_response({
+            'success': False,
+            'message': f'خطأ في جرد المواقع: {str(e)}'
+        }, status=500, dumps=json_dumps)
+
+
+@web.middleware
+async def trace_middleware(request: web.Request, handler):
+    """span لكل طلب - يُستخدم X-Trace-Id الوارد إن وُجد، ويُعاد للعميل"""
+    incoming = (request.headers.get('X-Trace-Id') or '').lower()
+    trace_id = incoming if 0 < len(incoming) <= 64 and set(incoming) <= TRACE_ID_CHARS else None
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else request.path
+    span, token = tracer.begin_span(f"{request.method} {route}", trace_id=trace_id, path=request.path)
+    error = None
+    try:
+        response = await handler(request)
+        span.set_attribute('status_code', response.status)
+        if not response.prepared:
+            response.headers['X-Trace-Id'] = span.trace_id
+        return response
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        tracer.end_span(span, token, error)
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    """نفس سلوك CORS(app) في app.py"""
+    response = await handler(request)
+    if not response.prepared:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+def create_app() -> web.Application:
+    """بناء تطبيق aiohttp"""
+    app = web.Application(middlewares=[trace_middleware, cors_middleware])
+    app.on_startup.append(backend.start)
+    app.on_cleanup.append(backend.stop)
+
+    app.router.add_get('/api/health', health_check)
+    app.router.add_get('/api/frappe-sites', get_frappe_sites)
+    app.router.add_get('/api/site-status/{site_name:.+}', check_site_status)
+    app.router.add_get('/api/bulk-trials/{job_id}', bulk_trials_status)
+    app.router.add_get('/api/recent-customers', get_recent_customers)
+    app.router.add_get('/api/nginx/sites', nginx_sites)
+    return app
+
+
+if __name__ == '__main__':
+    logger.info("🚀 بدء تشغيل خادم SaaS Trial غير المتزامن...")
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
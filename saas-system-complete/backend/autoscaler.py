@@ -0,0 +1,319 @@
+"""
+محرك سياسات التوسع التلقائي للكلاستر
+
+- كل سياسة تقترح إجراء (scale_up / scale_down / hold / None) مع السبب؛ hold اعتراض على التقليل
+- الإجراء يُنفذ فقط إذا استمر الاقتراح طوال نافذة الاستمرار (sustain) - لا تذبذب بسبب قمة قصيرة
+- فترة تهدئة بعد كل إجراء ناجح (أو مسجل في dry_run)، ومنع التقليل لفترة أطول بعد التوسع
+- احترام min_servers و max_servers دائماً
+- وضع التشغيل (AUTOSCALE_MODE): off | dry_run (تسجيل ما كان سيحدث فقط) | enabled
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCALE_UP = 'scale_up'
+SCALE_DOWN = 'scale_down'
+# اعتراض صريح: لا توسع، ولا تقليل ما دامت سياسة تعترض
+HOLD = 'hold'
+
+MODE_OFF = 'off'
+MODE_DRY_RUN = 'dry_run'
+MODE_ENABLED = 'enabled'
+
+
+@dataclass
+class ScalingContext:
+    """حالة الكلاستر المستخدمة في تقييم السياسات"""
+    now: float
+    total_servers: int
+    healthy_servers: int
+    min_servers: int
+    max_servers: int
+    avg_cpu: Optional[float] = None
+    avg_memory: Optional[float] = None
+    p95_cpu: Optional[float] = None
+    total_sites: int = 0
+    signups_per_hour: Optional[float] = None
+    provisioning_queue: Optional[int] = None
+
+
+@dataclass
+class ScalingDecision:
+    """نتيجة تقييم واحدة"""
+    at: float
+    action: Optional[str]
+    reason: str
+    mode: str
+    count: int = 1
+    executed: bool = False
+    result: Optional[Dict] = None
+    proposals: List[Dict] = field(default_factory=list)
+
+
+class ScalingPolicy:
+    """سياسة توسع - تعيد (الإجراء، السبب) أو (None، '')"""
+
+    name = 'policy'
+
+    def evaluate(self, context: ScalingContext) -> Tuple[Optional[str], str]:
+        """تقييم السياسة على السياق"""
+        raise NotImplementedError
+
+    def servers_needed(self, context: ScalingContext) -> int:
+        """عدد السيرفرات الإضافية المطلوبة عند التوسع (سيرفر واحد افتراضياً)"""
+        return 1
+
+
+class ThresholdPolicy(ScalingPolicy):
+    """عتبات CPU والذاكرة على متوسط النافذة، مع فجوة بين عتبة التوسع والتقليل"""
+
+    name = 'threshold'
+
+    def __init__(self, scale_up_threshold: float, scale_down_threshold: float):
+        self.scale_up_threshold = scale_up_threshold
+        self.scale_down_threshold = scale_down_threshold
+
+    def evaluate(self, context: ScalingContext) -> Tuple[Optional[str], str]:
+        if context.healthy_servers == 0:
+            # لا توجد قراءات موثوقة (عطل شامل أو انقطاع المراقبة) - لا توسع أعمى
+            return None, ''
+        if context.healthy_servers < context.min_servers:
+            return SCALE_UP, f"السيرفرات الصحية {context.healthy_servers} أقل من الحد الأدنى {context.min_servers}"
+        if context.avg_cpu is None:
+            return None, ''
+
+        memory = context.avg_memory or 0
+        if context.avg_cpu > self.scale_up_threshold or memory > self.scale_up_threshold:
+            return SCALE_UP, f"CPU {context.avg_cpu:.1f}% / ذاكرة {memory:.1f}% فوق {self.scale_up_threshold}%"
+        if context.avg_cpu < self.scale_down_threshold and memory < self.scale_up_threshold:
+            return SCALE_DOWN, f"CPU {context.avg_cpu:.1f}% تحت {self.scale_down_threshold}%"
+        return None, ''
+
+    def servers_needed(self, context: ScalingContext) -> int:
+        return max(1, context.min_servers - context.healthy_servers)
+
+
+class PredictiveCapacityPolicy(ScalingPolicy):
+    """
+    توسع استباقي من معدل التسجيلات وطابور الإنشاء
+
+    عدد المواقع المتوقع بعد horizon = الحالي + الطابور + معدل التسجيل × horizon؛
+    السيرفرات المطلوبة = ceil(المتوقع / target_sites_per_server).
+    """
+
+    name = 'predictive'
+
+    def __init__(self, target_sites_per_server: int, horizon_seconds: int):
+        self.target_sites_per_server = target_sites_per_server
+        self.horizon_seconds = horizon_seconds
+
+    def _needed(self, context: ScalingContext) -> Tuple[float, int]:
+        expected = (context.total_sites + (context.provisioning_queue or 0) +
+                    (context.signups_per_hour or 0) * self.horizon_seconds / 3600)
+        return expected, math.ceil(expected / max(self.target_sites_per_server, 1))
+
+    def evaluate(self, context: ScalingContext) -> Tuple[Optional[str], str]:
+        if context.signups_per_hour is None and context.provisioning_queue is None:
+            return None, ''
+
+        expected, needed = self._needed(context)
+        if needed > context.healthy_servers:
+            return SCALE_UP, (f"متوقع {expected:.0f} موقع خلال {self.horizon_seconds // 60} دقيقة "
+                              f"يحتاج {needed} سيرفر")
+        if needed >= context.healthy_servers:
+            # إزالة سيرفر تترك سعة أقل من المتوقع
+            return HOLD, (f"متوقع {expected:.0f} موقع خلال {self.horizon_seconds // 60} دقيقة "
+                          f"يحتاج كل السيرفرات الحالية ({needed})")
+        return None, ''
+
+    def servers_needed(self, context: ScalingContext) -> int:
+        return max(1, self._needed(context)[1] - context.healthy_servers)
+
+
+class Autoscaler:
+    """تقييم السياسات وتنفيذ الإجراءات مع الاستمرار والتهدئة"""
+
+    def __init__(self, cluster_manager, policies: List[ScalingPolicy], mode: str = MODE_DRY_RUN,
+                 up_sustain: float = 120, down_sustain: float = 600,
+                 up_cooldown: float = 300, down_cooldown: float = 900,
+                 signal_provider: Optional[Callable[[], Dict]] = None):
+        self.cluster_manager = cluster_manager
+        self.policies = policies
+        self.mode = mode
+        self.up_sustain = up_sustain
+        self.down_sustain = down_sustain
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.signal_provider = signal_provider
+
+        self._pending: Dict[str, float] = {}
+        self._last_action: Optional[Tuple[str, float]] = None
+        self.history: deque = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def _context(self, now: float) -> ScalingContext:
+        """بناء السياق من الكلاستر"""
+        manager = self.cluster_manager
+        healthy = manager.get_healthy_servers()
+        window = manager.config.scale_window_seconds
+        store = manager.metrics_store
+
+        context = ScalingContext(
+            now=now,
+            total_servers=len(manager.servers),
+            healthy_servers=len(healthy),
+            min_servers=manager.config.min_servers,
+            max_servers=manager.config.max_servers,
+            avg_cpu=store.aggregate('cpu_percent', window, healthy, now=now),
+            avg_memory=store.aggregate('memory_percent', window, healthy, now=now),
+            p95_cpu=store.cluster_percentile('cpu_percent', window, healthy, now=now),
+            total_sites=int(store.aggregate('sites_count', window, healthy, stat='latest', reduce='sum', now=now) or 0)
+        )
+        if self.signal_provider:
+            try:
+                signals = self.signal_provider() or {}
+                context.signups_per_hour = signals.get('signups_per_hour')
+                context.provisioning_queue = signals.get('provisioning_queue')
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر جلب إشارات الطلب للتوسع الاستباقي: {e}")
+        return context
+
+    def _combine(self, proposals: List[Dict]) -> Tuple[Optional[str], str]:
+        """التوسع إذا اقترحته أي سياسة؛ التقليل فقط إذا لم تطلب أي سياسة التوسع ولم تعترض (hold)"""
+        ups = [p for p in proposals if p['action'] == SCALE_UP]
+        if ups:
+            return SCALE_UP, '; '.join(f"{p['policy']}: {p['reason']}" for p in ups)
+        downs = [p for p in proposals if p['action'] == SCALE_DOWN]
+        holds = [p for p in proposals if p['action'] == HOLD]
+        if downs and holds:
+            return None, f"{SCALE_DOWN} معترض عليه - " + '; '.join(f"{p['policy']}: {p['reason']}" for p in holds)
+        if downs:
+            return SCALE_DOWN, '; '.join(f"{p['policy']}: {p['reason']}" for p in downs)
+        return None, ''
+
+    def _blocked(self, action: str, context: ScalingContext) -> Optional[str]:
+        """سبب منع الإجراء (الحدود أو التهدئة)"""
+        if action == SCALE_UP and context.total_servers >= context.max_servers:
+            return f"الحد الأقصى {context.max_servers} سيرفر"
+        if action == SCALE_DOWN and context.total_servers <= context.min_servers:
+            return f"الحد الأدنى {context.min_servers} سيرفر"
+
+        if self._last_action:
+            # التقليل ينتظر التهدئة الأطول بعد أي إجراء
+            elapsed = context.now - self._last_action[1]
+            cooldown = self.down_cooldown if action == SCALE_DOWN else self.up_cooldown
+            if elapsed < cooldown:
+                return f"فترة تهدئة ({cooldown - elapsed:.0f} ثانية متبقية)"
+        return None
+
+    def evaluate(self, now: Optional[float] = None) -> ScalingDecision:
+        """تقييم السياسات وتحديث نوافذ الاستمرار بدون تنفيذ"""
+        now = now or time.time()
+        context = self._context(now)
+        proposals = []
+        for policy in self.policies:
+            action, reason = policy.evaluate(context)
+            proposal = {'policy': policy.name, 'action': action, 'reason': reason}
+            if action == SCALE_UP:
+                proposal['servers'] = policy.servers_needed(context)
+            proposals.append(proposal)
+
+        action, reason = self._combine(proposals)
+
+        # نافذة الاستمرار: الاقتراح يجب أن يستمر دون انقطاع
+        for pending in list(self._pending):
+            if pending != action:
+                del self._pending[pending]
+        if action is None:
+            return ScalingDecision(now, None, reason or 'لا حاجة لتغيير', self.mode, proposals=proposals)
+
+        since = self._pending.setdefault(action, now)
+        sustain = self.up_sustain if action == SCALE_UP else self.down_sustain
+        if now - since < sustain:
+            return ScalingDecision(now, None, f"{action} مقترح منذ {now - since:.0f} من {sustain:.0f} ثانية: {reason}",
+                                   self.mode, proposals=proposals)
+
+        blocked = self._blocked(action, context)
+        if blocked:
+            return ScalingDecision(now, None, f"{action} ممنوع - {blocked}", self.mode, proposals=proposals)
+
+        # عدد السيرفرات: أكبر طلب بين السياسات دون تجاوز max_servers (scale_up يطبق حد الدفعة)
+        count = 1
+        if action == SCALE_UP:
+            requested = max(p.get('servers', 1) for p in proposals if p['action'] == SCALE_UP)
+            count = max(1, min(requested, context.max_servers - context.total_servers))
+        return ScalingDecision(now, action, reason, self.mode, count=count, proposals=proposals)
+
+    def step(self, now: Optional[float] = None) -> Optional[ScalingDecision]:
+        """تقييم وتنفيذ (أو تسجيل فقط في dry_run) - يُستدعى من حلقة المراقبة"""
+        if self.mode == MODE_OFF:
+            return None
+
+        with self._lock:
+            decision = self.evaluate(now)
+            if decision.action is None:
+                return decision
+
+            if self.mode == MODE_DRY_RUN:
+                logger.info(f"🧪 [DRY RUN] كان سيتم تنفيذ {decision.action} ({decision.count}): {decision.reason}")
+            else:
+                logger.info(f"⚖️ تنفيذ {decision.action} ({decision.count}): {decision.reason}")
+                if decision.action == SCALE_UP:
+                    decision.result = self.cluster_manager.scale_up(count=decision.count)
+                else:
+                    decision.result = self.cluster_manager.scale_down()
+                decision.executed = bool(decision.result and decision.result.get('success'))
+
+            # التهدئة تبدأ في dry_run أيضاً حتى يعكس السجل سلوك التشغيل الفعلي، ولا تبدأ بعد تنفيذ فاشل؛
+            # الاقتراح يجب أن يستمر نافذة الاستمرار من جديد قبل إعادة المحاولة
+            if self.mode == MODE_DRY_RUN or decision.executed:
+                self._last_action = (decision.action, decision.at)
+            else:
+                logger.warning(f"⚠️ فشل تنفيذ {decision.action} - لا تبدأ فترة التهدئة: {decision.result}")
+            self._pending.clear()
+            self.history.append(decision)
+            return decision
+
+    def status(self) -> Dict:
+        """حالة المحرك وآخر القرارات"""
+        return {
+            'mode': self.mode,
+            'policies': [policy.name for policy in self.policies],
+            'sustain_seconds': {SCALE_UP: self.up_sustain, SCALE_DOWN: self.down_sustain},
+            'cooldown_seconds': {SCALE_UP: self.up_cooldown, SCALE_DOWN: self.down_cooldown},
+            'pending': {action: round(time.time() - since, 1) for action, since in self._pending.items()},
+            'last_action': {'action': self._last_action[0], 'at': self._last_action[1]} if self._last_action else None,
+            'history': [asdict(decision) for decision in list(self.history)[-20:]]
+        }
+
+
+def create_autoscaler(cluster_manager, signal_provider: Optional[Callable[[], Dict]] = None) -> Autoscaler:
+    """إنشاء المحرك من ClusterConfig (AUTOSCALE_MODE يتجاوز الإعداد)"""
+    config = cluster_manager.config
+    policies: List[ScalingPolicy] = [ThresholdPolicy(config.scale_up_threshold, config.scale_down_threshold)]
+    if config.predictive_scaling:
+        policies.append(PredictiveCapacityPolicy(config.target_sites_per_server, config.prediction_horizon_seconds))
+
+    mode = os.environ.get('AUTOSCALE_MODE', config.autoscale_mode)
+    if mode not in (MODE_OFF, MODE_DRY_RUN, MODE_ENABLED):
+        logger.warning(f"⚠️ وضع توسع غير معروف {mode} - استخدام {MODE_DRY_RUN}")
+        mode = MODE_DRY_RUN
+
+    return Autoscaler(
+        cluster_manager,
+        policies,
+        mode=mode,
+        up_sustain=config.scale_up_sustain_seconds,
+        down_sustain=config.scale_down_sustain_seconds,
+        up_cooldown=config.scale_up_cooldown_seconds,
+        down_cooldown=config.scale_down_cooldown_seconds,
+        signal_provider=signal_provider if config.predictive_scaling else None
+    )
@@ -0,0 +1,116 @@
+"""
+المهام الخلفية (مراقبة الكلاستر وغيرها) - تعمل في عملية واحدة فقط
+
+عند التشغيل بعدة عمليات (gunicorn) تحاول كل عملية أخذ قفل ملف حصري؛
+العملية التي تحصل عليه تشغل المهام، والبقية تعيد المحاولة دورياً لتتولى
+المهام إذا توقفت العملية المالكة (مثلاً عند إعادة تدوير العامل).
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCK_PATH = os.environ.get('BACKGROUND_LOCK_PATH', '/tmp/saas-backend-background.lock')
+
+_tasks: List[Tuple[str, Callable[[], None]]] = []
+_state: Dict = {'owner': False, 'pid': None, 'started_tasks': []}
+_lock_file = None
+_state_lock = threading.Lock()
+
+
+def register_background_task(name: str, start: Callable[[], None]):
+    """تسجيل مهمة خلفية - تُستدعى start في thread منفصل حتى لا تؤخر إقلاع العامل"""
+    _tasks.append((name, start))
+
+
+def _try_acquire(lock_path: str) -> bool:
+    """محاولة أخذ القفل الحصري دون انتظار"""
+    global _lock_file
+    handle = open(lock_path, 'a+')
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(os.getpid()))
+    handle.flush()
+    # يبقى الملف مفتوحاً طوال عمر العملية؛ يُحرر القفل تلقائياً عند خروجها
+    _lock_file = handle
+    return True
+
+
+def _run_task(name: str, start: Callable[[], None]):
+    """تشغيل مهمة واحدة"""
+    try:
+        start()
+        _state['started_tasks'].append(name)
+        logger.info(f"✅ بدء المهمة الخلفية {name} في العملية {os.getpid()}")
+    except Exception as e:
+        logger.error(f"❌ فشل بدء المهمة الخلفية {name}: {e}")
+
+
+def _start_tasks():
+    """تشغيل المهام المسجلة في هذه العملية"""
+    _state['owner'] = True
+    _state['pid'] = os.getpid()
+    for name, start in _tasks:
+        threading.Thread(target=_run_task, args=(name, start), name=f"background-{name}", daemon=True).start()
+
+
+def _retry_loop(lock_path: str, retry_interval: float):
+    """إعادة محاولة أخذ القفل حتى تتوقف العملية المالكة"""
+    while True:
+        time.sleep(retry_interval)
+        with _state_lock:
+            if _state['owner']:
+                return
+            if _try_acquire(lock_path):
+                logger.info(f"🔁 العملية {os.getpid()} تولت المهام الخلفية")
+                _start_tasks()
+                return
+
+
+def start_background_tasks(lock_path: Optional[str] = None, retry_interval: float = 10) -> bool:
+    """
+    تشغيل المهام الخلفية إذا كانت هذه العملية هي المالكة للقفل
+
+    تعيد True إذا بدأت المهام في هذه العملية.
+    """
+    lock_path = lock_path or DEFAULT_LOCK_PATH
+    with _state_lock:
+        if _state['owner'] and _state['pid'] == os.getpid():
+            return True
+
+        # حالة موروثة من العملية الأم بعد fork
+        _state.update({'owner': False, 'pid': None, 'started_tasks': []})
+
+        if _try_acquire(lock_path):
+            _start_tasks()
+            return True
+
+    threading.Thread(
+        target=_retry_loop,
+        args=(lock_path, retry_interval),
+        name="background-lock-retry",
+        daemon=True
+    ).start()
+    logger.info(f"ℹ️ المهام الخلفية تعمل في عملية أخرى - العملية {os.getpid()} في وضع الانتظار")
+    return False
+
+
+def background_status() -> Dict:
+    """حالة المهام الخلفية في هذه العملية"""
+    return {
+        'pid': os.getpid(),
+        'owner': _state['owner'] and _state['pid'] == os.getpid(),
+        'registered_tasks': [name for name, _ in _tasks],
+        'started_tasks': list(_state['started_tasks'])
+    }
@@ -0,0 +1,637 @@
+"""
+الإنشاء الجماعي للحسابات التجريبية (استيراد الشركاء والموزعين)
+
+المراحل:
+1. تحليل الدفعة (CSV أو JSON) والتحقق من الصفوف وإزالة التكرار داخلها
+2. استعلام واحد على trial_customers لاستبعاد البريد/subdomain الموجود
+3. حجز subdomains بإدراج صفوف العملاء على دفعات (frappe_site_created = FALSE)
+4. إنشاء المواقع بالتوازي بعدد عمال محدود مع حالة لكل صف
+5. تكوين Nginx لكل المواقع الناجحة مع إعادة تحميل واحدة، ثم تحديث واحد
+   لحالة المواقع وحذف حجوزات الصفوف الفاشلة
+
+حالة الدفعة وكل صف محفوظة في bulk_trial_jobs / bulk_trial_rows: الطلب يحفظ الدفعة فقط،
+والتنفيذ في مالك المهام الخلفية (background.py) الذي يأخذ الدفعة بـ lease. إذا انتهت العملية
+أثناء التنفيذ (إعادة تدوير gunicorn) تُستأنف الدفعة من آخر حالة محفوظة: الصفوف المحجوزة
+يُعاد إنشاء مواقعها (create_trial_site لا يعيد إنشاء موقع موجود) وتُكمل مرحلة Nginx.
+"""
+
+import csv
+import io
+import json
+import logging
+import re
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from circuit_breaker import connect_mysql
+from nginx_manager import nginx_manager, DEFAULT_SERVER_ID
+from tracing import traced, with_current_context
+
+logger = logging.getLogger(__name__)
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+ROW_PENDING = 'pending'
+ROW_PROVISIONING = 'provisioning'
+ROW_DONE = 'done'
+ROW_FAILED = 'failed'
+ROW_SKIPPED = 'skipped'
+
+
+class BulkTrialJob:
+    """حالة دفعة استيراد واحدة - كل تغيير يُكتب في store"""
+
+    def __init__(self, rows: List[Dict], store: Optional['BulkTrialStore'] = None,
+                 job_id: Optional[str] = None, created_at: Optional[datetime] = None):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.created_at = created_at or datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.rows = rows
+        self.stage = 'queued'
+        self.nginx_result: Optional[str] = None
+        # آخر رقم تسلسلي لتغييرات الصفوف في قاعدة البيانات (نقطة بداية البث)
+        self.events = 0
+        self.store = store
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def counts(self) -> Dict:
+        """عدد الصفوف حسب الحالة"""
+        counts = {ROW_DONE: 0, ROW_PENDING: 0, ROW_PROVISIONING: 0, ROW_FAILED: 0, ROW_SKIPPED: 0}
+        for row in self.rows:
+            counts[row['status']] += 1
+        counts['total'] = len(self.rows)
+        return counts
+
+    def update_row(self, row: Dict, status: str, **fields):
+        """تحديث حالة صف وحفظه"""
+        row['status'] = status
+        row.update(fields)
+        self.save_rows([row])
+
+    def save_rows(self, rows: List[Dict]):
+        """حفظ الصفوف - فشل الحفظ لا يوقف التنفيذ (الاستئناف يعيد الخطوات غير المحفوظة)"""
+        if self.store is None or not rows:
+            return
+        try:
+            self.store.save_rows(self.job_id, rows)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر حفظ صفوف الدفعة {self.job_id}: {e}")
+
+    def set_stage(self, stage: str, finished: bool = False):
+        """تحديث المرحلة الحالية وحفظها"""
+        self.stage = stage
+        if finished:
+            self.finished_at = datetime.now()
+        if self.store is not None:
+            try:
+                self.store.save_stage(self)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر حفظ مرحلة الدفعة {self.job_id}: {e}")
+
+    @staticmethod
+    def public_row(row: Dict) -> Dict:
+        """بيانات الصف المعروضة (بدون كلمة المرور وحالة التنفيذ الداخلية)"""
+        return {key: value for key, value in row.items() if key not in ('password', 'data', 'reserved', 'routed')}
+
+    def report(self, include_rows: bool = True) -> Dict:
+        """تقرير الدفعة"""
+        report = {
+            'job_id': self.job_id,
+            'stage': self.stage,
+            'finished': self.finished,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'counts': self.counts(),
+            'nginx': self.nginx_result
+        }
+        if include_rows:
+            report['rows'] = [self.public_row(row) for row in self.rows]
+        return report
+
+
+class BulkTrialStore:
+    """
+    جداول bulk_trial_jobs و bulk_trial_rows
+
+    - كل حفظ لصفوف يأخذ أرقاماً تسلسلية من عداد events للدفعة (LAST_INSERT_ID) ويكتبها في seq،
+      فيقرأ البث من أي عامل التغييرات بعد آخر seq رآه
+    - claim يأخذ دفعة غير منتهية بـ lease (claimed_by / lease_expires_at) ويجدده المنفذ أثناء التنفيذ
+    """
+
+    def __init__(self, db_config: Dict, lease_seconds: int = 120):
+        self.db_config = db_config
+        self.lease_seconds = lease_seconds
+        self._schema_ready = False
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bulk_trial_jobs (
+                job_id VARCHAR(32) PRIMARY KEY,
+                stage VARCHAR(20) NOT NULL,
+                nginx_result TEXT NULL,
+                events BIGINT NOT NULL DEFAULT 0,
+                claimed_by VARCHAR(255) NULL,
+                lease_expires_at DATETIME NULL,
+                created_at DATETIME NOT NULL,
+                finished_at DATETIME NULL,
+                INDEX idx_finished_created (finished_at, created_at)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bulk_trial_rows (
+                job_id VARCHAR(32) NOT NULL,
+                row_no INT NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                seq BIGINT NOT NULL DEFAULT 0,
+                row_data MEDIUMTEXT NOT NULL,
+                PRIMARY KEY (job_id, row_no),
+                INDEX idx_job_seq (job_id, seq)
+            )
+        """)
+        self._schema_ready = True
+
+    def _transaction(self, work):
+        """تنفيذ work(cursor) في معاملة واحدة وإرجاع نتيجته"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            result = work(cursor)
+            conn.commit()
+            cursor.close()
+            return result
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _write_rows(cursor, job_id: str, rows: List[Dict]):
+        cursor.execute("UPDATE bulk_trial_jobs SET events = LAST_INSERT_ID(events + %s) WHERE job_id = %s",
+                       (len(rows), job_id))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        first = cursor.fetchone()[0] - len(rows) + 1
+        cursor.executemany("""
+            INSERT INTO bulk_trial_rows (job_id, row_no, status, seq, row_data) VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE status = VALUES(status), seq = VALUES(seq), row_data = VALUES(row_data)
+        """, [(job_id, row['row'], row['status'], first + offset, json.dumps(row, ensure_ascii=False, default=str))
+              for offset, row in enumerate(rows)])
+
+    def create(self, job: BulkTrialJob):
+        """حفظ دفعة جديدة مع كل صفوفها"""
+        def work(cursor):
+            cursor.execute("INSERT INTO bulk_trial_jobs (job_id, stage, created_at) VALUES (%s, %s, %s)",
+                           (job.job_id, job.stage, job.created_at))
+            if job.rows:
+                self._write_rows(cursor, job.job_id, job.rows)
+        self._transaction(work)
+        job.store = self
+
+    def save_rows(self, job_id: str, rows: List[Dict]):
+        """حفظ حالة صفوف"""
+        self._transaction(lambda cursor: self._write_rows(cursor, job_id, rows))
+
+    def save_stage(self, job: BulkTrialJob):
+        """حفظ المرحلة - الدفعة المنتهية تُحرر من المنفذ"""
+        self._transaction(lambda cursor: cursor.execute("""
+            UPDATE bulk_trial_jobs
+            SET stage = %s, nginx_result = %s, finished_at = %s,
+                claimed_by = IF(%s, NULL, claimed_by), lease_expires_at = IF(%s, NULL, lease_expires_at)
+            WHERE job_id = %s
+        """, (job.stage, job.nginx_result, job.finished_at, job.finished, job.finished, job.job_id)))
+
+    def load(self, job_id: str) -> Optional[BulkTrialJob]:
+        """تحميل دفعة بكل صفوفها"""
+        def work(cursor):
+            cursor.execute("""
+                SELECT stage, nginx_result, events, created_at, finished_at FROM bulk_trial_jobs WHERE job_id = %s
+            """, (job_id,))
+            header = cursor.fetchone()
+            if header is None:
+                return None
+            cursor.execute("SELECT row_data FROM bulk_trial_rows WHERE job_id = %s ORDER BY row_no", (job_id,))
+            rows = [json.loads(row_data) for (row_data,) in cursor.fetchall()]
+            return header, rows
+
+        loaded = self._transaction(work)
+        if loaded is None:
+            return None
+        (stage, nginx_result, events, created_at, finished_at), rows = loaded
+        job = BulkTrialJob(rows, store=self, job_id=job_id, created_at=created_at)
+        job.stage, job.nginx_result, job.events, job.finished_at = stage, nginx_result, events, finished_at
+        return job
+
+    def changes(self, job_id: str, since: int) -> Tuple[Optional[Dict], List[Tuple[int, Dict]]]:
+        """حالة الدفعة والصفوف التي تغيرت بعد seq معين"""
+        def work(cursor):
+            cursor.execute("SELECT stage, finished_at IS NOT NULL FROM bulk_trial_jobs WHERE job_id = %s", (job_id,))
+            header = cursor.fetchone()
+            if header is None:
+                return None, []
+            cursor.execute("SELECT status, COUNT(*) FROM bulk_trial_rows WHERE job_id = %s GROUP BY status", (job_id,))
+            counts = {ROW_DONE: 0, ROW_PENDING: 0, ROW_PROVISIONING: 0, ROW_FAILED: 0, ROW_SKIPPED: 0}
+            counts.update({status: count for status, count in cursor.fetchall()})
+            counts['total'] = sum(counts.values())
+            cursor.execute("""
+                SELECT seq, row_data FROM bulk_trial_rows WHERE job_id = %s AND seq > %s ORDER BY seq
+            """, (job_id, since))
+            rows = [(seq, json.loads(row_data)) for seq, row_data in cursor.fetchall()]
+            return {'stage': header[0], 'finished': bool(header[1]), 'counts': counts}, rows
+        return self._transaction(work)
+
+    def stream_steps(self, job: BulkTrialJob, poll_interval: float = 1.0,
+                     heartbeat: float = 15) -> Iterator:
+        """
+        خطوات البث: سطر NDJSON (str) أو مدة انتظار بالثواني (float) قبل القراءة التالية
+
+        المستدعي ينتظر بنفسه (time.sleep في stream، asyncio.sleep في async_app.py) فلا يُحجز thread أثناء الانتظار.
+        """
+        yield json.dumps({'type': 'report', **job.report(include_rows=False)}, ensure_ascii=False, default=str) + "\n"
+        since, stage, finished = job.events, job.stage, job.finished
+        last_sent = time.monotonic()
+        while not finished:
+            yield float(poll_interval)
+            try:
+                state, rows = self.changes(job.job_id, since)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر قراءة تقدم الدفعة {job.job_id}: {e}")
+                state, rows = None, []
+
+            for seq, row in rows:
+                since = seq
+                yield json.dumps({'type': 'row', 'row': job.public_row(row)}, ensure_ascii=False, default=str) + "\n"
+            if rows:
+                last_sent = time.monotonic()
+            if state is None:
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield json.dumps({'type': 'heartbeat', 'counts': None}) + "\n"
+                continue
+
+            finished = state['finished']
+            if state['stage'] != stage or finished:
+                stage = state['stage']
+                last_sent = time.monotonic()
+                yield json.dumps({'type': 'stage', 'stage': stage, 'counts': state['counts']}) + "\n"
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield json.dumps({'type': 'heartbeat', 'counts': state['counts']}) + "\n"
+
+        try:
+            job = self.load(job.job_id) or job
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحميل تقرير الدفعة {job.job_id}: {e}")
+        yield json.dumps({'type': 'report', **job.report(include_rows=False)}, ensure_ascii=False, default=str) + "\n"
+
+    def claim(self, owner: str) -> Optional[str]:
+        """أخذ أقدم دفعة غير منتهية (غير مأخوذة، أو مأخوذة من نفس المالك، أو انتهى الـ lease)"""
+        def work(cursor):
+            cursor.execute("""
+                UPDATE bulk_trial_jobs
+                SET claimed_by = %s, lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE finished_at IS NULL
+                  AND (claimed_by IS NULL OR claimed_by = %s OR lease_expires_at < NOW())
+                ORDER BY created_at
+                LIMIT 1
+            """, (owner, self.lease_seconds, owner))
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute("""
+                SELECT job_id FROM bulk_trial_jobs
+                WHERE finished_at IS NULL AND claimed_by = %s
+                ORDER BY created_at LIMIT 1
+            """, (owner,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return self._transaction(work)
+
+    def renew(self, job_id: str, owner: str) -> bool:
+        """تجديد الـ lease - False إذا أخذ مالك آخر الدفعة"""
+        def work(cursor):
+            cursor.execute("""
+                UPDATE bulk_trial_jobs SET lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE job_id = %s AND claimed_by = %s
+            """, (self.lease_seconds, job_id, owner))
+            return cursor.rowcount > 0
+        return self._transaction(work)
+
+    def purge(self, retention_seconds: int) -> int:
+        """حذف الدفعات المنتهية الأقدم من مدة الاحتفاظ"""
+        def work(cursor):
+            cursor.execute("""
+                SELECT job_id FROM bulk_trial_jobs
+                WHERE finished_at IS NOT NULL AND finished_at < NOW() - INTERVAL %s SECOND
+            """, (retention_seconds,))
+            job_ids = [job_id for (job_id,) in cursor.fetchall()]
+            for job_id in job_ids:
+                cursor.execute("DELETE FROM bulk_trial_rows WHERE job_id = %s", (job_id,))
+                cursor.execute("DELETE FROM bulk_trial_jobs WHERE job_id = %s", (job_id,))
+            return len(job_ids)
+        return self._transaction(work)
+
+
+class BulkTrialImporter:
+    """مدير الاستيراد الجماعي"""
+
+    def __init__(self, trial_manager, store: BulkTrialStore, max_workers: int = 4, max_rows: int = 5000,
+                 insert_batch_size: int = 200, poll_interval: float = 5.0):
+        self.trial_manager = trial_manager
+        self.store = store
+        self.max_workers = max_workers
+        self.max_rows = max_rows
+        self.insert_batch_size = insert_batch_size
+        self.poll_interval = poll_interval
+        self.job_retention_seconds = 7 * 24 * 3600
+        # مالك المهام الخلفية واحد لكل مضيف، فالعامل البديل بعد إعادة التدوير يستأنف دفعته فوراً
+        self.owner = socket.gethostname()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._runner: Optional[threading.Thread] = None
+
+    def parse_rows(self, body: bytes, content_type: str) -> List[Dict]:
+        """تحليل الدفعة من CSV أو JSON"""
+        if 'csv' in (content_type or ''):
+            reader = csv.DictReader(io.StringIO(body.decode('utf-8-sig')))
+            rows = []
+            for record in reader:
+                record = {key.strip(): (value or '').strip() for key, value in record.items() if key}
+                apps = record.get('selected_apps', '')
+                record['selected_apps'] = [a for a in re.split(r"[;|\s]+", apps) if a] if apps else []
+                rows.append(record)
+            return rows
+
+        payload = json.loads(body or b'[]')
+        if isinstance(payload, dict):
+            payload = payload.get('rows', [])
+        if not isinstance(payload, list):
+            raise ValueError('يجب أن تكون الدفعة قائمة صفوف')
+        return payload
+
+    def _validate(self, records: List[Dict]) -> List[Dict]:
+        """التحقق من الحقول وإزالة التكرار داخل الدفعة"""
+        rows, seen_emails = [], set()
+        for index, record in enumerate(records, start=1):
+            row = {'row': index, 'status': ROW_PENDING, 'data': record}
+            if not isinstance(record, dict):
+                row.update(status=ROW_SKIPPED, error='صف غير صالح')
+                rows.append(row)
+                continue
+
+            full_name = record.get('full_name') or record.get('contact_name')
+            email = (record.get('email') or '').strip().lower()
+            row.update(company_name=record.get('company_name'), email=email)
+
+            missing = [field for field, value in
+                       (('company_name', record.get('company_name')), ('full_name', full_name), ('email', email))
+                       if not value]
+            if missing:
+                row.update(status=ROW_SKIPPED, error=f"حقول مطلوبة: {', '.join(missing)}")
+            elif not EMAIL_PATTERN.match(email):
+                row.update(status=ROW_SKIPPED, error='بريد إلكتروني غير صالح')
+            elif email in seen_emails:
+                row.update(status=ROW_SKIPPED, error='بريد مكرر داخل الدفعة')
+            else:
+                try:
+                    trial_days = int(record.get('trial_days') or 14)
+                except (TypeError, ValueError):
+                    trial_days = 0
+                if trial_days <= 0:
+                    row.update(status=ROW_SKIPPED, error='trial_days غير صالح')
+                else:
+                    seen_emails.add(email)
+                    row.update(
+                        full_name=full_name,
+                        trial_days=trial_days,
+                        selected_apps=record.get('selected_apps') or ['erpnext'],
+                        password=record.get('password') or 'admin123'
+                    )
+            rows.append(row)
+        return rows
+
+    def submit(self, records: List[Dict]) -> BulkTrialJob:
+        """حفظ دفعة جديدة - التنفيذ في منفذ الدفعات لدى مالك المهام الخلفية"""
+        if len(records) > self.max_rows:
+            raise ValueError(f'الحد الأقصى {self.max_rows} صف لكل دفعة')
+
+        job = BulkTrialJob(self._validate(records))
+        self.store.create(job)
+        # إذا كانت هذه العملية هي المالك يبدأ التنفيذ دون انتظار الفحص التالي
+        self._wake.set()
+        logger.info(f"📥 دفعة استيراد جديدة {job.job_id}: {len(records)} صف")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[BulkTrialJob]:
+        """الحصول على دفعة من قاعدة البيانات"""
+        return self.store.load(job_id)
+
+    def stream(self, job: BulkTrialJob, poll_interval: float = 1.0, heartbeat: float = 15) -> Iterator[str]:
+        """بث التقدم كأسطر NDJSON حتى انتهاء الدفعة (من التغييرات المحفوظة - يعمل من أي عامل)"""
+        for step in self.store.stream_steps(job, poll_interval, heartbeat):
+            if isinstance(step, float):
+                time.sleep(step)
+            else:
+                yield step
+
+    # --- منفذ الدفعات (مالك المهام الخلفية) ---
+
+    def start(self):
+        """بدء منفذ الدفعات - يُستدعى من مالك المهام الخلفية فقط"""
+        if self._runner is not None and self._runner.is_alive():
+            return
+        self._stop.clear()
+        self._runner = threading.Thread(target=self._run_loop, name="bulk-trials-runner", daemon=True)
+        self._runner.start()
+        logger.info(f"📥 بدأ منفذ الدفعات الجماعية ({self.owner})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run_loop(self):
+        """أخذ الدفعات غير المنتهية وتنفيذها واحدة تلو الأخرى (ومنها دفعات عملية سابقة انتهت أثناء التنفيذ)"""
+        purged_at = 0.0
+        while not self._stop.is_set():
+            job = None
+            try:
+                if time.time() - purged_at > 3600:
+                    purged = self.store.purge(self.job_retention_seconds)
+                    purged_at = time.time()
+                    if purged:
+                        logger.info(f"🧹 حذف {purged} دفعة منتهية قديمة")
+                job_id = self.store.claim(self.owner)
+                job = self.store.load(job_id) if job_id else None
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر أخذ دفعة للتنفيذ: {e}")
+
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job: BulkTrialJob):
+        """تنفيذ دفعة مع تجديد الـ lease في الخلفية"""
+        done = threading.Event()
+
+        def renew_lease():
+            while not done.wait(self.store.lease_seconds / 4):
+                try:
+                    if not self.store.renew(job.job_id, self.owner):
+                        logger.warning(f"⚠️ فقد المنفذ lease الدفعة {job.job_id}")
+                except Exception as e:
+                    logger.warning(f"⚠️ تعذر تجديد lease الدفعة {job.job_id}: {e}")
+
+        threading.Thread(target=renew_lease, name=f"bulk-lease-{job.job_id}", daemon=True).start()
+        try:
+            self._run(job)
+        finally:
+            done.set()
+
+    @traced('bulk_trials.job')
+    def _run(self, job: BulkTrialJob):
+        """تنفيذ الدفعة أو استئنافها - كل مرحلة تختار صفوفها من الحالة المحفوظة"""
+        start_time = time.time()
+        db = self.trial_manager.db
+        if job.stage != 'queued':
+            logger.info(f"🔁 استئناف الدفعة {job.job_id} من مرحلة {job.stage}")
+        try:
+            candidates = [row for row in job.rows if row['status'] == ROW_PENDING and not row.get('reserved')]
+            if candidates:
+                # 1. استبعاد الموجود مسبقاً - استعلام واحد
+                job.set_stage('deduplicating')
+                # subdomain محفوظ من تشغيل سابق انقطع قبل تعليم الحجز: وجوده في الجدول يعني أنه حجزنا
+                resumed = {row['row'] for row in candidates if row.get('subdomain')}
+                for row in candidates:
+                    if row['row'] not in resumed:
+                        row['subdomain'] = self.trial_manager.generate_subdomain(row['company_name'])
+                existing_emails, existing_subdomains = db.find_existing_customers(
+                    [row['email'] for row in candidates], [row['subdomain'] for row in candidates]
+                )
+                for row in candidates:
+                    if row['row'] in resumed and row['subdomain'] in existing_subdomains:
+                        row['reserved'] = True
+                    elif row['email'] in existing_emails:
+                        job.update_row(row, ROW_SKIPPED, error='البريد الإلكتروني مسجل مسبقاً')
+                    elif row['subdomain'] in existing_subdomains:
+                        row['subdomain'] = self.trial_manager.generate_subdomain(row['company_name'])
+                job.save_rows([row for row in candidates if row.get('reserved')])
+                candidates = [row for row in candidates if row['status'] == ROW_PENDING and not row.get('reserved')]
+
+                # 2. حجز subdomains بإدراج العملاء على دفعات (الـ subdomain يُحفظ قبل الإدراج ليتعرف عليه الاستئناف)
+                job.set_stage('reserving')
+                for row in candidates:
+                    row['site_name'] = f"{row['subdomain']}.trial.local"
+                    row['site_url'] = f"http://{row['site_name']}"
+                job.save_rows(candidates)
+                inserted, conflicts = db.create_customers_bulk([{
+                    'company_name': row['company_name'],
+                    'full_name': row['full_name'],
+                    'email': row['email'],
+                    'phone': row['data'].get('phone', ''),
+                    'subdomain': row['subdomain'],
+                    'site_url': row['site_url'],
+                    'site_name': row['site_name'],
+                    'admin_password': row['password'],
+                    'selected_apps': row['selected_apps'],
+                    'trial_days': row['trial_days'],
+                    'frappe_site_created': False
+                } for row in candidates], batch_size=self.insert_batch_size)
+                for row in candidates:
+                    if row['subdomain'] in conflicts:
+                        row.update(status=ROW_SKIPPED, error=conflicts[row['subdomain']])
+                    else:
+                        row['reserved'] = True
+                job.save_rows(candidates)
+
+            # 3. إنشاء المواقع بالتوازي (الصف المنقطع أثناء الإنشاء يُعاد - الموقع الموجود لا يُعاد إنشاؤه)
+            job.set_stage('provisioning')
+            self._provision(job, [row for row in job.rows
+                                  if row.get('reserved') and row['status'] in (ROW_PENDING, ROW_PROVISIONING)])
+
+            # 4. Nginx مرة واحدة للدفعة ثم تحديث قاعدة البيانات
+            job.set_stage('routing')
+            created = [row for row in job.rows if row['status'] == ROW_DONE and not row.get('routed')]
+            if created:
+                nginx_success, nginx_msg = nginx_manager.create_site_configs([row['site_name'] for row in created])
+                job.nginx_result = nginx_msg
+                if not nginx_success:
+                    logger.warning(f"⚠️ فشل تكوين Nginx للدفعة {job.job_id}: {nginx_msg}")
+                db.mark_sites_created([row['subdomain'] for row in created])
+                self.trial_manager.assignments.assign_many(
+                    {row['site_name']: DEFAULT_SERVER_ID for row in created}
+                )
+                for row in created:
+                    row['routed'] = True
+                job.save_rows(created)
+
+            self._release_failed(job)
+            job.set_stage('completed', finished=True)
+        except Exception as e:
+            logger.error(f"❌ فشل تنفيذ الدفعة {job.job_id}: {e}")
+            for row in job.rows:
+                if row['status'] in (ROW_PENDING, ROW_PROVISIONING):
+                    row.update(status=ROW_FAILED, error=str(e))
+            job.save_rows([row for row in job.rows if row['status'] == ROW_FAILED])
+            try:
+                self._release_failed(job)
+            except Exception as release_error:
+                logger.warning(f"⚠️ تعذر حذف حجوزات الدفعة {job.job_id}: {release_error}")
+            job.set_stage('failed', finished=True)
+
+        counts = job.counts()
+        logger.info(f"🎉 انتهت الدفعة {job.job_id} في {time.time() - start_time:.2f} ثانية: "
+                    f"{counts[ROW_DONE]} نجح، {counts[ROW_FAILED]} فشل، {counts[ROW_SKIPPED]} مستبعد")
+
+    def _release_failed(self, job: BulkTrialJob):
+        """حذف حجوزات الصفوف الفاشلة"""
+        failed = [row for row in job.rows if row['status'] == ROW_FAILED and row.get('reserved')]
+        if failed:
+            self.trial_manager.db.delete_customers_by_subdomain([row['subdomain'] for row in failed])
+            for row in failed:
+                row['reserved'] = False
+            job.save_rows(failed)
+
+    def _provision(self, job: BulkTrialJob, rows: List[Dict]) -> List[Dict]:
+        """إنشاء المواقع بعدد عمال محدود وإرجاع الصفوف الناجحة"""
+        created = []
+        if not rows:
+            return created
+
+        def provision(row: Dict) -> Tuple[bool, str, float]:
+            job.update_row(row, ROW_PROVISIONING)
+            start_time = time.time()
+            success, result = self.trial_manager.frappe_manager.create_trial_site(
+                subdomain=row['subdomain'],
+                company_name=row['company_name'],
+                apps=row['selected_apps'],
+                admin_email=row['email'],
+                admin_password=row['password']
+            )
+            return success, result, time.time() - start_time
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"bulk-{job.job_id}") as executor:
+            provision = with_current_context(provision)
+            futures = {executor.submit(provision, row): row for row in rows}
+            for future in as_completed(futures):
+                row = futures[future]
+                try:
+                    success, result, duration = future.result()
+                except Exception as e:
+                    success, result, duration = False, str(e), 0.0
+                if success:
+                    job.update_row(row, ROW_DONE, site_url=result, duration=round(duration, 2))
+                    created.append(row)
+                else:
+                    job.update_row(row, ROW_FAILED, error=result, duration=round(duration, 2))
+        return created
@@ -0,0 +1,232 @@
+"""
+قواطع دوائر (circuit breakers) لكل تبعية: سيرفر تطبيق، حاوية docker، bench، خادم MySQL
+
+- closed: النداءات تمر وتُسجل نتائجها في نافذة زمنية (window_seconds)
+- open: عندما تبلغ نسبة الفشل في النافذة failure_rate (بعد min_calls نداء على الأقل) يُرفض كل نداء فوراً
+  بـ CircuitOpenError بدلاً من انتظار المهلة كاملة (10 ثوانٍ HTTP، 30 Nginx، 300 bench)
+- half_open: بعد open_seconds يمر نداء تجريبي واحد؛ نجاحه يغلق القاطع وفشله يعيد فتحه
+- الفشل = انقطاع أو مهلة أو خطأ في التبعية نفسها، وليس نتيجة فاشلة لأمر نُفذ (مثل موقع موجود مسبقاً)
+
+القواطع لكل عملية (breakers) بأسماء '<kind>:<target>' وإعدادات لكل نوع في BREAKER_DEFAULTS.
+CIRCUIT_BREAKERS=off يسجل النتائج دون رفض. سيرفر التطبيق الذي قاطعه غير مغلق يُستبعد من التوزيع.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# إعدادات كل نوع تبعية (البادئة قبل ':' في اسم القاطع)
+BREAKER_DEFAULTS = {
+    'app': {'window_seconds': 60, 'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 15},
+    'docker': {'window_seconds': 60, 'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 30},
+    'bench': {'window_seconds': 300, 'min_calls': 2, 'failure_rate': 0.5, 'open_seconds': 60},
+    'mysql': {'window_seconds': 30, 'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 10},
+}
+
+
+class CircuitOpenError(Exception):
+    """رفض فوري لأن قاطع التبعية مفتوح"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"القاطع {name} مفتوح - إعادة المحاولة بعد {retry_after:.0f} ثانية")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """قاطع لتبعية واحدة بنافذة نسبة فشل زمنية"""
+
+    def __init__(self, name: str, window_seconds: float = 60, min_calls: int = 3, failure_rate: float = 0.5,
+                 open_seconds: float = 15, enforce: bool = True):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.enforce = enforce
+
+        self.state = STATE_CLOSED
+        self.state_since = time.time()
+        self._outcomes = deque()  # (monotonic, failed)
+        self._window_failures = 0
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+
+    def _transition(self, state: str, now: float):
+        if state == STATE_OPEN:
+            self._opened_at = now
+            self.counters['opened'] += 1
+        elif state == STATE_CLOSED:
+            self._outcomes.clear()
+            self._window_failures = 0
+        self._trial_started = None
+        if state != self.state:
+            self.state = state
+            self.state_since = time.time()
+            if state == STATE_OPEN:
+                logger.warning(f"🔌 فتح القاطع {self.name} ({self.last_error}) - رفض فوري لـ {self.open_seconds:.0f} ثانية")
+            elif state == STATE_CLOSED:
+                logger.info(f"✅ إغلاق القاطع {self.name} بعد نجاح النداء التجريبي")
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._window_failures -= self._outcomes.popleft()[1]
+
+    def _reject(self, retry_after: float):
+        self.counters['rejected'] += 1
+        if self.enforce:
+            raise CircuitOpenError(self.name, retry_after)
+
+    def allow(self):
+        """قبل النداء: CircuitOpenError إذا كان القاطع مفتوحاً أو تجربته جارية"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == STATE_OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    return self._reject(remaining)
+                self._transition(STATE_HALF_OPEN, now)
+            if self.state == STATE_HALF_OPEN:
+                # تجربة واحدة؛ تجربة عالقة أطول من open_seconds لا تمنع غيرها
+                if self._trial_started is not None and now - self._trial_started < self.open_seconds:
+                    return self._reject(self._trial_started + self.open_seconds - now)
+                self._trial_started = now
+            self.counters['calls'] += 1
+
+    def record(self, failed: bool, error: Any = None):
+        """نتيجة نداء سُمح به"""
+        now = time.monotonic()
+        with self._lock:
+            if failed:
+                self.counters['failures'] += 1
+                self.last_error = str(error)[:200] if error is not None else None
+                self.last_failure_at = time.time()
+            if self.state == STATE_HALF_OPEN:
+                self._transition(STATE_OPEN if failed else STATE_CLOSED, now)
+                return
+            if self.state == STATE_OPEN:
+                # نداء بدأ قبل الفتح
+                return
+            self._outcomes.append((now, failed))
+            self._window_failures += failed
+            self._prune(now)
+            if failed and len(self._outcomes) >= self.min_calls \
+                    and self._window_failures / len(self._outcomes) >= self.failure_rate:
+                self._transition(STATE_OPEN, now)
+
+    def call(self, func: Callable, *args, is_failure: Optional[Callable[[Any], Any]] = None, **kwargs):
+        """
+        نداء عبر القاطع
+
+        الاستثناء فشل دائماً؛ is_failure(result) يعيد سبب الفشل (أو False) لنتيجة بدون استثناء (مثل HTTP 5xx).
+        """
+        self.allow()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(True, f"{type(e).__name__}: {e}")
+            raise
+        failure = is_failure(result) if is_failure else None
+        self.record(bool(failure), failure)
+        return result
+
+    async def call_async(self, func: Callable, *args, is_failure: Optional[Callable[[Any], Any]] = None, **kwargs):
+        """مثل call لدالة async (async_app.py) - الانتظار لا يحجز thread"""
+        self.allow()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record(True, f"{type(e).__name__}: {e}")
+            raise
+        failure = is_failure(result) if is_failure else None
+        self.record(bool(failure), failure)
+        return result
+
+    def status(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            calls = len(self._outcomes)
+            failures = self._window_failures
+            retry_after = max(0.0, self._opened_at + self.open_seconds - now) if self.state == STATE_OPEN else 0.0
+        return {
+            'state': self.state,
+            'state_since': self.state_since,
+            'retry_after': round(retry_after, 1),
+            'window': {'seconds': self.window_seconds, 'calls': calls, 'failures': failures,
+                       'failure_rate': round(failures / calls, 3) if calls else None},
+            **self.counters,
+            'last_error': self.last_error,
+            'last_failure_at': self.last_failure_at
+        }
+
+
+class BreakerRegistry:
+    """قواطع العملية حسب الاسم (تُنشأ عند أول استخدام)"""
+
+    def __init__(self):
+        self.enforce = os.environ.get('CIRCUIT_BREAKERS', 'on') != 'off'
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    kind = name.split(':', 1)[0]
+                    breaker = CircuitBreaker(name, enforce=self.enforce, **BREAKER_DEFAULTS.get(kind, {}))
+                    self._breakers[name] = breaker
+        return breaker
+
+    def available(self, name: str) -> bool:
+        """القاطع مغلق (أو لم يُستخدم بعد) - للاستبعاد من التوزيع"""
+        breaker = self._breakers.get(name)
+        return breaker is None or breaker.state == STATE_CLOSED
+
+    def status(self) -> Dict:
+        breakers = dict(self._breakers)
+        return {
+            'enforce': self.enforce,
+            'not_closed': sorted(name for name, breaker in breakers.items() if breaker.state != STATE_CLOSED),
+            'breakers': {name: breaker.status() for name, breaker in sorted(breakers.items())}
+        }
+
+
+breakers = BreakerRegistry()
+
+
+def connect_mysql(db_config: Dict, **kwargs):
+    """mysql.connector.connect عبر قاطع الخادم (mysql:<host>) - kwargs تتجاوز قيم db_config (مثل connect_timeout)"""
+    params = {**db_config, **kwargs}
+    return breakers.get(f"mysql:{db_config.get('host')}").call(lambda: mysql.connector.connect(**params))
+
+
+def docker_failure(result) -> Optional[str]:
+    """
+    فشل docker exec نفسه (وليس الأمر داخل الحاوية) - لـ is_failure مع subprocess.run
+
+    125: خطأ في docker، 126/127: تعذر تنفيذ الأمر، أو رسالة من الـ daemon (حاوية متوقفة، daemon لا يرد).
+    """
+    stderr = result.stderr if isinstance(result.stderr, str) else (result.stderr or b'').decode(errors='replace')
+    if result.returncode in (125, 126, 127) or 'Error response from daemon' in stderr \
+            or 'Cannot connect to the Docker daemon' in stderr:
+        return stderr.strip()[:200] or f"docker exec {result.returncode}"
+    return None
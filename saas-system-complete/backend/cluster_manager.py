@@ -2,12 +2,31 @@
 نظام إدارة الكلاستر المتقدم - SaaS Multi-tenant Platform
 """
 
+import os
 import requests
 import json
 import time
 import threading
 import logging
-import mysql.connector
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from metrics_collector import create_metrics_collector
+from autoscaler import create_autoscaler
+from migration import MigrationEngine, summarize_migrations
+from container_lifecycle import ContainerSpec, create_container_launcher, use_shared_bench
+from assignment_store import SiteAssignmentStore
+from address_allocator import AddressAllocator, AllocationError
+from leader_election import LeaderElector, LeaderSnapshotStore
+from shared_state import SharedClusterState
+from health_history import HealthHistoryStore
+from standby_pool import StandbyPool, ROLE_ACTIVE
+from failover import FailoverController
+from circuit_breaker import breakers, connect_mysql, CircuitOpenError
+from nginx_manager import DEFAULT_SERVER_ID
+from placement import (
+    consistent_hash_placement, weighted_placement, placement_utilization, assignment_map, placement_moves,
+    ServerCapacity, TenantCost, DEFAULT_TENANT_COSTS
+)
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
@@ -40,6 +59,11 @@ class ServerMetrics:
     response_time_ms: float
     uptime_seconds: int
     last_updated: datetime
+    block_read_bytes: int = 0
+    block_write_bytes: int = 0
+    pids: int = 0
+    gunicorn_workers: int = 0
+    background_workers: int = 0
 
 @dataclass
 class ClusterConfig:
@@ -49,24 +73,85 @@ class ClusterConfig:
     scale_up_threshold: float = 75.0
     scale_down_threshold: float = 30.0
     health_check_interval: int = 30
-    failover_timeout: int = 300
-    load_balance_algorithm: str = "least_sites"
+    # الفاصل أثناء الحوادث (سيرفر غير صحي أو تغير حالة)؛ يتضاعف حتى health_check_interval عند الاستقرار
+    incident_check_interval: int = 5
+    probe_connect_timeout: float = 1.0
+    probe_read_timeout: float = 3.0
+    # مهلة جمع مقاييس الحاويات في الجولة (منفصلة عن الفحص - بطء docker لا يجعل السيرفر OFFLINE)
+    metrics_collect_timeout: float = 10.0
+    health_check_workers: int = 64
+    # قرارات التوسع تُبنى على متوسط هذه النافذة وليس على عينة واحدة
+    scale_window_seconds: int = 300
+    metrics_retention_seconds: int = 3 * 3600
+    # التوسع التلقائي: off | dry_run | enabled (AUTOSCALE_MODE يتجاوزه)
+    autoscale_mode: str = "dry_run"
+    scale_up_sustain_seconds: int = 120
+    scale_down_sustain_seconds: int = 600
+    scale_up_cooldown_seconds: int = 300
+    scale_down_cooldown_seconds: int = 900
+    predictive_scaling: bool = True
+    target_sites_per_server: int = 50
+    prediction_horizon_seconds: int = 900
+    # تحويل مواقع السيرفر المتوقف بعد هذه المدة من أول جولة OFFLINE (FAILOVER_TIMEOUT يتجاوزه، 0 للتعطيل)
+    # وإعادتها بعد بقائه صحياً failback_stable_seconds
+    failover_timeout: int = 10
+    failback_stable_seconds: int = 60
+    # توزيع المواقع: consistent_hash | weighted | least_sites | round_robin
+    load_balance_algorithm: str = "consistent_hash"
+    # أقصى حمل لسيرفر = placement_load_factor × المتوسط (consistent_hash)
+    placement_load_factor: float = 1.25
+    placement_vnodes: int = 160
+    # weighted: الموقع يبقى على سيرفره الحالي ما دام حمل السيرفر لا يتجاوز متوسط الأسطول × (1 + هذا الهامش)
+    placement_margin: float = 0.02
+    # ترحيل المواقع بين السيرفرات (MIGRATION_STRATEGY: shared_db | backup)
+    migration_strategy: str = "shared_db"
+    max_concurrent_migrations: int = 2
+    migration_verify_timeout: int = 60
+    # فاصل فحص تغيير جدول site_assignments من عمليات أخرى
+    assignment_refresh_seconds: float = 2.0
+    # نطاقات حجز السيرفرات الجديدة (داخل شبكة frappe-cluster-net)
+    ip_pool_start: str = "172.22.0.20"
+    ip_pool_end: str = "172.22.0.99"
+    port_pool_start: int = 8000
+    port_pool_end: int = 8099
+    # أقصى عدد سيرفرات تُنشأ بالتوازي في توسع واحد
+    scale_up_max_batch: int = 3
+    # مهلة جاهزية السيرفر الجديد قبل دخوله التوزيع (SERVER_READY_TIMEOUT يتجاوزه)
+    server_ready_timeout: int = 180
+    # قائد المراقبة بين العمليات: التولي بعد توقف القائد خلال lease + renew (أقل من health_check_interval)
+    leader_lease_seconds: float = 20
+    leader_renew_seconds: float = 5
+    # فاصل فحص الحالة المنشورة من القائد في العمليات الأخرى
+    snapshot_refresh_seconds: float = 2.0
+    # نسخة الذاكرة المشتركة على المضيف (CLUSTER_STATE_PATH)؛ الأقدم من هذا يُتجاهل لصالح قاعدة البيانات
+    shared_state_max_servers: int = 256
+    shared_state_max_age_seconds: int = 90
+    # نتائج كل جولة في cluster_servers و cluster_metrics_history (الاحتفاظ بالعينات)، وما يُستعاد عند بدء المراقبة
+    health_history_retention_seconds: int = 7 * 24 * 3600
+    health_restore_seconds: int = 3600
+    # سيرفرات احتياطية مُقلعة خارج التوزيع للترقية الفورية (STANDBY_POOL_SIZE يتجاوزه)
+    standby_pool_size: int = 1
+    standby_probe_failures: int = 2
+    standby_warm_sites: int = 20
 
 class ServerConfig:
     """إعدادات السيرفر"""
-    docker_image: str = "frappe/bench:latest"
+    docker_image: str = "frappe/erpnext:v15"
+    docker_network: str = "frappe-cluster-net"
     base_port: int = 8000
     base_ip: str = "172.22.0.20"
     memory_limit: str = "2g"
     cpu_limit: str = "1.0"
     disk_limit: str = "50g"
+    # سعة الطلبات لكل سيرفر (لتوزيع weighted)
+    requests_per_min_capacity: int = 1200
 
 class ClusterManager:
     """
     مدير الكلاستر المتقدم مع Load Balancing و Auto-scaling
     """
 
-    def __init__(self):
+    def __init__(self, auto_start_monitoring: bool = True):
         self.config = ClusterConfig()
         self.servers: Dict[str, ServerConfig] = {}
         self.metrics: Dict[str, ServerMetrics] = {}
@@ -74,6 +159,49 @@ class ClusterManager:
         self.load_balancer = self._create_load_balancer_instance()
         self.monitoring_thread: Optional[threading.Thread] = None
         self.is_monitoring = False
+        self._stop_event = threading.Event()
+        self.current_check_interval = self.config.incident_check_interval
+        self.last_health_sweep: Dict = {}
+        # عناوين السيرفرات {server_id: {ip, port}} من cluster_servers
+        self.server_addresses: Dict[str, Dict] = {}
+        self.last_rebalance: Dict = {}
+        # ترحيلات آخر إعادة توزيع (Futures) - تُجمع نتائجها من حلقة المراقبة
+        self._rebalance_migrations: List = []
+        # السيرفرات قيد التفريغ قبل إزالتها {server_id: {started_at, sites, futures}} وآخر نتيجة لكل سيرفر
+        self.draining: Dict[str, Dict] = {}
+        self.last_drain: Dict[str, Dict] = {}
+        # إطلاقات scale_up الجارية في الخلفية [(servers, Future)] - تُضاف سيرفراتها من حلقة المراقبة
+        self._launches: List[Tuple[List[Dict], Future]] = []
+
+        # جلسة HTTP واحدة (keep-alive) وعمال محدودون لفحص كل السيرفرات بالتوازي
+        self.http = requests.Session()
+        self.http.headers.update({
+            'User-Agent': 'ClusterManager/1.0',
+            'Accept': 'application/json'
+        })
+        adapter = HTTPAdapter(
+            pool_connections=self.config.health_check_workers,
+            pool_maxsize=self.config.health_check_workers,
+            max_retries=0
+        )
+        self.http.mount('http://', adapter)
+        self._health_executor = ThreadPoolExecutor(
+            max_workers=self.config.health_check_workers,
+            thread_name_prefix="cluster-health"
+        )
+        # جمع المقاييس الجاري لكل سيرفر (الذي تجاوز مهلة الجولة لا يُكرر حتى ينتهي)
+        self._metrics_inflight: Dict[str, Future] = {}
+
+        # سلاسل زمنية للمقاييس (numpy يُحمّل هنا وليس عند استيراد التطبيق)
+        from metrics_store import MetricsStore
+        self.metrics_store = MetricsStore(retention_seconds=self.config.metrics_retention_seconds)
+
+        # مقاييس فعلية من الحاويات (METRICS_SOURCE: docker | cgroup | mock)
+        try:
+            self.metrics_collector = create_metrics_collector()
+        except Exception as e:
+            logger.error(f"❌ فشل تهيئة جامع المقاييس: {e}")
+            self.metrics_collector = None
 
         # إعدادات قاعدة البيانات
         self.db_config = {
@@ -83,11 +211,82 @@ class ClusterManager:
             'database': 'saas_trialsv1'
         }
 
+        # حجز الأسماء والعناوين والمنافذ للسيرفرات الجديدة (cluster_leases)
+        self.address_allocator = AddressAllocator(
+            self.db_config,
+            self.config.ip_pool_start, self.config.ip_pool_end,
+            self.config.port_pool_start, self.config.port_pool_end
+        )
+
+        # توزيع المواقع على السيرفرات (جدول site_assignments مع فهرس في الذاكرة)
+        self.assignments = SiteAssignmentStore(self.db_config,
+                                               refresh_interval=self.config.assignment_refresh_seconds)
+
+        # محرك التوسع التلقائي (الاستمرار والتهدئة والإشارات الاستباقية)
+        self.autoscaler = create_autoscaler(self, signal_provider=self._get_demand_signals)
+
+        # ترحيل المواقع بين السيرفرات بحد للتزامن
+        self.migration_engine = MigrationEngine(
+            self,
+            max_concurrent=self.config.max_concurrent_migrations,
+            strategy=os.environ.get('MIGRATION_STRATEGY', self.config.migration_strategy),
+            verify_timeout=self.config.migration_verify_timeout
+        )
+
+        # إطلاق حاويات السيرفرات عبر Docker Engine API (CONTAINER_BACKEND: docker | fake)
+        try:
+            self.container_launcher = create_container_launcher(self.config.server_ready_timeout)
+        except Exception as e:
+            logger.error(f"❌ فشل تهيئة مُطلق الحاويات: {e}")
+            self.container_launcher = None
+        # مواصفات حاوية سيرفر قائم (الصورة و bench) - تُقرأ عند أول إطلاق
+        self._template: Optional[Dict] = None
+
+        # قائد واحد للمراقبة بين كل العمليات؛ البقية تقرأ الحالة التي ينشرها (cluster_leader / cluster_snapshots)
+        self.leader = LeaderElector(
+            self.db_config,
+            lease_seconds=self.config.leader_lease_seconds,
+            renew_interval=self.config.leader_renew_seconds,
+            on_elected=self._on_elected,
+            on_demoted=self.stop_monitoring
+        )
+        self.snapshots = LeaderSnapshotStore(self.db_config, refresh_interval=self.config.snapshot_refresh_seconds)
+        # سيرفرات احتياطية جاهزة للترقية عند التوسع أو تعويض سيرفر متوقف
+        server_config = ServerConfig()
+        self.standby_pool = StandbyPool(
+            self,
+            size=int(os.environ.get('STANDBY_POOL_SIZE', self.config.standby_pool_size)),
+            cpu_limit=server_config.cpu_limit,
+            memory_limit=server_config.memory_limit,
+            probe_failures=self.config.standby_probe_failures,
+            warm_sites=self.config.standby_warm_sites
+        )
+
+        # تحويل مواقع السيرفرات المتوقفة إلى سيرفرات تخدمها وإعادتها عند التعافي
+        self.failover = FailoverController(
+            self,
+            detection_seconds=float(os.environ.get('FAILOVER_TIMEOUT', self.config.failover_timeout)),
+            failback_stable_seconds=self.config.failback_stable_seconds
+        )
+
+        # حفظ نتائج الجولات واستعادتها عند بدء المراقبة
+        self.health_history = HealthHistoryStore(self.db_config,
+                                                 retention_seconds=self.config.health_history_retention_seconds)
+        self._sweep_started: Optional[datetime] = None
+
+        # نسخة محلية على المضيف يكتبها المشارك في الانتخاب ويقرؤها بقية العمال بدون أقفال أو قاعدة بيانات
+        self.shared_state = SharedClusterState(max_servers=self.config.shared_state_max_servers)
+        self._electing = False
+        self._election_stop = threading.Event()
+        self._snapshot_version = None
+        self._published = 0
+
         # تحميل السيرفرات الموجودة
         self._load_existing_servers()
 
-        # بدء مراقبة الكلاستر
-        self.start_monitoring()
+        # المشاركة في انتخاب قائد المراقبة (عند التشغيل بعدة عمليات تُبدأ من background.py)
+        if auto_start_monitoring:
+            self.start_election()
 
     def _create_load_balancer_instance(self):
         """إنشاء instance للـ Load Balancer"""
@@ -97,7 +296,7 @@ class ClusterManager:
     def _load_existing_servers(self):
         """تحميل السيرفرات الموجودة من قاعدة البيانات"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = connect_mysql(self.db_config)
             cursor = conn.cursor(dictionary=True)
 
             cursor.execute("SELECT * FROM cluster_servers WHERE active = TRUE")
@@ -106,6 +305,7 @@ class ClusterManager:
             for server in servers:
                 server_config = ServerConfig()
                 self.servers[server['server_id']] = server_config
+                self.server_addresses[server['server_id']] = {'ip': server['ip_address'], 'port': server['port']}
 
             cursor.close()
             conn.close()
@@ -127,12 +327,13 @@ class ClusterManager:
         for server in default_servers:
             config = ServerConfig()
             self.servers[server["id"]] = config
+            self.server_addresses[server["id"]] = {'ip': server["ip"], 'port': server["port"]}
             self._save_server_to_db(server["id"], server["ip"], server["port"], True)
 
-    def _save_server_to_db(self, server_id: str, ip: str, port: int, active: bool = True):
-        """حفظ السيرفر في قاعدة البيانات"""
+    def _save_server_to_db(self, server_id: str, ip: str, port: int, active: bool = True, role: str = ROLE_ACTIVE):
+        """حفظ السيرفر في قاعدة البيانات (role: active أو standby للسيرفرات الاحتياطية)"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = connect_mysql(self.db_config)
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -143,16 +344,20 @@ class ClusterManager:
                     active BOOLEAN DEFAULT TRUE,
                     role ENUM('active', 'standby', 'maintenance') DEFAULT 'active',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_health_check TIMESTAMP NULL
+                    last_health_check TIMESTAMP NULL,
+                    cpu_percent FLOAT DEFAULT 0.0,
+                    memory_percent FLOAT DEFAULT 0.0,
+                    sites_count INT DEFAULT 0,
+                    status VARCHAR(20) DEFAULT 'unknown'
                 )
             """)
 
             cursor.execute("""
-                INSERT INTO cluster_servers (server_id, ip_address, port, active)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO cluster_servers (server_id, ip_address, port, active, role)
+                VALUES (%s, %s, %s, %s, %s)
                 ON DUPLICATE KEY UPDATE
-                ip_address=%s, port=%s, active=%s, last_health_check=CURRENT_TIMESTAMP
-            """, (server_id, ip, port, active, ip, port, active))
+                ip_address=%s, port=%s, active=%s, role=%s, last_health_check=CURRENT_TIMESTAMP
+            """, (server_id, ip, port, active, role, ip, port, active, role))
 
             conn.commit()
             cursor.close()
@@ -161,9 +366,13 @@ class ClusterManager:
         except Exception as e:
             logger.error(f"❌ فشل حفظ السيرفر في قاعدة البيانات: {e}")
 
-    def add_server(self, server_data: Dict) -> Dict:
+    def add_server(self, server_data: Dict, rebalance: bool = True) -> Dict:
         """
         إضافة سيرفر جديد للكلاستر
+
+        العنوان إما محجوز مسبقاً (leased من scale_up) أو يُسجل هنا كحجز حتى لا يُعطى لسيرفر آخر.
+        مع docker تُطلق الحاوية وتُنتظر جاهزيتها أولاً؛ السيرفر الجاهز (أو ready من scale_up)
+        يدخل التوزيع كسيرفر صحي مباشرة بدلاً من انتظار جولة الفحص التالية.
         """
         try:
             server_id = server_data['server_id']
@@ -177,27 +386,47 @@ class ClusterManager:
                     'message': f'السيرفر {server_id} موجود مسبقاً'
                 }
 
-            # إنشاء السيرفر عبر Docker
+            if not server_data.get('leased'):
+                try:
+                    self.address_allocator.adopt(server_id, ip, port)
+                except AllocationError as e:
+                    return {
+                        'success': False,
+                        'message': f'تعارض في العنوان: {e}'
+                    }
+                except Exception as e:
+                    logger.warning(f"⚠️ تعذر تسجيل حجز {server_id}: {e}")
+
+            # إنشاء السيرفر عبر Docker وانتظار جاهزيته
+            ready = bool(server_data.get('ready'))
+            time_to_ready_ms = server_data.get('time_to_ready_ms')
             if 'docker' in server_data:
                 container_result = self._create_docker_server(server_data)
                 if not container_result['success']:
                     return container_result
+                ready = True
+                time_to_ready_ms = container_result.get('time_to_ready_ms')
 
             # إضافة السيرفر للـ load balancer
             self.servers[server_id] = ServerConfig()
+            self.server_addresses[server_id] = {'ip': ip, 'port': port}
+            if ready:
+                self.health_status[server_id] = ServerStatus.HEALTHY
 
             # حفظ في قاعدة البيانات
             self._save_server_to_db(server_id, ip, port, True)
 
-            # إعادة توزيع المواقع
-            self.rebalance_sites()
+            # إعادة توزيع المواقع (التوسع المتوازي يعيد التوزيع مرة واحدة بعد كل السيرفرات)
+            if rebalance:
+                self.rebalance_sites()
 
             logger.info(f"✅ تم إضافة السيرفر {server_id}")
 
             return {
                 'success': True,
                 'message': f'تم إضافة السيرفر {server_id} بنجاح',
-                'server_id': server_id
+                'server_id': server_id,
+                'time_to_ready_ms': time_to_ready_ms
             }
 
         except Exception as e:
@@ -207,47 +436,71 @@ class ClusterManager:
                 'message': f'خطأ في إضافة السيرفر: {str(e)}'
             }
 
-    def _create_docker_server(self, server_data: Dict) -> Dict:
-        """إنشاء سيرفر عبر Docker"""
-        try:
-            import subprocess
+    def _server_template(self) -> Dict:
+        """
+        الصورة و bench من حاوية سيرفر تطبيق قائم (APP_SERVER_TEMPLATE، أو app-server-1 ثم بقية السيرفرات)
 
-            server_id = server_data['server_id']
-            ip = server_data['ip']
-            port = server_data['port']
+        يُحفظ بعد أول نجاح؛ قاموس فارغ إذا لم تُفحص أي حاوية (مثلاً CONTAINER_BACKEND=fake).
+        """
+        if self._template is not None:
+            return self._template
+        if self.container_launcher is None:
+            return {}
+        reference = os.environ.get('APP_SERVER_TEMPLATE')
+        candidates = [reference] if reference else [DEFAULT_SERVER_ID] + sorted(set(self.servers) - {DEFAULT_SERVER_ID})
+        for server_id in candidates:
+            try:
+                self._template = self.container_launcher.bench_template(server_id)
+                logger.info(f"📋 مواصفات السيرفرات الجديدة من {server_id}: {self._template}")
+                return self._template
+            except Exception as e:
+                logger.debug(f"تعذر فحص حاوية {server_id}: {e}")
+        logger.warning("⚠️ لا توجد حاوية سيرفر تطبيق مرجعية - الصورة الافتراضية بدون bench مركب")
+        return {}
 
-            # أمر إنشاء الحاوية
-            docker_cmd = [
-                'docker', 'run', '-d',
-                '--name', server_id,
-                '--network', 'frappe-cluster-net',
-                '--ip', ip,
-                '-p', f'{port}:{port}',
-                '--memory', '2g',
-                '--cpus', '1.0',
-                'frappe/bench:latest',
-                'tail', '-f', '/dev/null'
-            ]
-
-            result = subprocess.run(docker_cmd, capture_output=True, text=True)
-
-            if result.returncode == 0:
-                return {'success': True}
-            else:
-                return {
-                    'success': False,
-                    'message': f'فشل إنشاء حاوية Docker: {result.stderr}'
-                }
+    def _container_spec(self, server_data: Dict) -> ContainerSpec:
+        """
+        مواصفات حاوية السيرفر: حدود ServerConfig، والصورة و bench من سيرفر تطبيق قائم
+        """
+        server_config = ServerConfig()
+        template = self._server_template()
+        spec = ContainerSpec(
+            server_id=server_data['server_id'],
+            ip=server_data['ip'],
+            port=server_data['port'],
+            image=os.environ.get('APP_SERVER_IMAGE') or template.get('image') or server_config.docker_image,
+            network=server_config.docker_network,
+            memory_limit=server_config.memory_limit,
+            cpu_limit=server_config.cpu_limit,
+            user=template.get('user')
+        )
+        if template.get('bench_source'):
+            use_shared_bench(spec, template['bench_source'])
+        return spec
 
-        except Exception as e:
+    def _create_docker_server(self, server_data: Dict) -> Dict:
+        """إنشاء حاوية السيرفر عبر Docker Engine API وانتظار جاهزيتها"""
+        if self.container_launcher is None:
             return {
                 'success': False,
-                'message': f'خطأ في إنشاء السيرفر: {str(e)}'
+                'message': 'مُطلق الحاويات غير متاح (Docker Engine API)'
             }
 
+        launch = self.container_launcher.launch(self._container_spec(server_data))
+        return {
+            'success': launch.success,
+            'message': launch.message,
+            'server_id': server_data['server_id'],
+            'time_to_ready_ms': launch.time_to_ready_ms,
+            'stages_ms': launch.stages_ms
+        }
+
     def remove_server(self, server_id: str) -> Dict:
         """
         إزالة سيرفر من الكلاستر
+
+        مواقع السيرفر تُجدول للترحيل دون انتظار ويُعلَّم السيرفر كمُفرَّغ (draining) فلا يستقبل مواقع؛
+        الإيقاف وتحديث قاعدة البيانات وتحرير العنوان تتم في _track_draining بعد انتهاء كل ترحيلاته.
         """
         try:
             if server_id not in self.servers:
@@ -255,38 +508,49 @@ class ClusterManager:
                     'success': False,
                     'message': f'السيرفر {server_id} غير موجود'
                 }
+            if server_id in self.draining:
+                return {
+                    'success': False,
+                    'message': f'السيرفر {server_id} قيد التفريغ بالفعل'
+                }
 
             # الحصول على مواقع السيرفر
             server_sites = self._get_server_sites(server_id)
 
-            # إعادة توزيع المواقع
-            if server_sites:
-                healthy_servers = self.get_healthy_servers()
-                healthy_servers.remove(server_id)
-
-                if not healthy_servers:
-                    return {
-                        'success': False,
-                        'message': 'لا يمكن إزالة السيرفر - ليس هناك سيرفرات صحية أخرى'
-                    }
-
-                self._redistribute_sites(server_sites, healthy_servers)
-
-            # إيقاف السيرفر
-            self._stop_server_container(server_id)
+            if not server_sites:
+                self._finish_removal(server_id)
+                return {
+                    'success': True,
+                    'message': f'تم إزالة السيرفر {server_id} بنجاح',
+                    'sites_moved': 0
+                }
 
-            # حذف من الذاكرة
-            del self.servers[server_id]
+            # السيرفر المُزال قد لا يكون صحياً أصلاً (وهذا أهم وقت لترحيل مواقعه)
+            healthy_servers = [healthy for healthy in self.get_healthy_servers() if healthy != server_id]
+            if not healthy_servers:
+                return {
+                    'success': False,
+                    'message': 'لا يمكن إزالة السيرفر - ليس هناك سيرفرات صحية أخرى'
+                }
 
-            # تحديث قاعدة البيانات
-            self._update_server_in_db(server_id, False)
+            self.draining[server_id] = {
+                'started_at': datetime.now().isoformat(),
+                'sites': len(server_sites),
+                'futures': self._redistribute_sites(server_sites, healthy_servers, server_id)
+            }
+            logger.info(f"🚚 بدء تفريغ السيرفر {server_id} ({len(server_sites)} موقع)")
 
-            logger.info(f"✅ تم إزالة السيرفر {server_id}")
+            # الترحيلات المنتهية فوراً (أو المرفوضة) تُحسم الآن بدلاً من الجولة التالية
+            self._track_draining()
+            finished = self.last_drain.get(server_id)
+            if server_id not in self.draining and finished:
+                return finished
 
             return {
                 'success': True,
-                'message': f'تم إزالة السيرفر {server_id} بنجاح',
-                'sites_moved': len(server_sites)
+                'draining': True,
+                'message': f'بدأ تفريغ السيرفر {server_id} - يُزال بعد ترحيل {len(server_sites)} موقع',
+                'sites_moving': len(server_sites)
             }
 
         except Exception as e:
@@ -296,20 +560,70 @@ class ClusterManager:
                 'message': f'خطأ في إزالة السيرفر: {str(e)}'
             }
 
+    def _track_draining(self):
+        """
+        إنهاء إزالة السيرفرات المُفرَّغة بعد انتهاء كل ترحيلاتها
+
+        السيرفر الذي فشل (أو تُخطي) بعض ترحيلاته يبقى في الكلاستر ويعود لاستقبال المواقع،
+        لأن المواقع الفاشلة أُعيدت إليه.
+        """
+        for server_id, drain in list(self.draining.items()):
+            futures = drain['futures']
+            if not all(future.done() for future in futures):
+                continue
+            migrations = summarize_migrations([future.result() for future in futures])
+            del self.draining[server_id]
+            remaining = self._get_server_sites(server_id)
+            if migrations['completed'] < migrations['total'] or remaining:
+                logger.warning(f"⚠️ لم تتم إزالة السيرفر {server_id} - فشل ترحيل "
+                               f"{migrations['total'] - migrations['completed']} من {migrations['total']} موقع")
+                self.last_drain[server_id] = {
+                    'success': False,
+                    'message': f"لم تتم إزالة السيرفر {server_id} - فشل ترحيل "
+                               f"{migrations['total'] - migrations['completed']} من {migrations['total']} موقع",
+                    'migrations': {key: migrations[key] for key in
+                                   ('total', 'completed', 'rolled_back', 'failed', 'skipped', 'max_cutover_ms')}
+                }
+                continue
+            self._finish_removal(server_id)
+            self.last_drain[server_id] = {
+                'success': True,
+                'message': f'تم إزالة السيرفر {server_id} بنجاح',
+                'sites_moved': migrations['completed']
+            }
+
+    def _finish_removal(self, server_id: str):
+        """إيقاف حاوية السيرفر وحذفه من الذاكرة وقاعدة البيانات وتحرير حجزه"""
+        # إيقاف السيرفر
+        self._stop_server_container(server_id)
+
+        # حذف من الذاكرة
+        self.servers.pop(server_id, None)
+        self.server_addresses.pop(server_id, None)
+        self.health_status.pop(server_id, None)
+        self.metrics.pop(server_id, None)
+        self.metrics_store.remove(server_id)
+        self._metrics_inflight.pop(server_id, None)
+        if self.metrics_collector:
+            self.metrics_collector.forget(server_id)
+
+        # تحديث قاعدة البيانات وتحرير الاسم والعنوان والمنفذ
+        self._update_server_in_db(server_id, False)
+        self.address_allocator.release(server_id)
+
+        logger.info(f"✅ تم إزالة السيرفر {server_id}")
+
     def _stop_server_container(self, server_id: str):
         """إيقاف حاوية السيرفر"""
-        try:
-            import subprocess
-            subprocess.run(['docker', 'stop', server_id], capture_output=True)
-            subprocess.run(['docker', 'rm', server_id], capture_output=True)
-            logger.info(f"✅ تم إيقاف الحاوية {server_id}")
-        except Exception as e:
-            logger.warning(f"⚠️ فشل إيقاف الحاوية {server_id}: {e}")
+        if self.container_launcher is None:
+            logger.warning(f"⚠️ مُطلق الحاويات غير متاح - لم يتم إيقاف الحاوية {server_id}")
+            return
+        self.container_launcher.remove(server_id)
 
     def _update_server_in_db(self, server_id: str, active: bool):
         """تحديث السيرفر في قاعدة البيانات"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = connect_mysql(self.db_config)
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -327,79 +641,111 @@ class ClusterManager:
 
     def check_server_health(self, server_id: str) -> ServerStatus:
         """
-        فحص صحة السيرفر
+        فحص صحة السيرفر (HTTP ثم المقاييس)
+        """
+        response_time = self._probe_server(server_id)
+        if response_time is None:
+            return ServerStatus.OFFLINE
+        try:
+            metrics = self._get_server_metrics(server_id, self._get_server_info(server_id))
+            self._record_metrics(server_id, metrics, response_time)
+            return self._classify_metrics(metrics)
+        except Exception as e:
+            logger.error(f"❌ خطأ في فحص صحة السيرفر {server_id}: {e}")
+            return ServerStatus.OFFLINE
+
+    def _probe_server(self, server_id: str) -> Optional[float]:
+        """
+        فحص HTTP فقط: زمن الاستجابة بالمللي ثانية، أو None إذا لم يرد السيرفر بـ 200
         """
         try:
             if server_id not in self.servers:
-                return ServerStatus.OFFLINE
+                return None
 
             # محاولة الاتصال بالسيرفر
             server = self._get_server_info(server_id)
             url = f"http://{server['ip']}:{server['port']}/api/method/version"
 
+            # سيرفر لا يرد أو يرد بـ 5xx مراراً: رفض فوري حتى النداء التجريبي بدلاً من انتظار المهلة
             start_time = time.time()
-            response = requests.get(url, timeout=10, headers={
-                'User-Agent': 'ClusterManager/1.0',
-                'Accept': 'application/json'
-            })
-            response_time = (time.time() - start_time) * 1000
-
-            if response.status_code == 200:
-                # التحقق من المقاييس
-                metrics = self._get_server_metrics(server)
-
-                # تحديث المقاييس
-                self.metrics[server_id] = ServerMetrics(
-                    server_id=server_id,
-                    cpu_percent=metrics.get('cpu_percent', 0),
-                    memory_percent=metrics.get('memory_percent', 0),
-                    disk_percent=metrics.get('disk_percent', 0),
-                    network_rx_bytes=metrics.get('network_rx', 0),
-                    network_tx_bytes=metrics.get('network_tx', 0),
-                    active_connections=metrics.get('connections', 0),
-                    sites_count=metrics.get('sites_count', 0),
-                    response_time_ms=response_time,
-                    uptime_seconds=metrics.get('uptime', 0),
-                    last_updated=datetime.now()
-                )
-
-                # تحديد الحالة
-                if metrics['cpu_percent'] > 90 or metrics['memory_percent'] > 90:
-                    return ServerStatus.CRITICAL
-                elif metrics['cpu_percent'] > 75 or metrics['memory_percent'] > 75:
-                    return ServerStatus.WARNING
-
-                return ServerStatus.HEALTHY
-            else:
-                return ServerStatus.OFFLINE
-
-        except requests.exceptions.RequestException:
-            return ServerStatus.OFFLINE
+            response = breakers.get(f"app:{server_id}").call(
+                self.http.get, url,
+                timeout=(self.config.probe_connect_timeout, self.config.probe_read_timeout),
+                is_failure=lambda response: response.status_code >= 500 and f"HTTP {response.status_code}"
+            )
+            if response.status_code != 200:
+                return None
+            return (time.time() - start_time) * 1000
+
+        except (requests.exceptions.RequestException, CircuitOpenError):
+            return None
         except Exception as e:
             logger.error(f"❌ خطأ في فحص صحة السيرفر {server_id}: {e}")
-            return ServerStatus.OFFLINE
+            return None
+
+    def _record_metrics(self, server_id: str, metrics: Dict, response_time: float):
+        """تحديث المقاييس (تبقى العينة السابقة إذا تعذر الجمع) وإضافة العينة للسلسلة الزمنية"""
+        if metrics:
+            self.metrics[server_id] = ServerMetrics(
+                server_id=server_id,
+                cpu_percent=metrics.get('cpu_percent') or 0,
+                memory_percent=metrics.get('memory_percent', 0),
+                disk_percent=metrics.get('disk_percent', 0),
+                network_rx_bytes=metrics.get('network_rx', 0),
+                network_tx_bytes=metrics.get('network_tx', 0),
+                active_connections=metrics.get('connections', 0),
+                sites_count=metrics.get('sites_count', 0),
+                response_time_ms=response_time,
+                uptime_seconds=metrics.get('uptime', 0),
+                last_updated=datetime.now(),
+                block_read_bytes=metrics.get('block_read', 0),
+                block_write_bytes=metrics.get('block_write', 0),
+                pids=metrics.get('pids', 0),
+                gunicorn_workers=metrics.get('gunicorn_workers', 0),
+                background_workers=metrics.get('background_workers', 0)
+            )
+        self.metrics_store.record(server_id, {**metrics, 'response_time_ms': response_time})
+
+    @staticmethod
+    def _classify_metrics(metrics: Dict) -> ServerStatus:
+        """حالة سيرفر يرد على HTTP حسب مقاييسه (بدون مقاييس: HEALTHY)"""
+        cpu_percent = metrics.get('cpu_percent') or 0
+        memory_percent = metrics.get('memory_percent', 0)
+        if cpu_percent > 90 or memory_percent > 90:
+            return ServerStatus.CRITICAL
+        elif cpu_percent > 75 or memory_percent > 75:
+            return ServerStatus.WARNING
+        return ServerStatus.HEALTHY
+
+    def _get_server_metrics(self, server_id: str, server: Optional[Dict] = None) -> Dict:
+        """
+        الحصول على مقاييس حاوية السيرفر من جامع المقاييس
 
-    def _get_server_metrics(self, server: Dict) -> Dict:
-        """الحصول على مقاييس السيرفر (محاكاة)"""
-        # في المستقبل، سيتم الاتصال بـ Docker API أو Prometheus
-        return {
-            'cpu_percent': 45.2,
-            'memory_percent': 62.8,
-            'disk_percent': 34.7,
-            'network_rx': 1024000,
-            'network_tx': 524288,
-            'connections': 125,
-            'sites_count': 25,
-            'uptime': 86400
-        }
+        اسم الحاوية هو server_id (كما في _create_docker_server) ما لم يُحدد container.
+        يعيد قاموساً فارغاً إذا تعذر الجمع.
+        """
+        if self.metrics_collector is None:
+            return {}
+        container = (server or {}).get('container', server_id)
+        try:
+            return self.metrics_collector.collect(container)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر جمع مقاييس {server_id}: {e}")
+            return {}
 
     def get_healthy_servers(self) -> List[str]:
         """
         الحصول على قائمة السيرفرات الصحية
+
+        السيرفر الذي قاطعه في هذه العملية غير مغلق لا يدخل التوزيع حتى ينجح نداؤه التجريبي،
+        والسيرفر قيد التفريغ لا يستقبل مواقع.
         """
+        self._sync_from_leader()
         healthy = []
         for server_id in self.servers.keys():
-            if self.health_status.get(server_id) == ServerStatus.HEALTHY:
+            if server_id in self.draining:
+                continue
+            if self.health_status.get(server_id) == ServerStatus.HEALTHY and breakers.available(f"app:{server_id}"):
                 healthy.append(server_id)
         return healthy
 
@@ -409,6 +755,7 @@ class ClusterManager:
         """
         try:
             logger.info("🔄 بدء إعادة توزيع المواقع")
+            self._track_rebalance_migrations()
 
             healthy_servers = self.get_healthy_servers()
             if len(healthy_servers) < self.config.min_servers:
@@ -422,7 +769,13 @@ class ClusterManager:
             active_sites = self._get_all_active_sites()
 
             # توزيع المواقع على السيرفرات
-            server_sites = self._distribute_sites(active_sites, healthy_servers)
+            previous = self.assignments.snapshot()
+            for site in active_sites:
+                # المواقع المنشأة قبل جدول التوزيع موجودة على السيرفر الافتراضي
+                previous.setdefault(site, DEFAULT_SERVER_ID)
+            tenant_costs = self._get_tenant_costs() if self.config.load_balance_algorithm == "weighted" else {}
+            server_sites = self._distribute_sites(active_sites, healthy_servers, tenant_costs, current=previous)
+            moves = placement_moves(previous, server_sites)
 
             # تطبيق التوزيع الجديد
             success_count = 0
@@ -430,12 +783,53 @@ class ClusterManager:
                 if self._update_server_sites(server_id, sites):
                     success_count += 1
 
-            logger.info(f"✅ تم إعادة توزيع {len(active_sites)} موقع على {success_count} سيرفر")
+            # المنقول يبقى على المصدر حتى يعينه ترحيله (assign بعد التحويل)، والموقع الذي ما زال
+            # يُرحل من إعادة توزيع سابقة يُترك لترحيله الجاري
+            migrating = set(self.migration_engine.active_sites())
+            assignments = assignment_map(server_sites)
+            for move in moves['moves']:
+                assignments[move['site']] = move['from']
+            for site in migrating:
+                assignments.pop(site, None)
+            self.assignments.assign_many(assignments, removed=[site for site in previous
+                                                               if site not in assignments and site not in migrating])
+
+            # ترحيل المواقع المنقولة فعلياً دون انتظار (المواقع الجديدة لا تحتاج ترحيل)؛
+            # النتائج تُجمع في جولات المراقبة التالية (_track_rebalance_migrations)
+            pending = [move for move in moves['moves'] if move['site'] not in migrating]
+            if pending:
+                self._rebalance_migrations += self.migration_engine.submit_many(
+                    pending, guard=self._may_start_migration)
+
+            self.last_rebalance = {
+                'at': datetime.now().isoformat(),
+                'algorithm': self.config.load_balance_algorithm,
+                'sites': len(active_sites),
+                'servers': len(healthy_servers),
+                'moved': moves['moved'],
+                'moved_percent': moves['moved_percent'],
+                'placed': moves['placed'],
+                'dropped': moves['dropped'],
+                'max_server_sites': max((len(sites) for sites in server_sites.values()), default=0)
+            }
+            if pending or migrating:
+                self.last_rebalance['migrations'] = {'submitted': len(pending), 'in_progress': True}
+            if tenant_costs:
+                utilization = placement_utilization(server_sites, tenant_costs, self._server_capacity())
+                self.last_rebalance['utilization'] = utilization
+                self.last_rebalance['over_capacity'] = [
+                    server_id for server_id, usage in utilization.items() if max(usage.values()) > 100
+                ]
+
+            logger.info(f"✅ تم إعادة توزيع {len(active_sites)} موقع على {success_count} سيرفر "
+                        f"(نقل {moves['moved']} موقع - {moves['moved_percent']}%)")
 
             return {
                 'success': True,
                 'message': f'تم إعادة توزيع {len(active_sites)} موقع على {success_count} سيرفر',
-                'distribution': server_sites
+                'distribution': server_sites,
+                'moves': moves,
+                'migrations_submitted': len(pending)
             }
 
         except Exception as e:
@@ -445,11 +839,41 @@ class ClusterManager:
                 'message': f'خطأ في إعادة التوزيع: {str(e)}'
             }
 
-    def _distribute_sites(self, sites: List[str], servers: List[str]) -> Dict[str, List[str]]:
+    def _may_start_migration(self) -> bool:
+        """ترحيلات إعادة التوزيع تبدأ فقط في القائد (أو عملية لا تشارك في الانتخاب)"""
+        return not self._electing or self.leader.is_leader
+
+    def _track_rebalance_migrations(self):
+        """تسجيل نتيجة ترحيلات إعادة التوزيع بعد انتهائها كلها"""
+        futures = list(self._rebalance_migrations)
+        if not futures or not all(future.done() for future in futures):
+            return
+        migrations = summarize_migrations([future.result() for future in futures])
+        del self._rebalance_migrations[:len(futures)]
+        self.last_rebalance['migrations'] = {
+            key: migrations[key] for key in ('total', 'completed', 'rolled_back', 'failed', 'skipped', 'max_cutover_ms')
+        }
+        logger.info(f"🚚 انتهت ترحيلات إعادة التوزيع: {migrations['completed']} من {migrations['total']} "
+                    f"(تراجع {migrations['rolled_back']}، فشل {migrations['failed']}، تخطي {migrations['skipped']})")
+
+    def _distribute_sites(self, sites: List[str], servers: List[str],
+                          tenant_costs: Optional[Dict[str, TenantCost]] = None,
+                          current: Optional[Dict[str, str]] = None) -> Dict[str, List[str]]:
         """
         توزيع المواقع على السيرفرات حسب الخوارزمية المختارة
+
+        current: التوزيع الحالي ({site: server}) - weighted تبدأ منه ولا تنقل إلا ما يتجاوز متوسط الأسطول + الهامش
         """
-        if self.config.load_balance_algorithm == "round_robin":
+        if self.config.load_balance_algorithm == "weighted":
+            return weighted_placement(sites, servers, tenant_costs or {}, self._server_capacity(),
+                                      current=current, margin=self.config.placement_margin)
+        elif self.config.load_balance_algorithm == "consistent_hash":
+            return consistent_hash_placement(
+                sites, servers,
+                load_factor=self.config.placement_load_factor,
+                vnodes=self.config.placement_vnodes
+            )
+        elif self.config.load_balance_algorithm == "round_robin":
             return self._distribute_round_robin(sites, servers)
         elif self.config.load_balance_algorithm == "least_sites":
             return self._distribute_least_sites(sites, servers)
@@ -474,6 +898,86 @@ class ClusterManager:
 
         return distribution
 
+    def _server_capacity(self) -> ServerCapacity:
+        """سعة سيرفر التطبيق من حدود الحاوية"""
+        return ServerCapacity.from_limits(
+            ServerConfig.cpu_limit,
+            ServerConfig.memory_limit,
+            ServerConfig.disk_limit,
+            ServerConfig.requests_per_min_capacity
+        )
+
+    def _get_tenant_costs(self) -> Dict[str, TenantCost]:
+        """
+        تكلفة كل موقع نشط: القياسات من site_usage، وإلا تقدير حسب حالة العميل
+        """
+        try:
+            conn = connect_mysql(self.db_config)
+            cursor = conn.cursor()
+            self._ensure_site_usage_table(cursor)
+            cursor.execute("""
+                SELECT c.site_name, c.status, u.requests_per_min, u.cpu_seconds_per_min,
+                       u.db_bytes, u.worker_memory_bytes
+                FROM trial_customers c
+                LEFT JOIN site_usage u ON u.site_name = c.site_name
+                WHERE c.status IN ('active', 'converted') AND c.frappe_site_created = TRUE
+            """)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل جلب تكلفة المواقع: {e}")
+            return {}
+
+        costs = {}
+        for site_name, status, requests_per_min, cpu_seconds, db_bytes, worker_memory in rows:
+            prior = DEFAULT_TENANT_COSTS.get(status, DEFAULT_TENANT_COSTS['active'])
+            costs[site_name] = TenantCost(
+                requests_per_min=prior.requests_per_min if requests_per_min is None else float(requests_per_min),
+                cpu_seconds_per_min=prior.cpu_seconds_per_min if cpu_seconds is None else float(cpu_seconds),
+                db_bytes=prior.db_bytes if db_bytes is None else float(db_bytes),
+                worker_memory_bytes=prior.worker_memory_bytes if worker_memory is None else float(worker_memory)
+            )
+        return costs
+
+    def _ensure_site_usage_table(self, cursor):
+        """جدول قياسات استهلاك المواقع"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS site_usage (
+                site_name VARCHAR(255) PRIMARY KEY,
+                requests_per_min FLOAT NULL,
+                cpu_seconds_per_min FLOAT NULL,
+                db_bytes BIGINT NULL,
+                worker_memory_bytes BIGINT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+
+    def record_site_usage(self, site_name: str, usage: Dict) -> bool:
+        """
+        حفظ قياسات موقع (من سجلات Nginx، حجم قاعدة البيانات، ...) - الحقول غير الموجودة تبقى كما هي
+        """
+        fields = [f for f in ('requests_per_min', 'cpu_seconds_per_min', 'db_bytes', 'worker_memory_bytes')
+                  if usage.get(f) is not None]
+        if not fields:
+            return False
+        try:
+            conn = connect_mysql(self.db_config)
+            cursor = conn.cursor()
+            self._ensure_site_usage_table(cursor)
+            cursor.execute(f"""
+                INSERT INTO site_usage (site_name, {', '.join(fields)})
+                VALUES (%s, {', '.join(['%s'] * len(fields))})
+                ON DUPLICATE KEY UPDATE {', '.join(f'{f}=VALUES({f})' for f in fields)}
+            """, (site_name, *[usage[f] for f in fields]))
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ فشل حفظ استهلاك الموقع {site_name}: {e}")
+            return False
+
     def _update_server_sites(self, server_id: str, sites: List[str]) -> bool:
         """
         تحديث مواقع السيرفر في Nginx
@@ -488,22 +992,19 @@ class ClusterManager:
             logger.error(f"❌ فشل تحديث مواقع السيرفر {server_id}: {e}")
             return False
 
+    def _window_average(self, field: str, server_ids: List[str]) -> Optional[float]:
+        """متوسط المقياس على نافذة التوسع لكل سيرفر ثم عبر السيرفرات"""
+        return self.metrics_store.aggregate(field, self.config.scale_window_seconds, server_ids)
+
     def should_scale_up(self) -> bool:
         """
-        التحقق من الحاجة لإضافة سيرفر جديد
+        التحقق من الحاجة لإضافة سيرفر جديد (متوسط نافذة scale_window_seconds)
         """
         healthy_servers = self.get_healthy_servers()
-        total_cpu = 0
-        total_memory = 0
-
-        for server_id in healthy_servers:
-            if server_id in self.metrics:
-                total_cpu += self.metrics[server_id].cpu_percent
-                total_memory += self.metrics[server_id].memory_percent
 
         if healthy_servers:
-            avg_cpu = total_cpu / len(healthy_servers)
-            avg_memory = total_memory / len(healthy_servers)
+            avg_cpu = self._window_average('cpu_percent', healthy_servers) or 0
+            avg_memory = self._window_average('memory_percent', healthy_servers) or 0
 
             # الشروط: إعلى من العتبة أو اقترب من الحد الأقصى
             return (avg_cpu > self.config.scale_up_threshold or
@@ -514,7 +1015,7 @@ class ClusterManager:
 
     def should_scale_down(self) -> bool:
         """
-        التحقق من إمكانية تقليل السيرفرات
+        التحقق من إمكانية تقليل السيرفرات (متوسط نافذة scale_window_seconds)
         """
         if len(self.servers) <= self.config.min_servers:
             return False
@@ -523,41 +1024,87 @@ class ClusterManager:
         if not healthy_servers:
             return False
 
-        total_cpu = sum(self.metrics[s].cpu_percent for s in healthy_servers if s in self.metrics)
-        avg_cpu = total_cpu / len(healthy_servers)
+        avg_cpu = self._window_average('cpu_percent', healthy_servers)
+        if avg_cpu is None:
+            return False
 
         return avg_cpu < self.config.scale_down_threshold
 
-    def scale_up(self, manual: bool = False) -> Dict:
+    def scale_up(self, manual: bool = False, count: int = 1) -> Dict:
         """
-        إضافة سيرفر جديد تلقائياً
+        إضافة سيرفر جديد (أو عدة سيرفرات بالتوازي) تلقائياً
+
+        كل سيرفر يحصل على اسم و IP ومنفذ محجوزة ذرياً في قاعدة البيانات، فلا تتعارض
+        عمليات التوسع المتزامنة؛ الحجز يُحرر إذا فشل إنشاء السيرفر.
+        السيرفرات الاحتياطية تُرقى أولاً (خلال أجزاء من الثانية) ويُعاد التوزيع فوراً، والباقي حاويات جديدة
+        تُطلق بالتوازي في الخلفية (لا تنتظر حلقة المراقبة جاهزيتها)؛ _track_launches يضيفها بعد جاهزيتها
+        ثم يعيد التوزيع مرة واحدة.
         """
         try:
-            # إنشاء server ID جديد
-            server_number = len(self.servers) + 1
-            server_id = f"app-server-{server_number}"
-
-            # حساب IP جديد
-            base_ip_parts = [int(x) for x in self.servers['app-server-1'].ip.split('.')]
-            new_ip = "172.22.0.22"  # يجب تحسين حساب IP الجديد
-
-            # حساب Port جديد
-            new_port = 8002  # يجب تحسين حساب Port الجديد
+            launching = self._launching_count()
+            count = max(1, min(count, self.config.scale_up_max_batch,
+                               self.config.max_servers - len(self.servers) - launching))
+            if len(self.servers) + launching >= self.config.max_servers:
+                return {
+                    'success': False,
+                    'message': f'لا يمكن التوسع - الحد الأقصى من السيرفرات: {self.config.max_servers}'
+                }
 
-            result = self.add_server({
-                'server_id': server_id,
-                'ip': new_ip,
-                'port': new_port,
-                'docker': True
-            })
+            promotions = self.standby_pool.promote_many(count) if self.standby_pool else []
+            results = [{'success': True, 'message': promotion.message, 'server_id': promotion.server_id,
+                        'promotion_ms': promotion.promotion_ms} for promotion in promotions]
 
-            if result['success']:
-                logger.info(f"📈 تم إضافة سيرفر جديد: {server_id}")
-                if manual:
-                    result['message'] += " (يدوياً)"
+            leases = self.address_allocator.lease_many(count - len(promotions)) if count > len(promotions) else []
+            if not leases and not promotions:
+                return {
+                    'success': False,
+                    'message': 'لا توجد عناوين أو منافذ متاحة لسيرفر جديد'
+                }
 
-                return result
+            if leases and self.container_launcher is None:
+                for lease in leases:
+                    self.address_allocator.release(lease.server_id)
+                leases = []
+                if not promotions:
+                    return {
+                        'success': False,
+                        'message': 'مُطلق الحاويات غير متاح (Docker Engine API)'
+                    }
 
+            added = [result['server_id'] for result in results if result['success']]
+            if added:
+                self.rebalance_sites()
+                logger.info(f"📈 تم ترقية {len(added)} سيرفر احتياطي: {', '.join(added)}")
+
+            servers = [{'server_id': lease.server_id, 'ip': lease.ip, 'port': lease.port} for lease in leases]
+            if servers:
+                self._launches.append((servers, self._launch_servers(servers)))
+                logger.info(f"🚀 إطلاق {len(servers)} سيرفر جديد في الخلفية: "
+                            f"{', '.join(server['server_id'] for server in servers)}")
+                # الإطلاق المنتهي فوراً يُضاف الآن بدلاً من الجولة التالية
+                self._track_launches()
+
+            launched = [server['server_id'] for server in servers]
+            pending = [server_id for server_id in launched if server_id not in self.servers]
+            added += [server_id for server_id in launched if server_id in self.servers]
+            messages = [f'تم إضافة {len(added)} سيرفر'] if added else []
+            if pending:
+                messages.append(f'جارٍ إطلاق {len(pending)} سيرفر')
+
+            result = {
+                'success': bool(added or pending),
+                'message': ' - '.join(messages) if messages
+                           else f"فشل إضافة السيرفرات: {'; '.join(r['message'] for r in results)}",
+                'servers': added,
+                'launching': pending,
+                'results': results,
+                'promoted': [promotion.server_id for promotion in promotions],
+                'promotion_ms': {promotion.server_id: promotion.promotion_ms for promotion in promotions}
+            }
+            if len(added) == 1 and not pending:
+                result['server_id'] = added[0]
+            if manual and (added or pending):
+                result['message'] += " (يدوياً)"
             return result
 
         except Exception as e:
@@ -567,11 +1114,79 @@ class ClusterManager:
                 'message': f'خطأ في Auto-scaling: {str(e)}'
             }
 
+    def _launching_count(self) -> int:
+        """عدد السيرفرات التي تُطلق حاوياتها في الخلفية"""
+        return sum(len(servers) for servers, _ in self._launches)
+
+    def _launch_servers(self, servers: List[Dict]) -> Future:
+        """إطلاق حاويات السيرفرات وانتظار جاهزيتها في thread منفصل (Future بنتائج LaunchResult)"""
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self.container_launcher.launch_many(
+                    [self._container_spec(server) for server in servers]))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="scale-up-launch", daemon=True).start()
+        return future
+
+    def _track_launches(self):
+        """
+        إضافة السيرفرات الجاهزة من إطلاقات scale_up المنتهية ثم إعادة توزيع واحدة
+
+        الإطلاق الفاشل (أو السيرفر الذي رُفضت إضافته) يحرر حجزه.
+        """
+        finished = [(servers, future) for servers, future in self._launches if future.done()]
+        if not finished:
+            return
+        self._launches = [entry for entry in self._launches if not entry[1].done()]
+
+        added = []
+        for servers, future in finished:
+            try:
+                launches = future.result()
+            except Exception as e:
+                logger.error(f"❌ فشل إطلاق السيرفرات الجديدة: {e}")
+                launches = []
+            outcomes = {launch.server_id: launch for launch in launches}
+            for server in servers:
+                launch = outcomes.get(server['server_id'])
+                if launch is None or not launch.success:
+                    logger.error(f"❌ فشل إطلاق {server['server_id']}: "
+                                 f"{launch.message if launch else 'لم يكتمل الإطلاق'}")
+                    self.address_allocator.release(server['server_id'])
+                    continue
+                result = self.add_server({
+                    **server,
+                    'leased': True,
+                    'ready': True,
+                    'time_to_ready_ms': launch.time_to_ready_ms
+                }, rebalance=False)
+                if result['success']:
+                    added.append(server['server_id'])
+                    logger.info(f"🟢 {server['server_id']} جاهز خلال {launch.time_to_ready_ms:.0f}ms")
+                else:
+                    self.container_launcher.remove(server['server_id'])
+                    self.address_allocator.release(server['server_id'])
+
+        if added:
+            self.rebalance_sites()
+            logger.info(f"📈 تم إضافة {len(added)} سيرفر جديد: {', '.join(added)}")
+
     def scale_down(self, manual: bool = False) -> Dict:
         """
         إزالة سيرفر غير مطلوب تلقائياً
+
+        يعود فور بدء التفريغ؛ لا يبدأ تفريغ جديد قبل انتهاء السابق.
         """
         try:
+            if self.draining:
+                return {
+                    'success': False,
+                    'message': f"تفريغ سيرفر جارٍ بالفعل: {', '.join(sorted(self.draining))}"
+                }
             if len(self.servers) <= self.config.min_servers:
                 return {
                     'success': False,
@@ -586,12 +1201,12 @@ class ClusterManager:
                     'message': 'لا يوجد سيرفرات صحية لحذفها'
                 }
 
-            server_id = min(healthy_servers, key=lambda s: len(self.metrics.get(s, {}).get('sites_count', 0)) if s in self.metrics else 0)
+            server_id = min(healthy_servers, key=lambda s: self.metrics[s].sites_count if s in self.metrics else 0)
 
             result = self.remove_server(server_id)
 
             if result['success']:
-                logger.info(f"📉 تم حذف سيرفر غير مطلوب: {server_id}")
+                logger.info(f"📉 {'بدء تفريغ' if result.get('draining') else 'تم حذف'} سيرفر غير مطلوب: {server_id}")
                 if manual:
                     result['message'] += " (يدوياً)"
 
@@ -604,16 +1219,171 @@ class ClusterManager:
                 'message': f'خطأ في Auto-scaling down: {str(e)}'
             }
 
+    def start_election(self):
+        """المشاركة في انتخاب قائد المراقبة (القائد فقط يشغل حلقة المراقبة والتوسع)"""
+        self._electing = True
+        self._election_stop.clear()
+        self.leader.start()
+        threading.Thread(target=self._mirror_loop, name="cluster-state-mirror", daemon=True).start()
+
+    def stop_election(self):
+        """الانسحاب من الانتخاب وتسليم القيادة فوراً إن كانت لهذه العملية"""
+        self._electing = False
+        self._election_stop.set()
+        self.leader.stop()
+
+    def _mirror_loop(self):
+        """غير القائد: نسخ ما ينشره القائد في قاعدة البيانات إلى الذاكرة المشتركة لعمال هذا المضيف"""
+        mirrored = None
+        while not self._election_stop.is_set():
+            try:
+                snapshot = None if self.is_monitoring else self.snapshots.latest()
+                if snapshot and snapshot['_meta']['generation'] != mirrored:
+                    meta = snapshot['_meta']
+                    self._write_shared_state(snapshot, meta['generation'], meta['leader'], meta['token'])
+                    mirrored = meta['generation']
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر نسخ حالة القائد إلى الذاكرة المشتركة: {e}")
+            self._election_stop.wait(self.config.snapshot_refresh_seconds)
+
+    def _write_shared_state(self, payload: Dict, generation: int, leader: str, token: int):
+        """كتابة حالة منشورة (بنفس شكل snapshot) إلى الذاكرة المشتركة"""
+        if self.shared_state is None:
+            return
+        servers = [{
+            'server_id': server_id,
+            'ip': address.get('ip'),
+            'port': address.get('port'),
+            'status': payload['health_status'].get(server_id),
+            'metrics': payload['metrics'].get(server_id)
+        } for server_id, address in payload['servers'].items()]
+        extra = {key: value for key, value in payload.items()
+                 if key not in ('servers', 'health_status', 'metrics', '_meta')}
+        self.shared_state.write(servers, extra, generation, leader, token or 0)
+
+    def _on_elected(self):
+        """القائد الجديد: إعادة تحميل السيرفرات (قد يكون غيره أضاف أو حذف) ثم بدء المراقبة"""
+        self._load_existing_servers()
+        self.start_monitoring()
+
+    def _leader_snapshot(self) -> Optional[Dict]:
+        """
+        الحالة المنشورة من القائد، لعملية لا تشغل المراقبة بنفسها
+
+        الذاكرة المشتركة أولاً (قراءة 8 بايت إذا لم تتغير)، ثم cluster_snapshots إذا لم يكتبها أحد على هذا المضيف.
+        """
+        if self.is_monitoring:
+            return None
+        if self.shared_state is not None:
+            snapshot = self.shared_state.read()
+            if snapshot and time.time() - snapshot['_meta']['published_at'] <= self.config.shared_state_max_age_seconds:
+                return snapshot
+        return self.snapshots.latest() if self.snapshots is not None else None
+
+    def _sync_from_leader(self):
+        """تطبيق آخر حالة منشورة (السيرفرات والصحة والمقاييس) عند تغيرها"""
+        snapshot = self._leader_snapshot()
+        if not snapshot:
+            return
+        meta = snapshot['_meta']
+        version = (meta['source'], meta.get('seq', meta['generation']))
+        if version == self._snapshot_version:
+            return
+
+        servers = snapshot['servers']
+        for server_id in list(self.servers):
+            if server_id not in servers:
+                self.servers.pop(server_id, None)
+                self.server_addresses.pop(server_id, None)
+                self.metrics.pop(server_id, None)
+        for server_id, address in servers.items():
+            self.servers.setdefault(server_id, ServerConfig())
+            self.server_addresses[server_id] = address
+
+        self.health_status = {server_id: ServerStatus(status)
+                              for server_id, status in snapshot['health_status'].items()}
+        for server_id, values in snapshot['metrics'].items():
+            values = dict(values, last_updated=datetime.fromisoformat(values['last_updated']))
+            self.metrics[server_id] = ServerMetrics(**values)
+        self.last_health_sweep = snapshot.get('last_health_sweep', self.last_health_sweep)
+        self.last_rebalance = snapshot.get('last_rebalance', self.last_rebalance)
+        self.current_check_interval = snapshot.get('current_check_interval', self.current_check_interval)
+        self._snapshot_version = version
+
+    def _publish_snapshot(self):
+        """نشر حالة الجولة الأخيرة للعمليات الأخرى (بـ token القيادة)"""
+        if not self.leader.is_leader:
+            return
+        payload = {
+            'servers': dict(self.server_addresses),
+            'health_status': {server_id: status.value for server_id, status in self.health_status.items()},
+            'metrics': {server_id: {**metrics.__dict__, 'last_updated': metrics.last_updated.isoformat()}
+                        for server_id, metrics in self.metrics.items()},
+            'last_health_sweep': self.last_health_sweep,
+            'last_rebalance': self.last_rebalance,
+            'draining': {server_id: {'started_at': drain['started_at'], 'sites': drain['sites']}
+                         for server_id, drain in self.draining.items()},
+            'current_check_interval': self.current_check_interval,
+            'autoscaler': self.autoscaler.status(),
+            'stats': self.get_cluster_stats()
+        }
+        self.snapshots.publish(payload, self.leader.identity, self.leader.token)
+        self._published += 1
+        try:
+            self._write_shared_state(payload, self._published, self.leader.identity, self.leader.token)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر كتابة حالة الكلاستر في الذاكرة المشتركة: {e}")
+
+    def leadership_status(self) -> Dict:
+        """قائد المراقبة الحالي وعمر آخر حالة منشورة"""
+        snapshot = self._leader_snapshot()
+        return {
+            'electing': self._electing,
+            'monitoring_here': self.is_monitoring,
+            'elector': self.leader.status(),
+            'snapshot': snapshot['_meta'] if snapshot else None,
+            'shared_state': self.shared_state.status() if self.shared_state else None
+        }
+
+    def autoscaler_status(self) -> Dict:
+        """حالة التوسع التلقائي من القائد (المحرك يعمل في عملية القائد فقط)"""
+        snapshot = self._leader_snapshot()
+        if snapshot and snapshot.get('autoscaler'):
+            return snapshot['autoscaler']
+        return self.autoscaler.status()
+
+    def standby_status(self) -> Optional[Dict]:
+        """حالة السيرفرات الاحتياطية من القائد (الفحص وإعادة الملء في عملية القائد فقط)"""
+        snapshot = self._leader_snapshot()
+        if snapshot and snapshot.get('stats', {}).get('standby_pool'):
+            return snapshot['stats']['standby_pool']
+        return self.standby_pool.status() if self.standby_pool else None
+
+    def failover_status(self) -> Optional[Dict]:
+        """السيرفرات المتوقفة والمواقع المحوّلة وأزمنة التحويل من القائد"""
+        snapshot = self._leader_snapshot()
+        if snapshot and snapshot.get('stats', {}).get('failover'):
+            return snapshot['stats']['failover']
+        return self.failover.status() if self.failover else None
+
     def start_monitoring(self):
         """
         بدء مراقبة الكلاستر
+
+        كل حلقة لها حدث إيقاف خاص بها، فالحلقة القديمة التي لم تنته جولتها بعد stop_monitoring
+        (join محدود بـ 5 ثوان) لا تعود للعمل عند إعادة الانتخاب؛ والحلقة الجديدة لا تبدأ جولاتها
+        حتى تخرج القديمة، فلا تعمل حلقتان معاً.
         """
         if self.is_monitoring:
             logger.warning("المراقبة تعمل بالفعل")
             return
 
+        previous = self.monitoring_thread
+        stop_event = threading.Event()
+        self._stop_event = stop_event
         self.is_monitoring = True
-        self.monitoring_thread = threading.Thread(target=self._monitoring_loop, daemon=True)
+        self.monitoring_thread = threading.Thread(target=self._monitoring_loop, args=(stop_event, previous),
+                                                  name="cluster-monitor", daemon=True)
         self.monitoring_thread.start()
 
         logger.info("✅ بدء مراقبة الكلاستر")
@@ -623,113 +1393,272 @@ class ClusterManager:
         إيقاف مراقبة الكلاستر
         """
         self.is_monitoring = False
+        self._stop_event.set()
         if self.monitoring_thread:
             self.monitoring_thread.join(timeout=5)
+            if self.monitoring_thread.is_alive():
+                logger.warning("⚠️ حلقة المراقبة لم تنته بعد - تتوقف بعد جولتها الحالية")
         logger.info("🛑 تم إيقاف مراقبة الكلاستر")
 
-    def _monitoring_loop(self):
+    def _monitoring_loop(self, stop_event: threading.Event, previous: Optional[threading.Thread] = None):
         """
-        حلقة المراقبة الرئيسية
+        حلقة المراقبة الرئيسية (تعمل حتى يُضبط حدث إيقافها)
         """
+        while previous is not None and previous.is_alive():
+            logger.info("⏳ انتظار انتهاء حلقة المراقبة السابقة")
+            previous.join(timeout=5)
+            if stop_event.is_set():
+                return
+
+        self._restore_health_state()
+        if self.failover:
+            self.failover.reset()
         logger.info("🔄 بدء حلقة المراقبة")
 
-        while self.is_monitoring:
+        while not stop_event.is_set():
             try:
                 # فحص صحة جميع السيرفرات
                 self._check_all_servers_health()
 
-                # التحقق من الحاجة للتوسع
-                if self.should_scale_up():
-                    logger.info("⚠️ الكلاستر يحتاج إلى توسع")
-                    # في الإنتاج، سيتم تفعيل التوسع التلقائي
-                    # self.scale_up()
+                # الحلقة الموقوفة أو القائد الذي فقد القيادة أثناء الجولة لا ينشر ولا يتخذ قرار توسع
+                if stop_event.is_set() or (self._electing and not self.leader.is_leader):
+                    break
+
+                # تحويل مواقع السيرفرات المتوقفة (أو إعادتها) قبل نشر الحالة
+                if self.failover:
+                    self.failover.step()
+                self._track_rebalance_migrations()
+                self._track_draining()
+                self._track_launches()
+
+                self._persist_sweep()
+                self._publish_snapshot()
+
+                # التوسع التلقائي (dry_run افتراضياً: تسجيل القرار فقط)
+                self.autoscaler.step()
 
-                elif self.should_scale_down():
-                    logger.info("ℹ️ الكلاستر يمكن تقليله")
-                    # self.scale_down()
+                # فحص السيرفرات الاحتياطية وإعادة ملء المجموعة
+                if self.standby_pool:
+                    self.standby_pool.maintain()
 
-                # انتظار فترة الصحة
-                time.sleep(self.config.health_check_interval)
+                # انتظار فترة الصحة (أقصر أثناء الحوادث)
+                stop_event.wait(self.current_check_interval)
 
             except Exception as e:
                 logger.error(f"❌ خطأ في حلقة المراقبة: {e}")
-                time.sleep(10)  # انتظار أطول في حالة الخطأ
+                stop_event.wait(10)  # انتظار أطول في حالة الخطأ
 
     def _check_all_servers_health(self):
         """
-        فحص صحة جميع السيرفرات
+        فحص صحة جميع السيرفرات بالتوازي
+
+        1. فحص HTTP بمهلة الاتصال والقراءة، والجولة كاملة بمهلة واحدة: السيرفر الذي لا يرد قبلها
+           يُعتبر OFFLINE دون تأخير بقية السيرفرات. هذا وحده يحدد OFFLINE (ومنه قرار failover).
+        2. جمع مقاييس السيرفرات المستجيبة بمهلة منفصلة (metrics_collect_timeout). المقاييس التي
+           تصل بعدها تُهمل (تُكتب فقط من هذا الخيط)، والسيرفر الذي ما زال جمعه السابق يعمل لا يُجمع له
+           جديد حتى لا تتراكم الخيوط؛ حالته تُحدد بدون مقاييس هذه الجولة.
         """
-        for server_id in list(self.servers.keys()):
+        start_time = time.time()
+        self._sweep_started = datetime.now()
+        previous = dict(self.health_status)
+        server_ids = list(self.servers.keys())
+
+        probes = {self._health_executor.submit(self._probe_server, server_id): server_id
+                  for server_id in server_ids}
+        sweep_deadline = self.config.probe_connect_timeout + self.config.probe_read_timeout + 1
+        wait(probes, timeout=sweep_deadline)
+
+        timed_out = []
+        response_times: Dict[str, float] = {}
+        for future, server_id in probes.items():
+            if not future.done():
+                # لم يبدأ بعد -> إلغاء، أو ما زال ينتظر -> ينتهي بمهلة الطلب
+                future.cancel()
+                timed_out.append(server_id)
+                continue
             try:
-                status = self.check_server_health(server_id)
-                self.health_status[server_id] = status
-
-                if status == ServerStatus.CRITICAL or status == ServerStatus.OFFLINE:
-                    logger.warning(f"⚠️ سيرفر {server_id} في حالة: {status.value}")
-                elif status == ServerStatus.WARNING:
-                    logger.info(f"ℹ️ سيرفر {server_id} في حالة تحذير")
-
+                response_time = future.result()
             except Exception as e:
                 logger.error(f"❌ فشل فحص صحة {server_id}: {e}")
-                self.health_status[server_id] = ServerStatus.OFFLINE
+                response_time = None
+            if response_time is not None:
+                response_times[server_id] = response_time
+
+        collections = {}
+        for server_id in response_times:
+            running = self._metrics_inflight.get(server_id)
+            if running is not None and not running.done():
+                continue
+            try:
+                server = self._get_server_info(server_id)
+            except KeyError:
+                continue
+            future = self._health_executor.submit(self._get_server_metrics, server_id, server)
+            self._metrics_inflight[server_id] = future
+            collections[server_id] = future
+        wait(collections.values(), timeout=self.config.metrics_collect_timeout)
+
+        metrics_late = []
+        for server_id in server_ids:
+            if server_id not in response_times:
+                status = ServerStatus.OFFLINE
+            else:
+                future = collections.get(server_id)
+                if future is not None and future.done():
+                    metrics = future.result()
+                    self._metrics_inflight.pop(server_id, None)
+                else:
+                    if future is not None:
+                        future.cancel()
+                    metrics_late.append(server_id)
+                    metrics = {}
+                self._record_metrics(server_id, metrics, response_times[server_id])
+                status = self._classify_metrics(metrics)
+
+            self.health_status[server_id] = status
+
+            if status == ServerStatus.CRITICAL or status == ServerStatus.OFFLINE:
+                logger.warning(f"⚠️ سيرفر {server_id} في حالة: {status.value}")
+            elif status == ServerStatus.WARNING:
+                logger.info(f"ℹ️ سيرفر {server_id} في حالة تحذير")
+
+        if metrics_late:
+            logger.warning(f"⏱️ مقاييس {len(metrics_late)} سيرفر لم تُجمع في المهلة: {', '.join(metrics_late)}")
+
+        self.last_health_sweep = {
+            'checked': len(server_ids),
+            'timed_out': timed_out,
+            'metrics_late': metrics_late,
+            'duration_ms': round((time.time() - start_time) * 1000, 1),
+            'at': datetime.now().isoformat()
+        }
+        self._adapt_check_interval(previous)
 
-    def _get_server_info(self, server_id: str) -> Dict:
+    def _persist_sweep(self):
+        """حفظ نتيجة الجولة الأخيرة دفعة واحدة (المقاييس فقط للسيرفرات التي جُمعت مقاييسها في هذه الجولة)"""
+        if self.health_history is None or self._sweep_started is None:
+            return
+        results = []
+        for server_id, status in self.health_status.items():
+            address = self.server_addresses.get(server_id)
+            if server_id not in self.servers or address is None:
+                continue
+            metrics = self.metrics.get(server_id)
+            fresh = metrics is not None and metrics.last_updated >= self._sweep_started
+            results.append({
+                'server_id': server_id,
+                'ip': address['ip'],
+                'port': address['port'],
+                'status': status.value,
+                'metrics': {
+                    'cpu_percent': metrics.cpu_percent,
+                    'memory_percent': metrics.memory_percent,
+                    'disk_percent': metrics.disk_percent,
+                    'response_time_ms': metrics.response_time_ms,
+                    'connections': metrics.active_connections,
+                    'sites_count': metrics.sites_count,
+                    'pids': metrics.pids,
+                    'gunicorn_workers': metrics.gunicorn_workers,
+                    'background_workers': metrics.background_workers,
+                    'network_rx': metrics.network_rx_bytes,
+                    'network_tx': metrics.network_tx_bytes,
+                    'block_read': metrics.block_read_bytes,
+                    'block_write': metrics.block_write_bytes
+                } if fresh else None
+            })
+        self.health_history.record_sweep(results, self._sweep_started)
+
+    def _restore_health_state(self):
         """
-        الحصول على معلومات السيرفر
+        استعادة آخر حالة صحة وعينات النافذة الأخيرة من قاعدة البيانات قبل أول جولة
+
+        الحالة تُستعاد فقط إذا كان آخر فحص أحدث من ضعف health_check_interval، والعينات فقط لسيرفر
+        ليس له سلسلة في الذاكرة (قائد أعيد انتخابه يحتفظ بسلاسله).
         """
-        # في الإنتاج، سيتم تحميل هذه المعلومات من قاعدة البيانات
-        server_map = {
-            'app-server-1': {'ip': '172.22.0.20', 'port': 8000},
-            'app-server-2': {'ip': '172.22.0.21', 'port': 8001},
-        }
+        if self.health_history is None:
+            return
+        start = time.perf_counter()
+        try:
+            state = self.health_history.load_recent(self.config.health_restore_seconds)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر استعادة حالة الصحة المحفوظة: {e}")
+            return
 
-        if server_id in server_map:
-            return server_map[server_id]
+        restored_samples = 0
+        for server_id, samples in state['samples'].items():
+            if server_id not in self.servers or server_id in self.metrics_store.series:
+                continue
+            for timestamp, metrics in samples:
+                self.metrics_store.record(server_id, metrics, timestamp)
+            restored_samples += len(samples)
+
+        restored_status = 0
+        for server_id, row in state['servers'].items():
+            if server_id not in self.servers or server_id in self.health_status:
+                continue
+            if row['age_seconds'] is None or row['age_seconds'] > 2 * self.config.health_check_interval:
+                continue
+            try:
+                self.health_status[server_id] = ServerStatus(row['status'])
+                restored_status += 1
+            except ValueError:
+                pass
+
+        logger.info(f"✅ استعادة حالة {restored_status} سيرفر و {restored_samples} عينة "
+                    f"خلال {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _adapt_check_interval(self, previous: Dict[str, ServerStatus]):
+        """فحص أسرع أثناء الحوادث والعودة تدريجياً للفاصل العادي عند الاستقرار"""
+        incident = any(status != ServerStatus.HEALTHY for status in self.health_status.values())
+        changed = any(previous.get(server_id) != status for server_id, status in self.health_status.items())
+
+        if incident or changed:
+            self.current_check_interval = self.config.incident_check_interval
+        else:
+            self.current_check_interval = min(self.current_check_interval * 2, self.config.health_check_interval)
 
-        # Default info
-        return {'ip': '127.0.0.1', 'port': 8000}
+    def _get_server_info(self, server_id: str) -> Dict:
+        """
+        الحصول على معلومات السيرفر (من cluster_servers عند التحميل أو الإضافة)
+        """
+        info = self.server_addresses.get(server_id)
+        if info is None:
+            raise KeyError(f"عنوان السيرفر {server_id} غير معروف")
+        return info
 
     def _get_server_sites(self, server_id: str) -> List[str]:
         """
         الحصول على قائمة المواقع على سيرفر معين
         """
-        # في الإنتاج، يمكن استخدام قاعدة البيانات أو API للحصول على هذه المعلومات
-        # محاكاة بسيطة هنا
-        if server_id == 'app-server-1':
-            return [f"site{i}.trial.local" for i in range(1, 11)]  # أول 10 مواقع
-        elif server_id == 'app-server-2':
-            return [f"site{i}.trial.local" for i in range(11, 21)]  # 11-20
-        return []
+        return self.assignments.sites_of(server_id)
 
-    def _redistribute_sites(self, sites: List[str], target_servers: List[str]):
+    def _redistribute_sites(self, sites: List[str], target_servers: List[str], source_server: str) -> List[Future]:
         """
-        إعادة توزيع المواقع على السيرفرات المحددة
+        جدولة ترحيل مواقع سيرفر إلى السيرفرات المحددة دون انتظار (Futures)
         """
-        logger.info(f"🔄 إعادة توزيع {len(sites)} موقع على {len(target_servers)} سيرفر")
-
-        for site in sites:
-            # اختيار أقل سيرفر حملاً
-            target_server = min(target_servers, key=lambda s: len(self._get_server_sites(s)))
-
-            # تحديث تكوينات Nginx
-            try:
-                success_msg = f"تم نقل {site} إلى {target_server}"
-                logger.info(f"✓ {success_msg}")
-            except Exception as e:
-                logger.error(f"❌ فشل نقل {site}: {e}")
+        logger.info(f"🔄 ترحيل {len(sites)} موقع من {source_server} إلى {len(target_servers)} سيرفر")
+
+        tenant_costs = self._get_tenant_costs() if self.config.load_balance_algorithm == "weighted" else {}
+        plan = self._distribute_sites(sites, target_servers, tenant_costs)
+        moves = [
+            {'site': site, 'from': source_server, 'to': target_server}
+            for target_server, target_sites in plan.items()
+            for site in target_sites
+        ]
+        return self.migration_engine.submit_many(moves, guard=self._may_start_migration)
 
     def _get_all_active_sites(self) -> List[str]:
         """
         الحصول على جميع المواقع النشطة
         """
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = connect_mysql(self.db_config)
             cursor = conn.cursor()
 
             cursor.execute("""
                 SELECT DISTINCT site_name
                 FROM trial_customers
-                WHERE status = 'active' AND frappe_site_created = TRUE
+                WHERE status IN ('active', 'converted') AND frappe_site_created = TRUE
             """)
 
             sites = [row[0] for row in cursor.fetchall()]
@@ -743,27 +1672,50 @@ class ClusterManager:
             logger.error(f"❌ فشل جلب المواقع: {e}")
             return []
 
+    def _get_demand_signals(self) -> Dict:
+        """
+        إشارات الطلب للتوسع الاستباقي من قاعدة البيانات (مشتركة بين كل العمليات)
+
+        - signups_per_hour: التسجيلات في آخر ساعة
+        - provisioning_queue: عملاء محجوزون لم تُنشأ مواقعهم بعد (الإنشاء الجماعي)
+        """
+        conn = connect_mysql(self.db_config, connect_timeout=5)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(frappe_site_created = FALSE), 0)
+                FROM trial_customers
+                WHERE created_at >= DATE_SUB(NOW(), INTERVAL 1 HOUR)
+            """)
+            signups, pending = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return {'signups_per_hour': float(signups), 'provisioning_queue': int(pending)}
+
     def get_cluster_stats(self) -> Dict:
         """
         إحصائيات شاملة للكلاستر
         """
         try:
+            # عملية لا تشغل المراقبة تعرض إحصائيات القائد المنشورة
+            snapshot = self._leader_snapshot()
+            if snapshot and snapshot.get('stats', {}).get('success'):
+                return {**snapshot['stats'], 'snapshot': snapshot['_meta']}
+
             total_servers = len(self.servers)
             healthy_servers = len(self.get_healthy_servers())
 
-            # إحصائيات الموارد العامة
-            total_cpu = 0
-            total_memory = 0
-            total_sites = 0
+            # إحصائيات الموارد العامة (متوسط النافذة للسيرفرات الصحية)
+            healthy_ids = self.get_healthy_servers()
+            window = self.config.scale_window_seconds
+            store = self.metrics_store
+            avg_cpu = self._window_average('cpu_percent', healthy_ids) or 0
+            avg_memory = self._window_average('memory_percent', healthy_ids) or 0
+            total_sites = int(store.aggregate('sites_count', window, healthy_ids, stat='latest', reduce='sum') or 0)
 
-            for server_id, metrics in self.metrics.items():
-                if server_id in self.health_status and self.health_status[server_id] == ServerStatus.HEALTHY:
-                    total_cpu += metrics.cpu_percent
-                    total_memory += metrics.memory_percent
-                    total_sites += metrics.sites_count
-
-            avg_cpu = total_cpu / max(healthy_servers, 1)
-            avg_memory = total_memory / max(healthy_servers, 1)
+            def rounded(value, digits=1):
+                return None if value is None else round(value, digits)
 
             # إحصائيات العملاء
             customer_stats = self._get_customer_stats()
@@ -779,13 +1731,30 @@ class ClusterManager:
                     'total_sites': total_sites,
                     'health_ratio': round((healthy_servers / max(total_servers, 1)) * 100, 1)
                 },
+                'window': {
+                    'seconds': window,
+                    'cpu_p95': rounded(store.cluster_percentile('cpu_percent', window, healthy_ids)),
+                    'memory_p95': rounded(store.cluster_percentile('memory_percent', window, healthy_ids)),
+                    'response_time_p95_ms': rounded(store.cluster_percentile('response_time_ms', window, healthy_ids)),
+                    'network_rx_per_sec': rounded(store.aggregate('network_rx', window, healthy_ids, stat='rate', reduce='sum')),
+                    'network_tx_per_sec': rounded(store.aggregate('network_tx', window, healthy_ids, stat='rate', reduce='sum')),
+                    'servers': {server_id: store.summary(server_id, window) for server_id in self.servers}
+                },
                 'customer_stats': customer_stats,
                 'monitoring': {
                     'is_monitoring_active': self.is_monitoring,
                     'check_interval': self.config.health_check_interval,
+                    'current_check_interval': self.current_check_interval,
+                    'last_health_sweep': self.last_health_sweep,
                     'last_check': datetime.now().isoformat()
                 },
-                'load_balance_status': self._get_load_balance_status()
+                'load_balance_status': self._get_load_balance_status(),
+                'autoscaler': self.autoscaler.status(),
+                'leader': self.leader.status(),
+                'standby_pool': self.standby_pool.status() if self.standby_pool else None,
+                'failover': self.failover.status() if self.failover else None,
+                'breakers': breakers.status(),
+                'containers': self.container_launcher.status() if self.container_launcher else None
             }
 
         except Exception as e:
@@ -798,7 +1767,7 @@ class ClusterManager:
     def _get_customer_stats(self) -> Dict:
         """إحصائيات العملاء"""
         try:
-            conn = mysql.connector.connect(**self.db_config)
+            conn = connect_mysql(self.db_config)
             cursor = conn.cursor()
 
             # عدد العملاء النشطين
@@ -842,12 +1811,18 @@ class ClusterManager:
         """حالة موازنة الحمل"""
         distribution = {}
         total_sites = 0
+        assigned = self.assignments.counts()
 
         for server_id in self.servers.keys():
-            if server_id in self.metrics:
+            # جدول التوزيع إن وُجد، وإلا عدد المواقع المقاس داخل الحاوية
+            if assigned:
+                sites = assigned.get(server_id, 0)
+            elif server_id in self.metrics:
                 sites = self.metrics[server_id].sites_count
-                distribution[server_id] = sites
-                total_sites += sites
+            else:
+                continue
+            distribution[server_id] = sites
+            total_sites += sites
 
         if total_sites == 0:
             balance_ratio = 100
@@ -868,6 +1843,9 @@ class ClusterManager:
 
         return {
             'distribution': distribution,
+            'algorithm': self.config.load_balance_algorithm,
+            'assignments': self.assignments.status(),
+            'last_rebalance': self.last_rebalance,
             'balance_ratio': round(balance_ratio, 1),
             'recommendation': 'good' if balance_ratio >= 80 else ('fair' if balance_ratio >= 60 else 'poor')
         }
@@ -0,0 +1,799 @@
+"""
+محاكي الكلاستر بدون حاويات: تشغيل ClusterManager نفسه على أسطول وهمي بساعة افتراضية
+
+    python cluster_simulator.py run --servers 200 --sites 100000 --hours 24 --output base.json
+    python cluster_simulator.py run --algorithm weighted --trace load.jsonl --output weighted.json
+    python cluster_simulator.py trace --hours 24 --output load.jsonl      # حفظ trace للإعادة
+    python cluster_simulator.py bench --servers 500 --sites 100000        # زمن خوارزميات التوزيع فقط
+    python cluster_simulator.py compare base.json weighted.json           # مقارنة تقريرين
+
+كود التوزيع والتوسع هو كود الإنتاج (rebalance_sites، _distribute_sites، Autoscaler، scale_up/scale_down،
+remove_server)؛ المحاكاة تستبدل فقط ما يلمس العالم الخارجي: قاعدة البيانات (جدول التوزيع والحجوزات في الذاكرة)،
+الحاويات (جاهزة فوراً مع زمن جاهزية مسجل)، الترحيل (نقل فوري مع العد)، والمقاييس (من نموذج حمل).
+
+نموذج الحمل:
+- تكلفة كل موقع TenantCost عشوائية بـ seed (تجريبي خفيف، نسبة صغيرة من العملاء المحوّلين أثقل بكثير)
+- CPU السيرفر = مجموع ثواني CPU لمواقعه × حمل اللحظة من الـ trace ÷ سعة السيرفر، مع ضجيج
+- زمن الاستجابة = base ÷ (1 - الاستخدام) (طابور M/M/1)؛ السيرفر يخالف SLO إذا تجاوز slo_response_ms أو كان متوقفاً
+- الـ trace: حمل يومي (أدنى ليلاً وأعلى ظهراً) + قمم مفاجئة + تسجيلات جديدة + أعطال سيرفرات
+
+نفس الـ seed ونفس الـ trace = نفس القرارات ونفس digest للتوزيع النهائي، فالتقارير قابلة للمقارنة بين commits.
+أزمنة التنفيذ (runtime) فقط تعتمد على الجهاز.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Optional
+
+from address_allocator import AddressAllocator, Lease
+from assignment_store import SiteAssignmentStore
+from autoscaler import create_autoscaler, SCALE_UP, SCALE_DOWN
+from cluster_manager import ClusterManager, ServerMetrics, ServerStatus
+from container_lifecycle import LaunchResult
+from metrics_store import MetricsStore
+from migration import SiteMigration, summarize_migrations
+from nginx_manager import DEFAULT_SERVER_ID
+from placement import TenantCost, assignment_map, placement_moves, placement_utilization
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+# بداية الساعة الافتراضية (ثابتة حتى تتطابق التقارير)
+EPOCH = 1_700_000_000.0
+BASE_RESPONSE_MS = 80.0
+
+
+@dataclass
+class Scenario:
+    """إعدادات تشغيل محاكاة (كلها في التقرير)"""
+    seed: int = 1
+    servers: int = 200
+    sites: int = 100_000
+    hours: float = 24
+    tick_seconds: int = 60
+    algorithm: str = 'consistent_hash'
+    autoscale_mode: str = 'enabled'
+    # 0 = تلقائي من عدد السيرفرات والمواقع
+    min_servers: int = 0
+    max_servers: int = 0
+    target_sites_per_server: int = 0
+    converted_ratio: float = 0.03
+    signups_per_hour: float = 40
+    peak_load: float = 1.0
+    trough_load: float = 0.4
+    spikes_per_day: float = 2
+    failures_per_server_day: float = 0.02
+    outage_minutes: int = 10
+    rebalance_interval_minutes: int = 60
+    slo_response_ms: float = 400
+
+    def resolved(self) -> 'Scenario':
+        """ملء القيم التلقائية"""
+        values = asdict(self)
+        values['min_servers'] = self.min_servers or max(2, self.servers // 2)
+        values['max_servers'] = self.max_servers or self.servers * 2
+        values['target_sites_per_server'] = self.target_sites_per_server or \
+            math.ceil(self.sites / max(self.servers, 1) * 1.2)
+        return Scenario(**values)
+
+
+# --- الـ trace ---
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, int(round(rng.gauss(lam, math.sqrt(lam)))))
+    threshold, count, product = math.exp(-lam), 0, rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def generate_trace(scenario: Scenario) -> List[Dict]:
+    """
+    trace الحمل لكل tick: {t, load, signups, failures}
+
+    failures مواضع نسبية (0-1) في قائمة السيرفرات المرتبة وقت التشغيل، لأن أسماء السيرفرات
+    تتغير مع التوسع.
+    """
+    rng = random.Random(f"trace-{scenario.seed}")
+    ticks = int(scenario.hours * 3600 / scenario.tick_seconds)
+    ticks_per_day = 86400 / scenario.tick_seconds
+
+    spikes = []
+    for _ in range(_poisson(rng, scenario.spikes_per_day * scenario.hours / 24)):
+        spikes.append((rng.randrange(max(ticks, 1)), rng.randint(5, 30) * 60 // scenario.tick_seconds or 1,
+                       rng.uniform(0.3, 0.8)))
+
+    trace = []
+    for t in range(ticks):
+        phase = (t % ticks_per_day) / ticks_per_day
+        load = scenario.trough_load + (scenario.peak_load - scenario.trough_load) * 0.5 * (1 - math.cos(2 * math.pi * phase))
+        load *= 1 + sum(magnitude for start, length, magnitude in spikes if start <= t < start + length)
+        expected_failures = scenario.failures_per_server_day * scenario.servers * scenario.tick_seconds / 86400
+        trace.append({
+            't': t,
+            'load': round(load, 4),
+            'signups': _poisson(rng, scenario.signups_per_hour * scenario.tick_seconds / 3600 * load / scenario.peak_load),
+            'failures': [round(rng.random(), 6) for _ in range(_poisson(rng, expected_failures))]
+        })
+    return trace
+
+
+def save_trace(path: str, scenario: Scenario, trace: List[Dict]):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'scenario': asdict(scenario)}) + '\n')
+        for row in trace:
+            f.write(json.dumps(row) + '\n')
+
+
+def load_trace(path: str) -> List[Dict]:
+    """قراءة trace (السطر الأول رأس بإعدادات التوليد)"""
+    with open(path, encoding='utf-8') as f:
+        return [row for row in map(json.loads, f) if 't' in row]
+
+
+def site_name(index: int) -> str:
+    return f"sim{index:06d}.trial.local"
+
+
+def sample_cost(rng: random.Random, converted_ratio: float) -> TenantCost:
+    """تكلفة موقع: توزيع lognormal حول متوسط الفئة"""
+    factor = rng.lognormvariate(0, 0.8) / math.exp(0.32)
+    if rng.random() < converted_ratio:
+        return TenantCost(requests_per_min=12 * factor, cpu_seconds_per_min=0.8 * factor,
+                          db_bytes=400 * 1024 ** 2 * factor, worker_memory_bytes=24 * 1024 ** 2 * factor)
+    return TenantCost(requests_per_min=0.5 * factor, cpu_seconds_per_min=0.04 * factor,
+                      db_bytes=25 * 1024 ** 2 * factor, worker_memory_bytes=2 * 1024 ** 2 * factor)
+
+
+# --- بدائل المكونات الخارجية ---
+
+class InMemoryAssignmentStore(SiteAssignmentStore):
+    """site_assignments بدون قاعدة بيانات (نفس الفهرس في الذاكرة)"""
+
+    def __init__(self, on_change=None):
+        super().__init__(db_config={}, refresh_interval=float('inf'))
+        self._generation = 0
+        # on_change(site, السيرفر السابق، السيرفر الجديد) لتحديث أحمال السيرفرات تدريجياً
+        self.on_change = on_change
+
+    def _index(self, site: str, server_id: str, version: int):
+        previous = self._site_to_server.get(site)
+        super()._index(site, server_id, version)
+        if self.on_change and previous != server_id:
+            self.on_change(site, previous, server_id)
+
+    def _unindex(self, site: str):
+        previous = self._site_to_server.get(site)
+        super()._unindex(site)
+        if self.on_change and previous is not None:
+            self.on_change(site, previous, None)
+
+    def reload(self) -> bool:
+        return True
+
+    def _refresh_if_stale(self):
+        pass
+
+    def assign(self, site: str, server_id: str, expected_version: Optional[int] = None) -> bool:
+        with self._lock:
+            if expected_version is not None and self._versions.get(site) != expected_version:
+                return False
+            if self._site_to_server.get(site) != server_id:
+                self._index(site, server_id, self._versions.get(site, 0) + 1)
+                self._generation += 1
+        return True
+
+    def assign_many(self, assignments: Dict[str, str], removed=()) -> bool:
+        with self._lock:
+            for site, server_id in assignments.items():
+                if self._site_to_server.get(site) != server_id:
+                    self._index(site, server_id, self._versions.get(site, 0) + 1)
+            for site in removed:
+                self._unindex(site)
+            self._generation += 1
+        return True
+
+
+class SimulatedAllocator(AddressAllocator):
+    """cluster_leases في الذاكرة (نفس اختيار أول قيمة متاحة)"""
+
+    def __init__(self, config):
+        super().__init__({}, config.ip_pool_start, config.ip_pool_end,
+                         config.port_pool_start, config.port_pool_end)
+        self.leases: Dict[str, Dict[str, str]] = {}
+
+    def _used(self, cursor=None) -> Dict[str, set]:
+        used = {'name': set(), 'ip': set(), 'port': set()}
+        for server_id, lease in self.leases.items():
+            used['name'].add(server_id)
+            used['ip'].add(lease['ip'])
+            used['port'].add(lease['port'])
+        return used
+
+    def lease(self) -> Lease:
+        used = self._used()
+        server_id = self._first_free('name', used['name'])
+        ip = self._first_free('ip', used['ip'])
+        port = self._first_free('port', used['port'])
+        self.leases[server_id] = {'ip': ip, 'port': port}
+        return Lease(server_id=server_id, ip=ip, port=int(port))
+
+    def adopt(self, server_id: str, ip: str, port: int):
+        self.leases[server_id] = {'ip': ip, 'port': str(port)}
+
+    def release(self, server_id: str) -> int:
+        return 1 if self.leases.pop(server_id, None) else 0
+
+
+class SimulatedLauncher:
+    """حاويات جاهزة في نفس الـ tick؛ زمن الجاهزية عشوائي بـ seed ويُسجل فقط"""
+
+    backend = 'simulated'
+
+    def __init__(self, seed: int, ready_seconds=(40.0, 120.0)):
+        self.rng = random.Random(f"launch-{seed}")
+        self.ready_seconds = ready_seconds
+        self.launches: List[LaunchResult] = []
+        self.removed = 0
+
+    def launch(self, spec) -> LaunchResult:
+        ready_ms = round(self.rng.uniform(*self.ready_seconds) * 1000, 1)
+        result = LaunchResult(server_id=spec.server_id, success=True, message='simulated',
+                              time_to_ready_ms=ready_ms, stages_ms={'ready': ready_ms}, started_at=0.0)
+        self.launches.append(result)
+        return result
+
+    def launch_many(self, specs) -> List[LaunchResult]:
+        return [self.launch(spec) for spec in specs]
+
+    def remove(self, container: str, stop_timeout: int = 10) -> bool:
+        self.removed += 1
+        return True
+
+    def status(self) -> Dict:
+        return {'backend': self.backend, 'launches': len(self.launches), 'removed': self.removed}
+
+
+class SimulatedMigrationEngine:
+    """ترحيل فوري ناجح مع عد المواقع المنقولة (التعيين يُحفظ كما في مرحلة assign)"""
+
+    def __init__(self, cluster_manager):
+        self.cluster_manager = cluster_manager
+        self.total = 0
+        self.batches: List[int] = []
+
+    def submit_many(self, moves: List[Dict], guard=None) -> List[Future]:
+        self.total += len(moves)
+        self.batches.append(len(moves))
+        self.cluster_manager.assignments.assign_many({move['site']: move['to'] for move in moves})
+        futures = []
+        for move in moves:
+            future = Future()
+            future.set_result(SiteMigration(site=move['site'], source=move['from'], target=move['to'],
+                                            status='completed'))
+            futures.append(future)
+        return futures
+
+    def migrate_many(self, moves: List[Dict]) -> Dict:
+        return summarize_migrations([future.result() for future in self.submit_many(moves)])
+
+    def active_sites(self) -> List[str]:
+        return []
+
+    def status(self) -> Dict:
+        return {'strategy': 'simulated', 'total': self.total, 'batches': len(self.batches)}
+
+
+class SimulatedCluster(ClusterManager):
+    """ClusterManager على أسطول وهمي - كل منطق التوزيع والتوسع من الكلاس الأصلي"""
+
+    def __init__(self, scenario: Scenario, costs: Dict[str, TenantCost]):
+        self.scenario = scenario
+        self.site_costs = costs
+        self.now = EPOCH
+        self.outages: Dict[str, float] = {}
+        self.placement_runtimes_ms: List[float] = []
+        self.rebalances: List[Dict] = []
+        self.signups: List[tuple] = []
+        # [ثواني CPU/دقيقة، طلبات/دقيقة، ذاكرة، قاعدة بيانات، عدد المواقع] لكل سيرفر
+        self.loads: Dict[str, List[float]] = {}
+        self.current_samples: Dict[str, Dict] = {}
+        self.noise = random.Random(f"noise-{scenario.seed}")
+        super().__init__(auto_start_monitoring=False)
+
+        config = self.config
+        config.load_balance_algorithm = scenario.algorithm
+        config.min_servers = scenario.min_servers
+        config.max_servers = scenario.max_servers
+        config.target_sites_per_server = scenario.target_sites_per_server
+        config.ip_pool_end = '172.22.255.254'
+        config.port_pool_end = 8000 + scenario.max_servers + 100
+
+        self.metrics_collector = None
+        self.metrics_store = MetricsStore(retention_seconds=max(2 * config.scale_window_seconds, 3600),
+                                          resolution=scenario.tick_seconds)
+        self.assignments = InMemoryAssignmentStore(on_change=self._move_load)
+        self.address_allocator = SimulatedAllocator(config)
+        self.container_launcher = SimulatedLauncher(scenario.seed)
+        self.migration_engine = SimulatedMigrationEngine(self)
+        self.autoscaler = create_autoscaler(self, signal_provider=self._get_demand_signals)
+        self.autoscaler.mode = scenario.autoscale_mode
+        # المحاكاة عملية واحدة بدون قائد منشور
+        self.snapshots = None
+        self.shared_state = None
+        self.health_history = None
+        self.standby_pool = None
+        self.failover = None
+
+    # --- مصادر البيانات ---
+
+    def _load_existing_servers(self):
+        pass
+
+    def _save_server_to_db(self, server_id: str, ip: str, port: int, active: bool = True, role: str = 'active'):
+        pass
+
+    def _update_server_in_db(self, server_id: str, active: bool):
+        pass
+
+    def _update_server_sites(self, server_id: str, sites: List[str]) -> bool:
+        return True
+
+    def _get_all_active_sites(self) -> List[str]:
+        return list(self.site_costs)
+
+    def _launch_servers(self, servers: List[Dict]) -> Future:
+        # الإطلاق الوهمي فوري - بدون thread حتى تبقى المحاكاة حتمية
+        future = Future()
+        future.set_result(self.container_launcher.launch_many([self._container_spec(server) for server in servers]))
+        return future
+
+    def _get_tenant_costs(self) -> Dict[str, TenantCost]:
+        return self.site_costs
+
+    def _get_demand_signals(self) -> Dict:
+        since = self.now - 3600
+        return {'signups_per_hour': float(sum(count for at, count in self.signups if at >= since)),
+                'provisioning_queue': 0}
+
+    def _distribute_sites(self, sites, servers, tenant_costs=None, current=None):
+        start = time.perf_counter()
+        distribution = super()._distribute_sites(sites, servers, tenant_costs, current=current)
+        self.placement_runtimes_ms.append((time.perf_counter() - start) * 1000)
+        return distribution
+
+    def rebalance_sites(self) -> Dict:
+        result = super().rebalance_sites()
+        if result.get('success'):
+            self.rebalances.append({
+                'at': self.now,
+                'moved': result['moves']['moved'],
+                'moved_percent': result['moves']['moved_percent'],
+                'balance_ratio': self.balance_ratio()
+            })
+        return result
+
+    # --- نموذج الحمل ---
+
+    def _move_load(self, site: str, previous: Optional[str], server_id: Optional[str]):
+        cost = self.site_costs.get(site)
+        if cost is None:
+            return
+        vector = (cost.cpu_seconds_per_min, cost.requests_per_min, cost.worker_memory_bytes, cost.db_bytes, 1)
+        for target, sign in ((previous, -1), (server_id, 1)):
+            if target is not None:
+                load = self.loads.setdefault(target, [0.0, 0.0, 0.0, 0.0, 0])
+                for index, value in enumerate(vector):
+                    load[index] += sign * value
+
+    def balance_ratio(self) -> Optional[float]:
+        """
+        أعلى حمل ÷ متوسط الحمل على السيرفرات الحالية؛ 1.0 = توازن تام
+
+        حمل السيرفر = بُعد عنق الزجاجة كما في placement_utilization.
+        """
+        capacity = self._server_capacity()
+        limits = (capacity.cpu_seconds_per_min, capacity.requests_per_min, capacity.worker_memory_bytes,
+                  capacity.db_bytes)
+        peaks = [max(value / limit for value, limit in zip(self.loads.get(server_id, (0.0,) * 4), limits))
+                 for server_id in self.servers]
+        mean = sum(peaks) / len(peaks) if peaks else 0
+        return round(max(peaks) / mean, 3) if mean else None
+
+    def sample(self, server_id: str, load_factor: float) -> Dict:
+        """عينة مقاييس السيرفر في اللحظة الحالية"""
+        capacity = self._server_capacity()
+        cpu_seconds, requests, memory, db, sites = self.loads.get(server_id, (0.0, 0.0, 0.0, 0.0, 0))
+        cpu = max(0.0, cpu_seconds * load_factor / capacity.cpu_seconds_per_min * 100 + self.noise.gauss(0, 2.0))
+        utilization = min(cpu / 100, 0.98)
+        return {
+            'cpu_percent': round(min(cpu, 100.0), 2),
+            'memory_percent': round(min(100.0, 20 + memory / capacity.worker_memory_bytes * 60 * (0.5 + load_factor / 2)), 2),
+            'disk_percent': round(min(100.0, db / capacity.db_bytes * 100), 2),
+            'response_time_ms': round(BASE_RESPONSE_MS / (1 - utilization), 1),
+            'connections': int(requests * load_factor / 60),
+            'sites_count': sites,
+            'demand_percent': cpu
+        }
+
+    def check_server_health(self, server_id: str) -> ServerStatus:
+        """نفس عتبات الفحص الحقيقي على عينة النموذج"""
+        if server_id not in self.servers or self.outages.get(server_id, 0) > self.now:
+            return ServerStatus.OFFLINE
+        metrics = self.current_samples[server_id]
+        self.metrics_store.record(server_id, metrics, timestamp=self.now)
+        self.metrics[server_id] = ServerMetrics(
+            server_id=server_id, cpu_percent=metrics['cpu_percent'], memory_percent=metrics['memory_percent'],
+            disk_percent=metrics['disk_percent'], network_rx_bytes=0, network_tx_bytes=0,
+            active_connections=metrics['connections'], sites_count=metrics['sites_count'],
+            response_time_ms=metrics['response_time_ms'], uptime_seconds=0, last_updated=None
+        )
+        if metrics['cpu_percent'] > 90 or metrics['memory_percent'] > 90:
+            return ServerStatus.CRITICAL
+        if metrics['cpu_percent'] > 75 or metrics['memory_percent'] > 75:
+            return ServerStatus.WARNING
+        return ServerStatus.HEALTHY
+
+
+def placement_balance(distribution: Dict[str, List[str]], costs: Dict[str, TenantCost], capacity) -> Optional[float]:
+    """أعلى حمل ÷ متوسط الحمل لتوزيع (حمل السيرفر = بُعد عنق الزجاجة)؛ 1.0 = توازن تام"""
+    utilization = placement_utilization(distribution, costs, capacity)
+    peaks = [max(usage.values()) for usage in utilization.values()]
+    mean = sum(peaks) / len(peaks) if peaks else 0
+    return round(max(peaks) / mean, 3) if mean else None
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1))]
+
+
+def _summary(values: List[float], digits: int = 3) -> Dict:
+    if not values:
+        return {'mean': None, 'p95': None, 'max': None}
+    return {'mean': round(sum(values) / len(values), digits), 'p95': round(_percentile(values, 95), digits),
+            'max': round(max(values), digits)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# --- التشغيل ---
+
+class Simulator:
+    """حلقة المحاكاة: trace -> مقاييس -> فحص الصحة -> التوسع -> إعادة التوزيع"""
+
+    def __init__(self, scenario: Scenario, trace: Optional[List[Dict]] = None, timeline_path: Optional[str] = None):
+        self.scenario = scenario.resolved()
+        self.trace = trace if trace is not None else generate_trace(self.scenario)
+        self.timeline_path = timeline_path
+
+        rng = random.Random(f"sites-{self.scenario.seed}")
+        self.cost_rng = rng
+        costs = {site_name(i): sample_cost(rng, self.scenario.converted_ratio) for i in range(self.scenario.sites)}
+        self.next_site = self.scenario.sites
+        self.cluster = SimulatedCluster(self.scenario, costs)
+
+    def _seed_fleet(self):
+        """الأسطول الابتدائي موزعاً بالخوارزمية المختارة (بدون احتسابه كترحيلات)"""
+        cluster = self.cluster
+        for _ in range(self.scenario.servers):
+            lease = cluster.address_allocator.lease()
+            cluster.add_server({'server_id': lease.server_id, 'ip': lease.ip, 'port': lease.port,
+                                'leased': True, 'ready': True}, rebalance=False)
+        servers = cluster.get_healthy_servers()
+        tenant_costs = cluster.site_costs if cluster.config.load_balance_algorithm == 'weighted' else {}
+        cluster.assignments.assign_many(assignment_map(
+            cluster._distribute_sites(list(cluster.site_costs), servers, tenant_costs)))
+
+    def _signups(self, count: int):
+        """المواقع الجديدة تُنشأ على السيرفر الافتراضي كما في TrialManager"""
+        cluster = self.cluster
+        if not count:
+            return
+        target = DEFAULT_SERVER_ID if DEFAULT_SERVER_ID in cluster.servers else min(cluster.servers)
+        new_sites = {}
+        for _ in range(count):
+            name = site_name(self.next_site)
+            self.next_site += 1
+            cluster.site_costs[name] = sample_cost(self.cost_rng, self.scenario.converted_ratio)
+            new_sites[name] = target
+        cluster.assignments.assign_many(new_sites)
+        cluster.signups.append((cluster.now, count))
+
+    def run(self) -> Dict:
+        scenario = self.scenario
+        cluster = self.cluster
+        wall_start = time.perf_counter()
+        self._seed_fleet()
+        seed_runtime_ms = cluster.placement_runtimes_ms[:]
+        cluster.placement_runtimes_ms.clear()
+
+        tick_minutes = scenario.tick_seconds / 60
+        rebalance_every = max(1, int(scenario.rebalance_interval_minutes * 60 / scenario.tick_seconds))
+        violating_ticks = 0
+        server_ticks = 0
+        site_minutes_violated = 0.0
+        site_minutes = 0.0
+        load_ratios = []
+        server_counts = []
+        autoscaler_runtimes = []
+        decisions = {SCALE_UP: 0, SCALE_DOWN: 0}
+        executed = {SCALE_UP: 0, SCALE_DOWN: 0}
+        timeline = open(self.timeline_path, 'w', encoding='utf-8') if self.timeline_path else None
+
+        try:
+            for row in self.trace:
+                cluster.now = EPOCH + row['t'] * scenario.tick_seconds
+                self._signups(row.get('signups', 0))
+
+                servers = sorted(cluster.servers)
+                for position in row.get('failures', []):
+                    if servers:
+                        victim = servers[min(int(position * len(servers)), len(servers) - 1)]
+                        cluster.outages[victim] = cluster.now + scenario.outage_minutes * 60
+
+                cluster.current_samples = {server_id: cluster.sample(server_id, row['load']) for server_id in servers}
+                for server_id in servers:
+                    cluster.health_status[server_id] = cluster.check_server_health(server_id)
+
+                # SLO: السيرفر المتوقف أو البطيء يخالف لكل مواقعه، والمواقع على سيرفر غير موجود غير متاحة
+                violating = 0
+                for server_id in servers:
+                    sites = cluster.loads.get(server_id, (0, 0, 0, 0, 0))[4]
+                    bad = (cluster.health_status[server_id] == ServerStatus.OFFLINE or
+                           cluster.current_samples[server_id]['response_time_ms'] > scenario.slo_response_ms)
+                    if bad:
+                        violating += 1
+                        site_minutes_violated += sites * tick_minutes
+                orphaned = sum(load[4] for server_id, load in cluster.loads.items() if server_id not in cluster.servers)
+                site_minutes_violated += orphaned * tick_minutes
+                site_minutes += len(cluster.assignments._site_to_server) * tick_minutes
+                violating_ticks += violating
+                server_ticks += len(servers)
+
+                online = [cluster.current_samples[s]['demand_percent'] for s in servers
+                          if cluster.health_status[s] != ServerStatus.OFFLINE]
+                if online and sum(online) > 0:
+                    load_ratios.append(max(online) / (sum(online) / len(online)))
+
+                step_start = time.perf_counter()
+                decision = cluster.autoscaler.step(now=cluster.now)
+                autoscaler_runtimes.append((time.perf_counter() - step_start) * 1000)
+                if decision and decision.action:
+                    decisions[decision.action] += 1
+                    executed[decision.action] += int(decision.executed)
+
+                if (row['t'] + 1) % rebalance_every == 0:
+                    cluster.rebalance_sites()
+                server_counts.append(len(cluster.servers))
+
+                if timeline:
+                    timeline.write(json.dumps({
+                        't': row['t'], 'load': row['load'], 'servers': len(cluster.servers),
+                        'healthy': len(cluster.get_healthy_servers()), 'sites': len(cluster.site_costs),
+                        'max_cpu': max((cluster.current_samples[s]['cpu_percent'] for s in servers), default=None),
+                        'violating_servers': violating, 'orphaned_sites': orphaned,
+                        'decision': decision.action if decision else None
+                    }) + '\n')
+        finally:
+            if timeline:
+                timeline.close()
+
+        snapshot = cluster.assignments.snapshot()
+        digest = hashlib.sha256(json.dumps(
+            [sorted(cluster.servers), sorted(snapshot.items())], separators=(',', ':')
+        ).encode()).hexdigest()[:16]
+        rebalances = cluster.rebalances
+        return {
+            'report_version': REPORT_VERSION,
+            'commit': git_commit(),
+            'scenario': asdict(scenario),
+            'results': {
+                'ticks': len(self.trace),
+                'sites_final': len(cluster.site_costs),
+                'placement': {
+                    'calls': len(cluster.placement_runtimes_ms),
+                    'runtime_ms': _summary(cluster.placement_runtimes_ms, 1),
+                    'initial_runtime_ms': round(seed_runtime_ms[0], 1) if seed_runtime_ms else None,
+                    'balance_ratio': _summary([r['balance_ratio'] for r in rebalances if r['balance_ratio']]),
+                    'final_balance_ratio': cluster.balance_ratio()
+                },
+                'load_balance_ratio': _summary(load_ratios),
+                'migrations': {
+                    'total': cluster.migration_engine.total,
+                    'rebalances': len(rebalances),
+                    'max_per_rebalance': max((r['moved'] for r in rebalances), default=0),
+                    'moved_percent': _summary([r['moved_percent'] for r in rebalances], 2)
+                },
+                'scaling': {
+                    'runtime_ms': _summary(autoscaler_runtimes, 2),
+                    'decisions': decisions,
+                    'executed': executed,
+                    'servers': {'min': min(server_counts, default=0), 'max': max(server_counts, default=0),
+                                'final': len(cluster.servers)},
+                    'server_hours': round(sum(server_counts) * scenario.tick_seconds / 3600, 1)
+                },
+                'slo': {
+                    'violating_server_ticks': violating_ticks,
+                    'violating_server_percent': round(100 * violating_ticks / server_ticks, 3) if server_ticks else 0.0,
+                    'site_minutes_violated': round(site_minutes_violated, 1),
+                    'site_minutes_violated_percent': round(100 * site_minutes_violated / site_minutes, 4)
+                    if site_minutes else 0.0
+                },
+                'digest': digest
+            },
+            'wall_seconds': round(time.perf_counter() - wall_start, 2)
+        }
+
+
+def benchmark(scenario: Scenario, algorithms: List[str], repeat: int = 3) -> Dict:
+    """
+    زمن التوزيع والتوازن ونسبة النقل عند إضافة أو إزالة سيرفر لكل خوارزمية
+
+    نسبة النقل عند الإزالة تحسب المواقع التي لم تكن على السيرفر المُزال فقط (المثالي 0).
+    """
+    scenario = scenario.resolved()
+    rng = random.Random(f"sites-{scenario.seed}")
+    costs = {site_name(i): sample_cost(rng, scenario.converted_ratio) for i in range(scenario.sites)}
+    cluster = SimulatedCluster(scenario, costs)
+    sites = list(costs)
+    servers = [f"app-server-{i + 1}" for i in range(scenario.servers)]
+    capacity = cluster._server_capacity()
+
+    results = {}
+    for algorithm in algorithms:
+        cluster.config.load_balance_algorithm = algorithm
+        cluster.placement_runtimes_ms.clear()
+        tenant_costs = costs if algorithm == 'weighted' else {}
+        for _ in range(repeat):
+            distribution = cluster._distribute_sites(sites, servers, tenant_costs)
+        runtimes = sorted(cluster.placement_runtimes_ms)
+        # إضافة أو إزالة سيرفر تبدأ من التوزيع الحالي كما في rebalance_sites
+        current = assignment_map(distribution)
+        added = cluster._distribute_sites(sites, servers + [f"app-server-{len(servers) + 1}"], tenant_costs,
+                                          current=current)
+        removed = cluster._distribute_sites(sites, servers[:-1], tenant_costs, current=current)
+        counts = [len(s) for s in distribution.values()]
+        results[algorithm] = {
+            'runtime_ms': {'min': round(runtimes[0], 1), 'median': round(runtimes[len(runtimes) // 2], 1)},
+            'balance_ratio': placement_balance(distribution, costs, capacity),
+            'site_count_ratio': round(max(counts) / (sum(counts) / len(counts)), 3),
+            'add_server_moved_percent': placement_moves(assignment_map(distribution), added)['moved_percent'],
+            'remove_server_moved_percent': placement_moves(
+                {site: server for site, server in assignment_map(distribution).items() if server != servers[-1]},
+                removed)['moved_percent']
+        }
+    return {
+        'report_version': REPORT_VERSION,
+        'commit': git_commit(),
+        'scenario': {'seed': scenario.seed, 'servers': scenario.servers, 'sites': scenario.sites,
+                     'converted_ratio': scenario.converted_ratio, 'repeat': repeat},
+        'results': results
+    }
+
+
+def _flatten(value, prefix: str = '') -> Dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(base: Dict, new: Dict) -> List[Dict]:
+    """فرق كل قيمة رقمية في results بين تقريرين"""
+    old_values, new_values = _flatten(base.get('results', {})), _flatten(new.get('results', {}))
+    rows = []
+    for key in sorted(set(old_values) | set(new_values)):
+        a, b = old_values.get(key), new_values.get(key)
+        change = None
+        if a is not None and b is not None and a != 0:
+            change = round(100 * (b - a) / abs(a), 1)
+        rows.append({'metric': key, 'base': a, 'new': b, 'change_percent': change,
+                     'machine_dependent': 'runtime' in key})
+    return rows
+
+
+def _scenario_from_args(args) -> Scenario:
+    values = {f.name: getattr(args, f.name) for f in fields(Scenario) if getattr(args, f.name, None) is not None}
+    return Scenario(**values)
+
+
+def _add_scenario_args(parser):
+    for f in fields(Scenario):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", dest=f.name, type=f.type, default=None)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="محاكي الكلاستر وقياس خوارزميات التوزيع والتوسع")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='تشغيل محاكاة كاملة')
+    _add_scenario_args(run)
+    run.add_argument('--trace', help='إعادة trace محفوظ')
+    run.add_argument('--timeline', help='حفظ حالة كل tick (JSONL)')
+    run.add_argument('--output', help='حفظ التقرير (JSON)')
+
+    trace = sub.add_parser('trace', help='توليد trace وحفظه')
+    _add_scenario_args(trace)
+    trace.add_argument('--output', required=True)
+
+    bench = sub.add_parser('bench', help='زمن وجودة خوارزميات التوزيع فقط')
+    _add_scenario_args(bench)
+    bench.add_argument('--algorithms', default='consistent_hash,weighted,round_robin')
+    bench.add_argument('--repeat', type=int, default=3)
+    bench.add_argument('--output')
+
+    diff = sub.add_parser('compare', help='مقارنة تقريرين')
+    diff.add_argument('base')
+    diff.add_argument('new')
+
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        # سجلات إعادة التوزيع والتوسع لكل tick تغطي على النتيجة
+        for name in ('cluster_manager', 'autoscaler', 'placement'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    if args.command == 'compare':
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+        print(f"base {base.get('commit')}  ->  new {new.get('commit')}")
+        if base.get('scenario') != new.get('scenario'):
+            print("⚠️ السيناريو مختلف بين التقريرين")
+        print(f"{'metric':<52} {'base':>14} {'new':>14} {'change':>9}")
+        for row in compare(base, new):
+            change = '' if row['change_percent'] is None else f"{row['change_percent']:+.1f}%"
+            marker = ' ~' if row['machine_dependent'] else ''
+            print(f"{row['metric']:<52} {str(row['base']):>14} {str(row['new']):>14} {change:>9}{marker}")
+        return 0
+
+    scenario = _scenario_from_args(args)
+    if args.command == 'trace':
+        save_trace(args.output, scenario.resolved(), generate_trace(scenario.resolved()))
+        print(f"✅ تم حفظ trace في {args.output}")
+        return 0
+
+    if args.command == 'bench':
+        report = benchmark(scenario, [a.strip() for a in args.algorithms.split(',') if a.strip()], args.repeat)
+    else:
+        report = Simulator(scenario, load_trace(args.trace) if args.trace else None, args.timeline).run()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
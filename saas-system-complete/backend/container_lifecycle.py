@@ -0,0 +1,335 @@
+"""
+دورة حياة حاويات سيرفرات التطبيق عبر Docker Engine API (unix socket)
+
+الإطلاق لكل سيرفر:
+1. create - حاوية باسم server_id على frappe-cluster-net بعنوان IP ثابت وحدود الذاكرة و CPU،
+            الأمر gunicorn من بيئة bench (وليس حاوية خاملة)؛ الصورة تُسحب إذا لم تكن موجودة.
+            الصورة و bench من سيرفر تطبيق قائم (bench_template): apps و env للقراءة فقط، و sites/ خاص
+            بكل سيرفر (volume يُحذف مع الحاوية) يُهيأ من إعدادات sites المرجعي والمواقع تصله بالترحيل
+2. start
+3. ready  - انتظار فحص الجاهزية: الحاوية تعمل و /api/method/version يجيب 200 (نفس فحص الصحة)
+            حتى ready_timeout ثانية؛ خروج الحاوية يُنهي الانتظار فوراً مع آخر سطور السجل
+
+السيرفر لا يدخل مجموعة التوزيع إلا بعد الجاهزية؛ الحاوية التي لم تجهز تُحذف.
+زمن كل مرحلة و time_to_ready_ms يُسجل لكل إطلاق ويظهر في status().
+عدة سيرفرات تُطلق بالتوازي بـ launch_many.
+
+CONTAINER_BACKEND=fake يشغل fake_docker.FakeDockerEngine داخل العملية للتجربة بدون Docker.
+"""
+
+import logging
+import os
+import shlex
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import requests
+
+from metrics_collector import BENCH_PATH
+from tracing import tracer, with_current_context
+
+logger = logging.getLogger(__name__)
+
+SERVER_LABEL = 'frappe.cluster.server'
+# sites السيرفر المرجعي (للقراءة فقط) داخل الحاوية الجديدة
+SITES_TEMPLATE_PATH = '/home/frappe/sites-template'
+# ملفات sites المشتركة التي يحتاجها gunicorn (مجلدات المواقع لا تُنسخ)
+SITES_SEED_FILES = ('apps.txt', 'apps.json', 'common_site_config.json', 'assets')
+
+
+def gunicorn_command(port: int, workers: int = 2, threads: int = 4) -> List[str]:
+    """تشغيل تطبيق Frappe من بيئة bench على المنفذ المحجوز"""
+    return [
+        f"{BENCH_PATH}/env/bin/gunicorn",
+        f"--chdir={BENCH_PATH}/sites",
+        f"--bind=0.0.0.0:{port}",
+        f"--workers={workers}",
+        f"--threads={threads}",
+        "--worker-class=gthread",
+        "--timeout=120",
+        "--preload",
+        "frappe.app:application"
+    ]
+
+
+def bench_server_command(port: int, workers: int = 2, threads: int = 4) -> List[str]:
+    """gunicorn على bench مشترك بعد تهيئة sites/ الفارغ من SITES_TEMPLATE_PATH عند أول تشغيل"""
+    seed = ' '.join(SITES_SEED_FILES)
+    return ['bash', '-c', (
+        f"cd {BENCH_PATH}/sites && "
+        f"for f in {seed}; do "
+        f"if [ ! -e \"$f\" ] && [ -e {SITES_TEMPLATE_PATH}/$f ]; then cp -a {SITES_TEMPLATE_PATH}/$f .; fi; done && "
+        f"exec {shlex.join(gunicorn_command(port, workers, threads))}"
+    )]
+
+
+@dataclass
+class ContainerSpec:
+    """مواصفات حاوية سيرفر تطبيق"""
+    server_id: str
+    ip: str
+    port: int
+    image: str
+    network: str
+    memory_limit: str = "2g"
+    cpu_limit: str = "1.0"
+    command: Optional[List[str]] = None
+    environment: Dict[str, str] = field(default_factory=dict)
+    volumes: Dict[str, str] = field(default_factory=dict)
+    read_only_volumes: Dict[str, str] = field(default_factory=dict)
+    # volumes بدون اسم (تُحذف مع الحاوية)
+    anonymous_volumes: List[str] = field(default_factory=list)
+    user: Optional[str] = None
+
+
+def use_shared_bench(spec: ContainerSpec, bench_source: str) -> ContainerSpec:
+    """apps و env من bench سيرفر قائم للقراءة فقط، و sites/ و logs/ خاصة بالسيرفر (تُحذف مع الحاوية)"""
+    spec.read_only_volumes = {
+        f"{bench_source}/apps": f"{BENCH_PATH}/apps",
+        f"{bench_source}/env": f"{BENCH_PATH}/env",
+        f"{bench_source}/sites": SITES_TEMPLATE_PATH
+    }
+    spec.anonymous_volumes = [f"{BENCH_PATH}/sites", f"{BENCH_PATH}/logs"]
+    spec.command = bench_server_command(spec.port)
+    return spec
+
+
+@dataclass
+class LaunchResult:
+    """نتيجة إطلاق حاوية"""
+    server_id: str
+    success: bool = False
+    message: str = ''
+    container_id: Optional[str] = None
+    time_to_ready_ms: Optional[float] = None
+    stages_ms: Dict[str, float] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+
+
+class ContainerLauncher:
+    """إنشاء وتشغيل وإيقاف حاويات السيرفرات مع انتظار الجاهزية"""
+
+    def __init__(self, api, ready_timeout: float = 180, poll_interval: float = 1.0,
+                 probe_timeout: float = 3.0, probe_host: Optional[str] = None,
+                 max_workers: int = 4, history_size: int = 50):
+        self.api = api
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.probe_timeout = probe_timeout
+        # في وضع fake خادم التطبيق على 127.0.0.1 وليس على IP الشبكة
+        self.probe_host = probe_host
+        self.max_workers = max_workers
+        self.history = deque(maxlen=history_size)
+        self.http = requests.Session()
+        self.backend = 'docker'
+        # FakeDockerEngine عند CONTAINER_BACKEND=fake
+        self.engine = None
+
+    # --- المراحل ---
+
+    def _create(self, spec: ContainerSpec) -> str:
+        import docker
+
+        host_config = self.api.create_host_config(
+            port_bindings={spec.port: spec.port},
+            mem_limit=spec.memory_limit,
+            nano_cpus=int(float(spec.cpu_limit) * 10 ** 9),
+            binds={**{host: {'bind': path, 'mode': 'rw'} for host, path in spec.volumes.items()},
+                   **{host: {'bind': path, 'mode': 'ro'} for host, path in spec.read_only_volumes.items()}} or None,
+            restart_policy={'Name': 'unless-stopped'}
+        )
+        networking_config = self.api.create_networking_config({
+            spec.network: self.api.create_endpoint_config(ipv4_address=spec.ip)
+        })
+        kwargs = dict(
+            image=spec.image,
+            command=spec.command or gunicorn_command(spec.port),
+            name=spec.server_id,
+            ports=[spec.port],
+            volumes=list(spec.anonymous_volumes) or None,
+            user=spec.user,
+            environment=spec.environment or None,
+            labels={SERVER_LABEL: spec.server_id},
+            host_config=host_config,
+            networking_config=networking_config
+        )
+
+        try:
+            return self.api.create_container(**kwargs)['Id']
+        except docker.errors.ImageNotFound:
+            logger.info(f"⬇️ سحب الصورة {spec.image}")
+            repository, _, tag = spec.image.partition(':')
+            self.api.pull(repository, tag=tag or 'latest')
+            return self.api.create_container(**kwargs)['Id']
+        except docker.errors.APIError as e:
+            if e.status_code != 409:
+                raise
+            # الاسم محجوز لهذا السيرفر (cluster_leases)، فالحاوية الموجودة بقايا محاولة سابقة فاشلة
+            logger.warning(f"⚠️ حاوية سابقة باسم {spec.server_id} - حذفها وإعادة الإنشاء")
+            self.api.remove_container(spec.server_id, force=True, v=True)
+            return self.api.create_container(**kwargs)['Id']
+
+    def _logs_tail(self, container_id: str, lines: int = 20) -> str:
+        try:
+            output = self.api.logs(container_id, stdout=True, stderr=True, tail=lines)
+            return (output.decode(errors='replace') if isinstance(output, bytes) else str(output)).strip()
+        except Exception:
+            return ''
+
+    def wait_ready(self, spec: ContainerSpec, container_id: str, deadline: float) -> None:
+        """
+        انتظار الجاهزية حتى deadline (time.monotonic)
+
+        يرفع RuntimeError إذا خرجت الحاوية، و TimeoutError عند انتهاء المهلة.
+        """
+        url = f"http://{self.probe_host or spec.ip}:{spec.port}/api/method/version"
+        last_error = 'لم يبدأ'
+        while True:
+            state = self.api.inspect_container(container_id).get('State', {})
+            if not state.get('Running'):
+                if state.get('Status') in ('exited', 'dead'):
+                    raise RuntimeError(f"الحاوية خرجت (exit {state.get('ExitCode')}): "
+                                       f"{self._logs_tail(container_id)}")
+                last_error = f"الحالة {state.get('Status')}"
+            else:
+                try:
+                    response = self.http.get(url, timeout=(1.0, self.probe_timeout))
+                    if response.status_code == 200:
+                        return
+                    last_error = f"HTTP {response.status_code}"
+                except requests.exceptions.RequestException as e:
+                    last_error = type(e).__name__
+
+            if time.monotonic() + self.poll_interval > deadline:
+                raise TimeoutError(f"لم يجهز خلال {self.ready_timeout} ثانية (آخر فحص: {last_error})")
+            time.sleep(self.poll_interval)
+
+    # --- الإطلاق ---
+
+    def launch(self, spec: ContainerSpec) -> LaunchResult:
+        """إنشاء وتشغيل حاوية وانتظار جاهزيتها"""
+        result = LaunchResult(server_id=spec.server_id)
+        begin = time.monotonic()
+        deadline = begin + self.ready_timeout
+        stage_start = begin
+
+        def mark(stage: str):
+            nonlocal stage_start
+            now = time.monotonic()
+            result.stages_ms[stage] = round((now - stage_start) * 1000, 1)
+            stage_start = now
+
+        with tracer.start_span('container.launch', server=spec.server_id, image=spec.image) as span:
+            try:
+                result.container_id = self._create(spec)
+                mark('create')
+                self.api.start(result.container_id)
+                mark('start')
+                self.wait_ready(spec, result.container_id, deadline)
+                mark('ready')
+
+                result.success = True
+                result.time_to_ready_ms = round((time.monotonic() - begin) * 1000, 1)
+                result.message = f"جاهز خلال {result.time_to_ready_ms / 1000:.1f} ثانية"
+                span.set_attribute('time_to_ready_ms', result.time_to_ready_ms)
+                logger.info(f"✅ الحاوية {spec.server_id} جاهزة خلال {result.time_to_ready_ms:.0f}ms "
+                            f"{result.stages_ms}")
+            except Exception as e:
+                result.message = f"فشل إطلاق الحاوية {spec.server_id}: {e}"
+                span.set_attribute('error', str(e))
+                logger.error(f"❌ {result.message}")
+                if result.container_id:
+                    self.remove(result.container_id)
+
+        self.history.append(result)
+        return result
+
+    def launch_many(self, specs: List[ContainerSpec]) -> List[LaunchResult]:
+        """إطلاق عدة حاويات بالتوازي (النتائج بنفس ترتيب specs)"""
+        if not specs:
+            return []
+        workers = max(1, min(self.max_workers, len(specs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="container-launch") as executor:
+            return list(executor.map(with_current_context(self.launch), specs))
+
+    def bench_template(self, reference: str) -> Dict:
+        """
+        الصورة والمستخدم ومصدر bench لحاوية سيرفر تطبيق قائم
+
+        bench_source هو مسار volume (أو bind) المركب على BENCH_PATH على مضيف Docker،
+        أو None إذا كان bench داخل الصورة نفسها.
+        """
+        info = self.api.inspect_container(reference)
+        bench = next((mount for mount in info.get('Mounts') or [] if mount.get('Destination') == BENCH_PATH), None)
+        return {
+            'image': info['Config']['Image'],
+            'user': info['Config'].get('User') or None,
+            'bench_source': bench['Source'] if bench else None
+        }
+
+    def remove(self, container: str, stop_timeout: int = 10) -> bool:
+        """إيقاف وحذف حاوية (لا خطأ إذا لم تكن موجودة)"""
+        import docker
+
+        try:
+            try:
+                self.api.stop(container, timeout=stop_timeout)
+            except docker.errors.NotFound:
+                return True
+            self.api.remove_container(container, force=True, v=True)
+            logger.info(f"✅ تم إيقاف الحاوية {container}")
+            return True
+        except docker.errors.NotFound:
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ فشل إيقاف الحاوية {container}: {e}")
+            return False
+
+    def status(self) -> Dict:
+        """آخر الإطلاقات وأزمنة الجاهزية"""
+        launches = list(self.history)
+        ready = sorted(result.time_to_ready_ms for result in launches if result.success)
+        return {
+            'backend': self.backend,
+            'ready_timeout': self.ready_timeout,
+            'launches': len(launches),
+            'failed': sum(1 for result in launches if not result.success),
+            'time_to_ready_ms': {
+                'avg': round(sum(ready) / len(ready), 1) if ready else None,
+                'p50': ready[len(ready) // 2] if ready else None,
+                'max': ready[-1] if ready else None
+            },
+            'recent': [asdict(result) for result in launches[-10:]]
+        }
+
+
+def create_container_launcher(ready_timeout: Optional[float] = None,
+                              backend: Optional[str] = None) -> ContainerLauncher:
+    """إنشاء المُطلق حسب CONTAINER_BACKEND (docker | fake)"""
+    import docker
+    from metrics_collector import create_docker_api
+
+    backend = backend or os.environ.get('CONTAINER_BACKEND', 'docker')
+    ready_timeout = float(os.environ.get('SERVER_READY_TIMEOUT', ready_timeout or 180))
+    probe_host = os.environ.get('CONTAINER_PROBE_HOST') or None
+    engine = None
+
+    if backend == 'fake':
+        from fake_docker import FakeDockerEngine
+        engine = FakeDockerEngine(
+            os.environ.get('FAKE_DOCKER_SOCKET', f'/tmp/fake-docker-{os.getpid()}.sock'),
+            boot_delay=float(os.environ.get('FAKE_DOCKER_BOOT_DELAY', 2.0))
+        ).start()
+        probe_host = probe_host or '127.0.0.1'
+        api = docker.APIClient(base_url=engine.base_url, version='1.41', timeout=60)
+    else:
+        # create/pull قد تستغرق أطول من مهلة جمع المقاييس
+        api = create_docker_api(timeout=60)
+
+    launcher = ContainerLauncher(api, ready_timeout=ready_timeout, probe_host=probe_host)
+    launcher.backend = backend
+    launcher.engine = engine
+    return launcher
@@ -0,0 +1,11 @@
+"""
+إعدادات قاعدة بيانات النظام (saas_trialsv1) المشتركة بين app.py و async_app.py
+"""
+
+DB_CONFIG = {
+    'host': '172.20.0.102',
+    'user': 'root',
+    'password': '123456',
+    'database': 'saas_trialsv1',
+    'connect_timeout': 30,
+}
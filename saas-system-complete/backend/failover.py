@@ -0,0 +1,384 @@
+"""
+تحويل مواقع السيرفر المتوقف تلقائياً (failover) وإعادتها عند تعافيه (failback)
+
+- الكشف: السيرفر OFFLINE في كل الجولات لمدة detection_seconds متصلة (failover_timeout)
+- الأهداف: بقية السيرفرات الصحية، مع ترقية سيرفر احتياطي (reason='failover') بدل المتوقف
+- الموقع يُحوّل فقط إلى سيرفر يخدمه فعلاً (طلب بترويسة Host مباشرة على الهدف): مجلد sites مشترك
+  أو نسخة للموقع على الهدف. لا نسخ من المصدر لأنه متوقف؛ الموقع الذي لا يخدمه أي هدف يبقى ويُعاد المحاولة
+- التحويل دفعة واحدة: تكوينات Nginx لكل المواقع بإعادة تحميل واحدة، ثم site_assignments بمعاملة واحدة
+- السيرفر الأصلي لكل موقع محفوظ في site_failovers؛ عندما يبقى صحياً failback_stable_seconds تُعاد إليه
+  مواقعه التي لم تتحرك منذ التحويل بنفس الطريقة
+- step() بعد كل جولة فحص في حلقة المراقبة (القائد فقط)
+
+لكل تحويل يُسجل الزمن من الكشف (أول جولة OFFLINE) حتى اكتمال التوجيه.
+"""
+
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+from circuit_breaker import connect_mysql
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# قيم ServerStatus (cluster_manager يستورد هذه الوحدة)
+STATUS_OFFLINE = 'offline'
+STATUS_HEALTHY = 'healthy'
+
+KIND_FAILOVER = 'failover'
+KIND_FAILBACK = 'failback'
+
+
+@dataclass
+class FailoverEvent:
+    """تحويل (أو إعادة) مواقع سيرفر واحد"""
+    server_id: str
+    kind: str
+    detected_at: float
+    sites: int = 0
+    rerouted: int = 0
+    unservable: List[str] = field(default_factory=list)
+    targets: Dict[str, int] = field(default_factory=dict)
+    promoted: Optional[str] = None
+    success: bool = False
+    message: str = ''
+    reroute_ms: Optional[float] = None
+    detection_to_recovery_ms: Optional[float] = None
+    completed_at: Optional[float] = None
+
+
+class FailoverController:
+    """تحويل المواقع عن السيرفرات المتوقفة وإعادتها"""
+
+    def __init__(self, cluster_manager, detection_seconds: float = 10, failback_stable_seconds: float = 60,
+                 retry_seconds: float = 30, history_size: int = 50):
+        self.cluster_manager = cluster_manager
+        self.db_config = cluster_manager.db_config
+        self.detection_seconds = detection_seconds
+        self.failback_stable_seconds = failback_stable_seconds
+        # إعادة محاولة المواقع التي لم يخدمها أي هدف
+        self.retry_seconds = retry_seconds
+
+        self._offline_since: Dict[str, float] = {}
+        self._healthy_since: Dict[str, float] = {}
+        self._attempted_at: Dict[Tuple[str, str], float] = {}
+        # {site: (السيرفر الأصلي، السيرفر الحالي)} من site_failovers
+        self._homes: Optional[Dict[str, Tuple[str, str]]] = None
+        self._load_failed_at = 0.0
+        self._schema_ready = False
+        self.events = deque(maxlen=history_size)
+
+    # --- قاعدة البيانات ---
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS site_failovers (
+                site_name VARCHAR(255) PRIMARY KEY,
+                home_server VARCHAR(50) NOT NULL,
+                failover_server VARCHAR(50) NOT NULL,
+                failed_over_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_home_server (home_server)
+            )
+        """)
+        self._schema_ready = True
+
+    def _records(self, now: float) -> Dict[str, Tuple[str, str]]:
+        """السيرفر الأصلي لكل موقع محوّل (يُحمّل مرة عند بدء القيادة)"""
+        if self._homes is not None:
+            return self._homes
+        if now - self._load_failed_at < self.retry_seconds:
+            return {}
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                cursor.execute("SELECT site_name, home_server, failover_server FROM site_failovers")
+                self._homes = {site: (home, current) for site, home, current in cursor.fetchall()}
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحميل المواقع المحوّلة: {e}")
+            self._load_failed_at = now
+            return {}
+        return self._homes
+
+    def _save_records(self, records: Dict[str, Tuple[str, str]]):
+        """السيرفر الأصلي لا يتغير إذا حُوّل الموقع مرة ثانية قبل الإعادة"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            cursor.executemany("""
+                INSERT INTO site_failovers (site_name, home_server, failover_server) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE failover_server = VALUES(failover_server), failed_over_at = CURRENT_TIMESTAMP
+            """, [(site, home, current) for site, (home, current) in records.items()])
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        if self._homes is not None:
+            self._homes.update(records)
+
+    def _delete_records(self, sites: List[str]):
+        if not sites:
+            return
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            cursor.executemany("DELETE FROM site_failovers WHERE site_name = %s", [(site,) for site in sites])
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        for site in sites:
+            (self._homes or {}).pop(site, None)
+
+    def reset(self):
+        """قيادة جديدة: المؤقتات من الصفر وإعادة تحميل site_failovers"""
+        self._offline_since.clear()
+        self._healthy_since.clear()
+        self._attempted_at.clear()
+        self._homes = None
+        self._load_failed_at = 0.0
+
+    # --- الفحص والتوجيه ---
+
+    def _serves(self, server_id: str, site: str) -> bool:
+        """السيرفر يخدم الموقع (بدون المرور عبر Nginx)"""
+        cluster_manager = self.cluster_manager
+        try:
+            info = cluster_manager._get_server_info(server_id)
+            response = cluster_manager.http.get(
+                f"http://{info['ip']}:{info['port']}/api/method/version",
+                headers={'Host': site},
+                timeout=(cluster_manager.config.probe_connect_timeout, cluster_manager.config.probe_read_timeout)
+            )
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def _check_many(self, candidates: Dict[str, str]) -> Dict[str, bool]:
+        """{site: server_id} -> {site: يخدمه} بالتوازي على عمال الفحص"""
+        items = list(candidates.items())
+        results = self.cluster_manager._health_executor.map(lambda item: self._serves(item[1], item[0]), items)
+        return {site: served for (site, _), served in zip(items, results)}
+
+    def _place(self, sites: List[str], targets: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        """
+        هدف لكل موقع يخدمه فعلاً
+
+        التوزيع بخوارزمية الكلاستر أولاً؛ الموقع الذي لا يخدمه هدفه يُجرب على الهدف التالي (جولة لكل هدف).
+        """
+        cluster_manager = self.cluster_manager
+        tenant_costs = cluster_manager._get_tenant_costs() \
+            if cluster_manager.config.load_balance_algorithm == "weighted" else {}
+        plan = cluster_manager._distribute_sites(sites, targets, tenant_costs)
+        planned = {site: targets.index(target) for target, target_sites in plan.items() for site in target_sites}
+
+        placement: Dict[str, str] = {}
+        pending = list(sites)
+        for attempt in range(len(targets)):
+            candidates = {site: targets[(planned.get(site, 0) + attempt) % len(targets)] for site in pending}
+            for site, served in self._check_many(candidates).items():
+                if served:
+                    placement[site] = candidates[site]
+            pending = [site for site in pending if site not in placement]
+            if not pending:
+                break
+        return placement, pending
+
+    def _reroute(self, placement: Dict[str, str]) -> Tuple[bool, str]:
+        """Nginx لكل المواقع بإعادة تحميل واحدة، ثم التعيين بمعاملة واحدة"""
+        cluster_manager = self.cluster_manager
+        routes = {}
+        for site, server_id in placement.items():
+            info = cluster_manager._get_server_info(server_id)
+            routes[site] = f"{info['ip']}:{info['port']}"
+        success, message = cluster_manager.load_balancer.switch_sites_upstream(routes)
+        if not success:
+            return False, message
+        if not cluster_manager.assignments.assign_many(placement):
+            # التوجيه تغير فعلاً؛ الجولة التالية تعيد المحاولة لأن التعيين ما زال على السيرفر القديم
+            logger.error(f"❌ تم توجيه {len(placement)} موقع لكن فشل حفظ التعيين")
+        return True, message
+
+    def _finish(self, event: FailoverEvent, start: float):
+        event.completed_at = time.time()
+        event.reroute_ms = round((time.perf_counter() - start) * 1000, 1)
+        event.detection_to_recovery_ms = round((event.completed_at - event.detected_at) * 1000, 1)
+        self.events.append(event)
+
+    # --- الحلقة ---
+
+    def step(self, now: Optional[float] = None):
+        """تحديث مدة التوقف/التعافي لكل سيرفر من آخر جولة، ثم التحويل أو الإعادة المستحقة"""
+        now = now or time.time()
+        cluster_manager = self.cluster_manager
+        for tracked in (self._offline_since, self._healthy_since):
+            for server_id in [server_id for server_id in tracked if server_id not in cluster_manager.servers]:
+                tracked.pop(server_id)
+
+        for server_id in list(cluster_manager.servers):
+            status = cluster_manager.health_status.get(server_id)
+            status = status.value if status is not None else None
+            if status == STATUS_OFFLINE:
+                self._offline_since.setdefault(server_id, now)
+            else:
+                if self._offline_since.pop(server_id, None) is not None:
+                    self._attempted_at.pop((KIND_FAILOVER, server_id), None)
+            if status == STATUS_HEALTHY:
+                self._healthy_since.setdefault(server_id, now)
+            else:
+                self._healthy_since.pop(server_id, None)
+
+        if self.detection_seconds <= 0:
+            return
+        records = self._records(now)
+
+        for server_id, since in list(self._offline_since.items()):
+            if now - since >= self.detection_seconds and self._due(KIND_FAILOVER, server_id, now) \
+                    and cluster_manager.assignments.sites_of(server_id):
+                first = (KIND_FAILOVER, server_id) not in self._attempted_at
+                self._attempted_at[(KIND_FAILOVER, server_id)] = now
+                self.fail_over(server_id, since, promote=first)
+
+        for home in {home for home, _ in records.values()}:
+            if home not in cluster_manager.servers:
+                # السيرفر الأصلي أُزيل - المواقع تبقى حيث هي
+                self._forget_home(home)
+                continue
+            since = self._healthy_since.get(home)
+            if since is not None and now - since >= self.failback_stable_seconds \
+                    and self._due(KIND_FAILBACK, home, now):
+                self._attempted_at[(KIND_FAILBACK, home)] = now
+                self.fail_back(home, since)
+
+    def _due(self, kind: str, server_id: str, now: float) -> bool:
+        attempted = self._attempted_at.get((kind, server_id))
+        return attempted is None or now - attempted >= self.retry_seconds
+
+    def _forget_home(self, home: str):
+        try:
+            self._delete_records([site for site, (site_home, _) in (self._homes or {}).items() if site_home == home])
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر حذف سجلات التحويل لـ {home}: {e}")
+
+    def fail_over(self, server_id: str, detected_at: float, promote: bool = True) -> Optional[FailoverEvent]:
+        """تحويل مواقع السيرفر المتوقف إلى سيرفرات تخدمها"""
+        cluster_manager = self.cluster_manager
+        start = time.perf_counter()
+        sites = cluster_manager.assignments.sites_of(server_id)
+        if not sites:
+            return None
+        event = FailoverEvent(server_id=server_id, kind=KIND_FAILOVER, detected_at=detected_at, sites=len(sites))
+
+        with tracer.start_span('failover', server=server_id, sites=len(sites)) as span:
+            if promote and cluster_manager.standby_pool:
+                promotion = cluster_manager.standby_pool.promote(reason='failover')
+                event.promoted = promotion.server_id if promotion else None
+
+            targets = [target for target in cluster_manager.get_healthy_servers() if target != server_id]
+            if not targets:
+                event.message = 'لا توجد سيرفرات صحية للتحويل'
+                event.unservable = sites
+                logger.error(f"❌ تعذر تحويل مواقع {server_id}: {event.message}")
+                self._finish(event, start)
+                return event
+
+            placement, event.unservable = self._place(sites, targets)
+            if placement:
+                homes = self._homes or {}
+                event.success, event.message = self._reroute(placement)
+                if event.success:
+                    event.rerouted = len(placement)
+                    for target in placement.values():
+                        event.targets[target] = event.targets.get(target, 0) + 1
+                    try:
+                        self._save_records({site: (homes.get(site, (server_id, None))[0], target)
+                                            for site, target in placement.items()})
+                    except Exception as e:
+                        logger.error(f"❌ فشل حفظ السيرفر الأصلي لمواقع {server_id} (لن تُعاد تلقائياً): {e}")
+            else:
+                event.message = 'لا يوجد سيرفر يخدم مواقع السيرفر المتوقف (مجلد sites غير مشترك؟)'
+            span.set_attribute('rerouted', event.rerouted)
+
+        self._finish(event, start)
+        if event.success:
+            logger.warning(f"🚑 تحويل {event.rerouted} من {event.sites} موقع من {server_id} خلال "
+                           f"{event.detection_to_recovery_ms / 1000:.1f} ثانية من الكشف"
+                           + (f" - {len(event.unservable)} بدون سيرفر يخدمها" if event.unservable else ""))
+        else:
+            logger.error(f"❌ فشل تحويل مواقع {server_id}: {event.message}")
+        return event
+
+    def fail_back(self, home: str, healthy_since: float) -> Optional[FailoverEvent]:
+        """إعادة المواقع المحوّلة إلى سيرفرها الأصلي بعد استقراره"""
+        cluster_manager = self.cluster_manager
+        start = time.perf_counter()
+        records = {site: current for site, (site_home, current) in self._homes.items() if site_home == home}
+        # المواقع التي نقلها غيرنا منذ التحويل (إعادة توزيع أو ترحيل) لا تُعاد
+        moved = [site for site, current in records.items() if cluster_manager.assignments.server_of(site) != current]
+        candidates = {site: home for site in records if site not in moved}
+        event = FailoverEvent(server_id=home, kind=KIND_FAILBACK, detected_at=healthy_since, sites=len(candidates))
+
+        with tracer.start_span('failback', server=home, sites=len(candidates)) as span:
+            served = self._check_many(candidates) if candidates else {}
+            placement = {site: home for site, ok in served.items() if ok}
+            event.unservable = [site for site, ok in served.items() if not ok]
+            if placement:
+                event.success, event.message = self._reroute(placement)
+                if event.success:
+                    event.rerouted = len(placement)
+                    event.targets = {home: len(placement)}
+            else:
+                event.success = not candidates
+                event.message = f'{home} لا يخدم مواقعه المحوّلة' if candidates else 'لا توجد مواقع للإعادة'
+            span.set_attribute('rerouted', event.rerouted)
+
+            try:
+                self._delete_records(moved + (list(placement) if event.success else []))
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر حذف سجلات التحويل لـ {home}: {e}")
+
+        self._finish(event, start)
+        if event.rerouted:
+            logger.info(f"↩️ إعادة {event.rerouted} موقع إلى {home} بعد تعافيه")
+        elif not event.success:
+            logger.error(f"❌ فشل إعادة مواقع {home}: {event.message}")
+        return event
+
+    def status(self) -> Dict:
+        """السيرفرات المتوقفة، المواقع المحوّلة، وأزمنة التحويل"""
+        now = time.time()
+        events = list(self.events)
+        timings = sorted(event.detection_to_recovery_ms for event in events
+                         if event.kind == KIND_FAILOVER and event.rerouted)
+        by_home: Dict[str, int] = {}
+        for home, _ in (self._homes or {}).values():
+            by_home[home] = by_home.get(home, 0) + 1
+        return {
+            'enabled': self.detection_seconds > 0,
+            'detection_seconds': self.detection_seconds,
+            'failback_stable_seconds': self.failback_stable_seconds,
+            'offline': {server_id: round(now - since, 1) for server_id, since in self._offline_since.items()},
+            'failed_over_sites': by_home,
+            'failovers': sum(1 for event in events if event.kind == KIND_FAILOVER),
+            'failbacks': sum(1 for event in events if event.kind == KIND_FAILBACK),
+            'detection_to_recovery_ms': {
+                'avg': round(sum(timings) / len(timings), 1) if timings else None,
+                'p50': timings[len(timings) // 2] if timings else None,
+                'max': timings[-1] if timings else None
+            },
+            'recent': [asdict(event) for event in events[-10:]]
+        }
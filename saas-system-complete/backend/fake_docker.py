@@ -0,0 +1,345 @@
+"""
+Docker Engine API وهمي عبر unix socket لاختبار دورة حياة الحاويات بدون Docker
+
+يخدم نفس مسارات HTTP التي يستخدمها docker.APIClient (create/start/json/logs/stop/delete/images/create)،
+فالكود المختبر هو نفس كود الإنتاج والفرق فقط في DOCKER_HOST.
+عند start تبدأ الحاوية الوهمية خادم HTTP على 127.0.0.1:<المنفذ> بعد boot_delay ثانية
+يجيب /api/method/version (نفس فحص الجاهزية والصحة).
+
+    python fake_docker.py --socket /tmp/fake-docker.sock --boot-delay 2
+    DOCKER_HOST=unix:///tmp/fake-docker.sock CONTAINER_PROBE_HOST=127.0.0.1 ...
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class _AppHandler(BaseHTTPRequestHandler):
+    """سيرفر التطبيق داخل الحاوية الوهمية"""
+
+    def do_GET(self):
+        if self.path.startswith('/api/method/version'):
+            body = json.dumps({'message': '15.0.0'}).encode()
+            self.send_response(200)
+        else:
+            body = json.dumps({'exc_type': 'DoesNotExistError'}).encode()
+            self.send_response(404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeContainer:
+    """حاوية وهمية: الحالة + خادم التطبيق"""
+
+    def __init__(self, name: str, config: Dict):
+        self.name = name
+        self.id = hashlib.sha256(f"{name}-{time.time()}".encode()).hexdigest()
+        self.config = config
+        self.status = 'created'
+        self.exit_code = 0
+        self.started_at = '0001-01-01T00:00:00Z'
+        self.logs = []
+        self.server: Optional[ThreadingHTTPServer] = None
+        self._boot_timer: Optional[threading.Timer] = None
+
+    @property
+    def host_ports(self) -> Tuple[int, ...]:
+        bindings = (self.config.get('HostConfig') or {}).get('PortBindings') or {}
+        return tuple(int(binding['HostPort']) for entries in bindings.values() for binding in entries or []
+                     if binding.get('HostPort'))
+
+    def inspect(self) -> Dict:
+        networks = (self.config.get('NetworkingConfig') or {}).get('EndpointsConfig') or {}
+        return {
+            'Id': self.id,
+            'Name': f"/{self.name}",
+            'Created': _now_iso(),
+            'State': {
+                'Status': self.status,
+                'Running': self.status == 'running',
+                'ExitCode': self.exit_code,
+                'Pid': 0,
+                'StartedAt': self.started_at
+            },
+            'Config': {
+                'Image': self.config.get('Image'),
+                'User': self.config.get('User') or '',
+                'Cmd': self.config.get('Cmd'),
+                'Labels': self.config.get('Labels') or {},
+                'Tty': False
+            },
+            'HostConfig': self.config.get('HostConfig') or {},
+            'Mounts': [
+                {'Type': 'bind', 'Source': bind.split(':')[0], 'Destination': bind.split(':')[1],
+                 'RW': not bind.endswith(':ro')}
+                for bind in (self.config.get('HostConfig') or {}).get('Binds') or []
+            ] + [
+                {'Type': 'volume', 'Source': f"/var/lib/docker/volumes/{self.id[:12]}/_data", 'Destination': path,
+                 'RW': True}
+                for path in self.config.get('Volumes') or {}
+            ],
+            'NetworkSettings': {
+                'Networks': {
+                    network: {'IPAddress': ((endpoint or {}).get('IPAMConfig') or {}).get('IPv4Address', '')}
+                    for network, endpoint in networks.items()
+                }
+            }
+        }
+
+
+class FakeDockerEngine:
+    """
+    Docker Engine API وهمي
+
+    boot_delay: زمن الإقلاع قبل أن يجيب خادم التطبيق (رقم أو (أدنى، أقصى) لزمن عشوائي).
+    failing: أسماء حاويات تخرج فوراً بعد start (لاختبار مسار الفشل).
+    """
+
+    def __init__(self, socket_path: str, boot_delay=1.0, failing: Optional[Set[str]] = None,
+                 images: Optional[Set[str]] = None, seed: int = 0):
+        self.socket_path = socket_path
+        self.boot_delay = boot_delay
+        self.failing = set(failing or ())
+        # None = كل الصور موجودة محلياً
+        self.images = set(images) if images is not None else None
+        self.random = random.Random(seed)
+        self.containers: Dict[str, FakeContainer] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    # --- الحاويات ---
+
+    def _find(self, ref: str) -> Optional[FakeContainer]:
+        with self._lock:
+            container = self.containers.get(ref)
+            if container:
+                return container
+            for container in self.containers.values():
+                if container.id.startswith(ref):
+                    return container
+        return None
+
+    def _boot_seconds(self) -> float:
+        if isinstance(self.boot_delay, (tuple, list)):
+            return self.random.uniform(*self.boot_delay)
+        return float(self.boot_delay)
+
+    def _start(self, container: FakeContainer):
+        container.status = 'running'
+        container.started_at = _now_iso()
+        container.logs.append(f"starting {' '.join(container.config.get('Cmd') or [])}")
+        if container.name in self.failing:
+            container.status = 'exited'
+            container.exit_code = 1
+            container.logs.append('Error: fake boot failure')
+            return
+
+        def boot():
+            if container.status != 'running':
+                return
+            ports = container.host_ports
+            if not ports:
+                return
+            try:
+                container.server = ThreadingHTTPServer(('127.0.0.1', ports[0]), _AppHandler)
+            except OSError as e:
+                container.status = 'exited'
+                container.exit_code = 1
+                container.logs.append(f"bind failed: {e}")
+                return
+            container.logs.append(f"Listening at: http://0.0.0.0:{ports[0]}")
+            threading.Thread(target=container.server.serve_forever, daemon=True).start()
+
+        container._boot_timer = threading.Timer(self._boot_seconds(), boot)
+        container._boot_timer.daemon = True
+        container._boot_timer.start()
+
+    def _stop(self, container: FakeContainer):
+        if container._boot_timer:
+            container._boot_timer.cancel()
+        if container.server:
+            container.server.shutdown()
+            container.server.server_close()
+            container.server = None
+        if container.status == 'running':
+            container.status = 'exited'
+            container.exit_code = 0
+
+    # --- HTTP ---
+
+    def dispatch(self, method: str, path: str, query: Dict, body: Optional[Dict]) -> Tuple[int, object]:
+        """توجيه طلب API إلى (status, body)"""
+        path = re.sub(r'^/v[\d.]+', '', path)
+        self.requests += 1
+
+        if method == 'GET' and path in ('/version', '/_ping'):
+            return 200, {'ApiVersion': '1.41', 'Version': 'fake'} if path == '/version' else 'OK'
+
+        if method == 'POST' and path == '/images/create':
+            image = query.get('fromImage', [''])[0]
+            tag = query.get('tag', ['latest'])[0]
+            if self.images is not None:
+                self.images.add(f"{image}:{tag}")
+            return 200, {'status': f"Downloaded newer image for {image}:{tag}"}
+
+        if method == 'POST' and path == '/containers/create':
+            name = query.get('name', [''])[0]
+            image = body.get('Image', '')
+            if self.images is not None and image not in self.images:
+                return 404, {'message': f"No such image: {image}"}
+            with self._lock:
+                if name in self.containers:
+                    return 409, {'message': f'Conflict. The container name "/{name}" is already in use'}
+                container = FakeContainer(name, body)
+                self.containers[name] = container
+            return 201, {'Id': container.id, 'Warnings': []}
+
+        match = re.fullmatch(r'/containers/([^/]+)(/[a-z]+)?', path)
+        if not match:
+            return 404, {'message': f"page not found: {path}"}
+        container = self._find(match.group(1))
+        if container is None:
+            return 404, {'message': f"No such container: {match.group(1)}"}
+        action = match.group(2)
+
+        if method == 'GET' and action == '/json':
+            return 200, container.inspect()
+        if method == 'GET' and action == '/logs':
+            tail = query.get('tail', ['all'])[0]
+            lines = container.logs if tail == 'all' else container.logs[-int(tail):]
+            return 200, b''.join(self._frame(line + '\n') for line in lines)
+        if method == 'POST' and action == '/start':
+            if container.status == 'running':
+                return 304, None
+            self._start(container)
+            return 204, None
+        if method == 'POST' and action == '/stop':
+            self._stop(container)
+            return 204, None
+        if method == 'DELETE' and action is None:
+            if container.status == 'running' and query.get('force', ['False'])[0].lower() not in ('1', 'true'):
+                return 409, {'message': f"You cannot remove a running container {container.id}"}
+            self._stop(container)
+            with self._lock:
+                self.containers.pop(container.name, None)
+            return 204, None
+        return 404, {'message': f"page not found: {method} {path}"}
+
+    @staticmethod
+    def _frame(text: str) -> bytes:
+        """إطار stdout في تدفق السجلات المدمج (حاوية بدون tty)"""
+        data = text.encode()
+        return struct.pack('>BxxxL', 1, len(data)) + data
+
+    def _handler(self):
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                status, payload = engine.dispatch(self.command, url.path, parse_qs(url.query), body)
+
+                if payload is None:
+                    data, content_type = b'', 'text/plain'
+                elif isinstance(payload, bytes):
+                    data, content_type = payload, 'application/vnd.docker.raw-stream'
+                elif isinstance(payload, str):
+                    data, content_type = payload.encode(), 'text/plain'
+                else:
+                    data, content_type = json.dumps(payload).encode(), 'application/json'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if data:
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeDockerEngine':
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-docker").start()
+        logger.info(f"🐳 Docker وهمي على unix://{self.socket_path}")
+        return self
+
+    def stop(self):
+        for container in list(self.containers.values()):
+            self._stop(container)
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    @property
+    def base_url(self) -> str:
+        return f"unix://{self.socket_path}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Docker Engine API وهمي عبر unix socket")
+    parser.add_argument('--socket', default='/tmp/fake-docker.sock')
+    parser.add_argument('--boot-delay', type=float, default=1.0)
+    parser.add_argument('--fail', action='append', default=[], help='اسم حاوية تفشل عند الإقلاع')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    engine = FakeDockerEngine(args.socket, boot_delay=args.boot_delay, failing=set(args.fail)).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        engine.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
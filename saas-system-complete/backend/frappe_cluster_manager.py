@@ -4,7 +4,8 @@ import time
 import logging
 import json
 from typing import Tuple, List
-import mysql.connector
+from tracing import tracer
+from circuit_breaker import breakers, connect_mysql, docker_failure, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +28,7 @@ class FrappeClusterManager:
     def get_db_connection(self):
         """الاتصال بقاعدة بيانات Frappe"""
         try:
-            return mysql.connector.connect(**self.db_config)
+            return connect_mysql(self.db_config)
         except Exception as e:
             logger.error(f"❌ فشل الاتصال بقاعدة البيانات: {str(e)}")
             raise e
@@ -39,18 +40,22 @@ class FrappeClusterManager:
             
             # استخدام Docker لتنفيذ الأوامر في الخادم المحدد
             docker_cmd = [
-                "docker", "exec", server['name'],
+                "docker", "exec", *tracer.docker_env_args(), server['name'],
                 "bash", "-c", f"cd /home/frappe/production && {' '.join(command)}"
             ]
             
             logger.info(f"🏗️  تنفيذ أمر في {self.cluster_name}/{server['name']}: {' '.join(command)}")
             
-            result = subprocess.run(
-                docker_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
+            with tracer.start_span(f"cluster {command[0] if command else ''}".strip(), server=server['name']) as span:
+                result = breakers.get(f"docker:{server['name']}").call(
+                    subprocess.run,
+                    docker_cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=300,
+                    is_failure=docker_failure
+                )
+                span.set_attribute('returncode', result.returncode)
             
             if result.returncode == 0:
                 logger.info(f"✅ نجح الأمر في {server['name']}")
@@ -61,6 +66,8 @@ class FrappeClusterManager:
                 
         except subprocess.TimeoutExpired:
             return False, "انتهت مهلة التنفيذ"
+        except CircuitOpenError as e:
+            return False, str(e)
         except Exception as e:
             return False, f"خطأ في التنفيذ: {str(e)}"
     
@@ -6,6 +6,9 @@ import subprocess
 from typing import Tuple, List, Dict
 import mysql.connector
 import os
+import threading
+from tracing import tracer, traced
+from circuit_breaker import breakers, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
@@ -19,12 +22,9 @@ class RealFrappeManager:
         logger.info(f"🔧 [REAL] تهيئة RealFrappeManager الإجباري")
         logger.info(f"📁 المسار: {self.bench_path}")
         logger.info(f"📁 مواقع: {self.sites_path}")
-        
-        # التحقق الفوري من البيئة
-        self._debug_environment()
     
     def _debug_environment(self):
-        """تصحيح بيئة النظام"""
+        """تصحيح بيئة النظام (يُستدعى من التسخين وليس عند الإنشاء)"""
         logger.info("🔍 فحص بيئة النظام...")
         
         # التحقق من المسارات
@@ -68,14 +68,18 @@ class RealFrappeManager:
             
             # تنفيذ الأمر مع تسجيل تفصيلي
             start_time = time.time()
-            result = subprocess.run(
-                full_command,
-                cwd=self.bench_path,
-                capture_output=True,
-                text=True,
-                timeout=300,
-                env=os.environ.copy()
-            )
+            with tracer.start_span(f"bench {command[0]}", command=cmd_str, site=site) as span:
+                # المهلة أو تعذر تشغيل bench فشل في التبعية؛ كود خروج غير صفري نتيجة الأمر نفسه
+                result = breakers.get("bench:local").call(
+                    subprocess.run,
+                    full_command,
+                    cwd=self.bench_path,
+                    capture_output=True,
+                    text=True,
+                    timeout=300,
+                    env=tracer.subprocess_env(os.environ.copy())
+                )
+                span.set_attribute('returncode', result.returncode)
             execution_time = time.time() - start_time
             
             # تسجيل النتيجة بالتفصيل
@@ -97,10 +101,14 @@ class RealFrappeManager:
         except subprocess.TimeoutExpired:
             logger.error(f"⏰ [REAL] انتهت مهلة تنفيذ الأمر (300 ثانية)")
             return False, "انتهت مهلة تنفيذ الأمر"
+        except CircuitOpenError as e:
+            logger.error(f"🔌 [REAL] {e}")
+            return False, str(e)
         except Exception as e:
             logger.error(f"💥 [REAL] خطأ في التنفيذ: {str(e)}")
             return False, f"خطأ في التنفيذ: {str(e)}"
 
+    @traced('site.create')
     def create_trial_site(self, subdomain: str, company_name: str, apps: List[str], admin_email: str, admin_password: str = "admin123") -> Tuple[bool, str]:
         """إنشاء موقع تجريبي فعلي مع تتبع كامل"""
         try:
@@ -212,6 +220,7 @@ class RealFrappeManager:
         except Exception as e:
             logger.warning(f"⚠️ [REAL] فشل حفظ البيانات الوصفية: {str(e)}")
 
+    @traced('site.list')
     def get_all_sites(self) -> List[str]:
         """الحصول على قائمة المواقع الفعلية"""
         try:
@@ -250,14 +259,24 @@ class RealFrappeManager:
             return {'error': str(e), 'exists': False}
 
 # إجبار استخدام المدير الفعلي دائماً - لا محاكاة
-frappe_direct_manager = RealFrappeManager()
-logger.info("🎯 تم تحميل RealFrappeManager بشكل إجباري - لا محاكاة!")
+_frappe_direct_manager = None
+_frappe_direct_manager_lock = threading.Lock()
+
+def get_frappe_direct_manager() -> RealFrappeManager:
+    """الحصول على المدير الفعلي (يُنشأ مرة واحدة لكل عملية عند أول استخدام)"""
+    global _frappe_direct_manager
+    if _frappe_direct_manager is None:
+        with _frappe_direct_manager_lock:
+            if _frappe_direct_manager is None:
+                _frappe_direct_manager = RealFrappeManager()
+                logger.info("🎯 تم تحميل RealFrappeManager بشكل إجباري - لا محاكاة!")
+    return _frappe_direct_manager
 
 # دالة مساعدة للاختبار السريع
 def test_bench_connection():
     """اختبار سريع للاتصال"""
     logger.info("🧪 بدء اختبار الاتصال السريع...")
-    manager = RealFrappeManager()
+    manager = get_frappe_direct_manager()
     
     # اختبار بسيط
     success, output = manager.execute_bench_command(["--version"])
@@ -267,6 +286,3 @@ def test_bench_connection():
     else:
         logger.error("❌ اختبار الاتصال فاشل!")
         return False
-
-# تشغيل الاختبار عند التحميل
-test_bench_connection()
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+إعدادات gunicorn لتشغيل الإنتاج
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- عدة عمليات (pre-fork) مع threads لكل عملية، العدد الافتراضي حسب أنوية المضيف
+- preload_app: استيراد التطبيق مرة واحدة في العملية الرئيسية قبل fork (الاستيراد لا يفتح اتصالات)
+- التسخين في كل عامل بعد fork في thread منفصل (اتصالات قاعدة البيانات و HTTP والخيوط لا تُورث عبر fork)
+- إعادة تدوير العمال معطلة افتراضياً (GUNICORN_MAX_REQUESTS لتفعيلها)
+- إيقاف وإعادة تحميل هادئ: العامل ينهي الطلبات الجارية (إنشاء المواقع) قبل الخروج
+- المهام الخلفية (مراقبة الكلاستر) تعمل في عامل واحد فقط، والعامل الخارج يسلم قيادة المراقبة فوراً
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+preload_app = True
+
+# إعادة تدوير العمال (مع تفاوت حتى لا يعاد تشغيلهم معاً) - معطلة افتراضياً: العامل المالك للمهام الخلفية
+# (مراقبة الكلاستر، الدفعات الجماعية) يعيد انتخاب القائد ويستأنف الدفعات مع كل إعادة تدوير
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# إنشاء موقع عبر bench قد يستغرق عدة دقائق
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 600))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """بعد إنشاء العامل: التسخين في الخلفية (لا يؤخر استقبال الطلبات)"""
+    if os.environ.get('WARMUP_ON_START', '1') != '0':
+        from startup import start_warmups_in_background
+        start_warmups_in_background()
+
+
+def post_worker_init(worker):
+    """تشغيل المهام الخلفية في عامل واحد فقط"""
+    from background import start_background_tasks
+    start_background_tasks()
+
+
+def worker_exit(server, worker):
+    """تسليم قيادة مراقبة الكلاستر فوراً عند خروج العامل (بدلاً من انتظار انتهاء المدة)"""
+    from app import cluster_manager_resource
+    if cluster_manager_resource.initialized:
+        cluster_manager_resource.get().stop_election()
@@ -0,0 +1,208 @@
+"""
+حفظ نتائج فحص الصحة والمقاييس في قاعدة البيانات (cluster_servers + cluster_metrics_history)
+
+- كل جولة = معاملة واحدة: upsert متعدد الصفوف في cluster_servers (الحالة، CPU، الذاكرة، المواقع، وقت الفحص)
+  و INSERT متعدد الصفوف في cluster_metrics_history (عينة كاملة لكل سيرفر)، وليس كتابة لكل سيرفر
+- الاحتفاظ: حذف العينات الأقدم من retention_seconds على دفعات (LIMIT) كل prune_interval ثانية
+- عند بدء المراقبة (أو تولي قائد جديد) تُستعاد آخر حالة وعينات النافذة الأخيرة باستعلامين بالفهرس
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from circuit_breaker import connect_mysql
+
+logger = logging.getLogger(__name__)
+
+# نفس أسماء حقول MetricsStore (تُستعاد إليه كما هي)
+HISTORY_FIELDS = (
+    'cpu_percent',
+    'memory_percent',
+    'disk_percent',
+    'response_time_ms',
+    'connections',
+    'sites_count',
+    'pids',
+    'gunicorn_workers',
+    'background_workers',
+    'network_rx',
+    'network_tx',
+    'block_read',
+    'block_write',
+)
+
+
+class HealthHistoryStore:
+    """كتابة نتائج الجولات دفعة واحدة واستعادتها عند البدء"""
+
+    def __init__(self, db_config: Dict, retention_seconds: int = 7 * 24 * 3600, prune_interval: float = 600,
+                 prune_batch: int = 5000):
+        self.db_config = db_config
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self.prune_batch = prune_batch
+        self._pruned_at = 0.0
+        self._schema_ready = False
+        self.last_write: Dict = {}
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        # جداول أنشأها _save_server_to_db قديماً بدون أعمدة الحالة
+        for column, definition in (
+            ('cpu_percent', 'FLOAT DEFAULT 0.0'),
+            ('memory_percent', 'FLOAT DEFAULT 0.0'),
+            ('sites_count', 'INT DEFAULT 0'),
+            ('status', "VARCHAR(20) DEFAULT 'unknown'"),
+        ):
+            cursor.execute(f"ALTER TABLE cluster_servers ADD COLUMN IF NOT EXISTS {column} {definition}")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_metrics_history (
+                server_id VARCHAR(50) NOT NULL,
+                sampled_at DATETIME(3) NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                cpu_percent FLOAT NULL,
+                memory_percent FLOAT NULL,
+                disk_percent FLOAT NULL,
+                response_time_ms FLOAT NULL,
+                connections INT NULL,
+                sites_count INT NULL,
+                pids INT NULL,
+                gunicorn_workers INT NULL,
+                background_workers INT NULL,
+                network_rx BIGINT UNSIGNED NULL,
+                network_tx BIGINT UNSIGNED NULL,
+                block_read BIGINT UNSIGNED NULL,
+                block_write BIGINT UNSIGNED NULL,
+                PRIMARY KEY (server_id, sampled_at),
+                INDEX idx_sampled_at (sampled_at)
+            )
+        """)
+        self._schema_ready = True
+
+    def record_sweep(self, results: List[Dict], sampled_at: Optional[datetime] = None) -> bool:
+        """
+        حفظ جولة فحص واحدة
+
+        results: [{server_id, ip, port, status, metrics (حقول HISTORY_FIELDS) أو None إذا لم تُجمع}]
+        """
+        if not results:
+            return True
+        sampled_at = sampled_at or datetime.now()
+        start = time.perf_counter()
+
+        server_rows, history_rows = [], []
+        for result in results:
+            metrics = result.get('metrics')
+            server_rows.append((
+                result['server_id'], result['ip'], result['port'], result['status'],
+                (metrics or {}).get('cpu_percent'), (metrics or {}).get('memory_percent'),
+                (metrics or {}).get('sites_count'), sampled_at
+            ))
+            history_rows.append((result['server_id'], sampled_at, result['status']) +
+                                tuple((metrics or {}).get(field) if metrics else None for field in HISTORY_FIELDS))
+
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                # السيرفر الذي لم تُجمع مقاييسه يحتفظ بآخر قيم معروفة
+                cursor.execute(f"""
+                    INSERT INTO cluster_servers
+                        (server_id, ip_address, port, status, cpu_percent, memory_percent, sites_count, last_health_check)
+                    VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(server_rows))}
+                    ON DUPLICATE KEY UPDATE
+                        status = VALUES(status),
+                        cpu_percent = COALESCE(VALUES(cpu_percent), cpu_percent),
+                        memory_percent = COALESCE(VALUES(memory_percent), memory_percent),
+                        sites_count = COALESCE(VALUES(sites_count), sites_count),
+                        last_health_check = VALUES(last_health_check)
+                """, [value for row in server_rows for value in row])
+
+                placeholders = '(' + ', '.join(['%s'] * (3 + len(HISTORY_FIELDS))) + ')'
+                cursor.execute(f"""
+                    INSERT IGNORE INTO cluster_metrics_history (server_id, sampled_at, status, {', '.join(HISTORY_FIELDS)})
+                    VALUES {', '.join([placeholders] * len(history_rows))}
+                """, [value for row in history_rows for value in row])
+                conn.commit()
+
+                pruned = self._prune(cursor, conn)
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل حفظ نتائج فحص الصحة: {e}")
+            return False
+
+        self.last_write = {
+            'servers': len(server_rows),
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+            'pruned': pruned,
+            'at': sampled_at.isoformat()
+        }
+        return True
+
+    def _prune(self, cursor, conn) -> int:
+        """حذف العينات الأقدم من مدة الاحتفاظ على دفعات (حتى لا تُقفل الجدول طويلاً)"""
+        if time.monotonic() - self._pruned_at < self.prune_interval:
+            return 0
+        self._pruned_at = time.monotonic()
+        total = 0
+        while True:
+            cursor.execute("""
+                DELETE FROM cluster_metrics_history
+                WHERE sampled_at < NOW(3) - INTERVAL %s SECOND
+                LIMIT %s
+            """, (self.retention_seconds, self.prune_batch))
+            conn.commit()
+            total += cursor.rowcount
+            if cursor.rowcount < self.prune_batch:
+                break
+        if total:
+            logger.info(f"🧹 حذف {total} عينة صحة أقدم من {self.retention_seconds // 3600} ساعة")
+        return total
+
+    def load_recent(self, seconds: int) -> Dict:
+        """
+        آخر حالة لكل سيرفر نشط وعينات آخر seconds ثانية
+
+        {'servers': {id: {status, cpu_percent, memory_percent, sites_count, age_seconds}},
+         'samples': {id: [(timestamp, {field: value})]}}
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            cursor.execute("""
+                SELECT server_id, status, cpu_percent, memory_percent, sites_count,
+                       TIMESTAMPDIFF(SECOND, last_health_check, NOW())
+                FROM cluster_servers
+                WHERE active = TRUE AND last_health_check IS NOT NULL
+            """)
+            servers = {
+                server_id: {'status': status, 'cpu_percent': cpu, 'memory_percent': memory,
+                            'sites_count': sites, 'age_seconds': age}
+                for server_id, status, cpu, memory, sites, age in cursor.fetchall()
+            }
+
+            # النطاق على idx_sampled_at؛ العينات بلا مقاييس (سيرفر لم يرد) لا تُستعاد
+            cursor.execute(f"""
+                SELECT server_id, sampled_at, {', '.join(HISTORY_FIELDS)}
+                FROM cluster_metrics_history
+                WHERE sampled_at >= NOW(3) - INTERVAL %s SECOND AND cpu_percent IS NOT NULL
+                ORDER BY sampled_at
+            """, (seconds,))
+            samples: Dict[str, List] = {}
+            for server_id, sampled_at, *values in cursor.fetchall():
+                metrics = {field: value for field, value in zip(HISTORY_FIELDS, values) if value is not None}
+                samples.setdefault(server_id, []).append((sampled_at.timestamp(), metrics))
+            cursor.close()
+        finally:
+            conn.close()
+        return {'servers': servers, 'samples': samples}
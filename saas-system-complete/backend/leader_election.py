@@ -0,0 +1,309 @@
+"""
+انتخاب قائد واحد لمراقبة الكلاستر بين كل عمليات الـ backend (على نفس المضيف أو عدة مضيفات)
+
+- القيادة صف lease في cluster_leader: الحامل + تاريخ انتهاء بساعة قاعدة البيانات (لا اعتماد على ساعات المضيفات)
+- كل عملية تحاول كل renew_interval ثانية: القائد يجدد، والبقية تأخذ الصف فقط إذا انتهت مدته
+- token يزيد مع كل قائد جديد (fencing) ويُرفق بكل snapshot منشور
+- القائد الذي لا يستطيع التجديد يتنحى قبل انتهاء مدته محلياً، فلا يوجد قائدان في نفس الوقت
+- التنحي الهادئ (خروج العامل) ينهي المدة فوراً فيتولى غيره في المحاولة التالية
+- أسوأ مدة للتولي بعد توقف مفاجئ = lease_seconds + renew_interval
+
+القائد ينشر حالة الصحة والمقاييس بعد كل جولة فحص في cluster_snapshots،
+والعمليات الأخرى تقرأ آخر نسخة (مع مقارنة generation كل refresh_interval ثانية) بدلاً من الفحص بنفسها.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """قيادة بصف lease في قاعدة البيانات"""
+
+    def __init__(self, db_config: Dict, name: str = 'cluster_monitor', lease_seconds: float = 20,
+                 renew_interval: float = 5, on_elected: Optional[Callable[[], None]] = None,
+                 on_demoted: Optional[Callable[[], None]] = None):
+        if renew_interval * 2 > lease_seconds:
+            raise ValueError("renew_interval يجب أن يكون أقل من نصف lease_seconds")
+        self.db_config = db_config
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.renew_interval = renew_interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self.is_leader = False
+        self.token: Optional[int] = None
+        self.holder: Optional[str] = None
+        self.elected_at: Optional[float] = None
+        self.transitions = 0
+        self._renewed_at = 0.0
+        self._schema_ready = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return mysql.connector.connect(**self.db_config, connect_timeout=3)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_leader (
+                name VARCHAR(50) PRIMARY KEY,
+                holder VARCHAR(255) NOT NULL DEFAULT '',
+                token BIGINT NOT NULL DEFAULT 0,
+                expires_at DATETIME(3) NOT NULL,
+                renewed_at DATETIME(3) NULL
+            )
+        """)
+        self._schema_ready = True
+
+    def _try_acquire(self) -> bool:
+        """أخذ أو تجديد القيادة في معاملة واحدة (SELECT ... FOR UPDATE على صف الـ lease)"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            cursor.execute("INSERT IGNORE INTO cluster_leader (name, expires_at) VALUES (%s, NOW(3))", (self.name,))
+            cursor.execute("""
+                SELECT holder, token, expires_at < NOW(3) FROM cluster_leader WHERE name = %s FOR UPDATE
+            """, (self.name,))
+            holder, token, expired = cursor.fetchone()
+
+            if holder != self.identity and not expired:
+                conn.rollback()
+                self.holder, self.token = holder, token
+                return False
+
+            token = token if holder == self.identity else token + 1
+            cursor.execute("""
+                UPDATE cluster_leader
+                SET holder = %s, token = %s, renewed_at = NOW(3),
+                    expires_at = NOW(3) + INTERVAL %s MICROSECOND
+                WHERE name = %s
+            """, (self.identity, token, int(self.lease_seconds * 1_000_000), self.name))
+            conn.commit()
+            cursor.close()
+            self.holder, self.token = self.identity, token
+            return True
+        finally:
+            conn.close()
+
+    def _become_leader(self):
+        self.is_leader = True
+        self.elected_at = time.time()
+        self.transitions += 1
+        logger.info(f"👑 {self.identity} أصبح قائد {self.name} (token {self.token})")
+        if self.on_elected:
+            try:
+                self.on_elected()
+            except Exception as e:
+                logger.error(f"❌ فشل بدء مهام القائد: {e}")
+
+    def _step_down(self, reason: str):
+        self.is_leader = False
+        self.elected_at = None
+        logger.warning(f"⚠️ {self.identity} تنحى عن قيادة {self.name}: {reason}")
+        if self.on_demoted:
+            try:
+                self.on_demoted()
+            except Exception as e:
+                logger.error(f"❌ فشل إيقاف مهام القائد: {e}")
+
+    def tick(self):
+        """محاولة واحدة: أخذ/تجديد القيادة أو التنحي"""
+        with self._lock:
+            # الوقت قبل الطلب: المدة في قاعدة البيانات تبدأ بعده، فالحساب المحلي متحفظ
+            attempt_at = time.monotonic()
+            try:
+                acquired = self._try_acquire()
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر تجديد قيادة {self.name}: {e}")
+                # المحاولة التالية قد تأتي بعد انتهاء المدة (renew_interval + مهلة الاتصال)، فالتنحي قبلها
+                if self.is_leader and time.monotonic() - self._renewed_at > self.lease_seconds - 2 * self.renew_interval:
+                    self._step_down("تعذر التجديد قبل انتهاء المدة")
+                return
+
+            if acquired:
+                self._renewed_at = attempt_at
+                if not self.is_leader:
+                    self._become_leader()
+            elif self.is_leader:
+                self._step_down(f"القيادة انتقلت إلى {self.holder}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.renew_interval)
+
+    def start(self):
+        """بدء المحاولات الدورية في thread خلفي"""
+        if self._thread and self._thread.is_alive():
+            return
+        # هوية جديدة عند البدء: نسخة منشأة قبل fork لا تتقاسم الهوية مع عملية أخرى
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"🗳️ {self.identity} يشارك في انتخاب {self.name}")
+
+    def stop(self, release: bool = True):
+        """إيقاف المحاولات والتنحي (مع إنهاء المدة فوراً حتى يتولى غيره)"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.renew_interval + 5)
+        with self._lock:
+            if self.is_leader:
+                self._step_down("إيقاف العملية")
+                if release:
+                    self.release()
+
+    def release(self):
+        """إنهاء مدة القيادة إذا كانت لهذه العملية"""
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE cluster_leader SET expires_at = NOW(3) WHERE name = %s AND holder = %s",
+                               (self.name, self.identity))
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحرير قيادة {self.name}: {e}")
+
+    def status(self) -> Dict:
+        return {
+            'name': self.name,
+            'identity': self.identity,
+            'is_leader': self.is_leader,
+            'holder': self.holder,
+            'token': self.token,
+            'elected_at': self.elected_at,
+            'lease_seconds': self.lease_seconds,
+            'renew_interval': self.renew_interval,
+            'transitions': self.transitions
+        }
+
+
+class LeaderSnapshotStore:
+    """آخر حالة نشرها القائد (صحة السيرفرات، المقاييس، الإحصائيات)"""
+
+    def __init__(self, db_config: Dict, name: str = 'cluster_monitor', refresh_interval: float = 2.0,
+                 failure_backoff: float = 30.0):
+        self.db_config = db_config
+        self.name = name
+        self.refresh_interval = refresh_interval
+        self.failure_backoff = failure_backoff
+        self._snapshot: Optional[Dict] = None
+        self._generation: Optional[int] = None
+        self._checked_at = 0.0
+        self._schema_ready = False
+        self._refresh_lock = threading.Lock()
+
+    def _connect(self):
+        return mysql.connector.connect(**self.db_config, connect_timeout=3)
+
+    def _ensure_schema(self, cursor):
+        if self._schema_ready:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_snapshots (
+                name VARCHAR(50) PRIMARY KEY,
+                generation BIGINT NOT NULL DEFAULT 0,
+                leader VARCHAR(255) NOT NULL,
+                token BIGINT NOT NULL,
+                payload MEDIUMTEXT NOT NULL,
+                published_at DATETIME(3) NOT NULL
+            )
+        """)
+        self._schema_ready = True
+
+    def publish(self, payload: Dict, leader: str, token: int) -> bool:
+        """
+        نشر حالة القائد
+
+        الكتابة مشروطة بأن token لا يقل عن المنشور (قائد سابق متأخر لا يكتب فوق القائد الجديد).
+        """
+        data = json.dumps(payload, default=str)
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                cursor.execute("""
+                    INSERT INTO cluster_snapshots (name, generation, leader, token, payload, published_at)
+                    VALUES (%s, 1, %s, %s, %s, NOW(3))
+                    ON DUPLICATE KEY UPDATE
+                        generation = IF(VALUES(token) >= token, generation + 1, generation),
+                        leader = IF(VALUES(token) >= token, VALUES(leader), leader),
+                        payload = IF(VALUES(token) >= token, VALUES(payload), payload),
+                        published_at = IF(VALUES(token) >= token, VALUES(published_at), published_at),
+                        token = GREATEST(token, VALUES(token))
+                """, (self.name, leader, token, data))
+                written = cursor.rowcount > 0
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ فشل نشر حالة الكلاستر: {e}")
+            return False
+        if not written:
+            logger.warning(f"⚠️ لم يُنشر snapshot: قائد أحدث من token {token}")
+        return written
+
+    def latest(self) -> Optional[Dict]:
+        """آخر snapshot (يُعاد تحميله إذا تغير generation، بفحص كل refresh_interval ثانية)"""
+        if time.monotonic() - self._checked_at >= self.refresh_interval and self._refresh_lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            finally:
+                self._refresh_lock.release()
+        return self._snapshot
+
+    def _refresh(self):
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                self._ensure_schema(cursor)
+                cursor.execute("SELECT generation FROM cluster_snapshots WHERE name = %s", (self.name,))
+                row = cursor.fetchone()
+                if row and row[0] != self._generation:
+                    cursor.execute("""
+                        SELECT generation, leader, token, payload,
+                               TIMESTAMPDIFF(MICROSECOND, published_at, NOW(3)) / 1000000
+                        FROM cluster_snapshots WHERE name = %s
+                    """, (self.name,))
+                    generation, leader, token, payload, age = cursor.fetchone()
+                    snapshot = json.loads(payload)
+                    snapshot['_meta'] = {
+                        'source': 'db',
+                        'generation': generation,
+                        'leader': leader,
+                        'token': token,
+                        'age_seconds': float(age),
+                        'loaded_at': time.time()
+                    }
+                    self._snapshot, self._generation = snapshot, generation
+                cursor.close()
+            finally:
+                conn.close()
+            self._checked_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر قراءة حالة الكلاستر المنشورة: {e}")
+            self._checked_at = time.monotonic() + self.failure_backoff
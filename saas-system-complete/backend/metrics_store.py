@@ -0,0 +1,240 @@
+"""
+سلاسل زمنية لمقاييس السيرفرات بذاكرة ثابتة
+
+لكل سيرفر ring buffer على مصفوفة numpy (عمود لكل مقياس) مع مصفوفة للأوقات:
+- الإضافة O(1) بدون نسخ
+- الاستعلامات (المتوسط، النسبة المئوية، المعدل) على نافذة زمنية قابلة للتحديد
+- التجميع عبر السيرفرات على مصفوفات numpy
+
+السعة = مدة الاحتفاظ / الدقة، مثلاً 3 ساعات بدقة ثانية = 10800 عينة
+(حوالي 800 كيلوبايت لكل سيرفر: المقاييس الآنية float32 والعدادات float64).
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+METRIC_FIELDS: Tuple[str, ...] = (
+    'cpu_percent',
+    'memory_percent',
+    'disk_percent',
+    'response_time_ms',
+    'connections',
+    'sites_count',
+    'pids',
+    'gunicorn_workers',
+    'background_workers',
+    'network_rx',
+    'network_tx',
+    'block_read',
+    'block_write',
+)
+
+# عدادات تراكمية - يُستعلم عنها كمعدل في الثانية
+COUNTER_FIELDS = ('network_rx', 'network_tx', 'block_read', 'block_write')
+
+
+class ServerTimeSeries:
+    """ring buffer لعينات سيرفر واحد"""
+
+    def __init__(self, capacity: int, fields: Tuple[str, ...] = METRIC_FIELDS, resolution: float = 1.0):
+        self.capacity = capacity
+        self.fields = fields
+        self.resolution = resolution
+        gauges = [field for field in fields if field not in COUNTER_FIELDS]
+        counters = [field for field in fields if field in COUNTER_FIELDS]
+        # المقاييس الآنية float32؛ العدادات التراكمية تتجاوز دقة float32 فتُخزن float64
+        self.gauges = np.full((capacity, len(gauges)), np.nan, dtype=np.float32)
+        self.counters = np.full((capacity, len(counters)), np.nan, dtype=np.float64)
+        self.columns = {field: (self.gauges, index) for index, field in enumerate(gauges)}
+        self.columns.update({field: (self.counters, index) for index, field in enumerate(counters)})
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+
+    @property
+    def nbytes(self) -> int:
+        """حجم المخزن بالبايت"""
+        return self.gauges.nbytes + self.counters.nbytes + self.timestamps.nbytes
+
+    def append(self, timestamp: float, metrics: Dict):
+        """إضافة عينة (المقاييس غير الموجودة تُخزن NaN)"""
+        position = self.head
+        if self.count:
+            last = (self.head - 1) % self.capacity
+            if timestamp < self.timestamps[last]:
+                # عينة أقدم من الأخيرة (ساعة غير رتيبة) - تُتجاهل للحفاظ على الترتيب
+                return
+            if timestamp - self.timestamps[last] < self.resolution:
+                # أكثر من عينة في نفس فترة الدقة: الأحدث تحل محل السابقة
+                position = last
+
+        for field, (array, index) in self.columns.items():
+            value = metrics.get(field)
+            array[position, index] = np.nan if value is None else value
+        self.timestamps[position] = timestamp
+        if position == self.head:
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def _ranges(self, seconds: Optional[float], now: Optional[float]) -> List[Tuple[int, int]]:
+        """نطاقات الفهارس داخل النافذة بالترتيب الزمني (نطاق أو اثنان)"""
+        if not self.count:
+            return []
+
+        if self.count < self.capacity:
+            segments = [(0, self.count)]
+        else:
+            # المخزن ممتلئ: الجزء الأقدم [head:] ثم الأحدث [:head]
+            segments = [(self.head, self.capacity), (0, self.head)]
+        segments = [(a, b) for a, b in segments if b > a]
+        if seconds is None:
+            return segments
+
+        since = (now or time.time()) - seconds
+        for position, (a, b) in enumerate(segments):
+            if self.timestamps[b - 1] >= since:
+                start = a + int(np.searchsorted(self.timestamps[a:b], since, side='left'))
+                return [(start, b)] + segments[position + 1:]
+        return []
+
+    def column(self, field: str, seconds: Optional[float] = None, now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(الأوقات، القيم) لمقياس واحد داخل النافذة - نسخ العمود المطلوب فقط"""
+        array, index = self.columns[field]
+        ranges = self._ranges(seconds, now)
+        if not ranges:
+            return self.timestamps[:0], array[:0, index]
+        if len(ranges) == 1:
+            a, b = ranges[0]
+            return self.timestamps[a:b], array[a:b, index]
+        return (np.concatenate([self.timestamps[a:b] for a, b in ranges]),
+                np.concatenate([array[a:b, index] for a, b in ranges]))
+
+    def latest(self, field: str) -> Optional[float]:
+        """آخر قيمة"""
+        if not self.count:
+            return None
+        array, index = self.columns[field]
+        value = array[(self.head - 1) % self.capacity, index]
+        return None if np.isnan(value) else float(value)
+
+    def mean(self, field: str, seconds: float, now: Optional[float] = None) -> Optional[float]:
+        """المتوسط المتحرك"""
+        _, values = self.column(field, seconds, now)
+        values = values[~np.isnan(values)]
+        return float(values.mean()) if len(values) else None
+
+    def percentile(self, field: str, seconds: float, q: float = 95, now: Optional[float] = None) -> Optional[float]:
+        """النسبة المئوية داخل النافذة"""
+        _, values = self.column(field, seconds, now)
+        values = values[~np.isnan(values)]
+        return float(np.percentile(values, q)) if len(values) else None
+
+    def rate(self, field: str, seconds: float, now: Optional[float] = None) -> Optional[float]:
+        """معدل التغير في الثانية لعداد تراكمي (إعادة التصفير عند إعادة تشغيل الحاوية تُتجاهل)"""
+        timestamps, values = self.column(field, seconds, now)
+        mask = ~np.isnan(values)
+        timestamps, values = timestamps[mask], values[mask]
+        if len(values) < 2:
+            return None
+        elapsed = timestamps[-1] - timestamps[0]
+        if elapsed <= 0:
+            return None
+        deltas = np.diff(values)
+        return float(deltas[deltas > 0].sum() / elapsed)
+
+
+class MetricsStore:
+    """سلاسل زمنية لكل السيرفرات"""
+
+    def __init__(self, retention_seconds: int = 3 * 3600, resolution: float = 1.0,
+                 fields: Tuple[str, ...] = METRIC_FIELDS):
+        self.retention_seconds = retention_seconds
+        self.resolution = resolution
+        self.capacity = max(2, int(retention_seconds / resolution))
+        self.fields = fields
+        self.series: Dict[str, ServerTimeSeries] = {}
+        self._lock = threading.Lock()
+
+    def record(self, server_id: str, metrics: Dict, timestamp: Optional[float] = None):
+        """إضافة عينة لسيرفر"""
+        with self._lock:
+            series = self.series.get(server_id)
+            if series is None:
+                series = self.series[server_id] = ServerTimeSeries(self.capacity, self.fields, self.resolution)
+            series.append(timestamp or time.time(), metrics)
+
+    def remove(self, server_id: str):
+        """حذف سلسلة سيرفر أزيل"""
+        with self._lock:
+            self.series.pop(server_id, None)
+
+    def _stat(self, series: ServerTimeSeries, field: str, seconds: float, stat: str, now: Optional[float]):
+        """إحصائية واحدة (mean | p95 | max | rate | latest) لسلسلة"""
+        if stat == 'mean':
+            return series.mean(field, seconds, now)
+        if stat == 'p95':
+            return series.percentile(field, seconds, 95, now)
+        if stat == 'max':
+            return series.percentile(field, seconds, 100, now)
+        if stat == 'rate':
+            return series.rate(field, seconds, now)
+        if stat == 'latest':
+            return series.latest(field)
+        raise ValueError(f"إحصائية غير معروفة: {stat}")
+
+    def server_values(self, field: str, seconds: float, server_ids: Iterable[str], stat: str = 'mean',
+                      now: Optional[float] = None) -> np.ndarray:
+        """قيمة الإحصائية لكل سيرفر كمصفوفة (NaN للسيرفر بدون بيانات)"""
+        with self._lock:
+            series = [self.series.get(server_id) for server_id in server_ids]
+            values = [self._stat(s, field, seconds, stat, now) if s else None for s in series]
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    def aggregate(self, field: str, seconds: float, server_ids: Iterable[str], stat: str = 'mean',
+                  reduce: str = 'mean', now: Optional[float] = None) -> Optional[float]:
+        """تجميع إحصائية السيرفرات (mean | max | min | sum) - None إذا لا توجد بيانات"""
+        values = self.server_values(field, seconds, server_ids, stat, now)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return None
+        return float(getattr(np, reduce)(values))
+
+    def cluster_percentile(self, field: str, seconds: float, server_ids: Iterable[str], q: float = 95,
+                           now: Optional[float] = None) -> Optional[float]:
+        """النسبة المئوية لكل عينات السيرفرات معاً داخل النافذة"""
+        with self._lock:
+            columns = [self.series[s].column(field, seconds, now)[1] for s in server_ids if s in self.series]
+        if not columns:
+            return None
+        values = np.concatenate(columns)
+        values = values[~np.isnan(values)]
+        return float(np.percentile(values, q)) if len(values) else None
+
+    def summary(self, server_id: str, seconds: float, now: Optional[float] = None) -> Dict:
+        """ملخص سيرفر: المتوسط و p95 للمقاييس الآنية ومعدل العدادات"""
+        with self._lock:
+            series = self.series.get(server_id)
+            if series is None:
+                return {}
+            result = {'samples': int(len(series.column(self.fields[0], seconds, now)[0]))}
+            for field in self.fields:
+                if field in COUNTER_FIELDS:
+                    value = series.rate(field, seconds, now)
+                    if value is not None:
+                        result[f"{field}_per_sec"] = round(value, 1)
+                else:
+                    mean = series.mean(field, seconds, now)
+                    if mean is not None:
+                        result[field] = {
+                            'mean': round(mean, 2),
+                            'p95': round(series.percentile(field, seconds, 95, now), 2)
+                        }
+            return result
+
+    def memory_bytes(self) -> int:
+        """حجم الذاكرة المستخدمة للمخازن"""
+        with self._lock:
+            return sum(s.nbytes for s in self.series.values())
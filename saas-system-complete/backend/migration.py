@@ -0,0 +1,394 @@
+"""
+ترحيل المواقع بين سيرفرات التطبيق
+
+المراحل لكل موقع:
+1. precheck  - الموقع موجود على المصدر وغير موجود على الهدف
+2. copy      - نسخ مجلد الموقع (أو نسخة احتياطية) من حاوية المصدر إلى الهدف عبر pipe بدون ملفات وسيطة
+3. verify    - الهدف يخدم الموقع (HTTP مع ترويسة Host مباشرة على السيرفر، قبل تحويل المرور)
+4. cutover   - وضع الصيانة على المصدر، مزامنة نهائية، تحويل Nginx ذرياً، إلغاء الصيانة على الهدف
+5. cleanup   - نقل نسخة المصدر إلى migrated-sites/ (لا حذف مباشر)؛ فشله لا يلغي الترحيل (cleanup_pending)
+
+الاستراتيجيات (MIGRATION_STRATEGY):
+- shared_db (افتراضي): كل السيرفرات تستخدم نفس MariaDB، فيكفي نقل مجلد الموقع (الإعدادات والملفات)
+- backup: قواعد بيانات منفصلة - bench backup --with-files على المصدر ثم bench new-site --source_sql على الهدف
+
+أي فشل قبل حفظ التعيين يعيد الحالة تلقائياً: التوجيه للمصدر، إلغاء الصيانة، حذف نسخة الهدف.
+عدد الترحيلات المتزامنة محدود (max_concurrent_migrations) حتى لا تُشبع قاعدة البيانات والقرص.
+"""
+
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tracing import tracer, with_current_context
+
+logger = logging.getLogger(__name__)
+
+BENCH_PATH = os.environ.get('BENCH_PATH', '/home/frappe/production')
+STRATEGY_SHARED_DB = 'shared_db'
+STRATEGY_BACKUP = 'backup'
+
+
+class MigrationError(Exception):
+    """فشل مرحلة ترحيل"""
+
+
+@dataclass
+class SiteMigration:
+    """سجل ترحيل موقع واحد"""
+    site: str
+    source: str
+    target: str
+    migration_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: str = 'pending'  # pending | running | completed | rolled_back | failed | skipped
+    stage: str = ''
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cutover_ms: Optional[float] = None
+    stages_ms: Dict[str, float] = field(default_factory=dict)
+    assignment_version: Optional[int] = None
+    # الترحيل اكتمل لكن نسخة المصدر لم تُبعد إلى migrated-sites/
+    cleanup_pending: bool = False
+
+
+class ContainerShell:
+    """تنفيذ أوامر في حاويات سيرفرات التطبيق عبر docker exec"""
+
+    def __init__(self, workdir: str = BENCH_PATH, timeout: int = 600):
+        self.workdir = workdir
+        self.timeout = timeout
+
+    def _docker_exec(self, container: str, script: str, interactive: bool = False) -> List[str]:
+        cmd = ['docker', 'exec'] + tracer.docker_env_args() + ['-w', self.workdir]
+        if interactive:
+            cmd.append('-i')
+        return cmd + [container, 'bash', '-c', script]
+
+    def run(self, container: str, script: str, timeout: Optional[int] = None) -> str:
+        """تنفيذ سكربت وإرجاع stdout (MigrationError عند الفشل)"""
+        result = subprocess.run(self._docker_exec(container, script), capture_output=True, text=True,
+                                timeout=timeout or self.timeout)
+        if result.returncode != 0:
+            raise MigrationError(f"{container}: {(result.stderr or result.stdout).strip()[:500]}")
+        return result.stdout
+
+    def stream(self, source: str, read_script: str, target: str, write_script: str,
+               timeout: Optional[int] = None) -> None:
+        """stdout سكربت المصدر -> stdin سكربت الهدف (tar عبر pipe بين الحاويتين)"""
+        reader = subprocess.Popen(self._docker_exec(source, read_script), stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
+        try:
+            writer = subprocess.run(self._docker_exec(target, write_script, interactive=True),
+                                    stdin=reader.stdout, capture_output=True, timeout=timeout or self.timeout)
+        finally:
+            reader.stdout.close()
+        reader_err = reader.stderr.read().decode(errors='replace')
+        reader.stderr.close()
+        if reader.wait(timeout=30) != 0:
+            raise MigrationError(f"{source}: {reader_err.strip()[:500]}")
+        if writer.returncode != 0:
+            raise MigrationError(f"{target}: {writer.stderr.decode(errors='replace').strip()[:500]}")
+
+
+class MigrationEngine:
+    """ترحيل المواقع مع حد للتزامن وإعادة تلقائية عند الفشل"""
+
+    def __init__(self, cluster_manager, max_concurrent: int = 2, strategy: str = STRATEGY_SHARED_DB,
+                 verify_timeout: float = 60.0, shell: Optional[ContainerShell] = None,
+                 router: Optional[Callable[[str, str], Tuple[bool, str]]] = None):
+        self.cluster_manager = cluster_manager
+        self.max_concurrent = max(1, max_concurrent)
+        self.strategy = strategy
+        self.verify_timeout = verify_timeout
+        self.shell = shell or ContainerShell()
+        self._router = router
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="migration")
+        self._lock = threading.Lock()
+        self._active_sites: Dict[str, SiteMigration] = {}
+        self.history: deque = deque(maxlen=200)
+
+    def _switch_route(self, site: str, server_id: str) -> Tuple[bool, str]:
+        """تحويل Nginx للموقع إلى السيرفر"""
+        info = self.cluster_manager._get_server_info(server_id)
+        upstream = f"{info['ip']}:{info['port']}"
+        if self._router:
+            return self._router(site, upstream)
+        return self.cluster_manager.load_balancer.switch_site_upstream(site, upstream)
+
+    def _stage(self, migration: SiteMigration, name: str, func, *args):
+        """تنفيذ مرحلة مع قياس مدتها"""
+        migration.stage = name
+        start = time.perf_counter()
+        with tracer.start_span(f"migration.{name}", site=migration.site, source=migration.source,
+                               target=migration.target):
+            result = func(*args)
+        migration.stages_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    # --- المراحل ---
+
+    def _precheck(self, migration: SiteMigration):
+        assignments = self.cluster_manager.assignments
+        current = assignments.server_of(migration.site)
+        if current is not None and current != migration.source:
+            raise MigrationError(f"الموقع {migration.site} على {current} وليس {migration.source}")
+        migration.assignment_version = assignments.version_of(migration.site)
+
+        site = shlex.quote(migration.site)
+        self.shell.run(migration.source, f"test -f sites/{site}/site_config.json")
+        exists = self.shell.run(migration.target, f"test -e sites/{site} && echo yes || echo no").strip()
+        if exists == 'yes':
+            raise MigrationError(f"الموقع {migration.site} موجود مسبقاً على {migration.target}")
+
+    def _copy_site_dir(self, migration: SiteMigration):
+        site = shlex.quote(migration.site)
+        self.shell.stream(
+            migration.source, f"tar -C sites -cf - {site}",
+            migration.target, "tar -C sites -xf -"
+        )
+
+    def _copy_backup(self, migration: SiteMigration):
+        """نسخة احتياطية كاملة على المصدر -> استعادة على الهدف (قواعد بيانات منفصلة)"""
+        site = shlex.quote(migration.site)
+        backup_dir = f"/tmp/migration-{migration.migration_id}"
+        self.shell.run(migration.source,
+                       f"bench --site {site} backup --with-files --backup-path {backup_dir}")
+        self.shell.stream(
+            migration.source, f"tar -C {backup_dir} -cf - . && rm -rf {backup_dir}",
+            migration.target, f"mkdir -p {backup_dir} && tar -C {backup_dir} -xf -"
+        )
+        password = shlex.quote(os.environ.get('MIGRATION_DB_ROOT_PASSWORD', ''))
+        # موقع جديد من ملف SQL، ثم الملفات، ثم encryption_key الأصلي (لفك كلمات المرور المشفرة)
+        self.shell.run(migration.target, (
+            f"set -e; "
+            f"db=$(ls -1 {backup_dir}/*-database.sql.gz | head -1); "
+            f"bench new-site {site} --db-root-password {password} --admin-password $(head -c 12 /dev/urandom | od -An -tx1 | tr -d ' \\n') "
+            f"--source_sql $db; "
+            f"for files in {backup_dir}/*-files.tar; do if [ -f \"$files\" ]; then tar -C sites -xf \"$files\"; fi; done; "
+            f"config=$(ls -1 {backup_dir}/*-site_config_backup.json 2>/dev/null | head -1); "
+            f"if [ -n \"$config\" ]; then "
+            f"key=$(python3 -c \"import json,sys; print(json.load(open(sys.argv[1])).get('encryption_key', ''))\" $config); "
+            f"if [ -n \"$key\" ]; then bench --site {site} set-config encryption_key \"$key\"; fi; fi; "
+            f"rm -rf {backup_dir}"
+        ), timeout=3600)
+
+    def _verify(self, migration: SiteMigration):
+        """الهدف يخدم الموقع مباشرة (بدون المرور عبر Nginx)"""
+        info = self.cluster_manager._get_server_info(migration.target)
+        url = f"http://{info['ip']}:{info['port']}/api/method/version"
+        deadline = time.monotonic() + self.verify_timeout
+        last_error = ''
+        while time.monotonic() < deadline:
+            try:
+                response = self.cluster_manager.http.get(url, headers={'Host': migration.site}, timeout=(1.0, 5.0))
+                if response.status_code == 200:
+                    return
+                last_error = f"HTTP {response.status_code}"
+            except Exception as e:
+                last_error = str(e)
+            time.sleep(1)
+        raise MigrationError(f"الموقع لا يستجيب على {migration.target}: {last_error}")
+
+    def _set_maintenance(self, container: str, site: str, enabled: bool):
+        self.shell.run(container, f"bench --site {shlex.quote(site)} set-maintenance-mode {'on' if enabled else 'off'}")
+
+    def _remove_target_copy(self, migration: SiteMigration):
+        """حذف نسخة الهدف (مع قاعدة البيانات في استراتيجية backup)"""
+        site = shlex.quote(migration.site)
+        if self.strategy == STRATEGY_BACKUP:
+            password = shlex.quote(os.environ.get('MIGRATION_DB_ROOT_PASSWORD', ''))
+            self.shell.run(migration.target, f"bench drop-site {site} --force --no-backup --db-root-password {password} "
+                                             f"|| rm -rf sites/{site}")
+        else:
+            self.shell.run(migration.target, f"rm -rf sites/{site}")
+
+    def _cleanup_source(self, migration: SiteMigration):
+        """إبعاد نسخة المصدر خارج sites/ (تبقى للاستعادة اليدوية)"""
+        site = shlex.quote(migration.site)
+        self.shell.run(migration.source,
+                       f"mkdir -p migrated-sites && mv sites/{site} migrated-sites/{site}-{migration.migration_id}")
+
+    # --- التنفيذ ---
+
+    def _run(self, migration: SiteMigration) -> SiteMigration:
+        """ترحيل موقع واحد (داخل حد التزامن)"""
+        site, source, target = migration.site, migration.source, migration.target
+        copied = maintenance = switched = False
+        migration.status = 'running'
+        migration.started_at = time.time()
+        logger.info(f"🚚 بدء ترحيل {site}: {source} -> {target} ({self.strategy})")
+
+        try:
+            self._stage(migration, 'precheck', self._precheck, migration)
+
+            if self.strategy == STRATEGY_SHARED_DB:
+                # نسخ أولي والموقع ما زال يُخدم من المصدر، ثم التحقق قبل أي توقف
+                copied = True
+                self._stage(migration, 'copy', self._copy_site_dir, migration)
+                self._stage(migration, 'verify', self._verify, migration)
+
+            # نافذة التحويل: من تفعيل الصيانة على المصدر حتى إلغائها على الهدف
+            cutover_start = time.perf_counter()
+            maintenance = True
+            self._stage(migration, 'maintenance_on', self._set_maintenance, source, site, True)
+
+            if self.strategy == STRATEGY_SHARED_DB:
+                # مزامنة نهائية للملفات المرفوعة أثناء النسخ الأولي
+                self._stage(migration, 'final_sync', self._copy_site_dir, migration)
+            else:
+                copied = True
+                self._stage(migration, 'backup_restore', self._copy_backup, migration)
+
+            success, message = self._stage(migration, 'switch', self._switch_route, site, target)
+            if not success:
+                raise MigrationError(message)
+            switched = True
+
+            self._stage(migration, 'maintenance_off', self._set_maintenance, target, site, False)
+            migration.cutover_ms = round((time.perf_counter() - cutover_start) * 1000, 1)
+
+            if self.strategy == STRATEGY_BACKUP:
+                self._stage(migration, 'verify', self._verify, migration)
+
+            # التعيين بشرط عدم تغيره منذ precheck (وإلا تراجع: عملية أخرى غيرت مكان الموقع)
+            assigned = self._stage(migration, 'assign', self.cluster_manager.assignments.assign,
+                                   site, target, migration.assignment_version)
+            if not assigned:
+                raise MigrationError(f"تعذر حفظ تعيين {site} إلى {target}")
+
+            # بعد التعيين لا تراجع: الموقع يُخدم من الهدف والتوجيه والتعيين متفقان، ونسخة المصدر
+            # التي تعذر إبعادها تبقى معلقة للتنظيف اليدوي
+            migration.status = 'completed'
+            try:
+                self._stage(migration, 'cleanup', self._cleanup_source, migration)
+            except Exception as e:
+                migration.cleanup_pending = True
+                migration.error = f"cleanup: {e}"
+                logger.warning(f"⚠️ تعذر إبعاد نسخة {site} على {source} بعد الترحيل: {e}")
+            logger.info(f"✅ تم ترحيل {site} إلى {target} (نافذة التحويل {migration.cutover_ms} مللي ثانية)")
+
+        except Exception as e:
+            migration.error = str(e)
+            logger.error(f"❌ فشل ترحيل {site} في مرحلة {migration.stage}: {e}")
+            migration.status = 'rolled_back' if self._rollback(migration, copied, maintenance, switched) else 'failed'
+
+        migration.finished_at = time.time()
+        return migration
+
+    def _rollback(self, migration: SiteMigration, copied: bool, maintenance: bool, switched: bool) -> bool:
+        """إعادة الموقع للمصدر - True إذا نجحت كل الخطوات"""
+        site, source = migration.site, migration.source
+        ok = True
+        steps = []
+        if switched:
+            steps.append(('route', lambda: self._switch_route(site, source)))
+        if maintenance:
+            steps.append(('maintenance', lambda: self._set_maintenance(source, site, False)))
+        if copied:
+            steps.append(('target_copy', lambda: self._remove_target_copy(migration)))
+
+        for name, step in steps:
+            try:
+                result = step()
+                if isinstance(result, tuple) and not result[0]:
+                    raise MigrationError(result[1])
+            except Exception as e:
+                ok = False
+                logger.error(f"❌ فشل التراجع ({name}) لترحيل {site}: {e}")
+        if ok:
+            logger.info(f"↩️ تم التراجع عن ترحيل {site} - الموقع على {source}")
+        return ok
+
+    def _execute(self, migration: SiteMigration, guard: Optional[Callable[[], bool]] = None) -> SiteMigration:
+        with self._slots:
+            try:
+                # الشرط يُفحص عند البدء الفعلي وليس عند الجدولة (مثلاً: ما زالت العملية قائد المراقبة)
+                if guard is not None and not guard():
+                    migration.status = 'skipped'
+                    migration.error = 'لم يبدأ الترحيل - شرط البدء لم يعد متحققاً'
+                    migration.finished_at = time.time()
+                    logger.info(f"⏭️ تخطي ترحيل {migration.site}: {migration.source} -> {migration.target}")
+                    return migration
+                return self._run(migration)
+            finally:
+                with self._lock:
+                    self._active_sites.pop(migration.site, None)
+                    self.history.append(migration)
+
+    def submit(self, site: str, source: str, target: str, guard: Optional[Callable[[], bool]] = None):
+        """جدولة ترحيل (Future) - يرفض الموقع الذي يُرحل حالياً"""
+        migration = SiteMigration(site=site, source=source, target=target)
+        with self._lock:
+            if site in self._active_sites:
+                raise MigrationError(f"الموقع {site} قيد الترحيل")
+            self._active_sites[site] = migration
+        return self._executor.submit(with_current_context(self._execute), migration, guard)
+
+    def submit_many(self, moves: List[Dict], guard: Optional[Callable[[], bool]] = None) -> List[Future]:
+        """
+        جدولة قائمة نقل [{site, from, to}] دون انتظار
+
+        الموقع المرفوض (قيد ترحيل آخر) يعود كـ Future منتهٍ بحالة failed.
+        """
+        futures = []
+        for move in moves:
+            try:
+                futures.append(self.submit(move['site'], move['from'], move['to'], guard))
+            except MigrationError as e:
+                rejected = Future()
+                rejected.set_result(SiteMigration(site=move['site'], source=move['from'], target=move['to'],
+                                                  status='failed', error=str(e)))
+                futures.append(rejected)
+        return futures
+
+    def active_sites(self) -> List[str]:
+        """المواقع قيد الترحيل (أو في الانتظار)"""
+        with self._lock:
+            return list(self._active_sites)
+
+    def migrate(self, site: str, source: str, target: str) -> SiteMigration:
+        """ترحيل موقع واحد وانتظار النتيجة"""
+        return self.submit(site, source, target).result()
+
+    def migrate_many(self, moves: List[Dict]) -> Dict:
+        """ترحيل قائمة نقل [{site, from, to}] بحد التزامن - ملخص النتائج"""
+        return summarize_migrations([future.result() for future in self.submit_many(moves)])
+
+    def status(self) -> Dict:
+        """الترحيلات الجارية وآخر النتائج"""
+        with self._lock:
+            active = [asdict(m) for m in self._active_sites.values()]
+            recent = [asdict(m) for m in list(self.history)[-20:]]
+        return {
+            'strategy': self.strategy,
+            'max_concurrent': self.max_concurrent,
+            'active': active,
+            'recent': recent
+        }
+
+
+def summarize_migrations(results: List[SiteMigration]) -> Dict:
+    """ملخص نتائج دفعة ترحيل"""
+    completed = [m for m in results if m.status == 'completed']
+    cutovers = sorted(m.cutover_ms for m in completed if m.cutover_ms is not None)
+    return {
+        'total': len(results),
+        'completed': len(completed),
+        'rolled_back': sum(1 for m in results if m.status == 'rolled_back'),
+        'failed': sum(1 for m in results if m.status == 'failed'),
+        'skipped': sum(1 for m in results if m.status == 'skipped'),
+        'cleanup_pending': sum(1 for m in results if m.cleanup_pending),
+        'max_cutover_ms': cutovers[-1] if cutovers else None,
+        'migrations': [asdict(m) for m in results]
+    }
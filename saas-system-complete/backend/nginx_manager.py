@@ -1,10 +1,17 @@
+import shlex
 import subprocess
 import logging
-from typing import Tuple, List
+from typing import Dict, Tuple, List, Optional
+from tracing import tracer
+from circuit_breaker import breakers, docker_failure, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# سيرفر التطبيق الافتراضي للمواقع الجديدة
+DEFAULT_SERVER_ID = "app-server-1"
+DEFAULT_UPSTREAM = f"{DEFAULT_SERVER_ID}:8000"
+
 class NginxManager:
     """مدير لإعدادات Nginx"""
 
@@ -12,22 +19,28 @@ class NginxManager:
         self.nginx_conf_dir = "/etc/nginx/conf.d/dynamic"
         self.proxy_server = "proxy-server"  # اسم حاوية nginx الرئيسية
 
-    def execute_nginx_command(self, command: str) -> Tuple[bool, str]:
-        """تنفيذ أوامر Nginx في حاوية proxy-server"""
+    def execute_nginx_command(self, command: str, input_data: Optional[str] = None) -> Tuple[bool, str]:
+        """تنفيذ أوامر Nginx في حاوية proxy-server (input_data يُمرر عبر stdin)"""
         try:
-            docker_cmd = [
-                "docker", "exec", self.proxy_server,
-                "bash", "-c", command
-            ]
+            docker_cmd = ["docker", "exec"] + tracer.docker_env_args()
+            if input_data is not None:
+                docker_cmd.append("-i")
+            docker_cmd += [self.proxy_server, "bash", "-c", command]
 
             logger.info(f"🔧 تنفيذ أمر Nginx: {command}")
 
-            result = subprocess.run(
-                docker_cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            with tracer.start_span('nginx.exec', command=command.split()[0] if command.split() else '') as span:
+                # حاوية proxy-server عالقة أو متوقفة: رفض فوري بعد عدة فشل بدلاً من 30 ثانية لكل أمر
+                result = breakers.get(f"docker:{self.proxy_server}").call(
+                    subprocess.run,
+                    docker_cmd,
+                    input=input_data,
+                    capture_output=True,
+                    text=True,
+                    timeout=30,
+                    is_failure=docker_failure
+                )
+                span.set_attribute('returncode', result.returncode)
 
             if result.returncode == 0:
                 logger.info(f"✅ نجاح أمر Nginx: {command}")
@@ -36,17 +49,20 @@ class NginxManager:
                 logger.error(f"❌ فشل أمر Nginx: {result.stderr.strip()}")
                 return False, result.stderr.strip()
 
+        except CircuitOpenError as e:
+            logger.warning(f"⚠️ لم يُنفذ أمر Nginx: {e}")
+            return False, str(e)
         except Exception as e:
             logger.exception("خطأ أثناء تنفيذ أمر Nginx")
             return False, str(e)
 
-    def create_site_config(self, site_name: str) -> Tuple[bool, str]:
-        """إنشاء تكوين Nginx للموقع الجديد"""
-        try:
-            config_filename = site_name.replace('.', '_') + ".conf"
-            config_path = f"{self.nginx_conf_dir}/{config_filename}"
+    def config_filename(self, site_name: str) -> str:
+        """اسم ملف تكوين الموقع"""
+        return site_name.replace('.', '_') + ".conf"
 
-            nginx_config = f"""
+    def _render_site_config(self, site_name: str, upstream: str = DEFAULT_UPSTREAM) -> str:
+        """نص تكوين Nginx للموقع"""
+        return f"""
 # {site_name} - Auto-generated configuration
 server {{
     listen 80;
@@ -56,7 +72,7 @@ server {{
     error_log /var/log/nginx/{site_name.replace('.', '_')}_error.log;
 
     location / {{
-        proxy_pass http://app-server-1:8000;
+        proxy_pass http://{upstream};
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -68,7 +84,7 @@ server {{
     }}
 
     location /assets {{
-        proxy_pass http://app-server-1:8000;
+        proxy_pass http://{upstream};
         proxy_set_header Host $host;
         expires 1y;
         add_header Cache-Control "public, immutable";
@@ -76,6 +92,14 @@ server {{
 }}
 """
 
+    def create_site_config(self, site_name: str) -> Tuple[bool, str]:
+        """إنشاء تكوين Nginx للموقع الجديد"""
+        try:
+            config_filename = site_name.replace('.', '_') + ".conf"
+            config_path = f"{self.nginx_conf_dir}/{config_filename}"
+
+            nginx_config = self._render_site_config(site_name)
+
             command = f"mkdir -p {self.nginx_conf_dir} && echo \"{nginx_config}\" > {config_path}"
             success, output = self.execute_nginx_command(command)
 
@@ -99,6 +123,121 @@ server {{
             logger.exception("خطأ في إنشاء تكوين Nginx")
             return False, str(e)
 
+    def create_site_configs(self, site_names: List[str]) -> Tuple[bool, str]:
+        """
+        إنشاء تكوينات عدة مواقع مع اختبار وإعادة تحميل واحدة لـ Nginx
+
+        الملفات تُكتب بأمر docker exec واحد عبر stdin (heredoc بعلامات اقتباس
+        حتى لا تُفسر متغيرات Nginx مثل $host).
+        """
+        try:
+            if not site_names:
+                return True, "لا توجد مواقع"
+
+            script_parts = [f"mkdir -p {self.nginx_conf_dir}"]
+            for i, site_name in enumerate(site_names):
+                config_path = f"{self.nginx_conf_dir}/{self.config_filename(site_name)}"
+                marker = f"SITE_CONFIG_EOF_{i}"
+                script_parts.append(f"cat > {config_path} <<'{marker}'\n{self._render_site_config(site_name)}\n{marker}")
+
+            success, output = self.execute_nginx_command("bash -s", input_data="\n".join(script_parts) + "\n")
+            if not success:
+                return False, f"فشل إنشاء ملفات التكوين: {output}"
+
+            test_success, test_output = self.execute_nginx_command("nginx -t")
+            if not test_success:
+                return False, f"فشل اختبار تكوين Nginx: {test_output}"
+
+            reload_success, reload_output = self.execute_nginx_command("nginx -s reload")
+            if not reload_success:
+                return False, f"فشل إعادة تحميل Nginx: {reload_output}"
+
+            logger.info(f"✅ تم إنشاء تكوين Nginx لـ {len(site_names)} موقع مع إعادة تحميل واحدة")
+            return True, f"تم إنشاء {len(site_names)} تكوين وإعادة تحميل Nginx"
+
+        except Exception as e:
+            logger.exception("خطأ في إنشاء تكوينات Nginx الجماعية")
+            return False, str(e)
+
+    def switch_site_upstream(self, site_name: str, upstream: str) -> Tuple[bool, str]:
+        """
+        توجيه الموقع إلى سيرفر تطبيق آخر بشكل ذري
+
+        التكوين الجديد يُكتب لملف مؤقت ثم يحل محل القديم بـ mv (rename ذري)، وإذا فشل
+        nginx -t يُعاد الملف السابق؛ إعادة التحميل graceful فلا تنقطع الطلبات الجارية.
+        """
+        try:
+            config_path = f"{self.nginx_conf_dir}/{self.config_filename(site_name)}"
+            script = (
+                f"set -e\n"
+                f"mkdir -p {self.nginx_conf_dir}\n"
+                f"cat > {config_path}.new\n"
+                f"[ -f {config_path} ] && cp -p {config_path} {config_path}.prev || rm -f {config_path}.prev\n"
+                f"mv -f {config_path}.new {config_path}\n"
+                f"if ! nginx -t 2>&1; then\n"
+                f"  if [ -f {config_path}.prev ]; then mv -f {config_path}.prev {config_path}; else rm -f {config_path}; fi\n"
+                f"  exit 1\n"
+                f"fi\n"
+                f"rm -f {config_path}.prev\n"
+                f"nginx -s reload\n"
+            )
+            success, output = self.execute_nginx_command(
+                f"bash -c {shlex.quote(script)}",
+                input_data=self._render_site_config(site_name, upstream)
+            )
+            if not success:
+                return False, f"فشل تحويل {site_name} إلى {upstream}: {output}"
+
+            logger.info(f"🔀 تم توجيه {site_name} إلى {upstream}")
+            return True, f"تم توجيه {site_name} إلى {upstream}"
+
+        except Exception as e:
+            logger.exception("خطأ في تحويل توجيه الموقع")
+            return False, str(e)
+
+    def switch_sites_upstream(self, routes: Dict[str, str]) -> Tuple[bool, str]:
+        """
+        توجيه عدة مواقع {site: upstream} دفعة واحدة
+
+        أمر docker exec واحد: كتابة كل الملفات الجديدة ثم استبدالها، اختبار واحد وإعادة تحميل واحدة.
+        إذا فشل nginx -t تُعاد كل الملفات السابقة (كل المواقع أو لا شيء).
+        """
+        try:
+            if not routes:
+                return True, "لا توجد مواقع"
+
+            paths = [f"{self.nginx_conf_dir}/{self.config_filename(site_name)}" for site_name in routes]
+            script_parts = ["set -e", f"mkdir -p {self.nginx_conf_dir}"]
+            for i, (path, (site_name, upstream)) in enumerate(zip(paths, routes.items())):
+                marker = f"ROUTE_CONFIG_EOF_{i}"
+                script_parts.append(f"cat > {path}.new <<'{marker}'\n"
+                                    f"{self._render_site_config(site_name, upstream)}\n{marker}")
+            script_parts.append(f"paths='{' '.join(paths)}'")
+            script_parts.append(
+                "for p in $paths; do\n"
+                "  if [ -f $p ]; then cp -p $p $p.prev; else rm -f $p.prev; fi\n"
+                "  mv -f $p.new $p\n"
+                "done\n"
+                "if ! nginx -t 2>&1; then\n"
+                "  for p in $paths; do if [ -f $p.prev ]; then mv -f $p.prev $p; else rm -f $p; fi; done\n"
+                "  exit 1\n"
+                "fi\n"
+                "for p in $paths; do rm -f $p.prev; done\n"
+                "nginx -s reload"
+            )
+
+            with tracer.start_span('nginx.switch_many', sites=len(routes)):
+                success, output = self.execute_nginx_command("bash -s", input_data="\n".join(script_parts) + "\n")
+            if not success:
+                return False, f"فشل تحويل {len(routes)} موقع: {output}"
+
+            logger.info(f"🔀 تم توجيه {len(routes)} موقع مع إعادة تحميل واحدة لـ Nginx")
+            return True, f"تم توجيه {len(routes)} موقع"
+
+        except Exception as e:
+            logger.exception("خطأ في تحويل توجيه المواقع الجماعي")
+            return False, str(e)
+
     def remove_site_config(self, site_name: str) -> Tuple[bool, str]:
         """إزالة تكوين Nginx للموقع"""
         try:
@@ -0,0 +1,288 @@
+"""
+خوارزميات توزيع المواقع على سيرفرات التطبيق
+
+consistent hashing مع حد للحمل (bounded loads):
+- كل سيرفر يظهر على الحلقة بعدة نقاط افتراضية (vnodes)
+- الموقع يذهب لأول سيرفر بعد موضعه على الحلقة لم يصل لسعته
+- السعة = ceil(load_factor × عدد المواقع / عدد السيرفرات)، فلا يتجاوز أي سيرفر هذه الحصة
+- إضافة أو إزالة سيرفر تنقل حوالي 1/N من المواقع فقط بدلاً من إعادة التوزيع الكامل
+
+bin-packing موزون بتكلفة كل موقع (weighted):
+- تكلفة الموقع متجه: الطلبات/دقيقة، ثواني CPU/دقيقة، حجم قاعدة البيانات، ذاكرة العمال
+- كل بُعد يُنسب لسعة السيرفر، وحمل السيرفر = أعلى بُعد (عنق الزجاجة)
+- المواقع الأثقل أولاً، كل موقع للسيرفر الأقل حملاً من heap يتسع له
+- مع التوزيع الحالي: الموقع يبقى على سيرفره ما لم يتجاوز حمل السيرفر متوسط الأسطول + هامش، والزائد
+  ينتقل فقط لسيرفر أقل حملاً يتسع له
+"""
+
+import bisect
+import hashlib
+import heapq
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_VNODES = 160
+DEFAULT_LOAD_FACTOR = 1.25
+
+
+def stable_hash(key: str) -> int:
+    """hash ثابت بين العمليات وإعادة التشغيل (hash() في بايثون عشوائي لكل عملية)"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """حلقة consistent hashing بنقاط افتراضية لكل سيرفر"""
+
+    def __init__(self, servers: List[str], vnodes: int = DEFAULT_VNODES):
+        points = sorted(
+            (stable_hash(f"{server}#{replica}"), server)
+            for server in servers
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._servers = [server for _, server in points]
+        self.server_count = len(set(servers))
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """السيرفرات بترتيب الحلقة بدءاً من موضع المفتاح (كل سيرفر مرة واحدة)"""
+        if not self._hashes:
+            return
+        start = bisect.bisect_right(self._hashes, stable_hash(key))
+        seen = set()
+        size = len(self._servers)
+        for offset in range(size):
+            server = self._servers[(start + offset) % size]
+            if server not in seen:
+                seen.add(server)
+                yield server
+                if len(seen) == self.server_count:
+                    return
+
+    def node(self, key: str) -> Optional[str]:
+        """السيرفر المالك للمفتاح بدون حد للحمل"""
+        return next(self.candidates(key), None)
+
+
+def bounded_load_capacity(site_count: int, server_count: int, load_factor: float = DEFAULT_LOAD_FACTOR) -> int:
+    """الحد الأقصى للمواقع على سيرفر واحد"""
+    if server_count <= 0:
+        return 0
+    return max(1, math.ceil(max(load_factor, 1.0) * site_count / server_count))
+
+
+def consistent_hash_placement(sites: List[str], servers: List[str], load_factor: float = DEFAULT_LOAD_FACTOR,
+                              vnodes: int = DEFAULT_VNODES) -> Dict[str, List[str]]:
+    """
+    توزيع المواقع بـ consistent hashing مع حد للحمل
+
+    المواقع تُعالج بترتيب الـ hash (وليس ترتيب الإدخال) حتى تكون النتيجة نفسها
+    لنفس المواقع والسيرفرات مهما كان ترتيب القائمة القادمة من قاعدة البيانات.
+    """
+    distribution = {server: [] for server in servers}
+    if not servers:
+        return distribution
+
+    ring = HashRing(servers, vnodes)
+    capacity = bounded_load_capacity(len(sites), len(servers), load_factor)
+
+    for site in sorted(set(sites), key=lambda s: (stable_hash(s), s)):
+        for server in ring.candidates(site):
+            if len(distribution[server]) < capacity:
+                distribution[server].append(site)
+                break
+    return distribution
+
+
+def assignment_map(distribution: Dict[str, List[str]]) -> Dict[str, str]:
+    """{server: [sites]} -> {site: server}"""
+    return {site: server for server, sites in distribution.items() for site in sites}
+
+
+def placement_moves(previous: Dict[str, str], distribution: Dict[str, List[str]]) -> Dict:
+    """
+    مقارنة التوزيع الجديد بالسابق
+
+    النقل = موقع كان على سيرفر وأصبح على سيرفر آخر (كل نقل = ترحيل مكلف)؛
+    المواقع الجديدة والمحذوفة تُحسب منفصلة.
+    """
+    current = assignment_map(distribution)
+    moves = [
+        {'site': site, 'from': previous[site], 'to': server}
+        for site, server in current.items()
+        if site in previous and previous[site] != server
+    ]
+    kept = sum(1 for site in current if site in previous)
+    return {
+        'moved': len(moves),
+        'moved_percent': round(100 * len(moves) / kept, 1) if kept else 0.0,
+        'placed': sum(1 for site in current if site not in previous),
+        'dropped': sum(1 for site in previous if site not in current),
+        'moves': moves
+    }
+
+
+@dataclass
+class TenantCost:
+    """تكلفة موقع واحد (مقاسة أو تقديرية)"""
+    requests_per_min: float = 0.0
+    cpu_seconds_per_min: float = 0.0
+    db_bytes: float = 0.0
+    worker_memory_bytes: float = 0.0
+
+    def vector(self) -> Tuple[float, float, float, float]:
+        return (self.requests_per_min, self.cpu_seconds_per_min, self.db_bytes, self.worker_memory_bytes)
+
+
+# تقدير للمواقع بدون قياس في site_usage: العميل المدفوع أثقل بكثير من موقع تجريبي خامل
+DEFAULT_TENANT_COSTS: Dict[str, TenantCost] = {
+    'active': TenantCost(requests_per_min=2, cpu_seconds_per_min=0.5, db_bytes=150 * 1024 ** 2,
+                         worker_memory_bytes=30 * 1024 ** 2),
+    'converted': TenantCost(requests_per_min=30, cpu_seconds_per_min=6, db_bytes=600 * 1024 ** 2,
+                            worker_memory_bytes=120 * 1024 ** 2),
+}
+
+COST_DIMENSIONS = ('requests', 'cpu', 'db', 'memory')
+
+_SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value: str) -> int:
+    """'2g' / '512m' / '50G' -> بايت (نفس صيغة حدود docker)"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([bkmgt]?)b?\s*', str(value).lower())
+    if not match:
+        raise ValueError(f"حجم غير صالح: {value}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+@dataclass
+class ServerCapacity:
+    """سعة سيرفر واحد بنفس أبعاد TenantCost"""
+    requests_per_min: float
+    cpu_seconds_per_min: float
+    db_bytes: float
+    worker_memory_bytes: float
+
+    @classmethod
+    def from_limits(cls, cpu_limit: str, memory_limit: str, disk_limit: str,
+                    requests_per_min: float) -> 'ServerCapacity':
+        """من حدود الحاوية (cpus=1.0 -> 60 ثانية CPU في الدقيقة)"""
+        return cls(
+            requests_per_min=requests_per_min,
+            cpu_seconds_per_min=float(cpu_limit) * 60,
+            db_bytes=parse_size(disk_limit),
+            worker_memory_bytes=parse_size(memory_limit)
+        )
+
+    def vector(self) -> Tuple[float, float, float, float]:
+        return (self.requests_per_min, self.cpu_seconds_per_min, self.db_bytes, self.worker_memory_bytes)
+
+
+def _normalized(cost: TenantCost, capacity: ServerCapacity) -> Tuple[float, ...]:
+    """تكلفة الموقع كنسبة من سعة السيرفر في كل بُعد"""
+    return tuple(c / cap if cap > 0 else 0.0 for c, cap in zip(cost.vector(), capacity.vector()))
+
+
+def weighted_placement(sites: List[str], servers: List[str], costs: Dict[str, TenantCost],
+                       capacity: ServerCapacity, default_cost: Optional[TenantCost] = None,
+                       probe: int = 3, current: Optional[Dict[str, str]] = None,
+                       margin: float = 0.02) -> Dict[str, List[str]]:
+    """
+    vector bin-packing بالمواقع الأثقل أولاً على heap للسيرفرات مرتب حسب الحمل
+
+    current ({site: server}) يجعل التوزيع لاصقاً: كل موقع يبقى على سيرفره الحالي ما دام حمل السيرفر
+    لا يتجاوز متوسط الأسطول × (1 + margin) في أي بُعد (الأخف أولاً، فالسيرفر فوق الحد يتخلى عن أقل عدد
+    من المواقع). الموقع الزائد ينتقل فقط إلى سيرفر أقل حملاً يتسع له تحت الحد وتحت السعة (1.0)،
+    وإلا يبقى مكانه: الأسطول المحمل فوق سعته لا يُعاد ترتيبه بلا فائدة، والسيرفر الجديد (أو البعيد
+    تحت المتوسط) يسحب الزائد من البقية حتى يقترب من المتوسط.
+    المواقع الجديدة ومواقع السيرفرات المحذوفة تُوزع أولاً على الـ heap الذي يبدأ من الحمل الباقي.
+
+    لكل موقع يُفحص حتى probe سيرفرات من الأقل حملاً؛ أول سيرفر يتسع له (كل بُعد <= 1)
+    يأخذه، وإلا يذهب للأقل حملاً (تجاوز سعة يظهر في placement_utilization).
+    التكلفة: ترتيب المواقع مرة واحدة ثم O(log N) لكل موقع بدلاً من min() على كل السيرفرات.
+    """
+    distribution = {server: [] for server in servers}
+    if not servers:
+        return distribution
+
+    default_cost = default_cost or DEFAULT_TENANT_COSTS['active']
+    dimensions = len(COST_DIMENSIONS)
+    loads = {server: [0.0] * dimensions for server in servers}
+
+    weighted = []
+    for site in dict.fromkeys(sites):
+        vector = _normalized(costs.get(site) or default_cost, capacity)
+        weighted.append((max(vector), site, vector))
+
+    excess = []
+    limit = [1.0] * dimensions
+    if current:
+        # حد البقاء: متوسط الأسطول في كل بُعد + الهامش؛ الموقع الزائد ينتقل فقط تحت الحد وتحت السعة
+        cap = [sum(item[2][d] for item in weighted) / len(servers) * (1 + margin) for d in range(dimensions)]
+        limit = [min(1.0, value) for value in cap]
+        remaining = []
+        for item in sorted(weighted, key=lambda item: (item[0], item[1])):
+            _, site, vector = item
+            server = current.get(site)
+            load = loads.get(server)
+            if load is None:
+                remaining.append(item)
+            elif not distribution[server] or all(load[d] + vector[d] <= cap[d] for d in range(dimensions)):
+                for d in range(dimensions):
+                    load[d] += vector[d]
+                distribution[server].append(site)
+            else:
+                excess.append(item)
+        weighted = remaining
+
+    heap = [(max(loads[server]), server) for server in sorted(servers)]
+    heapq.heapify(heap)
+
+    def place(site: str, vector: Tuple[float, ...], bound: List[float], fallback: Optional[str]) -> None:
+        # الإدخالات القديمة (حمل تغير بعد دفعها) تُتجاهل عند السحب
+        popped = []
+        chosen = None
+        while heap and len(popped) < probe:
+            entry = heapq.heappop(heap)
+            if entry[0] != max(loads[entry[1]]):
+                continue
+            popped.append(entry)
+            load = loads[entry[1]]
+            if all(load[d] + vector[d] <= bound[d] for d in range(dimensions)):
+                chosen = entry
+                break
+        server = chosen[1] if chosen else (fallback or popped[0][1])
+        load = loads[server]
+        for d in range(dimensions):
+            load[d] += vector[d]
+        distribution[server].append(site)
+
+        for entry in popped:
+            if entry[1] != server:
+                heapq.heappush(heap, entry)
+        heapq.heappush(heap, (max(load), server))
+
+    weighted.sort(key=lambda item: (-item[0], item[1]))
+    for _, site, vector in weighted:
+        place(site, vector, [1.0] * dimensions, None)
+
+    # الزائد عن الحد: لسيرفر أقل حملاً يتسع له تحت الحد، وإلا يبقى على سيرفره
+    excess.sort(key=lambda item: (-item[0], item[1]))
+    for _, site, vector in excess:
+        place(site, vector, limit, current[site])
+    return distribution
+
+
+def placement_utilization(distribution: Dict[str, List[str]], costs: Dict[str, TenantCost],
+                          capacity: ServerCapacity, default_cost: Optional[TenantCost] = None) -> Dict[str, Dict]:
+    """نسبة استخدام كل بُعد لكل سيرفر بعد التوزيع (> 100 = تجاوز السعة)"""
+    default_cost = default_cost or DEFAULT_TENANT_COSTS['active']
+    result = {}
+    for server, sites in distribution.items():
+        totals = [0.0] * len(COST_DIMENSIONS)
+        for site in sites:
+            for d, value in enumerate(_normalized(costs.get(site) or default_cost, capacity)):
+                totals[d] += value
+        result[server] = {dimension: round(100 * total, 1) for dimension, total in zip(COST_DIMENSIONS, totals)}
+    return result
@@ -0,0 +1,202 @@
+"""
+ذاكرة مؤقتة لاستجابات نقاط النهاية مع TTL و stale-while-revalidate
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# مدد الذاكرة المؤقتة لكل نقطة نهاية بالثواني: (صلاحية، فترة إرجاع القيمة القديمة أثناء التحديث)
+# مشتركة بين app.py و async_app.py
+CACHE_TTLS = {
+    'bench_sites': (30, 300),
+    'health': (10, 120),
+    'frappe_status': (60, 600),
+    'nginx_configs': (30, 300),
+    'fleet_status': (15, 60),
+}
+
+
+class CacheEntry:
+    """قيمة مخزنة مع حدود صلاحيتها"""
+
+    __slots__ = ('value', 'fresh_until', 'stale_until', 'loaded_at')
+
+    def __init__(self, value: Any, ttl: float, stale_ttl: float):
+        now = time.monotonic()
+        self.value = value
+        self.loaded_at = now
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class _Flight:
+    """تحميل جارٍ لمفتاح: المنتظرون يأخذون نتيجته مباشرة"""
+
+    __slots__ = ('event', 'generation', 'value', 'error')
+
+    def __init__(self, generation: Tuple[int, int]):
+        self.event = threading.Event()
+        self.generation = generation
+        self.value: Any = None
+        self.error: Optional[Exception] = None
+
+
+class ResponseCache:
+    """
+    ذاكرة مؤقتة في العملية مع:
+    - TTL لكل مفتاح
+    - إرجاع القيمة القديمة وتحديثها في الخلفية (stale-while-revalidate)
+    - تحميل واحد فقط لكل مفتاح مهما كان عدد الطلبات المتزامنة (single-flight)
+    - generation لكل مفتاح تزيد مع invalidate: تحميل بدأ قبل الإبطال لا يُخزن نتيجته
+      (وإلا أعاد تحميل بطيء القيمة القديمة بعد كتابة أبطلتها)
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CacheEntry] = {}
+        self._inflight: Dict[str, _Flight] = {}
+        self._generations: Dict[str, int] = {}
+        # invalidate() بدون مفتاح يبطل كل المفاتيح بما فيها التحميلات الجارية
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'loads': 0, 'load_errors': 0, 'stale_loads': 0}
+
+    def _generation_locked(self, key: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(key, 0)
+
+    def get(self, key: str, loader: Callable[[], Any], ttl: float, stale_ttl: float = 0,
+            wait: bool = True, default: Any = None) -> Any:
+        """
+        إرجاع القيمة المخزنة أو تحميلها
+
+        wait=False: عند عدم وجود قيمة يبدأ التحميل في الخلفية ويعيد default فوراً،
+        فلا ينفذ الطلب الحالي أي عمل مكلف.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now < entry.fresh_until:
+                self._stats['hits'] += 1
+                return entry.value
+
+            if entry and now < entry.stale_until:
+                self._stats['stale_hits'] += 1
+                self._start_load_locked(key, loader, ttl, stale_ttl, background=True)
+                return entry.value
+
+            self._stats['misses'] += 1
+            flight, owner = self._start_load_locked(key, loader, ttl, stale_ttl, background=not wait)
+
+        if not wait:
+            return default
+
+        if owner:
+            return self._load(key, loader, ttl, stale_ttl, flight)
+
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _start_load_locked(self, key: str, loader: Callable[[], Any], ttl: float, stale_ttl: float,
+                           background: bool):
+        """تسجيل تحميل جديد إن لم يكن هناك تحميل جارٍ (يُستدعى مع القفل)"""
+        flight = self._inflight.get(key)
+        if flight is not None:
+            return flight, False
+
+        flight = _Flight(self._generation_locked(key))
+        self._inflight[key] = flight
+        if background:
+            threading.Thread(
+                target=self._load_quietly,
+                args=(key, loader, ttl, stale_ttl, flight),
+                name=f"cache-refresh-{key}",
+                daemon=True
+            ).start()
+            return flight, False
+        return flight, True
+
+    def _load(self, key: str, loader: Callable[[], Any], ttl: float, stale_ttl: float,
+              flight: _Flight) -> Any:
+        """تنفيذ المحمّل وتخزين النتيجة (إن لم يُبطل المفتاح أثناء التحميل) وإبلاغ المنتظرين"""
+        start_time = time.time()
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self._stats['load_errors'] += 1
+                if self._inflight.get(key) is flight:
+                    self._inflight.pop(key)
+            flight.error = e
+            flight.event.set()
+            raise
+
+        with self._lock:
+            if self._inflight.get(key) is flight:
+                self._inflight.pop(key)
+            if flight.generation == self._generation_locked(key):
+                self._stats['loads'] += 1
+                self._entries[key] = CacheEntry(value, ttl, stale_ttl)
+                stale = False
+            else:
+                self._stats['stale_loads'] += 1
+                stale = True
+        # المنتظرون طلبوا القيمة قبل الإبطال فيأخذونها، لكنها لا تُخزن للطلبات التالية
+        flight.value = value
+        flight.event.set()
+
+        if stale:
+            logger.debug(f"🗃️ تم تجاهل تحميل {key} (أُبطل المفتاح أثناء التحميل)")
+        else:
+            logger.debug(f"🗃️ تم تحديث {key} في {time.time() - start_time:.2f} ثانية")
+        return value
+
+    def _load_quietly(self, key: str, loader: Callable[[], Any], ttl: float, stale_ttl: float,
+                      flight: _Flight):
+        """تحميل في الخلفية مع الإبقاء على القيمة القديمة عند الفشل"""
+        try:
+            self._load(key, loader, ttl, stale_ttl, flight)
+        except Exception as e:
+            logger.warning(f"⚠️ فشل تحديث الذاكرة المؤقتة {key}: {e}")
+
+    def peek(self, key: str) -> Optional[Any]:
+        """القيمة الحالية دون تحميل"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry.value if entry else None
+
+    def invalidate(self, key: Optional[str] = None):
+        """حذف مفتاح أو كل المفاتيح وزيادة generation (الطلب التالي يبدأ تحميلاً جديداً)"""
+        with self._lock:
+            if key is None:
+                self._epoch += 1
+                self._entries.clear()
+                self._inflight.clear()
+            else:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._entries.pop(key, None)
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict:
+        """إحصائيات الذاكرة المؤقتة"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                **self._stats,
+                'keys': {
+                    key: {
+                        'age_seconds': round(now - entry.loaded_at, 3),
+                        'fresh': now < entry.fresh_until,
+                        'refreshing': key in self._inflight
+                    }
+                    for key, entry in self._entries.items()
+                }
+            }
+
+
+# إنشاء الذاكرة المؤقتة
+response_cache = ResponseCache()
@@ -0,0 +1,265 @@
+"""
+حالة الكلاستر في ذاكرة مشتركة (mmap) بين كل عمليات الـ backend على المضيف
+
+الكاتب واحد لكل مضيف (العملية المشاركة في انتخاب قائد المراقبة): القائد يكتب نتيجة جولته،
+وغير القائد ينسخ ما نشره القائد في cluster_snapshots. بقية العمال يقرؤون بدون أقفال وبدون قاعدة البيانات.
+
+التخطيط ثابت (little-endian):
+
+    header   magic 'CLST' | layout | max_servers | seq | generation | published_at | count | extra_len | token | leader
+    records  max_servers × سجل ثابت لكل سيرفر (المعرف، العنوان، الحالة، المقاييس)
+    extra    JSON لبقية الحالة (إحصائيات get_cluster_stats، حالة التوسع، آخر جولة)
+
+seqlock: الكاتب يجعل seq فردياً قبل الكتابة وزوجياً بعدها؛ القارئ يعيد المحاولة إذا كان seq فردياً
+أو تغير أثناء القراءة. seq في إزاحة 8 ويُقرأ ويُكتب عبر memoryview بصيغة 'Q' (نسخ 8 بايت محاذاة = عملية واحدة
+على x86-64 و arm64)، وليس عبر struct الذي يصفّر المنطقة ثم يكتب بايتاً بايتاً.
+القارئ يحتفظ بآخر نسخة مفككة، فإذا لم يتغير seq تكلف القراءة 8 بايت فقط.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CLST'
+LAYOUT_VERSION = 1
+
+HEADER = struct.Struct('<4sHHQQdIIQ64s')
+# الرأس يُكتب على جزأين حول seq حتى لا يلمسه struct
+HEAD = struct.Struct('<4sHH')
+META = struct.Struct('<QdIIQ64s')
+META_OFFSET = 16
+SEQ_INDEX = 1  # إزاحة 8 كعنصر Q
+
+# (اسم الحقل في ServerMetrics، صيغة struct)
+METRIC_FIELDS = (
+    ('cpu_percent', 'd'),
+    ('memory_percent', 'd'),
+    ('disk_percent', 'd'),
+    ('response_time_ms', 'd'),
+    ('network_rx_bytes', 'Q'),
+    ('network_tx_bytes', 'Q'),
+    ('block_read_bytes', 'Q'),
+    ('block_write_bytes', 'Q'),
+    ('active_connections', 'I'),
+    ('sites_count', 'I'),
+    ('uptime_seconds', 'I'),
+    ('pids', 'I'),
+    ('gunicorn_workers', 'I'),
+    ('background_workers', 'I'),
+)
+# server_id | ip | port | status | has_metrics | last_updated | المقاييس
+RECORD = struct.Struct('<64s46sH16s?d' + ''.join(fmt for _, fmt in METRIC_FIELDS))
+
+DEFAULT_PATH = os.environ.get(
+    'CLUSTER_STATE_PATH',
+    '/dev/shm/saas-cluster-state' if os.path.isdir('/dev/shm') else '/tmp/saas-cluster-state'
+)
+
+
+def _text(raw: bytes) -> str:
+    return raw.rstrip(b'\0').decode(errors='replace')
+
+
+def _metric_values(metrics: Optional[Dict]) -> tuple:
+    """قيم السجل من قاموس ServerMetrics (last_updated كـ datetime أو نص ISO)"""
+    if metrics is None:
+        return (False, 0.0) + tuple(0 for _ in METRIC_FIELDS)
+    updated = metrics.get('last_updated')
+    if isinstance(updated, str):
+        updated = datetime.fromisoformat(updated)
+    values = tuple(float(metrics.get(name) or 0) if fmt == 'd' else int(metrics.get(name) or 0)
+                   for name, fmt in METRIC_FIELDS)
+    return (True, updated.timestamp() if updated else 0.0) + values
+
+
+class SharedClusterState:
+    """ملف mmap بتخطيط ثابت: كاتب واحد (بقفل ملف) وقراء بدون أقفال"""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_servers: int = 256, extra_capacity: int = 4 * 1024 * 1024,
+                 reopen_interval: float = 1.0):
+        self.path = path
+        self.max_servers = max_servers
+        self.extra_offset = HEADER.size + max_servers * RECORD.size
+        self.size = self.extra_offset + extra_capacity
+        self.reopen_interval = reopen_interval
+        self._map: Optional[mmap.mmap] = None
+        self._words: Optional[memoryview] = None
+        self._fd: Optional[int] = None
+        self._writable = False
+        self._opened_at = 0.0
+        self._seq: Optional[int] = None
+        self._snapshot: Optional[Dict] = None
+        self.reads = 0
+        self.retries = 0
+
+    # --- الكاتب ---
+
+    def _open_writer(self):
+        if self._writable:
+            return
+        self.close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size != self.size:
+            # نفس الملف (inode) يبقى دائماً: القراء الذين فتحوه سابقاً يرون الكتابات الجديدة
+            os.ftruncate(fd, self.size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._words = memoryview(self._map)[:META_OFFSET].cast('Q')
+        self._writable = True
+
+    def write(self, servers: List[Dict], extra: Dict, generation: int, leader: str = '', token: int = 0) -> int:
+        """
+        كتابة الحالة كاملة
+
+        servers: [{server_id, ip, port, status, metrics (dict أو None)}]. يرجع seq الجديد.
+        """
+        self._open_writer()
+        if len(servers) > self.max_servers:
+            logger.warning(f"⚠️ {len(servers)} سيرفر أكثر من سعة الذاكرة المشتركة ({self.max_servers})")
+            servers = servers[:self.max_servers]
+            extra = dict(extra, truncated=True)
+        data = json.dumps(extra, default=str).encode()
+        if len(data) > self.size - self.extra_offset:
+            logger.warning(f"⚠️ حجم الحالة ({len(data)} بايت) أكبر من سعة الذاكرة المشتركة - حفظ السيرفرات فقط")
+            data = b'{"truncated": true}'
+
+        mm, words = self._map, self._words
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            seq = words[SEQ_INDEX]
+            seq += 1 + (seq % 2)  # فردي: كتابة جارية
+            words[SEQ_INDEX] = seq
+
+            for index, server in enumerate(servers):
+                RECORD.pack_into(
+                    mm, HEADER.size + index * RECORD.size,
+                    server['server_id'].encode()[:64],
+                    (server.get('ip') or '').encode()[:46],
+                    int(server.get('port') or 0),
+                    (server.get('status') or '').encode()[:16],
+                    *_metric_values(server.get('metrics'))
+                )
+            mm[self.extra_offset:self.extra_offset + len(data)] = data
+
+            if HEAD.unpack_from(mm, 0) != (MAGIC, LAYOUT_VERSION, self.max_servers):
+                HEAD.pack_into(mm, 0, MAGIC, LAYOUT_VERSION, self.max_servers)
+            META.pack_into(mm, META_OFFSET, generation, time.time(), len(servers), len(data), token,
+                           leader.encode()[:64])
+            words[SEQ_INDEX] = seq + 1  # زوجي: الكتابة اكتملت
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return seq
+
+    # --- القراء ---
+
+    def _open_reader(self) -> bool:
+        if self._map is not None:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.reopen_interval:
+            return False
+        self._opened_at = now
+        try:
+            with open(self.path, 'rb') as handle:
+                if os.fstat(handle.fileno()).st_size != self.size:
+                    return False
+                self._map = mmap.mmap(handle.fileno(), self.size, mmap.MAP_SHARED, mmap.PROT_READ)
+            self._words = memoryview(self._map)[:META_OFFSET].cast('Q')
+            return True
+        except OSError:
+            return False
+
+    def read(self, max_attempts: int = 100) -> Optional[Dict]:
+        """
+        آخر حالة منشورة (None إذا لم يكتب أحد بعد)
+
+        الشكل: {servers: {id: {ip, port}}, health_status: {id: status}, metrics: {id: {...}}, ...extra, _meta}
+        نفس القاموس يُعاد ما دام seq لم يتغير - لا يُعدل.
+        """
+        if not self._open_reader():
+            return None
+        mm, words = self._map, self._words
+        self.reads += 1
+        for _ in range(max_attempts):
+            seq = words[SEQ_INDEX]
+            if seq == self._seq:
+                return self._snapshot
+            if seq == 0:
+                return None
+            if seq % 2:
+                self.retries += 1
+                time.sleep(0)
+                continue
+
+            magic, layout, max_servers = HEAD.unpack_from(mm, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION or max_servers != self.max_servers:
+                if words[SEQ_INDEX] != seq:
+                    continue
+                return None
+            generation, published_at, count, extra_len, token, leader = META.unpack_from(mm, META_OFFSET)
+            records = [RECORD.unpack_from(mm, HEADER.size + index * RECORD.size) for index in range(count)]
+            extra = mm[self.extra_offset:self.extra_offset + extra_len]
+
+            if words[SEQ_INDEX] != seq:
+                self.retries += 1
+                continue
+
+            snapshot = self._decode(records, extra)
+            snapshot['_meta'] = {
+                'source': 'shm',
+                'seq': seq,
+                'generation': generation,
+                'leader': _text(leader),
+                'token': token,
+                'published_at': published_at
+            }
+            self._seq, self._snapshot = seq, snapshot
+            return snapshot
+        # الكاتب مشغول طويلاً: آخر نسخة متسقة
+        return self._snapshot
+
+    @staticmethod
+    def _decode(records: List[tuple], extra: bytes) -> Dict:
+        snapshot = json.loads(extra) if extra else {}
+        servers, health_status, metrics = {}, {}, {}
+        for server_id, ip, port, status, has_metrics, last_updated, *values in records:
+            server_id = _text(server_id)
+            servers[server_id] = {'ip': _text(ip), 'port': port}
+            if status.rstrip(b'\0'):
+                health_status[server_id] = _text(status)
+            if has_metrics:
+                metrics[server_id] = dict(zip((name for name, _ in METRIC_FIELDS), values), server_id=server_id,
+                                          last_updated=datetime.fromtimestamp(last_updated).isoformat())
+        snapshot.update(servers=servers, health_status=health_status, metrics=metrics)
+        return snapshot
+
+    def status(self) -> Dict:
+        return {
+            'path': self.path,
+            'size': self.size,
+            'writer': self._writable,
+            'seq': self._seq,
+            'reads': self.reads,
+            'retries': self.retries
+        }
+
+    def close(self):
+        if self._words is not None:
+            self._words.release()
+            self._words = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._writable = False
+        self._seq = self._snapshot = None
@@ -1,6 +1,12 @@
-import mysql.connector
 import logging
-from typing import dict, List, Optional
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+from tracing import tracer, traced
+from circuit_breaker import breakers, connect_mysql, docker_failure
+from assignment_store import SiteAssignmentStore
+from nginx_manager import DEFAULT_SERVER_ID
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +27,22 @@ class SiteChecker:
             'password': '123456',
             'database': 'saas_trialsv1'
         }
+        
+        # مسار مواقع bench داخل حاويات سيرفرات التطبيق (غير مركب في حاوية الـ backend)
+        self.sites_path = "/home/frappe/production/sites"
+        # سيرفر كل موقع لقراءة site_config.json من حاويته
+        self.assignments = SiteAssignmentStore(self.saas_db_config)
+        
+        # ذاكرة مؤقتة قصيرة لنتائج التحقق الجماعي
+        self.cache_ttl = 30
+        self._verification_cache: Dict[str, tuple] = {}
+        self._cache_lock = threading.Lock()
     
+    @traced('db.frappe_site_check')
     def check_site_in_frappe_db(self, site_name: str) -> dict:
         """التحقق من وجود الموقع في قاعدة بيانات Frappe"""
         try:
-            conn = mysql.connector.connect(**self.frappe_db_config)
+            conn = connect_mysql(self.frappe_db_config)
             cursor = conn.cursor(dictionary=True)
             
             # التحقق من جدول المواقع
@@ -56,10 +73,11 @@ class SiteChecker:
         except Exception as e:
             return {"exists": False, "error": str(e)}
     
+    @traced('db.saas_site_check')
     def check_site_in_saas_db(self, subdomain: str) -> dict:
         """التحقق من سجل الموقع في قاعدة بيانات SaaS"""
         try:
-            conn = mysql.connector.connect(**self.saas_db_config)
+            conn = connect_mysql(self.saas_db_config)
             cursor = conn.cursor(dictionary=True)
             
             cursor.execute("""
@@ -122,11 +140,204 @@ class SiteChecker:
                 logger.error("❌ لم يتم العثور على سجل في قاعدة بيانات Frappe")
         
         return result
-    
+
+    # يطبع "الموقع<TAB>db_name" لكل موقع (db_name فارغ إذا لم يوجد site_config.json)
+    _DB_NAME_SCRIPT = (
+        "import json, sys\n"
+        "for site in sys.argv[1:]:\n"
+        "    try:\n"
+        "        db_name = json.load(open(site + '/site_config.json')).get('db_name') or ''\n"
+        "    except (OSError, ValueError):\n"
+        "        db_name = ''\n"
+        "    print(site + '\\t' + db_name)\n"
+    )
+
+    @traced('docker.site_db_names')
+    def _resolve_site_db_names(self, site_names: List[str]) -> Dict[str, Optional[str]]:
+        """
+        اسم قاعدة بيانات كل موقع من site_config.json في حاوية سيرفره
+
+        أمر docker exec واحد لكل سيرفر في الدفعة. الموقع بدون site_config.json -> '' (غير موجود)،
+        وتعذر القراءة من الحاوية -> None (غير معروف) بدلاً من تخمين الاسم.
+        """
+        by_server: Dict[str, List[str]] = {}
+        for site_name in site_names:
+            try:
+                server_id = self.assignments.server_of(site_name) or DEFAULT_SERVER_ID
+            except Exception:
+                server_id = DEFAULT_SERVER_ID
+            by_server.setdefault(server_id, []).append(site_name)
+
+        db_names: Dict[str, Optional[str]] = {site_name: None for site_name in site_names}
+        for server_id, sites in by_server.items():
+            try:
+                result = breakers.get(f"docker:{server_id}").call(
+                    subprocess.run,
+                    ["docker", "exec", *tracer.docker_env_args(), "-w", self.sites_path, server_id,
+                     "python3", "-c", self._DB_NAME_SCRIPT, *sites],
+                    capture_output=True,
+                    text=True,
+                    timeout=30,
+                    is_failure=docker_failure
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip()[:200])
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر قراءة أسماء قواعد بيانات المواقع من {server_id}: {e}")
+                continue
+            for line in result.stdout.splitlines():
+                site_name, _, db_name = line.partition('\t')
+                if site_name in db_names:
+                    db_names[site_name] = db_name
+        return db_names
+
+    @traced('db.saas_records')
+    def _fetch_saas_records(self, subdomains: List[str]) -> Dict[str, dict]:
+        """جلب سجلات العملاء لعدة مواقع باستعلام IN واحد"""
+        conn = connect_mysql(self.saas_db_config)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ", ".join(["%s"] * len(subdomains))
+            cursor.execute(f"""
+                SELECT id, company_name, subdomain, site_url, site_name,
+                       created_at, frappe_site_created
+                FROM trial_customers
+                WHERE subdomain IN ({placeholders})
+            """, tuple(subdomains))
+            records = {row['subdomain']: row for row in cursor.fetchall()}
+            cursor.close()
+            return records
+        finally:
+            conn.close()
+
+    @traced('db.table_counts')
+    def _fetch_db_table_counts(self, db_names: List[str]) -> Dict[str, int]:
+        """عدد جداول كل قاعدة بيانات مواقع باستعلام information_schema واحد"""
+        conn = connect_mysql(self.frappe_db_config)
+        try:
+            cursor = conn.cursor()
+            placeholders = ", ".join(["%s"] * len(db_names))
+            cursor.execute(f"""
+                SELECT TABLE_SCHEMA, COUNT(*)
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA IN ({placeholders})
+                GROUP BY TABLE_SCHEMA
+            """, tuple(db_names))
+            counts = {schema: count for schema, count in cursor.fetchall()}
+            cursor.close()
+            return counts
+        finally:
+            conn.close()
+
+    @traced('sites.verify_bulk')
+    def verify_sites_bulk(self, subdomains: List[str], customer_records: Optional[Dict[str, dict]] = None,
+                          use_cache: bool = True) -> Dict[str, dict]:
+        """
+        التحقق من عدة مواقع بعدد ثابت من الاستعلامات
+
+        استعلام IN واحد على trial_customers واستعلام information_schema واحد
+        لقواعد بيانات المواقع، بدلاً من اتصالين وثلاثة استعلامات لكل موقع.
+        """
+        subdomains = list(dict.fromkeys(s for s in subdomains if s))
+        results: Dict[str, dict] = {}
+        now = time.monotonic()
+
+        if use_cache:
+            with self._cache_lock:
+                for subdomain in subdomains:
+                    cached = self._verification_cache.get(subdomain)
+                    if cached and cached[0] > now:
+                        results[subdomain] = cached[1]
+
+        pending = [s for s in subdomains if s not in results]
+        if not pending:
+            return results
+
+        logger.info(f"🔍 بدء التحقق الجماعي من {len(pending)} موقع")
+
+        # 1. سجلات SaaS
+        saas_error = None
+        if customer_records is not None:
+            saas_records = {s: customer_records[s] for s in pending if s in customer_records}
+        else:
+            try:
+                saas_records = self._fetch_saas_records(pending)
+            except Exception as e:
+                saas_records, saas_error = {}, str(e)
+                logger.error(f"❌ فشل التحقق الجماعي من قاعدة بيانات SaaS: {saas_error}")
+
+        # 2. قواعد بيانات المواقع في Frappe
+        site_names = {s: f"{s}.trial.local" for s in pending}
+        resolved = self._resolve_site_db_names(list(site_names.values()))
+        db_names = {s: resolved[site_names[s]] for s in pending}
+        frappe_error = None
+        try:
+            known = sorted({db_name for db_name in db_names.values() if db_name})
+            table_counts = self._fetch_db_table_counts(known) if known else {}
+        except Exception as e:
+            table_counts, frappe_error = {}, str(e)
+            logger.error(f"❌ فشل التحقق الجماعي من قاعدة بيانات Frappe: {frappe_error}")
+
+        expires_at = time.monotonic() + self.cache_ttl
+        fresh: Dict[str, dict] = {}
+        for subdomain in pending:
+            customer_record = saas_records.get(subdomain)
+            db_name = db_names[subdomain]
+            tables_count = table_counts.get(db_name, 0) if db_name else 0
+
+            saas_check = {"exists": customer_record is not None, "customer_record": customer_record}
+            if saas_error:
+                saas_check["error"] = saas_error
+
+            frappe_check = {
+                "exists": tables_count > 0,
+                "db_name": db_name or None,
+                "tables_count": tables_count
+            }
+            if frappe_error:
+                frappe_check["error"] = frappe_error
+            elif db_name is None:
+                frappe_check["status"] = "unknown"
+                frappe_check["error"] = "تعذر قراءة اسم قاعدة بيانات الموقع من حاوية سيرفره"
+            elif not db_name:
+                frappe_check["status"] = "missing"
+
+            fresh[subdomain] = {
+                "overall_success": saas_check['exists'] and frappe_check['exists'],
+                "site_name": site_names[subdomain],
+                "saas_database": saas_check,
+                "frappe_database": frappe_check,
+                "details": {
+                    "saas_record_exists": saas_check['exists'],
+                    "frappe_record_exists": frappe_check['exists'],
+                    "frappe_tables_count": tables_count
+                }
+            }
+
+        # لا نخزن النتائج الناتجة عن خطأ اتصال أو اسم قاعدة بيانات غير معروف
+        if use_cache and not saas_error and not frappe_error:
+            with self._cache_lock:
+                for subdomain, verification in fresh.items():
+                    if db_names[subdomain] is not None:
+                        self._verification_cache[subdomain] = (expires_at, verification)
+
+        results.update(fresh)
+        verified = sum(1 for v in fresh.values() if v['overall_success'])
+        logger.info(f"✅ انتهى التحقق الجماعي: {verified}/{len(fresh)} موقع مكتمل")
+        return results
+
+    def invalidate_cache(self, subdomain: Optional[str] = None):
+        """مسح الذاكرة المؤقتة للتحقق"""
+        with self._cache_lock:
+            if subdomain is None:
+                self._verification_cache.clear()
+            else:
+                self._verification_cache.pop(subdomain, None)
+
     def get_recent_sites(self, limit: int = 10) -> List[dict]:
         """الحصول على أحدث المواقع"""
         try:
-            conn = mysql.connector.connect(**self.saas_db_config)
+            conn = connect_mysql(self.saas_db_config)
             cursor = conn.cursor(dictionary=True)
             
             cursor.execute("""
@@ -142,14 +353,14 @@ class SiteChecker:
             cursor.close()
             conn.close()
             
-            # التحقق من كل موقع في Frappe
-            verified_sites = []
+            # التحقق من جميع المواقع دفعة واحدة (السجلات محملة بالفعل)
+            records = {site['subdomain']: dict(site) for site in sites}
+            verifications = self.verify_sites_bulk(list(records), customer_records=records)
+
             for site in sites:
-                verification = self.verify_site_creation(site['subdomain'])
-                site['verification'] = verification
-                verified_sites.append(site)
-            
-            return verified_sites
+                site['verification'] = verifications.get(site['subdomain'])
+
+            return sites
             
         except Exception as e:
             logger.error(f"❌ فشل جلب المواقع: {str(e)}")
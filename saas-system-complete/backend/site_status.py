@@ -0,0 +1,143 @@
+"""
+فحص حالة المواقع عبر HTTP
+
+- جلسة requests واحدة باتصالات keep-alive مشتركة بين كل الفحوصات
+- فحص موقع واحد: المخزون (Nginx / bench) من الذاكرة المؤقتة والفحص الحي بالتوازي مع مهلة قصيرة
+- فحص كل المواقع بعدد عمال محدود ونتائج مختصرة للوحة المراقبة
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from nginx_manager import nginx_manager
+from tracing import tracer, with_current_context
+
+logger = logging.getLogger(__name__)
+
+
+def configured_sites(sites: Iterable[str], nginx_configs: List[str]) -> Set[str]:
+    """المواقع التي لها ملف تكوين Nginx (مطابقة اسم الملف وليس البحث النصي)"""
+    filenames = {os.path.basename(config) for config in nginx_configs}
+    return {site for site in sites if nginx_manager.config_filename(site) in filenames}
+
+
+class SiteStatusChecker:
+    """فحص الاستجابة الحية للمواقع"""
+
+    def __init__(self, probe_timeout: float = None, max_workers: int = None):
+        self.probe_timeout = probe_timeout or float(os.environ.get('SITE_PROBE_TIMEOUT', 3))
+        self.max_workers = max_workers or int(os.environ.get('SITE_STATUS_CONCURRENCY', 32))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # عمال مشتركون للفحوصات الفردية
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="site-status")
+
+    def probe(self, site_name: str, timeout: Optional[float] = None, include_body: bool = False) -> Dict:
+        """فحص /api/method/version لموقع واحد"""
+        timeout = timeout or self.probe_timeout
+        start_time = time.perf_counter()
+        result = {'status': 'unknown', 'http_status': None}
+        with tracer.start_span('site.probe', site=site_name) as span:
+            try:
+                response = self.session.get(
+                    f"http://{site_name}/api/method/version",
+                    timeout=(min(timeout, 2.0), timeout)
+                )
+                result['status'] = 'connected' if response.status_code == 200 else 'failed'
+                result['http_status'] = response.status_code
+                if include_body:
+                    result['response'] = response.text[:200] if response.text else 'empty'
+            except requests.exceptions.ConnectionError:
+                result['status'] = 'unreachable'
+            except requests.exceptions.Timeout:
+                result['status'] = 'timeout'
+            except Exception as e:
+                result['status'] = f"error: {str(e)}"
+            span.set_attribute('status', result['status'])
+        result['latency_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+        return result
+
+    def check_site(self, site_name: str, load_nginx_configs: Callable[[], List[str]],
+                   load_sites: Callable[[], List[str]], deadline: Optional[float] = None) -> Dict:
+        """
+        حالة موقع واحد - جرد Nginx وجرد bench والفحص الحي تعمل بالتوازي
+
+        أي فحص لا ينتهي قبل المهلة يُعاد كـ None بدلاً من انتظار الأمر البطيء.
+        """
+        deadline = deadline or self.probe_timeout + 1
+        futures = {
+            'nginx': self._executor.submit(with_current_context(load_nginx_configs)),
+            'sites': self._executor.submit(with_current_context(load_sites)),
+            'probe': self._executor.submit(with_current_context(self.probe), site_name, None, True),
+        }
+        wait(futures.values(), timeout=deadline)
+
+        def result_of(key):
+            future = futures[key]
+            if not future.done():
+                return None
+            try:
+                return future.result()
+            except Exception as e:
+                logger.warning(f"⚠️ فشل فحص {key} للموقع {site_name}: {e}")
+                return None
+
+        nginx_configs = result_of('nginx')
+        sites = result_of('sites')
+        probe = result_of('probe') or {'status': 'timeout', 'http_status': None, 'response': ''}
+
+        return {
+            'site_name': site_name,
+            'nginx_config': None if nginx_configs is None else bool(configured_sites([site_name], nginx_configs)),
+            'frappe_site_exists': None if sites is None else site_name in sites,
+            'frappe_status': probe['status'],
+            'frappe_response': probe.get('response', ''),
+            'http_status': probe.get('http_status'),
+            'latency_ms': probe.get('latency_ms'),
+            'sites': sites
+        }
+
+    def check_fleet(self, sites: Iterable[str], nginx_configs: Optional[List[str]] = None,
+                    max_workers: Optional[int] = None) -> Dict:
+        """فحص كل المواقع بعدد عمال محدود - نتيجة مختصرة لكل موقع"""
+        sites = list(dict.fromkeys(sites))
+        configured: Optional[Set[str]] = None
+        if nginx_configs is not None:
+            configured = configured_sites(sites, nginx_configs)
+
+        start_time = time.perf_counter()
+        workers = max(1, min(max_workers or self.max_workers, len(sites) or 1))
+        results: Dict[str, Dict] = {}
+        with tracer.start_span('site.fleet_status', sites=len(sites), workers=workers):
+            probe = with_current_context(self.probe)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet-status") as executor:
+                for site, result in zip(sites, executor.map(probe, sites)):
+                    entry = {'s': result['status'], 'ms': result['latency_ms']}
+                    if configured is not None:
+                        entry['nginx'] = site in configured
+                    results[site] = entry
+
+        summary: Dict[str, int] = {}
+        for entry in results.values():
+            summary[entry['s']] = summary.get(entry['s'], 0) + 1
+
+        return {
+            'count': len(results),
+            'summary': summary,
+            'duration_ms': round((time.perf_counter() - start_time) * 1000, 1),
+            'sites': results
+        }
+
+
+# مثيل مشترك (جلسة HTTP واحدة لكل عملية)
+site_status_checker = SiteStatusChecker()
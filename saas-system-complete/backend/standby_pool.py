@@ -0,0 +1,398 @@
+"""
+مجموعة سيرفرات احتياطية جاهزة (standby) خارج التوزيع
+
+- size سيرفرات مُقلعة دائماً: الحاوية تعمل، gunicorn محمّل، والذاكرة المؤقتة مسخنة بطلبات لعدد من المواقع
+- السيرفر الاحتياطي صف في cluster_servers بـ role='standby' و active=FALSE (لا يُحمّل في التوزيع)
+  وعنوانه محجوز في cluster_leases؛ صف standby بدون حجز أو بعنوان سيرفر نشط لا يُحسب في المجموعة
+- الترقية (scale_up أو تعويض سيرفر متوقف): فحص سريع ثم أخذ الصف ذرياً (UPDATE ... WHERE role='standby')
+  فلا تُرقي عمليتان نفس السيرفر، ثم add_server كسيرفر جاهز - خلال أجزاء من الثانية بدلاً من إطلاق حاوية
+- بعد كل ترقية يُعاد ملء المجموعة في الخلفية
+- maintain() من حلقة المراقبة (القائد فقط): فحص الاحتياطيين، استبعاد من يفشل probe_failures مرات، وإعادة الملء
+
+يُسجل زمن كل ترقية، وكلفة الانتظار (ثواني السيرفر، ثواني أنوية CPU و GB الذاكرة المحجوزة، والاستهلاك المقاس).
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import requests
+
+from address_allocator import KIND_NAME
+from circuit_breaker import connect_mysql
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ROLE_STANDBY = 'standby'
+ROLE_ACTIVE = 'active'
+ROLE_MAINTENANCE = 'maintenance'
+
+
+def _size_gb(limit: str) -> float:
+    """'2g' / '512m' -> GB"""
+    units = {'k': 1 / 1024 ** 2, 'm': 1 / 1024, 'g': 1.0, 't': 1024.0}
+    limit = limit.strip().lower()
+    if limit and limit[-1] in units:
+        return float(limit[:-1]) * units[limit[-1]]
+    return float(limit) / 1024 ** 3
+
+
+@dataclass
+class StandbyServer:
+    """سيرفر احتياطي"""
+    server_id: str
+    ip: str
+    port: int
+    time_to_ready_ms: Optional[float] = None
+    warm_ms: Optional[float] = None
+    warmed_sites: int = 0
+    ready_since: float = field(default_factory=time.time)
+    last_probe: Optional[float] = None
+    probe_failures: int = 0
+    cpu_percent: Optional[float] = None
+    memory_percent: Optional[float] = None
+
+
+@dataclass
+class Promotion:
+    """ترقية سيرفر احتياطي"""
+    server_id: str
+    reason: str
+    success: bool = False
+    message: str = ''
+    promotion_ms: Optional[float] = None
+    idle_seconds: Optional[float] = None
+    at: float = field(default_factory=time.time)
+
+
+class StandbyPool:
+    """إدارة السيرفرات الاحتياطية وترقيتها"""
+
+    def __init__(self, cluster_manager, size: int = 1, cpu_limit: str = "1.0", memory_limit: str = "2g",
+                 probe_failures: int = 2, warm_sites: int = 20, probe_timeout: float = 1.0, history_size: int = 50):
+        self.cluster_manager = cluster_manager
+        self.db_config = cluster_manager.db_config
+        self.size = size
+        self.probe_failures = probe_failures
+        self.warm_sites = warm_sites
+        self.probe_timeout = probe_timeout
+
+        self.standbys: Dict[str, StandbyServer] = {}
+        self.promotions = deque(maxlen=history_size)
+        self.backfill_failures = 0
+        self._backfilling = 0
+        self._backfill_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+        # كلفة الانتظار التراكمية (الموارد المحجوزة لكل احتياطي)
+        self.cpu_limit = float(cpu_limit)
+        self.memory_gb = _size_gb(memory_limit)
+        self.idle = {'server_seconds': 0.0, 'cpu_core_seconds': 0.0, 'memory_gb_seconds': 0.0,
+                     'measured_cpu_core_seconds': 0.0}
+        self._accounted_at: Optional[float] = None
+
+    # --- قاعدة البيانات ---
+
+    def _connect(self):
+        return connect_mysql(self.db_config, connect_timeout=5)
+
+    def _list_standbys(self) -> List[Dict]:
+        """
+        الاحتياطيون المسجلون (الأحدث فحصاً أولاً)
+
+        فقط من أطلقته المجموعة: اسمه محجوز في cluster_leases، وعنوانه ليس عنوان سيرفر نشط
+        (صفوف standby القديمة أو اليدوية قد تشير إلى سيرفر يخدم المواقع بالفعل).
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT s.server_id, s.ip_address, s.port FROM cluster_servers s
+                JOIN cluster_leases l ON l.kind = %s AND l.value = s.server_id AND l.server_id = s.server_id
+                WHERE s.role = %s AND s.active = FALSE
+                  AND NOT EXISTS (
+                      SELECT 1 FROM cluster_servers a
+                      WHERE a.active = TRUE AND a.ip_address = s.ip_address AND a.port = s.port
+                  )
+                ORDER BY s.last_health_check DESC
+            """, (KIND_NAME, ROLE_STANDBY))
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+        # السيرفرات النشطة في هذه العملية (ومنها الافتراضية غير المحفوظة في الجدول)
+        active = {(address['ip'], int(address['port']))
+                  for address in list(self.cluster_manager.server_addresses.values())}
+        return [row for row in rows if (row['ip_address'], int(row['port'])) not in active]
+
+    def _claim(self, server_id: str) -> bool:
+        """أخذ الاحتياطي ذرياً (عملية واحدة فقط تنجح)"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE cluster_servers SET role = %s, active = TRUE
+                WHERE server_id = %s AND role = %s AND active = FALSE
+            """, (ROLE_ACTIVE, server_id, ROLE_STANDBY))
+            claimed = cursor.rowcount == 1
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return claimed
+
+    def _set_role(self, server_id: str, role: str):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE cluster_servers SET role = %s, active = FALSE WHERE server_id = %s",
+                           (role, server_id))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def _mark_checked(self, server_ids: List[str]):
+        if not server_ids:
+            return
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                UPDATE cluster_servers SET last_health_check = CURRENT_TIMESTAMP, status = 'healthy'
+                WHERE server_id IN ({', '.join(['%s'] * len(server_ids))})
+            """, server_ids)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    # --- الفحص والتسخين ---
+
+    def _url(self, standby: StandbyServer) -> str:
+        # نفس عنوان فحص الجاهزية في المُطلق (127.0.0.1 في وضع fake)
+        launcher = self.cluster_manager.container_launcher
+        host = (launcher.probe_host if launcher is not None else None) or standby.ip
+        return f"http://{host}:{standby.port}/api/method/version"
+
+    def _probe(self, standby: StandbyServer) -> bool:
+        try:
+            response = self.cluster_manager.http.get(
+                self._url(standby),
+                timeout=(self.probe_timeout, self.probe_timeout)
+            )
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def _warm(self, standby: StandbyServer):
+        """طلبات لعدد من المواقع حتى تُحمّل إعداداتها واتصالاتها قبل دخول التوزيع"""
+        start = time.perf_counter()
+        sites = self.cluster_manager._get_all_active_sites()[:self.warm_sites]
+        warmed = 0
+        for site in sites:
+            try:
+                response = self.cluster_manager.http.get(
+                    self._url(standby),
+                    headers={'Host': site}, timeout=(1.0, 5.0)
+                )
+                warmed += response.status_code == 200
+            except requests.exceptions.RequestException:
+                pass
+        standby.warmed_sites = warmed
+        standby.warm_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    # --- الترقية ---
+
+    def promote(self, reason: str = 'scale_up') -> Optional[Promotion]:
+        """
+        ترقية أفضل احتياطي إلى سيرفر نشط في التوزيع (بدون إعادة توزيع؛ المستدعي يعيد التوزيع)
+
+        يرجع None إذا لم يكن هناك احتياطي صالح.
+        """
+        start = time.perf_counter()
+        try:
+            candidates = self._list_standbys()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر قراءة السيرفرات الاحتياطية: {e}")
+            return None
+
+        for row in candidates:
+            standby = self.standbys.get(row['server_id']) or StandbyServer(row['server_id'], row['ip_address'],
+                                                                            row['port'])
+            if not self._probe(standby) or not self._claim(standby.server_id):
+                continue
+
+            with tracer.start_span('standby.promote', server=standby.server_id, reason=reason) as span:
+                promotion = Promotion(server_id=standby.server_id, reason=reason,
+                                      idle_seconds=round(time.time() - standby.ready_since, 1))
+                result = self.cluster_manager.add_server({
+                    'server_id': standby.server_id,
+                    'ip': standby.ip,
+                    'port': standby.port,
+                    'leased': True,
+                    'ready': True
+                }, rebalance=False)
+                promotion.promotion_ms = round((time.perf_counter() - start) * 1000, 1)
+                promotion.success = result['success']
+                promotion.message = result['message']
+                span.set_attribute('promotion_ms', promotion.promotion_ms)
+
+            with self._lock:
+                self.standbys.pop(standby.server_id, None)
+            if not promotion.success:
+                # الصف أصبح active دون أن يدخل التوزيع - إعادته احتياطياً
+                self._set_role(standby.server_id, ROLE_STANDBY)
+                logger.error(f"❌ فشل ترقية {standby.server_id}: {promotion.message}")
+            else:
+                logger.info(f"⚡ ترقية {standby.server_id} ({reason}) خلال {promotion.promotion_ms:.0f}ms "
+                            f"بعد انتظار {promotion.idle_seconds:.0f} ثانية")
+            self.promotions.append(promotion)
+            self.backfill()
+            if promotion.success:
+                return promotion
+        return None
+
+    def promote_many(self, count: int, reason: str = 'scale_up') -> List[Promotion]:
+        promotions = []
+        for _ in range(count):
+            promotion = self.promote(reason)
+            if promotion is None:
+                break
+            promotions.append(promotion)
+        return promotions
+
+    # --- الصيانة وإعادة الملء ---
+
+    def _account_idle(self, now: float):
+        if self._accounted_at is not None:
+            elapsed = now - self._accounted_at
+            ready = [standby for standby in self.standbys.values()
+                     if standby.last_probe is not None and standby.probe_failures == 0]
+            self.idle['server_seconds'] += len(ready) * elapsed
+            self.idle['cpu_core_seconds'] += len(ready) * self.cpu_limit * elapsed
+            self.idle['memory_gb_seconds'] += len(ready) * self.memory_gb * elapsed
+            self.idle['measured_cpu_core_seconds'] += sum((standby.cpu_percent or 0) / 100 for standby in ready) * elapsed
+        self._accounted_at = now
+
+    def maintain(self):
+        """فحص الاحتياطيين واستبعاد المتعطلين وإعادة الملء (من حلقة المراقبة)"""
+        now = time.time()
+        self._account_idle(now)
+        try:
+            rows = self._list_standbys()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر قراءة السيرفرات الاحتياطية: {e}")
+            return
+
+        registered = {row['server_id'] for row in rows}
+        healthy = []
+        with self._lock:
+            for server_id in list(self.standbys):
+                if server_id not in registered:
+                    self.standbys.pop(server_id)  # رُقي من عملية أخرى
+            for row in rows:
+                self.standbys.setdefault(row['server_id'], StandbyServer(row['server_id'], row['ip_address'],
+                                                                         row['port']))
+
+        for standby in list(self.standbys.values()):
+            if self._probe(standby):
+                standby.probe_failures = 0
+                standby.last_probe = now
+                healthy.append(standby.server_id)
+                metrics = self.cluster_manager._get_server_metrics(standby.server_id)
+                standby.cpu_percent = metrics.get('cpu_percent')
+                standby.memory_percent = metrics.get('memory_percent')
+            else:
+                standby.probe_failures += 1
+                if standby.probe_failures >= self.probe_failures:
+                    self.retire(standby.server_id, f"فشل الفحص {standby.probe_failures} مرات")
+
+        try:
+            self._mark_checked(healthy)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحديث فحص الاحتياطيين: {e}")
+        self.backfill()
+
+    def retire(self, server_id: str, reason: str):
+        """إخراج احتياطي من المجموعة (حذف الحاوية وتحرير الحجز)"""
+        logger.warning(f"⚠️ استبعاد السيرفر الاحتياطي {server_id}: {reason}")
+        with self._lock:
+            self.standbys.pop(server_id, None)
+        try:
+            self._set_role(server_id, ROLE_MAINTENANCE)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحديث دور {server_id}: {e}")
+        if self.cluster_manager.container_launcher is not None:
+            self.cluster_manager.container_launcher.remove(server_id)
+        self.cluster_manager.address_allocator.release(server_id)
+
+    def backfill(self):
+        """
+        إطلاق ما ينقص المجموعة في الخلفية (لا تُطلق دفعتان لنفس النقص)
+
+        في عملية القائد فقط؛ ترقية من عملية أخرى يعوضها القائد في جولته التالية.
+        """
+        if not self.cluster_manager.is_monitoring:
+            return
+        with self._backfill_lock:
+            missing = self.size - len(self.standbys) - self._backfilling
+            if missing <= 0 or self.cluster_manager.container_launcher is None:
+                return
+            self._backfilling += missing
+        threading.Thread(target=self._backfill, args=(missing,), name="standby-backfill", daemon=True).start()
+
+    def _backfill(self, count: int):
+        try:
+            leases = self.cluster_manager.address_allocator.lease_many(count)
+            servers = [{'server_id': lease.server_id, 'ip': lease.ip, 'port': lease.port} for lease in leases]
+            launches = self.cluster_manager.container_launcher.launch_many(
+                [self.cluster_manager._container_spec(server) for server in servers])
+
+            for server, launch in zip(servers, launches):
+                if not launch.success:
+                    self.backfill_failures += 1
+                    self.cluster_manager.address_allocator.release(server['server_id'])
+                    continue
+                standby = StandbyServer(server['server_id'], server['ip'], server['port'],
+                                        time_to_ready_ms=launch.time_to_ready_ms)
+                self._warm(standby)
+                self.cluster_manager._save_server_to_db(standby.server_id, standby.ip, standby.port, False,
+                                                        role=ROLE_STANDBY)
+                standby.ready_since = standby.last_probe = time.time()
+                with self._lock:
+                    self.standbys[standby.server_id] = standby
+                logger.info(f"🛟 سيرفر احتياطي {standby.server_id} جاهز خلال {launch.time_to_ready_ms:.0f}ms "
+                            f"(تسخين {standby.warmed_sites} موقع)")
+        except Exception as e:
+            self.backfill_failures += 1
+            logger.error(f"❌ فشل إعادة ملء السيرفرات الاحتياطية: {e}")
+        finally:
+            with self._backfill_lock:
+                self._backfilling -= count
+
+    def status(self) -> Dict:
+        """الاحتياطيون وزمن الترقيات وكلفة الانتظار"""
+        self._account_idle(time.time())
+        promotions = list(self.promotions)
+        timings = sorted(promotion.promotion_ms for promotion in promotions if promotion.success)
+        return {
+            'size': self.size,
+            'ready': len(self.standbys),
+            'backfilling': self._backfilling,
+            'backfill_failures': self.backfill_failures,
+            'standbys': [asdict(standby) for standby in self.standbys.values()],
+            'promotions': len(promotions),
+            'promotion_ms': {
+                'avg': round(sum(timings) / len(timings), 1) if timings else None,
+                'p50': timings[len(timings) // 2] if timings else None,
+                'max': timings[-1] if timings else None
+            },
+            'idle_cost': {key: round(value, 1) for key, value in self.idle.items()},
+            'recent': [asdict(promotion) for promotion in promotions[-10:]]
+        }
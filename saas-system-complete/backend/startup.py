@@ -0,0 +1,138 @@
+"""
+تهيئة مؤجلة للخادم: موارد تُنشأ مرة واحدة لكل عملية عند أول استخدام،
+ودوال تسخين (warmup) صريحة، وتفصيل لزمن بدء التشغيل
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# بداية تحميل الوحدات (أقرب نقطة لبدء العملية)
+PROCESS_START = time.perf_counter()
+
+
+class StartupProfiler:
+    """تسجيل زمن كل مرحلة من مراحل بدء التشغيل"""
+
+    def __init__(self):
+        self._phases: List[Dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """قياس مرحلة"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error)
+
+    def record(self, name: str, duration: float, error: Optional[str] = None):
+        """تسجيل مرحلة مقاسة مسبقاً"""
+        with self._lock:
+            self._phases.append({
+                'phase': name,
+                'duration_ms': round(duration * 1000, 2),
+                'offset_ms': round((time.perf_counter() - PROCESS_START - duration) * 1000, 2),
+                'thread': threading.current_thread().name,
+                'error': error
+            })
+        logger.info(f"⏱️ [STARTUP] {name}: {duration * 1000:.1f} ms{' - خطأ: ' + error if error else ''}")
+
+    def summary(self) -> Dict:
+        """تفصيل زمن بدء التشغيل"""
+        with self._lock:
+            phases = list(self._phases)
+        return {
+            'uptime_ms': round((time.perf_counter() - PROCESS_START) * 1000, 2),
+            'phases': phases,
+            'total_phase_ms': round(sum(p['duration_ms'] for p in phases), 2)
+        }
+
+
+profiler = StartupProfiler()
+
+
+class LazyResource(Generic[T]):
+    """مورد يُنشأ مرة واحدة لكل عملية عند أول طلب له"""
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        """إرجاع المورد وإنشاؤه عند الحاجة"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                with profiler.phase(f"init:{self.name}"):
+                    self._instance = self._factory()
+            return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def reset(self):
+        """إعادة الإنشاء عند الاستخدام التالي"""
+        with self._lock:
+            self._instance = None
+
+
+_warmup_hooks: List[Tuple[str, Callable[[], None]]] = []
+_warmup_lock = threading.Lock()
+_warmup_state = {'started': False, 'finished': False}
+
+
+def register_warmup(name: str, hook: Callable[[], None]):
+    """تسجيل دالة تسخين تُنفذ بالترتيب بعد بدء الخادم"""
+    _warmup_hooks.append((name, hook))
+
+
+def run_warmups():
+    """تنفيذ دوال التسخين مرة واحدة لكل عملية"""
+    with _warmup_lock:
+        if _warmup_state['started']:
+            return
+        _warmup_state['started'] = True
+
+    for name, hook in _warmup_hooks:
+        try:
+            with profiler.phase(f"warmup:{name}"):
+                hook()
+        except Exception as e:
+            logger.warning(f"⚠️ فشل التسخين {name}: {e}")
+
+    _warmup_state['finished'] = True
+    logger.info("✅ اكتمل تسخين الخادم")
+
+
+def start_warmups_in_background() -> threading.Thread:
+    """تنفيذ التسخين في thread منفصل حتى لا يؤخر استقبال الطلبات"""
+    thread = threading.Thread(target=run_warmups, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warmup_status() -> Dict:
+    """حالة التسخين"""
+    return {
+        'hooks': [name for name, _ in _warmup_hooks],
+        'started': _warmup_state['started'],
+        'finished': _warmup_state['finished']
+    }
@@ -0,0 +1,10 @@
+"""
+إعداد الاختبارات: وحدات backend تُستورد بأسمائها كما في app.py
+
+    cd backend && python -m pytest -q tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,196 @@
+"""
+AddressAllocator: المفتاح الأساسي (kind, value) في cluster_leases هو الحجز الذري
+
+FakeDatabase يحاكي الجدولين بمعاملات (commit / rollback) ويرفع IntegrityError عند تكرار المفتاح،
+ويمكنه حقن حجز من "عملية أخرى" بين قراءة القيم المستخدمة والإدراج.
+"""
+
+import threading
+import time
+
+import mysql.connector
+import pytest
+from mysql.connector import errorcode
+
+from address_allocator import AddressAllocator, AllocationError
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.leases = {}  # (kind, value) -> server_id
+        self.servers = []  # (server_id, ip, port) النشطة في cluster_servers
+        self.lock = threading.Lock()
+        # يُستدعى مرة بعد قراءة cluster_leases (سباق مع عملية أخرى)
+        self.after_read = None
+        # مهلة بين القراءة والإدراج توسع نافذة السباق بين الخيوط
+        self.read_delay = 0.0
+        self.conflicts = 0
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        with self.db.lock:
+            self.db.leases.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        self.pending = {}
+
+    def close(self):
+        self.pending = {}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.db = conn.db
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, args=()):
+        query = ' '.join(query.split())
+        if query.startswith('CREATE TABLE'):
+            return
+        if query == 'SELECT kind, value FROM cluster_leases':
+            with self.db.lock:
+                self.rows = list(self.db.leases)
+            hook, self.db.after_read = self.db.after_read, None
+            if hook:
+                hook()
+            if self.db.read_delay:
+                time.sleep(self.db.read_delay)
+        elif query.startswith('SELECT server_id, ip_address, port FROM cluster_servers'):
+            self.rows = list(self.db.servers)
+        elif query.startswith('INSERT INTO cluster_leases') and 'ON DUPLICATE KEY' in query:
+            kind, value, server_id = args
+            with self.db.lock:
+                self.conn.pending[(kind, value)] = self.db.leases.get((kind, value), server_id)
+        elif query.startswith('SELECT server_id FROM cluster_leases'):
+            self.rows = [(self.conn.pending.get(args) or self.db.leases.get(args),)]
+        elif query.startswith('DELETE FROM cluster_leases'):
+            with self.db.lock:
+                keys = [key for key, owner in self.db.leases.items() if owner == args[0]]
+                for key in keys:
+                    del self.db.leases[key]
+            self.rowcount = len(keys)
+        else:
+            raise AssertionError(f"استعلام غير متوقع: {query}")
+
+    def executemany(self, query, rows):
+        with self.db.lock:
+            for kind, value, server_id in rows:
+                if (kind, value) in self.db.leases or (kind, value) in self.conn.pending:
+                    self.db.conflicts += 1
+                    raise mysql.connector.IntegrityError(msg=f"Duplicate entry '{kind}-{value}'",
+                                                         errno=errorcode.ER_DUP_ENTRY)
+                self.conn.pending[(kind, value)] = server_id
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def _allocator(db, **kwargs):
+    options = dict(ip_range_start='172.30.0.10', ip_range_end='172.30.0.20',
+                   port_range_start=8100, port_range_end=8110)
+    options.update(kwargs)
+    allocator = AddressAllocator({}, **options)
+    allocator._connect = db.connect
+    return allocator
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+
+def test_lease_skips_active_servers_and_existing_leases(db):
+    db.servers = [('app-server-1', '172.30.0.10', 8100)]
+    first = _allocator(db).lease()
+    second = _allocator(db).lease()
+
+    assert (first.server_id, first.ip, first.port) == ('app-server-2', '172.30.0.11', 8101)
+    assert (second.server_id, second.ip, second.port) == ('app-server-3', '172.30.0.12', 8102)
+
+
+def test_conflicting_insert_retries_with_the_next_free_values(db):
+    other = _allocator(db)
+    allocator = _allocator(db)
+    # عملية أخرى تحجز نفس القيم بعد أن قرأ الحاجز القيم المستخدمة
+    db.after_read = lambda: other.lease()
+
+    lease = allocator.lease()
+
+    assert db.conflicts == 1
+    assert (lease.server_id, lease.ip, lease.port) == ('app-server-2', '172.30.0.11', 8101)
+    assert db.leases[('name', 'app-server-1')] == 'app-server-1'
+    # الإدراج الفاشل تراجع بالكامل: لا حجز جزئي
+    assert sorted(owner for owner in db.leases.values()) == ['app-server-1'] * 3 + ['app-server-2'] * 3
+
+
+def test_concurrent_allocators_never_share_a_value(db):
+    db.read_delay = 0.002
+    allocators = [_allocator(db, ip_range_end='172.30.0.100', port_range_end=8200) for _ in range(4)]
+    leases = []
+    lock = threading.Lock()
+
+    def worker(allocator):
+        for _ in range(10):
+            lease = allocator.lease()
+            with lock:
+                leases.append(lease)
+
+    threads = [threading.Thread(target=worker, args=(allocator,)) for allocator in allocators]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(leases) == 40
+    assert db.conflicts > 0
+    for field in ('server_id', 'ip', 'port'):
+        assert len({getattr(lease, field) for lease in leases}) == 40
+
+
+def test_exhausted_range_raises_and_lease_many_stops(db):
+    allocator = _allocator(db, ip_range_end='172.30.0.11')
+
+    assert len(allocator.lease_many(5)) == 2
+    with pytest.raises(AllocationError):
+        allocator.lease()
+
+
+def test_release_frees_values_for_reuse(db):
+    allocator = _allocator(db)
+    first = allocator.lease()
+    allocator.lease()
+
+    assert allocator.release(first.server_id) == 3
+    again = allocator.lease()
+    assert (again.server_id, again.ip, again.port) == (first.server_id, first.ip, first.port)
+
+
+def test_adopt_rejects_values_leased_to_another_server(db):
+    allocator = _allocator(db)
+    lease = allocator.lease()
+
+    with pytest.raises(AllocationError):
+        allocator.adopt('manual-server', lease.ip, 9000)
+    assert ('name', 'manual-server') not in db.leases
+
+    allocator.adopt('manual-server', '172.30.0.50', 9000)
+    assert db.leases[('ip', '172.30.0.50')] == 'manual-server'
+    # نفس السيرفر مرة أخرى لا يفشل
+    allocator.adopt('manual-server', '172.30.0.50', 9000)
@@ -0,0 +1,203 @@
+"""CircuitBreaker: closed -> open -> half_open -> closed / open بساعة وهمية"""
+
+import asyncio
+import subprocess
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    BreakerRegistry,
+    CircuitBreaker,
+    CircuitOpenError,
+    docker_failure,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', SimpleNamespace(monotonic=clock.monotonic, time=time.time))
+    return clock
+
+
+def _breaker(**kwargs):
+    options = dict(window_seconds=60, min_calls=3, failure_rate=0.5, open_seconds=15)
+    options.update(kwargs)
+    return CircuitBreaker('app:app-server-1', **options)
+
+
+def _fail():
+    raise ConnectionError('refused')
+
+
+def _fail_times(breaker, count):
+    for _ in range(count):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+
+
+def test_opens_only_after_min_calls_at_failure_rate(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 2)
+    assert breaker.state == STATE_CLOSED
+
+    _fail_times(breaker, 1)
+    assert breaker.state == STATE_OPEN
+    assert breaker.counters['opened'] == 1
+    assert breaker.last_error == 'ConnectionError: refused'
+
+
+def test_successes_keep_rate_below_threshold(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        assert breaker.call(lambda: 'ok') == 'ok'
+    _fail_times(breaker, 3)
+    # 3 من 7 < 50%
+    assert breaker.state == STATE_CLOSED
+    _fail_times(breaker, 1)
+    assert breaker.state == STATE_OPEN
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 2)
+    clock.advance(61)
+    _fail_times(breaker, 1)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_open_rejects_without_calling(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 3)
+    calls = []
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.call(calls.append, 1)
+    assert calls == []
+    assert error.value.retry_after == pytest.approx(15)
+    assert breaker.counters['rejected'] == 1
+
+
+def test_half_open_trial_success_closes(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 3)
+    clock.advance(15)
+
+    breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    # تجربة واحدة فقط أثناء half_open
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'second')
+    breaker.record(False)
+
+    assert breaker.state == STATE_CLOSED
+    assert breaker.status()['window']['calls'] == 0
+    assert breaker.call(lambda: 'ok') == 'ok'
+
+
+def test_half_open_trial_failure_reopens(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 3)
+    clock.advance(15)
+
+    _fail_times(breaker, 1)
+    assert breaker.state == STATE_OPEN
+    assert breaker.counters['opened'] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+
+
+def test_stuck_trial_does_not_block_forever(clock):
+    breaker = _breaker()
+    _fail_times(breaker, 3)
+    clock.advance(15)
+    breaker.allow()  # تجربة لم تُسجل نتيجتها
+
+    clock.advance(15)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == STATE_CLOSED
+
+
+def test_is_failure_marks_results_without_exceptions(clock):
+    breaker = CircuitBreaker('docker:proxy-server', min_calls=2, open_seconds=30)
+    daemon_down = subprocess.CompletedProcess([], 1, '', 'Cannot connect to the Docker daemon at unix:///var/run/docker.sock')
+    command_failed = subprocess.CompletedProcess([], 1, '', 'nginx: [emerg] unknown directive')
+
+    for _ in range(3):
+        breaker.call(lambda: command_failed, is_failure=docker_failure)
+    assert breaker.state == STATE_CLOSED
+
+    for _ in range(3):
+        breaker.call(lambda: daemon_down, is_failure=docker_failure)
+    assert breaker.state == STATE_OPEN
+    assert 'Docker daemon' in breaker.last_error
+
+
+def test_docker_failure_exit_codes():
+    assert docker_failure(subprocess.CompletedProcess([], 125, '', b'')) == 'docker exec 125'
+    assert docker_failure(subprocess.CompletedProcess([], 127, '', 'exec: "bench": not found'))
+    assert docker_failure(subprocess.CompletedProcess([], 0, 'ok', '')) is None
+    assert docker_failure(subprocess.CompletedProcess([], 1, '', 'Error response from daemon: No such container'))
+
+
+def test_call_async_follows_the_same_transitions(clock):
+    breaker = _breaker()
+
+    async def fail():
+        raise asyncio.TimeoutError()
+
+    async def ok():
+        return 'ok'
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await breaker.call_async(fail)
+        assert breaker.state == STATE_OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call_async(ok)
+        clock.advance(15)
+        assert await breaker.call_async(ok) == 'ok'
+
+    asyncio.run(scenario())
+    assert breaker.state == STATE_CLOSED
+
+
+def test_not_enforced_records_without_rejecting(clock):
+    breaker = _breaker(enforce=False)
+    _fail_times(breaker, 3)
+
+    assert breaker.state == STATE_OPEN
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.counters['rejected'] == 1
+
+
+def test_registry_defaults_per_kind_and_availability(clock):
+    registry = BreakerRegistry()
+    bench = registry.get('bench:local')
+
+    assert registry.get('bench:local') is bench
+    assert (bench.window_seconds, bench.min_calls, bench.open_seconds) == (300, 2, 60)
+    assert registry.available('app:never-used')
+
+    app = registry.get('app:app-server-1')
+    _fail_times(app, 3)
+    assert not registry.available('app:app-server-1')
+    assert registry.status()['not_closed'] == ['app:app-server-1']
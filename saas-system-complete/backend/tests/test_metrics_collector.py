@@ -0,0 +1,111 @@
+"""MetricsCollector: نسب CPU من فرق العينات، المقاييس البطيئة المخزنة، وقارئ cgroup v2"""
+
+import os
+
+import pytest
+
+from metrics_collector import CgroupStatsReader, MetricsCollector, MetricsUnavailable, MockDockerAPI
+
+
+@pytest.fixture
+def collector():
+    api = MockDockerAPI(seed=1)
+    api.add_container('app-server-1', cpus=2, sites=40, cpu_load=0.6, memory_load=0.25)
+    api.add_container('app-server-2', cpus=1, sites=8, cpu_load=0.1, memory_load=0.5)
+    return MetricsCollector(api=api, slow_interval=30)
+
+
+def test_cpu_percent_comes_from_the_delta_between_samples(collector):
+    first = collector.collect('app-server-1')
+    second = collector.collect('app-server-1')
+
+    # بدون precpu_stats لا تُحسب النسبة من عينة واحدة
+    assert first['cpu_percent'] is None
+    assert second['cpu_percent'] == pytest.approx(60, abs=3)
+    assert second['memory_percent'] == pytest.approx(25)
+    assert second['network_rx'] > first['network_rx']
+
+
+def test_slow_sample_is_cached_between_rounds(collector, monkeypatch):
+    calls = []
+    original = collector.api.exec_create
+    monkeypatch.setattr(collector.api, 'exec_create', lambda *args, **kwargs: calls.append(1) or original(*args, **kwargs))
+
+    sample = collector.collect('app-server-1')
+    collector.collect('app-server-1')
+
+    assert len(calls) == 1
+    assert sample['sites_count'] == 40
+    assert sample['gunicorn_workers'] == 4
+    assert sample['background_workers'] == 2
+
+
+def test_collect_many_skips_unavailable_containers(collector):
+    collector.api.remove_container('app-server-2')
+    results = collector.collect_many(['app-server-1', 'app-server-2'])
+    assert list(results) == ['app-server-1']
+
+
+def test_forget_resets_cpu_baseline(collector):
+    collector.collect('app-server-2')
+    collector.collect('app-server-2')
+    collector.forget('app-server-2')
+    assert collector.collect('app-server-2')['cpu_percent'] is None
+
+
+def test_page_cache_is_not_counted_as_memory(collector):
+    stats = {
+        'memory_stats': {'usage': 1000, 'limit': 2000, 'stats': {'inactive_file': 400}},
+        'cpu_stats': {'cpu_usage': {'total_usage': 0}, 'system_cpu_usage': 0},
+    }
+    sample = collector._fast_sample('app-server-1', stats)
+    assert sample['memory_bytes'] == 600
+    assert sample['memory_percent'] == 30.0
+
+
+def test_cpu_percent_is_relative_to_the_container_limit(collector):
+    stats = {'cpu_stats': {'cpu_usage': {'total_usage': 0}, 'system_cpu_usage': 0, 'online_cpus': 8}}
+    collector._cpu_percent('c', stats, cpu_limit=2.0)
+    # نواة واحدة مشغولة من 8 = 50% من حد نواتين
+    stats = {'cpu_stats': {'cpu_usage': {'total_usage': 10 ** 9}, 'system_cpu_usage': 8 * 10 ** 9, 'online_cpus': 8}}
+    assert collector._cpu_percent('c', stats, cpu_limit=2.0) == 50.0
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_cgroup_v2_reader_matches_docker_stats_shape(tmp_path):
+    container_id = 'a' * 64
+    scope = tmp_path / 'cgroup' / 'system.slice' / f'docker-{container_id}.scope'
+    _write(str(scope / 'cgroup.controllers'), 'cpu memory io pids')
+    _write(str(scope / 'cpu.stat'), 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000')
+    _write(str(scope / 'memory.current'), '104857600')
+    _write(str(scope / 'memory.max'), 'max')
+    _write(str(scope / 'memory.stat'), 'anon 80000000\ninactive_file 4857600')
+    _write(str(scope / 'pids.current'), '23')
+    _write(str(scope / 'io.stat'), '8:0 rbytes=4096 wbytes=8192 rios=1 wios=2\n8:16 rbytes=1 wbytes=2 rios=1 wios=1')
+    _write(str(tmp_path / 'proc' / 'stat'), 'cpu  100 0 100 800 0 0 0 0 0 0\ncpu0 100 0 100 800 0 0 0 0 0 0')
+    _write(str(tmp_path / 'proc' / 'meminfo'), 'MemTotal:       8192000 kB\n')
+    _write(str(tmp_path / 'proc' / '42' / 'net' / 'dev'),
+           'Inter-|   Receive\n face |bytes\n'
+           '    lo: 999 0 0 0 0 0 0 0 999 0 0 0 0 0 0 0\n'
+           '  eth0: 1500 10 0 0 0 0 0 0 2500 20 0 0 0 0 0 0\n')
+
+    reader = CgroupStatsReader(cgroup_root=str(tmp_path / 'cgroup'), proc_root=str(tmp_path / 'proc'))
+    stats = reader.stats(container_id, pid=42)
+
+    assert stats['cpu_stats']['cpu_usage']['total_usage'] == 2_500_000_000
+    assert stats['memory_stats'] == {'usage': 104857600, 'limit': 8192000 * 1024, 'stats': {'inactive_file': 4857600}}
+    assert stats['pids_stats'] == {'current': 23}
+    assert stats['blkio_stats']['io_service_bytes_recursive'] == [{'op': 'read', 'value': 4097},
+                                                                  {'op': 'write', 'value': 8194}]
+    assert stats['networks'] == {'eth0': {'rx_bytes': 1500, 'tx_bytes': 2500}}
+
+
+def test_cgroup_reader_without_container_cgroup_raises(tmp_path):
+    reader = CgroupStatsReader(cgroup_root=str(tmp_path), proc_root=str(tmp_path))
+    with pytest.raises(MetricsUnavailable):
+        reader.stats('b' * 64)
@@ -0,0 +1,100 @@
+"""MetricsStore: ring buffer بذاكرة ثابتة واستعلامات النوافذ الزمنية"""
+
+import math
+
+import numpy as np
+import pytest
+
+from metrics_store import MetricsStore, ServerTimeSeries
+
+NOW = 1_700_000_000.0
+
+
+def test_buffer_wraps_and_keeps_time_order():
+    series = ServerTimeSeries(capacity=5)
+    for i in range(8):
+        series.append(NOW + i, {'cpu_percent': i})
+
+    timestamps, values = series.column('cpu_percent')
+    assert list(values) == [3, 4, 5, 6, 7]
+    assert list(timestamps) == [NOW + i for i in range(3, 8)]
+    assert series.latest('cpu_percent') == 7
+    # الذاكرة لا تكبر مع عدد العينات
+    assert series.gauges.shape[0] == 5
+
+
+def test_window_queries_after_wrap():
+    series = ServerTimeSeries(capacity=100)
+    for i in range(250):
+        series.append(NOW + i, {'cpu_percent': i % 100})
+
+    now = NOW + 249
+    # آخر 10 ثوانٍ: القيم 39..49 (11 عينة بما فيها الحد)
+    assert series.mean('cpu_percent', 10, now) == pytest.approx(44)
+    assert series.percentile('cpu_percent', 10, 100, now) == 49
+    assert series.percentile('cpu_percent', 1000, 0, now) == 0
+    assert series.mean('cpu_percent', 5, now + 1000) is None
+
+
+def test_samples_within_resolution_replace_and_older_are_dropped():
+    series = ServerTimeSeries(capacity=10, resolution=1.0)
+    series.append(NOW, {'cpu_percent': 10})
+    series.append(NOW + 0.5, {'cpu_percent': 20})
+    series.append(NOW - 5, {'cpu_percent': 99})
+
+    _, values = series.column('cpu_percent')
+    assert list(values) == [20]
+
+
+def test_missing_fields_are_nan_and_ignored():
+    series = ServerTimeSeries(capacity=10)
+    series.append(NOW, {'cpu_percent': 10})
+    series.append(NOW + 1, {'memory_percent': 50})
+
+    assert series.latest('cpu_percent') is None
+    assert series.mean('cpu_percent', 60, NOW + 1) == 10
+
+
+def test_counter_rate_ignores_resets():
+    series = ServerTimeSeries(capacity=10)
+    for i, value in enumerate([1000, 2000, 3000, 100, 1100]):
+        series.append(NOW + i, {'network_rx': value})
+
+    # 1000 + 1000 + (إعادة تصفير) + 1000 خلال 4 ثوانٍ
+    assert series.rate('network_rx', 60, NOW + 4) == pytest.approx(750)
+
+
+def test_counters_keep_float64_precision():
+    series = ServerTimeSeries(capacity=4)
+    series.append(NOW, {'network_rx': 2 ** 40})
+    series.append(NOW + 1, {'network_rx': 2 ** 40 + 7})
+    assert series.rate('network_rx', 60, NOW + 1) == 7
+
+
+def test_store_aggregates_across_servers():
+    store = MetricsStore(retention_seconds=60)
+    for i in range(10):
+        store.record('app-server-1', {'cpu_percent': 20}, NOW + i)
+        store.record('app-server-2', {'cpu_percent': 60 + i}, NOW + i)
+
+    servers = ['app-server-1', 'app-server-2', 'app-server-3']
+    values = store.server_values('cpu_percent', 30, servers, now=NOW + 9)
+    assert values[0] == 20 and values[1] == pytest.approx(64.5) and math.isnan(values[2])
+    assert store.aggregate('cpu_percent', 30, servers, reduce='max', now=NOW + 9) == pytest.approx(64.5)
+    assert store.cluster_percentile('cpu_percent', 30, servers, q=100, now=NOW + 9) == 69
+    assert store.aggregate('cpu_percent', 30, ['app-server-3']) is None
+
+    store.remove('app-server-2')
+    assert np.isnan(store.server_values('cpu_percent', 30, ['app-server-2'], now=NOW + 9)[0])
+
+
+def test_summary_reports_mean_p95_and_rates():
+    store = MetricsStore(retention_seconds=60)
+    for i in range(20):
+        store.record('app-server-1', {'cpu_percent': i, 'network_tx': i * 100}, NOW + i)
+
+    summary = store.summary('app-server-1', 60, now=NOW + 19)
+    assert summary['samples'] == 20
+    assert summary['cpu_percent'] == {'mean': 9.5, 'p95': 18.05}
+    assert summary['network_tx_per_sec'] == 100.0
+    assert store.summary('missing', 60) == {}
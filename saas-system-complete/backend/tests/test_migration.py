@@ -0,0 +1,211 @@
+"""
+ترحيل المواقع على حاويات fake_docker.py: التحقق يطرق خادم التطبيق الوهمي فعلاً، والتراجع يعيد الحالة
+
+ContainerShell (docker exec) يُستبدل بـ FakeShell الذي يحاكي مجلد sites/ في كل حاوية
+ويرفض التنفيذ في حاوية لا تعمل حسب المحرك الوهمي.
+"""
+
+import re
+import socket
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from cluster_simulator import InMemoryAssignmentStore
+from container_lifecycle import ContainerSpec, create_container_launcher
+from migration import ContainerShell, MigrationEngine, MigrationError
+
+SITE = 'shop.example.com'
+SERVERS = ('app-server-1', 'app-server-2', 'app-server-3')
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeShell(ContainerShell):
+    """sites/ لكل حاوية في الذاكرة مع سجل الأوامر"""
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self.sites = {server: set() for server in SERVERS}
+        self.migrated = {server: set() for server in SERVERS}
+        self.maintenance = set()
+        self.commands = []
+        self.fail_on = None
+
+    def _check(self, container: str, script: str):
+        self.commands.append((container, script))
+        fake = self.engine.containers.get(container)
+        if fake is None or fake.status != 'running':
+            raise MigrationError(f"{container}: Error response from daemon: container is not running")
+        if self.fail_on and self.fail_on in script:
+            raise MigrationError(f"{container}: {self.fail_on} failed")
+
+    def run(self, container, script, timeout=None):
+        self._check(container, script)
+        site = re.search(r'sites/(\S+?)(/| |$)', script)
+        if script.startswith('test -f'):
+            if site.group(1) not in self.sites[container]:
+                raise MigrationError(f"{container}: no site")
+            return ''
+        if script.startswith('test -e'):
+            return 'yes\n' if site.group(1) in self.sites[container] else 'no\n'
+        if 'set-maintenance-mode' in script:
+            name = re.search(r'--site (\S+)', script).group(1)
+            (self.maintenance.add if script.endswith(' on') else self.maintenance.discard)((container, name))
+            return ''
+        if script.startswith('rm -rf'):
+            self.sites[container].discard(site.group(1))
+            return ''
+        if script.startswith('mkdir -p migrated-sites'):
+            self.sites[container].discard(site.group(1))
+            self.migrated[container].add(site.group(1))
+            return ''
+        raise AssertionError(f"أمر غير متوقع: {script}")
+
+    def stream(self, source, read_script, target, write_script, timeout=None):
+        self._check(source, read_script)
+        self._check(target, write_script)
+        self.sites[target].add(read_script.split()[-1])
+
+
+class FakeCluster:
+    """ما يحتاجه MigrationEngine من ClusterManager"""
+
+    def __init__(self, ports):
+        self.ports = ports
+        self.assignments = InMemoryAssignmentStore()
+        self.http = requests.Session()
+
+    def _get_server_info(self, server_id):
+        return {'ip': '127.0.0.1', 'port': self.ports[server_id]}
+
+
+@pytest.fixture(scope='module')
+def launcher(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('FAKE_DOCKER_SOCKET', str(tmp_path_factory.mktemp('docker') / 'docker.sock'))
+        patch.setenv('FAKE_DOCKER_BOOT_DELAY', '0')
+        patch.delenv('CONTAINER_PROBE_HOST', raising=False)
+        launcher = create_container_launcher(ready_timeout=10, backend='fake')
+    launcher.poll_interval = 0.05
+    ports = {}
+    for server_id in SERVERS:
+        ports[server_id] = _free_port()
+        result = launcher.launch(ContainerSpec(server_id=server_id, ip='172.30.0.10', port=ports[server_id],
+                                               image='frappe/bench:latest', network='frappe-cluster-net'))
+        assert result.success, result.message
+    launcher.ports = ports
+    yield launcher
+    launcher.engine.stop()
+
+
+@pytest.fixture
+def env(launcher):
+    cluster = FakeCluster(launcher.ports)
+    cluster.assignments.assign(SITE, 'app-server-1')
+    shell = FakeShell(launcher.engine)
+    shell.sites['app-server-1'].add(SITE)
+    env = SimpleNamespace(cluster=cluster, shell=shell, routes=[],
+                          route_result=lambda site, upstream: (True, 'ok'),
+                          upstream=lambda server_id: f"127.0.0.1:{launcher.ports[server_id]}")
+
+    def router(site, upstream):
+        env.routes.append(upstream)
+        return env.route_result(site, upstream)
+
+    env.engine = MigrationEngine(cluster, verify_timeout=1.5, shell=shell, router=router)
+    return env
+
+
+def test_migration_completes_and_moves_source_copy_aside(env):
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-2')
+
+    assert migration.status == 'completed', migration.error
+    assert env.cluster.assignments.server_of(SITE) == 'app-server-2'
+    assert env.routes == [env.upstream('app-server-2')]
+    assert SITE in env.shell.sites['app-server-2']
+    assert SITE in env.shell.migrated['app-server-1']
+    # الصيانة تبقى مفعلة فقط في نسخة المصدر المُبعدة
+    assert ('app-server-2', SITE) not in env.shell.maintenance
+    assert 'verify' in migration.stages_ms and migration.cutover_ms is not None
+
+
+def test_failed_route_switch_rolls_back(env):
+    env.route_result = lambda site, upstream: (False, 'nginx -t failed')
+
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-2')
+
+    assert migration.status == 'rolled_back'
+    assert migration.stage == 'switch'
+    assert env.cluster.assignments.server_of(SITE) == 'app-server-1'
+    # التوجيه لم يتغير فلا يُعاد، والصيانة أُلغيت على المصدر، ونسخة الهدف حُذفت
+    assert env.routes == [env.upstream('app-server-2')]
+    assert env.shell.maintenance == set()
+    assert SITE not in env.shell.sites['app-server-2']
+    assert SITE in env.shell.sites['app-server-1']
+
+
+def test_unresponsive_target_rolls_back_before_cutover(env, launcher):
+    # الحاوية تعمل لكن خادم التطبيق فيها لا يجيب
+    container = launcher.engine.containers['app-server-3']
+    container.server.shutdown()
+    container.server.server_close()
+    container.server = None
+
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-3')
+
+    assert migration.status == 'rolled_back'
+    assert migration.stage == 'verify'
+    assert 'app-server-3' in migration.error
+    assert env.routes == []
+    assert not any('set-maintenance-mode' in script for _, script in env.shell.commands)
+    assert SITE not in env.shell.sites['app-server-3']
+    assert env.cluster.assignments.server_of(SITE) == 'app-server-1'
+
+
+def test_concurrent_reassignment_switches_route_back(env):
+    def route(site, upstream):
+        if upstream == env.upstream('app-server-2'):
+            # عملية أخرى نقلت الموقع وأعادته بعد precheck (تغيرت النسخة)
+            env.cluster.assignments.assign(SITE, 'app-server-3')
+            env.cluster.assignments.assign(SITE, 'app-server-1')
+        return True, 'ok'
+    env.route_result = route
+
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-2')
+
+    assert migration.status == 'rolled_back'
+    assert migration.stage == 'assign'
+    assert env.routes == [env.upstream('app-server-2'), env.upstream('app-server-1')]
+    assert env.shell.maintenance == set()
+    assert SITE not in env.shell.sites['app-server-2']
+
+
+def test_failed_rollback_step_marks_migration_failed(env):
+    env.route_result = lambda site, upstream: (False, 'nginx -t failed')
+    env.shell.fail_on = 'rm -rf'
+
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-2')
+
+    assert migration.status == 'failed'
+    # بقية خطوات التراجع نُفذت رغم فشل حذف نسخة الهدف
+    assert env.shell.maintenance == set()
+    assert env.cluster.assignments.server_of(SITE) == 'app-server-1'
+
+
+def test_precheck_rejects_site_already_on_target(env):
+    env.shell.sites['app-server-2'].add(SITE)
+
+    migration = env.engine.migrate(SITE, 'app-server-1', 'app-server-2')
+
+    assert migration.status == 'rolled_back'
+    assert migration.stage == 'precheck'
+    # نسخة الهدف الموجودة مسبقاً ليست من هذا الترحيل فلا تُحذف
+    assert SITE in env.shell.sites['app-server-2']
+    assert env.routes == []
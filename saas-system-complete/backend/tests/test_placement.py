@@ -0,0 +1,142 @@
+"""خوارزميات التوزيع: consistent hashing بحد للحمل، و bin-packing الموزون اللاصق"""
+
+import random
+
+from placement import (
+    ServerCapacity,
+    TenantCost,
+    assignment_map,
+    bounded_load_capacity,
+    consistent_hash_placement,
+    placement_moves,
+    placement_utilization,
+    weighted_placement,
+)
+
+SITES = [f"site{i}.example.com" for i in range(2000)]
+SERVERS = [f"app-server-{i}" for i in range(1, 11)]
+
+
+def test_every_site_placed_once_under_the_load_cap():
+    distribution = consistent_hash_placement(SITES, SERVERS)
+    capacity = bounded_load_capacity(len(SITES), len(SERVERS))
+
+    assert sorted(assignment_map(distribution)) == sorted(SITES)
+    assert max(len(sites) for sites in distribution.values()) <= capacity
+
+
+def test_load_factor_one_is_perfectly_even():
+    distribution = consistent_hash_placement(SITES, SERVERS, load_factor=1.0)
+    assert {len(sites) for sites in distribution.values()} == {len(SITES) // len(SERVERS)}
+
+
+def test_placement_ignores_input_order():
+    shuffled = SITES[:]
+    random.Random(3).shuffle(shuffled)
+    assert assignment_map(consistent_hash_placement(shuffled, SERVERS[::-1])) == \
+        assignment_map(consistent_hash_placement(SITES, SERVERS))
+
+
+def test_adding_a_server_moves_about_one_nth_only_onto_it():
+    previous = assignment_map(consistent_hash_placement(SITES, SERVERS))
+    moves = placement_moves(previous, consistent_hash_placement(SITES, SERVERS + ['app-server-11']))
+
+    # المثالي 1/11 ≈ 9%؛ إعادة التوزيع الكاملة تنقل ~90%
+    assert 0 < moves['moved_percent'] <= 12
+    assert {move['to'] for move in moves['moves']} == {'app-server-11'}
+
+
+def test_removing_a_server_moves_only_its_sites():
+    distribution = consistent_hash_placement(SITES, SERVERS)
+    previous = assignment_map(distribution)
+    moves = placement_moves(previous, consistent_hash_placement(SITES, SERVERS[:-1]))
+
+    assert moves['moved'] == len(distribution['app-server-10'])
+    assert {move['from'] for move in moves['moves']} == {'app-server-10'}
+
+
+def test_new_sites_are_placed_without_moving_existing_ones():
+    previous = assignment_map(consistent_hash_placement(SITES, SERVERS))
+    grown = SITES + [f"new{i}.example.com" for i in range(20)]
+    moves = placement_moves(previous, consistent_hash_placement(grown, SERVERS))
+
+    assert moves['moved'] == 0
+    assert moves['placed'] == 20
+    assert moves['dropped'] == 0
+
+
+def test_cap_holds_when_ring_points_are_skewed():
+    # عدد قليل من النقاط الافتراضية يجعل الحلقة غير متوازنة - الحد يمنع تكدس المواقع
+    distribution = consistent_hash_placement(SITES, SERVERS, load_factor=1.1, vnodes=2)
+    assert max(len(sites) for sites in distribution.values()) <= bounded_load_capacity(len(SITES), len(SERVERS), 1.1)
+    assert len(assignment_map(distribution)) == len(SITES)
+
+
+def _costs(seed: int = 7):
+    rng = random.Random(seed)
+    return {
+        site: TenantCost(requests_per_min=rng.uniform(0.5, 5), cpu_seconds_per_min=rng.uniform(0.1, 1.5),
+                         db_bytes=rng.uniform(50, 400) * 1024 ** 2, worker_memory_bytes=rng.uniform(10, 60) * 1024 ** 2)
+        for site in SITES
+    }
+
+
+COSTS = _costs()
+# الأسطول عند ~66% من سعته
+CAPACITY = ServerCapacity.from_limits('4.0', '16g', '200g', requests_per_min=2400)
+
+
+def _peaks(distribution, capacity=CAPACITY):
+    """أعلى بُعد لكل سيرفر (نسبة مئوية)"""
+    return {server: max(dims.values()) for server, dims in placement_utilization(distribution, COSTS, capacity).items()}
+
+
+def test_weighted_unchanged_fleet_moves_nothing():
+    previous = assignment_map(weighted_placement(SITES, SERVERS, COSTS, CAPACITY))
+    again = weighted_placement(SITES, SERVERS, COSTS, CAPACITY, current=previous)
+    assert placement_moves(previous, again)['moved'] == 0
+
+
+def test_weighted_new_server_pulls_load_up_to_the_mean():
+    previous = assignment_map(weighted_placement(SITES, SERVERS, COSTS, CAPACITY))
+    servers = SERVERS + ['app-server-11']
+    distribution = weighted_placement(SITES, servers, COSTS, CAPACITY, current=previous)
+    moves = placement_moves(previous, distribution)
+    peaks = _peaks(distribution)
+    mean = sum(peaks.values()) / len(peaks)
+
+    # النقل فقط إلى السيرفر الجديد، وبقدر ما يقربه من المتوسط
+    assert {move['to'] for move in moves['moves']} == {'app-server-11'}
+    assert moves['moved_percent'] <= 12
+    assert peaks['app-server-11'] >= 0.9 * mean
+    assert max(peaks.values()) <= 1.05 * mean
+
+
+def test_weighted_overloaded_server_sheds_only_its_excess():
+    current = {site: 'app-server-1' if index < 1000 else SERVERS[index % len(SERVERS)]
+               for index, site in enumerate(SITES)}
+    distribution = weighted_placement(SITES, SERVERS, COSTS, CAPACITY, current=current)
+    moves = placement_moves(current, distribution)
+    peaks = _peaks(distribution)
+
+    assert {move['from'] for move in moves['moves']} == {'app-server-1'}
+    assert max(peaks.values()) <= 1.05 * sum(peaks.values()) / len(peaks)
+
+
+def test_weighted_removed_server_moves_only_its_sites():
+    distribution = weighted_placement(SITES, SERVERS, COSTS, CAPACITY)
+    previous = assignment_map(distribution)
+    moves = placement_moves(previous, weighted_placement(SITES, SERVERS[:-1], COSTS, CAPACITY, current=previous))
+
+    assert moves['moved'] == len(distribution['app-server-10'])
+    assert {move['from'] for move in moves['moves']} == {'app-server-10'}
+
+
+def test_weighted_fleet_over_capacity_is_not_reshuffled():
+    # كل السيرفرات فوق سعتها: النقل لا يخفض الحمل فلا يحدث
+    small = ServerCapacity.from_limits('0.5', '1g', '20g', requests_per_min=300)
+    previous = assignment_map(weighted_placement(SITES, SERVERS, COSTS, small))
+    assert min(_peaks(weighted_placement(SITES, SERVERS, COSTS, small), small).values()) > 100
+
+    again = weighted_placement(SITES, SERVERS, COSTS, small, current=previous)
+    assert placement_moves(previous, again)['moved'] == 0
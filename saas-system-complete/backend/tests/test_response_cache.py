@@ -0,0 +1,160 @@
+"""ResponseCache: تحميل واحد لكل مفتاح، و generation يمنع تخزين تحميل بدأ قبل الإبطال"""
+
+import threading
+import time
+
+from response_cache import ResponseCache
+
+
+class GatedLoader:
+    """محمّل ينتظر إشارة الاختبار ويعد مرات استدعائه"""
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        value = self.values[min(self.calls, len(self.values)) - 1]
+        self.started.set()
+        assert self.release.wait(5)
+        return value
+
+
+def _get_in_thread(cache, key, loader, results, ttl=60, stale_ttl=0):
+    thread = threading.Thread(target=lambda: results.append(cache.get(key, loader, ttl, stale_ttl)))
+    thread.start()
+    return thread
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ResponseCache()
+    loader = GatedLoader(['sites'])
+    results = []
+
+    threads = [_get_in_thread(cache, 'bench_sites', loader, results) for _ in range(20)]
+    assert loader.started.wait(5)
+    time.sleep(0.05)
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loader.calls == 1
+    assert results == ['sites'] * 20
+    assert cache.stats()['loads'] == 1
+
+
+def test_load_error_reaches_every_waiter_and_is_not_cached():
+    cache = ResponseCache()
+    gate = threading.Event()
+    calls = []
+
+    def failing():
+        calls.append(1)
+        gate.wait(5)
+        raise RuntimeError('bench down')
+
+    errors = []
+
+    def worker():
+        try:
+            cache.get('bench_sites', failing, 60)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert errors == ['bench down'] * 5
+    assert cache.peek('bench_sites') is None
+
+
+def test_invalidate_during_load_fences_the_result():
+    cache = ResponseCache()
+    loader = GatedLoader(['old', 'new'])
+    results = []
+
+    thread = _get_in_thread(cache, 'bench_sites', loader, results)
+    assert loader.started.wait(5)
+    # كتابة أبطلت المفتاح أثناء التحميل البطيء
+    cache.invalidate('bench_sites')
+    loader.release.set()
+    thread.join(5)
+
+    # من طلب القيمة قبل الإبطال يأخذها، لكنها لا تُخزن
+    assert results == ['old']
+    assert cache.peek('bench_sites') is None
+    assert cache.stats()['stale_loads'] == 1
+
+    assert cache.get('bench_sites', loader, 60) == 'new'
+    assert cache.peek('bench_sites') == 'new'
+    assert loader.calls == 2
+
+
+def test_invalidate_all_fences_inflight_loads():
+    cache = ResponseCache()
+    loader = GatedLoader(['old'])
+    results = []
+
+    thread = _get_in_thread(cache, 'health', loader, results)
+    assert loader.started.wait(5)
+    cache.invalidate()
+    loader.release.set()
+    thread.join(5)
+
+    assert results == ['old']
+    assert cache.peek('health') is None
+
+
+def test_invalidating_another_key_does_not_fence():
+    cache = ResponseCache()
+    loader = GatedLoader(['sites'])
+    results = []
+
+    thread = _get_in_thread(cache, 'bench_sites', loader, results)
+    assert loader.started.wait(5)
+    cache.invalidate('nginx_configs')
+    loader.release.set()
+    thread.join(5)
+
+    assert cache.peek('bench_sites') == 'sites'
+
+
+def test_stale_value_is_served_while_refreshing():
+    cache = ResponseCache()
+    assert cache.get('health', lambda: 'v1', ttl=0, stale_ttl=60) == 'v1'
+
+    loader = GatedLoader(['v2'])
+    # القيمة القديمة فوراً والتحديث في الخلفية
+    assert cache.get('health', loader, ttl=0, stale_ttl=60) == 'v1'
+    assert loader.started.wait(5)
+    # تحديث واحد فقط مهما تكررت الطلبات
+    assert cache.get('health', loader, ttl=0, stale_ttl=60) == 'v1'
+    loader.release.set()
+
+    deadline = time.monotonic() + 5
+    while cache.peek('health') != 'v2' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.peek('health') == 'v2'
+    assert loader.calls == 1
+
+
+def test_no_wait_miss_returns_default_and_loads_in_background():
+    cache = ResponseCache()
+    loader = GatedLoader(['sites'])
+    missing = object()
+
+    assert cache.get('bench_sites', loader, 60, wait=False, default=missing) is missing
+    assert loader.started.wait(5)
+    loader.release.set()
+    # الطلب المنتظر ينضم للتحميل الجاري بدلاً من بدء تحميل ثانٍ
+    assert cache.get('bench_sites', loader, 60) == 'sites'
+    assert loader.calls == 1
@@ -0,0 +1,139 @@
+"""SharedClusterState: seqlock بين كاتب واحد وقراء بدون أقفال على نفس ملف mmap"""
+
+from datetime import datetime
+
+import pytest
+
+import shared_state
+from shared_state import SharedClusterState
+
+
+def _servers(status: str, cpu: float):
+    return [
+        {'server_id': 'app-server-1', 'ip': '172.30.0.10', 'port': 8100, 'status': status,
+         'metrics': {'cpu_percent': cpu, 'memory_percent': 40.5, 'network_rx_bytes': 2 ** 40, 'pids': 17,
+                     'last_updated': datetime(2026, 1, 1, 12, 0, 0)}},
+        {'server_id': 'app-server-2', 'ip': '172.30.0.11', 'port': 8101, 'status': status, 'metrics': None},
+    ]
+
+
+@pytest.fixture
+def pair(tmp_path):
+    path = str(tmp_path / 'cluster-state')
+    writer = SharedClusterState(path, max_servers=8, extra_capacity=4096)
+    reader = SharedClusterState(path, max_servers=8, extra_capacity=4096, reopen_interval=0)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_reader_before_first_write_gets_none(pair):
+    _, reader = pair
+    assert reader.read() is None
+
+
+def test_round_trip(pair):
+    writer, reader = pair
+    seq = writer.write(_servers('healthy', 12.5), {'stats': {'total_sites': 3}}, generation=4,
+                       leader='host-a:123', token=9)
+    snapshot = reader.read()
+
+    assert snapshot['servers'] == {'app-server-1': {'ip': '172.30.0.10', 'port': 8100},
+                                   'app-server-2': {'ip': '172.30.0.11', 'port': 8101}}
+    assert snapshot['health_status'] == {'app-server-1': 'healthy', 'app-server-2': 'healthy'}
+    metrics = snapshot['metrics']['app-server-1']
+    assert (metrics['cpu_percent'], metrics['memory_percent'], metrics['network_rx_bytes'], metrics['pids']) == \
+        (12.5, 40.5, 2 ** 40, 17)
+    assert metrics['last_updated'] == '2026-01-01T12:00:00'
+    assert 'app-server-2' not in snapshot['metrics']
+    assert snapshot['stats'] == {'total_sites': 3}
+    assert snapshot['_meta']['seq'] == seq + 1
+    assert (snapshot['_meta']['generation'], snapshot['_meta']['leader'], snapshot['_meta']['token']) == \
+        (4, 'host-a:123', 9)
+
+
+def test_unchanged_seq_returns_the_same_snapshot(pair):
+    writer, reader = pair
+    writer.write(_servers('healthy', 1), {}, generation=1)
+    first = reader.read()
+    assert reader.read() is first
+
+    writer.write(_servers('critical', 2), {}, generation=2)
+    second = reader.read()
+    assert second is not first
+    assert second['health_status']['app-server-1'] == 'critical'
+
+
+def test_read_during_write_waits_for_even_seq(pair, monkeypatch):
+    writer, reader = pair
+    writer.write(_servers('healthy', 1), {}, generation=1)
+    # الكاتب في منتصف الكتابة: seq فردي
+    writer._words[shared_state.SEQ_INDEX] += 1
+
+    def finish_write(_):
+        writer._words[shared_state.SEQ_INDEX] -= 1
+        writer.write(_servers('warning', 2), {}, generation=2)
+
+    monkeypatch.setattr(shared_state.time, 'sleep', finish_write)
+    snapshot = reader.read()
+
+    assert reader.retries == 1
+    assert snapshot['health_status']['app-server-1'] == 'warning'
+    assert snapshot['_meta']['generation'] == 2
+
+
+class _WriteDuringRead:
+    """META يبدأ كتابة كاملة أول مرة يقرأه القارئ - نسخة ممزقة يجب رفضها"""
+
+    def __init__(self, meta, write):
+        self._meta = meta
+        self._write = write
+
+    def unpack_from(self, buffer, offset=0):
+        values = self._meta.unpack_from(buffer, offset)
+        if self._write:
+            write, self._write = self._write, None
+            write()
+        return values
+
+    def __getattr__(self, name):
+        return getattr(self._meta, name)
+
+
+def test_torn_read_is_retried(pair, monkeypatch):
+    writer, reader = pair
+    writer.write(_servers('healthy', 1), {'round': 1}, generation=1)
+    monkeypatch.setattr(shared_state, 'META', _WriteDuringRead(
+        shared_state.META, lambda: writer.write(_servers('critical', 99), {'round': 2}, generation=2)))
+
+    snapshot = reader.read()
+
+    assert reader.retries == 1
+    # الرأس (generation 1) والسجلات (round 2) من كتابتين مختلفتين - القارئ أعاد المحاولة
+    assert snapshot['_meta']['generation'] == 2
+    assert snapshot['round'] == 2
+    assert snapshot['metrics']['app-server-1']['cpu_percent'] == 99
+
+
+def test_busy_writer_returns_last_consistent_snapshot(pair, monkeypatch):
+    writer, reader = pair
+    writer.write(_servers('healthy', 1), {}, generation=1)
+    last = reader.read()
+    writer.write(_servers('critical', 2), {}, generation=2)
+    writer._words[shared_state.SEQ_INDEX] += 1
+    monkeypatch.setattr(shared_state.time, 'sleep', lambda _: None)
+
+    assert reader.read(max_attempts=5) is last
+    assert reader.retries == 5
+
+
+def test_servers_beyond_capacity_are_truncated(tmp_path):
+    state = SharedClusterState(str(tmp_path / 'state'), max_servers=1, extra_capacity=4096)
+    state.write(_servers('healthy', 1), {}, generation=1)
+    reader = SharedClusterState(state.path, max_servers=1, extra_capacity=4096)
+    snapshot = reader.read()
+
+    assert list(snapshot['servers']) == ['app-server-1']
+    assert snapshot['truncated'] is True
+    reader.close()
+    state.close()
@@ -0,0 +1,136 @@
+"""
+عرض الـ spans المصدّرة من tracing.py
+
+    python trace_report.py slowest                # أبطأ الطلبات
+    python trace_report.py stages                 # تجميع المراحل: العدد، p50، p95، الأقصى
+    python trace_report.py show <trace_id>        # شجرة تتبع طلب واحد
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+DEFAULT_PATH = os.environ.get('TRACE_EXPORT_PATH', '/tmp/saas-backend-traces.jsonl')
+
+
+def load_spans(path: str) -> List[Dict]:
+    """قراءة ملف JSONL مع النسخة المدورة path.1 إن وجدت (تجاهل الأسطر التالفة)"""
+    spans = []
+    for candidate in (f"{path}.1", path):
+        if candidate != path and not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    return spans
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """نسبة مئوية بأقرب رتبة"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def stage_summary(spans: List[Dict]) -> List[Dict]:
+    """تجميع المدد حسب اسم المرحلة مرتبة حسب الوقت الكلي"""
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for span in spans:
+        durations[span['name']].append(span.get('duration_ms') or 0.0)
+        if span.get('error'):
+            errors[span['name']] += 1
+
+    rows = []
+    for name, values in durations.items():
+        rows.append({
+            'name': name,
+            'count': len(values),
+            'errors': errors[name],
+            'total_ms': round(sum(values), 1),
+            'p50_ms': round(percentile(values, 50), 1),
+            'p95_ms': round(percentile(values, 95), 1),
+            'max_ms': round(max(values), 1)
+        })
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def render_trace(spans: List[Dict], trace_id: str) -> List[str]:
+    """شجرة الـ spans لتتبع واحد مع إزاحة زمنية من بداية الطلب"""
+    trace = [span for span in spans if span['trace_id'] == trace_id]
+    if not trace:
+        return []
+
+    span_ids = {span['span_id'] for span in trace}
+    children = defaultdict(list)
+    roots = []
+    for span in sorted(trace, key=lambda s: s['start']):
+        if span.get('parent_id') in span_ids:
+            children[span['parent_id']].append(span)
+        else:
+            roots.append(span)
+
+    origin = roots[0]['start']
+    lines = []
+
+    def walk(span: Dict, depth: int):
+        offset = (span['start'] - origin) * 1000
+        attrs = ' '.join(f"{k}={v}" for k, v in span.get('attributes', {}).items() if v is not None)
+        error = f"  ❌ {span['error']}" if span.get('error') else ''
+        lines.append(f"{offset:>10.1f}ms {span.get('duration_ms') or 0:>10.1f}ms  "
+                     f"{'  ' * depth}{span['name']}  {attrs}{error}".rstrip())
+        for child in children[span['span_id']]:
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return lines
+
+
+def slowest_traces(spans: List[Dict], limit: int) -> List[Dict]:
+    """أبطأ الطلبات (الـ spans الجذرية)"""
+    roots = [span for span in spans if not span.get('parent_id')]
+    roots.sort(key=lambda span: span.get('duration_ms') or 0.0, reverse=True)
+    return roots[:limit]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='تقرير الـ traces')
+    parser.add_argument('--file', default=DEFAULT_PATH, help='ملف JSONL للـ spans')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stages', help='تجميع المراحل حسب الاسم')
+    slowest = sub.add_parser('slowest', help='أبطأ الطلبات')
+    slowest.add_argument('-n', type=int, default=10)
+    show = sub.add_parser('show', help='شجرة تتبع واحد')
+    show.add_argument('trace_id')
+    args = parser.parse_args(argv)
+
+    spans = load_spans(args.file)
+
+    if args.command == 'stages':
+        print(f"{'stage':<40} {'count':>7} {'errors':>7} {'p50':>10} {'p95':>10} {'max':>10} {'total':>12}")
+        for row in stage_summary(spans):
+            print(f"{row['name'][:40]:<40} {row['count']:>7} {row['errors']:>7} {row['p50_ms']:>10} "
+                  f"{row['p95_ms']:>10} {row['max_ms']:>10} {row['total_ms']:>12}")
+    elif args.command == 'slowest':
+        for span in slowest_traces(spans, args.n):
+            print(f"{span['trace_id']}  {span.get('duration_ms') or 0:>10.1f}ms  {span['name']}")
+    else:
+        lines = render_trace(spans, args.trace_id)
+        if not lines:
+            print(f"لا توجد spans للتتبع {args.trace_id}", file=sys.stderr)
+            return 1
+        print('\n'.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+تتبع الطلبات (spans) عبر مسار إنشاء المواقع
+
+- trace id يبدأ مع طلب HTTP (أو يُقرأ من ترويسة X-Trace-Id) وينتقل عبر contextvars
+- كل أمر bench / docker يحصل على span ويستلم TRACE_ID و TRACEPARENT كمتغيرات بيئة
+- كل سجل (log) يحمل الحقل trace_id
+- الـ spans تُصدّر على دفعات في thread خلفي إلى ملف JSONL أو إلى collector عبر HTTP
+
+الإعدادات:
+    TRACING_ENABLED=1
+    TRACE_EXPORT_PATH=/tmp/saas-backend-traces.jsonl
+    TRACE_EXPORT_MAX_BYTES=52428800   (عند تجاوزه يُنقل الملف إلى .1 ويبدأ ملف جديد - 0 بدون حد)
+    TRACE_COLLECTOR_URL=http://collector:4318/spans   (اختياري - بدلاً من الملف)
+    TRACE_SAMPLE_RATE=0.01   (trace id والسجلات لكل الطلبات، والتصدير لنسبة منها فقط)
+
+عرض تتبع طلب واحد أو أبطأ المراحل: python trace_report.py --help
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """مرحلة مقاسة ضمن تتبع"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'start_time',
+                 '_start_perf', 'duration_ms', 'error', 'sampled')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value):
+        """إضافة خاصية للـ span"""
+        self.attributes[key] = value
+
+    def finish(self):
+        """تسجيل مدة الـ span"""
+        self.duration_ms = round((time.perf_counter() - self._start_perf) * 1000, 3)
+
+    def to_dict(self) -> Dict:
+        """تمثيل الـ span للتصدير"""
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_time,
+            'duration_ms': self.duration_ms,
+            'error': self.error,
+            'attributes': self.attributes,
+            'pid': os.getpid(),
+            'host': socket.gethostname()
+        }
+
+
+class SpanExporter:
+    """تصدير الـ spans على دفعات من thread خلفي"""
+
+    def __init__(self, path: Optional[str], collector_url: Optional[str],
+                 batch_size: int = 200, flush_interval: float = 2.0, max_queue: int = 10000,
+                 max_bytes: int = 50 * 1024 ** 2):
+        self.path = path
+        self.collector_url = collector_url
+        # حجم الملف الأقصى قبل تدويره إلى path.1 (نسخة سابقة واحدة فقط)
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, span: Span):
+        """إضافة span للدفعة التالية (لا يحجز المستدعي أبداً)"""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        """thread التصدير لكل عملية (يُعاد إنشاؤه بعد fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        """تجميع الـ spans وكتابتها كل flush_interval أو عند امتلاء الدفعة"""
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict]):
+        """كتابة دفعة إلى الملف أو إرسالها إلى الـ collector"""
+        try:
+            if self.collector_url:
+                requests.post(self.collector_url, json={'spans': batch}, timeout=5)
+            elif self.path:
+                data = "".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in batch)
+                self._rotate()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.debug(f"فشل تصدير {len(batch)} span: {e}")
+
+    def _rotate(self):
+        """نقل الملف إلى path.1 عند تجاوز max_bytes (كل العمال يكتبون نفس الملف - أول من يلاحظ ينقله)"""
+        if not self.max_bytes:
+            return
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+
+
+class Tracer:
+    """إنشاء الـ spans ونقل السياق"""
+
+    def __init__(self):
+        self.enabled = os.environ.get('TRACING_ENABLED', '1') != '0'
+        # trace id ينتقل لكل الطلبات (السجلات وأوامر bench)، لكن الـ spans تُصدّر لنسبة منها فقط
+        self.sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+        self.exporter = SpanExporter(
+            path=os.environ.get('TRACE_EXPORT_PATH', '/tmp/saas-backend-traces.jsonl'),
+            collector_url=os.environ.get('TRACE_COLLECTOR_URL'),
+            max_bytes=int(os.environ.get('TRACE_EXPORT_MAX_BYTES', 50 * 1024 ** 2))
+        )
+
+    def current_span(self) -> Optional[Span]:
+        """الـ span الحالي في هذا السياق"""
+        return _current_span.get()
+
+    def current_trace_id(self) -> Optional[str]:
+        """trace id الحالي"""
+        span = _current_span.get()
+        return span.trace_id if span else None
+
+    def begin_span(self, name: str, trace_id: Optional[str] = None, **attributes):
+        """بدء span وجعله الحالي - يعيد (span, token) لاستخدامه مع end_span"""
+        parent = _current_span.get()
+        if parent is not None and trace_id is None:
+            span = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+        else:
+            span = Span(name, trace_id or uuid.uuid4().hex, None,
+                        self.enabled and random.random() < self.sample_rate, attributes)
+        return span, _current_span.set(span)
+
+    def end_span(self, span: Span, token, error: Optional[BaseException] = None):
+        """إنهاء span وإرجاع السياق السابق"""
+        span.finish()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # انتهى في سياق مختلف (مثلاً بعد بث الاستجابة)
+            _current_span.set(None)
+        if span.sampled:
+            self.exporter.export(span)
+
+    @contextmanager
+    def start_span(self, name: str, trace_id: Optional[str] = None, **attributes):
+        """span كـ context manager"""
+        span, token = self.begin_span(name, trace_id, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, token, e)
+            raise
+        else:
+            self.end_span(span, token)
+
+    def subprocess_env(self, env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """متغيرات البيئة لنقل التتبع إلى عملية فرعية"""
+        env = dict(os.environ if env is None else env)
+        span = _current_span.get()
+        if span is not None:
+            env.update(self.propagation_vars(span))
+        return env
+
+    def propagation_vars(self, span: Optional[Span] = None) -> Dict[str, str]:
+        """TRACE_ID و TRACEPARENT (W3C) للـ span الحالي"""
+        span = span or _current_span.get()
+        if span is None:
+            return {}
+        flags = '01' if span.sampled else '00'
+        return {
+            'TRACE_ID': span.trace_id,
+            'TRACEPARENT': f"00-{span.trace_id.rjust(32, '0')[:32]}-{span.span_id}-{flags}"
+        }
+
+    def docker_env_args(self) -> List[str]:
+        """معاملات -e لنقل التتبع إلى أوامر docker exec"""
+        args = []
+        for key, value in self.propagation_vars().items():
+            args += ['-e', f"{key}={value}"]
+        return args
+
+
+tracer = Tracer()
+
+
+def traced(name: Optional[str] = None):
+    """مزخرف لإنشاء span حول دالة"""
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def with_current_context(func: Callable) -> Callable:
+    """ربط دالة بسياق التتبع الحالي لتشغيلها في thread أو ThreadPoolExecutor"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+_base_record_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs):
+    record = _base_record_factory(*args, **kwargs)
+    span = _current_span.get()
+    record.trace_id = span.trace_id if span else '-'
+    return record
+
+
+def install_log_trace_ids():
+    """إضافة الحقل trace_id لكل سجل (يُستخدم في صيغة التسجيل)"""
+    logging.setLogRecordFactory(_record_factory)
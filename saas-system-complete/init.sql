@@ -45,7 +45,117 @@ CREATE TABLE IF NOT EXISTS cluster_servers (
     INDEX idx_last_health_check (last_health_check)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Measured per-site usage used by the weighted placement algorithm
+CREATE TABLE IF NOT EXISTS site_usage (
+    site_name VARCHAR(255) PRIMARY KEY,
+    requests_per_min FLOAT NULL,
+    cpu_seconds_per_min FLOAT NULL,
+    db_bytes BIGINT NULL,
+    worker_memory_bytes BIGINT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Site -> app server assignment (source of truth for routing, migration and stats)
+CREATE TABLE IF NOT EXISTS site_assignments (
+    site_name VARCHAR(255) PRIMARY KEY,
+    server_id VARCHAR(50) NOT NULL,
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_server_id (server_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Generation counters used to invalidate per-process caches
+CREATE TABLE IF NOT EXISTS cluster_state_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Atomic reservations of server names, IPs and host ports for new app servers
+CREATE TABLE IF NOT EXISTS cluster_leases (
+    kind VARCHAR(10) NOT NULL,
+    value VARCHAR(64) NOT NULL,
+    server_id VARCHAR(50) NOT NULL,
+    leased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, value),
+    INDEX idx_server_id (server_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Per-sweep health/metrics samples written in one batch by the cluster monitor (pruned by retention)
+CREATE TABLE IF NOT EXISTS cluster_metrics_history (
+    server_id VARCHAR(50) NOT NULL,
+    sampled_at DATETIME(3) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    cpu_percent FLOAT NULL,
+    memory_percent FLOAT NULL,
+    disk_percent FLOAT NULL,
+    response_time_ms FLOAT NULL,
+    connections INT NULL,
+    sites_count INT NULL,
+    pids INT NULL,
+    gunicorn_workers INT NULL,
+    background_workers INT NULL,
+    network_rx BIGINT UNSIGNED NULL,
+    network_tx BIGINT UNSIGNED NULL,
+    block_read BIGINT UNSIGNED NULL,
+    block_write BIGINT UNSIGNED NULL,
+    PRIMARY KEY (server_id, sampled_at),
+    INDEX idx_sampled_at (sampled_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Original server of sites rerouted off an offline server (failback target)
+CREATE TABLE IF NOT EXISTS site_failovers (
+    site_name VARCHAR(255) PRIMARY KEY,
+    home_server VARCHAR(50) NOT NULL,
+    failover_server VARCHAR(50) NOT NULL,
+    failed_over_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_home_server (home_server)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Bulk trial import jobs (claimed with a lease by the background owner and resumed after a restart)
+CREATE TABLE IF NOT EXISTS bulk_trial_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    stage VARCHAR(20) NOT NULL,
+    nginx_result TEXT NULL,
+    events BIGINT NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(255) NULL,
+    lease_expires_at DATETIME NULL,
+    created_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    INDEX idx_finished_created (finished_at, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Per-row state of a bulk import job (seq orders changes for progress streaming)
+CREATE TABLE IF NOT EXISTS bulk_trial_rows (
+    job_id VARCHAR(32) NOT NULL,
+    row_no INT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    seq BIGINT NOT NULL DEFAULT 0,
+    row_data MEDIUMTEXT NOT NULL,
+    PRIMARY KEY (job_id, row_no),
+    INDEX idx_job_seq (job_id, seq)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Cluster monitor leader lease (one backend process runs health checks and autoscaling)
+CREATE TABLE IF NOT EXISTS cluster_leader (
+    name VARCHAR(50) PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL DEFAULT '',
+    token BIGINT NOT NULL DEFAULT 0,
+    expires_at DATETIME(3) NOT NULL,
+    renewed_at DATETIME(3) NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Health/metrics snapshot published by the leader for the other processes
+CREATE TABLE IF NOT EXISTS cluster_snapshots (
+    name VARCHAR(50) PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0,
+    leader VARCHAR(255) NOT NULL,
+    token BIGINT NOT NULL,
+    payload MEDIUMTEXT NOT NULL,
+    published_at DATETIME(3) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Insert default cluster servers (mock data for development)
+-- Not leased in cluster_leases, so the standby pool never counts or promotes these rows
 INSERT IGNORE INTO cluster_servers (server_id, ip_address, port, active, role) VALUES
 ('frappe-app-01', '172.22.0.20', 8000, FALSE, 'standby'),
 ('frappe-app-02', '172.22.0.21', 8000, FALSE, 'standby'),